@@ -0,0 +1,48 @@
+"""
+Backfill: Move eSIM QR payloads/images from esims.qr_code_data to the blob store.
+
+Copies each legacy qr_code_data into the content-addressed blob store
+(BLOB_STORE / BLOB_STORE_DIR) and clears the column. Safe to re-run.
+Needs the esims.qr_blob_key column (alembic upgrade head).
+
+Run: python backfill_esim_qr_blobs.py
+"""
+import asyncio
+from database import engine
+from sqlalchemy import text
+
+from services.esim_service import guardar_qr
+
+BATCH = 200
+
+
+async def migrate():
+    movidas = 0
+    ultimo_id = None
+    while True:
+        async with engine.begin() as conn:
+            filtro = "AND id > :ultimo_id" if ultimo_id is not None else ""
+            rows = (await conn.execute(text(f"""
+                SELECT id, qr_code_data FROM esims
+                WHERE qr_code_data IS NOT NULL AND qr_blob_key IS NULL {filtro}
+                ORDER BY id
+                LIMIT :batch
+            """), {"ultimo_id": ultimo_id, "batch": BATCH})).all()
+            if not rows:
+                break
+
+            for row in rows:
+                key = await guardar_qr(row.qr_code_data)
+                await conn.execute(
+                    text("UPDATE esims SET qr_blob_key = :key, qr_code_data = NULL WHERE id = :id"),
+                    {"key": key, "id": row.id},
+                )
+            movidas += len(rows)
+            ultimo_id = rows[-1].id
+            print(f"Moved {movidas} QR codes to the blob store")
+
+    print(f"Backfill completed successfully! ({movidas} QR codes moved)")
+
+
+if __name__ == "__main__":
+    asyncio.run(migrate())
@@ -0,0 +1,158 @@
+"""
+Benchmark del pipeline de registro de ventas (POST /api/sales/ventas).
+
+Mide, por venta en efectivo, cuántas sentencias SQL y cuántos commits se envían
+a PostgreSQL y la latencia de punta a punta de `registrar_venta`.
+
+Crea datos temporales (usuario, turno abierto, lote y SIMs con prefijo BENCH-)
+y los elimina al terminar.
+
+Ejecutar: python bench_sale_pipeline.py [--ventas 50] [--items 2]
+
+Para comparar con una versión anterior, copiar el script a ese árbol: desde el soporte
+de Idempotency-Key `registrar_venta` recibe `idempotency_key`, y en los commits previos
+hay que quitar ese argumento de la llamada.
+
+Resultados (venta en efectivo, 2 SIMs, 200 ventas, PostgreSQL 16 local; media de 3
+corridas):
+
+                                  sentencias  commits  media     p50       p95
+    antes (3 transacciones)       10          3        12.5 ms   12.1 ms   15.0 ms
+    después (una transacción)     5           1        6.7 ms    5.8 ms    7.6 ms
+
+La versión actual suma 2 sentencias (7 por venta, ~8 ms de media): la invalidación de la
+caché del dashboard, un pg_notify por dominio (ventas y sims) dentro de la misma transacción.
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from types import SimpleNamespace
+from uuid import uuid4
+
+from dotenv import load_dotenv
+from sqlalchemy import event, text
+
+load_dotenv()
+
+from database import engine, SessionLocal  # noqa: E402
+from routes.sales import registrar_venta  # noqa: E402
+from schemas.sale_schemas import SaleCreateSchema, SaleItemSchema  # noqa: E402
+
+
+class StatementCounter:
+    def __init__(self):
+        self.statements = 0
+        self.commits = 0
+
+    def reset(self):
+        self.statements = 0
+        self.commits = 0
+
+    def on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements += 1
+
+    def on_commit(self, conn):
+        self.commits += 1
+
+
+async def _setup(prefix: str, n_sims: int) -> tuple[int, list[str]]:
+    async with engine.begin() as conn:
+        user_id = (await conn.execute(text("""
+            INSERT INTO users (username, hashed_password, full_name, is_active)
+            VALUES (:u, 'x', 'Benchmark', true) RETURNING id
+        """), {"u": f"{prefix}-user"})).scalar_one()
+
+        await conn.execute(text("""
+            INSERT INTO turnos (id, numero_consecutivo, user_id, estado)
+            VALUES (:id, (SELECT coalesce(max(numero_consecutivo), 0) + 1 FROM turnos), :uid, 'abierto')
+        """), {"id": uuid4(), "uid": user_id})
+
+        await conn.execute(text("""
+            INSERT INTO sim_lotes (id, operador, estado) VALUES (:id, 'BENCH', 'available')
+        """), {"id": f"{prefix}-lote"})
+
+        sim_ids = [f"{prefix}-sim-{i}" for i in range(n_sims)]
+        await conn.execute(text("""
+            INSERT INTO sim_detalle (id, lote_id, numero_linea, iccid, estado, vendida)
+            VALUES (:id, :lote, :linea, :iccid, 'recargado', false)
+        """), [
+            {"id": sid, "lote": f"{prefix}-lote", "linea": f"399{i:07d}", "iccid": f"{prefix}-{i:018d}"}
+            for i, sid in enumerate(sim_ids)
+        ])
+    return user_id, sim_ids
+
+
+async def _cleanup(prefix: str, user_id: int):
+    async with engine.begin() as conn:
+        await conn.execute(text("DELETE FROM movimientos_caja WHERE sale_id IN (SELECT id FROM sales WHERE user_id = :u)"), {"u": user_id})
+        await conn.execute(text("DELETE FROM sale_items WHERE sale_id IN (SELECT id FROM sales WHERE user_id = :u)"), {"u": user_id})
+        await conn.execute(text("DELETE FROM sales WHERE user_id = :u"), {"u": user_id})
+        await conn.execute(text("DELETE FROM sim_detalle WHERE lote_id = :l"), {"l": f"{prefix}-lote"})
+        await conn.execute(text("DELETE FROM sim_lotes WHERE id = :l"), {"l": f"{prefix}-lote"})
+        await conn.execute(text("DELETE FROM turnos WHERE user_id = :u"), {"u": user_id})
+        await conn.execute(text("DELETE FROM users WHERE id = :u"), {"u": user_id})
+
+
+async def run(n_ventas: int, n_items: int):
+    engine.echo = False
+    prefix = f"BENCH-{uuid4().hex[:8]}"
+    user_id, sim_ids = await _setup(prefix, n_ventas * n_items)
+    current_user = SimpleNamespace(id=user_id)
+
+    counter = StatementCounter()
+    event.listen(engine.sync_engine, "before_cursor_execute", counter.on_execute)
+    event.listen(engine.sync_engine, "commit", counter.on_commit)
+
+    latencias, sentencias, commits = [], [], []
+    try:
+        for v in range(n_ventas):
+            items = [
+                SaleItemSchema(
+                    product_id="bench",
+                    product_code="S01",
+                    description="SIM prepago",
+                    quantity=1,
+                    unit_price=1000.0,
+                    sim_id=sim_ids[v * n_items + i],
+                )
+                for i in range(n_items)
+            ]
+            sale = SaleCreateSchema(
+                customer_id="bench",
+                customer_identification="222222222222",
+                payment_method="cash",
+                items=items,
+            )
+
+            async with SessionLocal() as db:
+                counter.reset()
+                t0 = time.perf_counter()
+                await registrar_venta(sale, db, current_user, idempotency_key=None)
+                latencias.append((time.perf_counter() - t0) * 1000)
+                sentencias.append(counter.statements)
+                commits.append(counter.commits)
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", counter.on_execute)
+        event.remove(engine.sync_engine, "commit", counter.on_commit)
+        await _cleanup(prefix, user_id)
+        await engine.dispose()
+
+    lat_sorted = sorted(latencias)
+    p95 = lat_sorted[max(0, int(len(lat_sorted) * 0.95) - 1)]
+    print("=" * 60)
+    print(f"Ventas: {n_ventas}  |  Items (SIMs) por venta: {n_items}")
+    print(f"Sentencias SQL por venta: {statistics.mean(sentencias):.1f}")
+    print(f"Commits por venta:        {statistics.mean(commits):.1f}")
+    print(f"Latencia media:           {statistics.mean(latencias):.2f} ms")
+    print(f"Latencia p50 / p95:       {statistics.median(latencias):.2f} / {p95:.2f} ms")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark del registro de ventas")
+    parser.add_argument("--ventas", type=int, default=50)
+    parser.add_argument("--items", type=int, default=2)
+    args = parser.parse_args()
+    asyncio.run(run(args.ventas, args.items))
@@ -0,0 +1,75 @@
+"""
+Presupuesto de tiempo de import de la aplicación (arranque de cada worker).
+
+Importa server.py en un proceso nuevo con `python -X importtime` y falla (código 1) si:
+  - el import acumulado supera el presupuesto (--budget-ms, por defecto IMPORT_BUDGET_MS o 1500), o
+  - se cargó alguna dependencia pesada que solo deben usar los endpoints de carga/QR o
+    la analítica (pandas, PyMuPDF, OpenCV, pyzbar, PIL, NumPy, openpyxl, pyarrow, DuckDB).
+
+No se conecta a la BD: solo mide los imports.
+
+Ejecutar: python check_import_budget.py [--budget-ms 1500] [--top 15]
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+PESADAS = ("pandas", "fitz", "cv2", "pyzbar", "PIL", "numpy", "openpyxl", "pyarrow", "duckdb")
+
+_LINEA = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def medir():
+    """Retorna [(módulo, propio_us, acumulado_us, nivel)] del import de server."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import server"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        print(proc.stderr[-3000:])
+        raise SystemExit(f"El import de server falló (código {proc.returncode})")
+
+    modulos = []
+    for linea in proc.stderr.splitlines():
+        m = _LINEA.match(linea)
+        if m:
+            propio, acumulado, sangria, modulo = m.groups()
+            modulos.append((modulo, int(propio), int(acumulado), len(sangria) // 2))
+    return modulos
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("IMPORT_BUDGET_MS", "1500")))
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    modulos = medir()
+    # Nivel 0 = imports directos del proceso; su acumulado suma el total
+    total_ms = sum(acumulado for _m, _p, acumulado, nivel in modulos if nivel == 0) / 1000
+
+    print(f"Import de server: {total_ms:.0f} ms (presupuesto {args.budget_ms:.0f} ms)")
+    print("\nMódulos más lentos (tiempo propio):")
+    for modulo, propio, acumulado, _nivel in sorted(modulos, key=lambda m: m[1], reverse=True)[: args.top]:
+        print(f"  {propio / 1000:8.1f} ms  (acum. {acumulado / 1000:8.1f} ms)  {modulo}")
+
+    cargadas = sorted({m.split(".")[0] for m, *_ in modulos} & set(PESADAS))
+    errores = []
+    if total_ms > args.budget_ms:
+        errores.append(f"el import tardó {total_ms:.0f} ms, más que el presupuesto de {args.budget_ms:.0f} ms")
+    if cargadas:
+        errores.append(f"dependencias pesadas cargadas al arrancar: {', '.join(cargadas)}")
+
+    if errores:
+        print("\n❌ " + "\n❌ ".join(errores))
+        sys.exit(1)
+    print("\n✅ Dentro del presupuesto y sin dependencias pesadas")
+
+
+if __name__ == "__main__":
+    main()
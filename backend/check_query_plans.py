@@ -0,0 +1,184 @@
+"""
+Verificación de planes de las consultas del dashboard, turnos, sims y la exportación de analytics.
+
+Ejecuta EXPLAIN (FORMAT JSON) sobre el mismo SQL que ejecutan las rutas y los jobs: las
+funciones sql_* de routes/dashboard.py, consulta_* de routes/turnos.py y routes/sims.py y
+sql_exportacion de services/analytics_export.py, no copias a mano. Comprueba que el plan
+use los índices de migrations/versions/0002_indices_consultas.py y
+0003_indices_dashboard_turnos.py y sale con código 1 si alguna consulta no usa el índice
+esperado.
+
+Por defecto se verifica el plan real con los datos actuales: es lo que cuenta en una BD
+con volumen de producción (o una copia). Con pocas filas (BD de desarrollo, CI después de
+`alembic upgrade head`) PostgreSQL prefiere recorrer la tabla completa aunque exista el
+índice; --forzar hace el EXPLAIN con enable_seqscan = off, lo que solo prueba que el
+índice *sirve* para la consulta (predicado del índice parcial compatible, columnas
+correctas), no que el planificador lo elija.
+
+Ejecutar: python check_query_plans.py [--forzar] [--verbose]
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
+
+from dotenv import load_dotenv
+from sqlalchemy import text
+
+load_dotenv()
+
+from database import engine  # noqa: E402
+from routes import dashboard, sims, turnos  # noqa: E402
+from services import analytics_export  # noqa: E402
+
+
+def _consultas() -> list:
+    """(nombre, sentencia, parámetros, índices aceptados: basta con que el plan use uno)."""
+    ahora = datetime.now(timezone.utc).replace(tzinfo=None)
+    hoy = ahora.replace(hour=0, minute=0, second=0, microsecond=0)
+    desde = hoy - timedelta(days=30)
+    rango = {"fecha_desde": desde, "fecha_hasta": ahora}
+
+    # Mismos parámetros que arma get_dashboard_stats con rango y vendedor
+    stats = {
+        "today0": hoy, "week0": hoy - timedelta(days=hoy.weekday()), "month0": hoy.replace(day=1),
+        "serie_desde": desde.date(), "serie_hasta": ahora.date(),
+        "desde": desde, "hasta": ahora, "base_desde": desde, "user_id": 1,
+    }
+
+    ventas_dia, _resumen = dashboard.sql_ventas_ingresos(False)
+    devoluciones_dia, _resumen, _motivos = dashboard.sql_devoluciones_por_dia(False)
+    trazabilidad, trazabilidad_params = dashboard.sql_trazabilidad_sims()
+    export_movimientos, export_params = analytics_export.sql_exportacion("movimientos_caja", desde.date())
+
+    return [
+        (
+            "dashboard /stats: ventas con rango y vendedor",
+            dashboard.sql_stats_ventas(True, True), stats,
+            {"ix_movimientos_caja_ventas_fecha", "ix_sales_activas_user"},
+        ),
+        (
+            # ORDER BY fecha DESC LIMIT: casi todos los movimientos son ventas, recorrer el índice
+            # completo por fecha hacia atrás y filtrar el tipo cuesta lo mismo que el parcial
+            "dashboard /stats: últimas ventas",
+            dashboard.sql_stats_ultimas(False, False), {},
+            {"ix_movimientos_caja_ventas_fecha", "ix_movimientos_caja_fecha"},
+        ),
+        (
+            "dashboard /ventas-ingresos: ventas por día y método de pago",
+            ventas_dia, rango,
+            {"ix_movimientos_caja_ventas_fecha"},
+        ),
+        (
+            "dashboard /cierres-descuadres: cierres por rango de fechas",
+            dashboard.sql_cierres_descuadres(False, False), rango,
+            {"ix_cierres_caja_fecha_cierre"},
+        ),
+        (
+            "dashboard /devoluciones: devoluciones por día",
+            devoluciones_dia, rango,
+            {"ix_devoluciones_sim_fecha"},
+        ),
+        (
+            "dashboard /trazabilidad: últimas SIMs vendidas",
+            trazabilidad, trazabilidad_params,
+            {"ix_sim_detalle_vendidas_fecha"},
+        ),
+        (
+            "sims /find-by-code: búsqueda por ICCID o número de línea",
+            sims.consulta_sim_por_codigo("3000000000"), {},
+            {"ix_sim_detalle_numero_linea"},
+        ),
+        (
+            "turnos: turno abierto del usuario",
+            turnos.consulta_turno_abierto(1), {},
+            {"ix_turnos_user_abierto"},
+        ),
+        (
+            "turnos: historial del usuario",
+            turnos.consulta_historial_turnos(1), {},
+            {"ix_turnos_user_apertura"},
+        ),
+        (
+            "turnos: ventas del turno",
+            turnos.consulta_ventas_turno(uuid4()), {},
+            {"ix_movimientos_caja_ventas_turno"},
+        ),
+        (
+            "turnos: totales de varios turnos",
+            turnos.consulta_totales_turnos([uuid4(), uuid4()]), {},
+            {"ix_movimientos_caja_ventas_turno"},
+        ),
+        (
+            "turnos: último cierre de varios turnos",
+            turnos.consulta_ultimo_cierre([uuid4(), uuid4()]), {},
+            {"ix_cierres_caja_turno_id"},
+        ),
+        (
+            "analytics: exportación incremental de movimientos de caja (todos los tipos)",
+            export_movimientos, export_params,
+            {"ix_movimientos_caja_fecha"},
+        ),
+    ]
+
+
+def _sql_literal(sentencia, params: dict, dialect) -> str:
+    """SQL de la sentencia con los parámetros como literales, para anteponerle EXPLAIN."""
+    if isinstance(sentencia, str):
+        sentencia = text(sentencia)
+    if params:
+        sentencia = sentencia.bindparams(**params)
+    return str(sentencia.compile(dialect=dialect, compile_kwargs={"literal_binds": True}))
+
+
+def _indices_del_plan(nodo: dict) -> set:
+    encontrados = set()
+    if "Index Name" in nodo:
+        encontrados.add(nodo["Index Name"])
+    for hijo in nodo.get("Plans", []):
+        encontrados |= _indices_del_plan(hijo)
+    return encontrados
+
+
+async def main(forzar: bool, verbose: bool) -> int:
+    consultas = _consultas()
+    fallos = 0
+    async with engine.connect() as conn:
+        for nombre, sentencia, params, esperados in consultas:
+            sql = _sql_literal(sentencia, params, conn.dialect)
+            # Cada EXPLAIN en su propia transacción: SET LOCAL no se filtra al pool
+            if forzar:
+                await conn.execute(text("SET LOCAL enable_seqscan = off"))
+            plan = (await conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {sql}")).scalar_one()
+            await conn.rollback()
+
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            usados = _indices_del_plan(plan[0]["Plan"])
+
+            if usados & esperados:
+                print(f"OK     {nombre}: {', '.join(sorted(usados & esperados))}")
+            else:
+                fallos += 1
+                print(f"FALLO  {nombre}: se esperaba {' o '.join(sorted(esperados))}, "
+                      f"el plan usa {', '.join(sorted(usados)) or 'solo recorridos secuenciales'}")
+            if verbose:
+                print(sql)
+                print(json.dumps(plan[0]["Plan"], indent=2, default=str))
+
+    await engine.dispose()
+    print(f"\n{len(consultas) - fallos}/{len(consultas)} consultas usan el índice esperado"
+          f"{' (enable_seqscan = off)' if forzar else ''}")
+    return 1 if fallos else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--forzar", action="store_true",
+                        help="desactivar enable_seqscan: solo prueba que el índice sirve (BD con pocas filas)")
+    parser.add_argument("--verbose", action="store_true", help="imprime el SQL y el plan completo de cada consulta")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main(forzar=args.forzar, verbose=args.verbose)))
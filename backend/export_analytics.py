@@ -0,0 +1,35 @@
+"""
+Exporta a Parquet las tablas de reportes (services/analytics_export.py).
+
+El job analytics_export_job lo hace solo (completo de noche, incremental durante el día);
+este script sirve para la primera carga o para reconstruir un dataset.
+
+Ejecutar: python export_analytics.py [--completo] [dataset ...]
+"""
+
+import argparse
+import asyncio
+import json
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from database import engine  # noqa: E402
+from services.analytics_export import DATASETS, exportar  # noqa: E402
+
+
+async def main(completo: bool, datasets: list[str]):
+    try:
+        resumen = await exportar(completo=completo, datasets=datasets or None)
+    finally:
+        await engine.dispose()
+    print(json.dumps(resumen, indent=2, default=str))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--completo", action="store_true", help="reconstruye los datasets en lugar de solo los últimos días")
+    parser.add_argument("datasets", nargs="*", help=f"por defecto, todos: {', '.join(DATASETS)}")
+    args = parser.parse_args()
+    asyncio.run(main(args.completo, args.datasets))
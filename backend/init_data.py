@@ -3,13 +3,11 @@ import asyncio
 from database import engine, get_async_session
 from models import Base, Role, Module, User, RoleModule
 from utils.auth_utils import get_password_hash
+from utils.migraciones import upgrade_head
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 
 async def init():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
-
     # Abrimos sesión
     async for session in get_async_session():
         # Verificar si ya existen datos
@@ -29,7 +27,9 @@ async def init():
                 "Devoluciones",
                 "Usuarios",
                 "Turnos",
-                "Inventarios Sims"
+                "Inventarios Sims",
+                "eSims",
+                "Contingencia"
             }
 
             # Eliminar módulos que ya no están en la lista
@@ -62,7 +62,9 @@ async def init():
                 "Devoluciones",
                 "Usuarios",
                 "Turnos",
-                "Inventarios Sims"
+                "Inventarios Sims",
+                "eSims",
+                "Contingencia"
             ]
             modules = [Module(name=name) for name in module_names]
             session.add_all(modules)
@@ -77,7 +79,8 @@ async def init():
             "Vendedor": [m for m in modules if m.name in [
                 "Dashboard", "Punto de venta", "Sims", "Recargas", "Devoluciones", "Turnos"
             ]],  # Módulos operativos
-            "Supervisor": [m for m in modules if m.name != "Usuarios"]  # Todos excepto Usuarios
+            # Todos excepto Usuarios; eSims y Contingencia solo Admin (como en la migración 0001)
+            "Supervisor": [m for m in modules if m.name not in ("Usuarios", "eSims", "Contingencia")]
         }
 
         roles_dict = {}
@@ -135,4 +138,6 @@ async def init():
         print(f"✅ Roles: {', '.join(roles_config.keys())}")
 
 if __name__ == "__main__":
+    # Crea o actualiza las tablas con las migraciones antes de cargar los datos iniciales
+    upgrade_head()
     asyncio.run(init())
\ No newline at end of file
@@ -0,0 +1,29 @@
+"""
+Job automático para exportar las tablas de reportes a Parquet
+
+Completo cada noche (ANALYTICS_EXPORT_HOUR) e incremental cada
+ANALYTICS_INCREMENTAL_MINUTES durante el día; ver services/analytics_export.py.
+A mano: python export_analytics.py [--completo] [dataset ...]
+"""
+
+import logging
+
+from services.analytics_export import exportar
+
+logger = logging.getLogger(__name__)
+
+
+async def export_analytics(completo: bool = False):
+    """Exporta sales, movimientos, cierres, devoluciones, inventarios y sim_detalle a Parquet"""
+    try:
+        resumen = await exportar(completo=completo)
+        filas = sum(stats["filas"] for stats in resumen.values())
+        logger.info(f"Exportación analítica {'completa' if completo else 'incremental'}: {filas} filas")
+        return {"success": True, "completo": completo, "datasets": resumen}
+    except ImportError as e:
+        logger.warning(f"Exportación analítica omitida: falta pyarrow ({e})")
+        return {"success": False, "error": f"pyarrow no está instalado: {e}"}
+    except Exception as e:
+        logger.error(f"Error en la exportación analítica: {str(e)}", exc_info=True)
+        return {"success": False, "error": str(e)}
+
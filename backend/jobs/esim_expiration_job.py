@@ -7,7 +7,7 @@ las eSIMs cuya fecha de vencimiento ya pasó
 
 import asyncio
 import logging
-from datetime import datetime
+from datetime import datetime, timezone
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from database import SessionLocal
@@ -33,20 +33,21 @@ async def process_esim_expirations():
             # Procesar vencimientos
             count = await service.procesar_vencimientos_automaticos()
 
-            # Obtener eSIMs próximas a vencer para alertar
-            proximas_vencer = await service.get_esims_proximas_a_vencer(dias=3)
+            # Contar eSIMs próximas a vencer para alertar (sin cargar filas)
+            proximas_vencer = await service.contar_esims_proximas_a_vencer(dias=3)
 
             elapsed = (datetime.now() - start_time).total_seconds()
 
             logger.info(f"=== Job de vencimiento completado ===")
             logger.info(f"eSIMs procesadas como vencidas: {count}")
-            logger.info(f"eSIMs próximas a vencer (3 días): {len(proximas_vencer)}")
+            logger.info(f"eSIMs próximas a vencer (3 días): {proximas_vencer}")
             logger.info(f"Tiempo de ejecución: {elapsed:.2f} segundos")
 
             if proximas_vencer:
-                logger.warning(f"ALERTA: {len(proximas_vencer)} eSIMs vencerán en los próximos 3 días")
-                for esim in proximas_vencer[:5]:  # Mostrar primeras 5
-                    dias_restantes = (esim.fecha_vencimiento - datetime.utcnow()).days
+                logger.warning(f"ALERTA: {proximas_vencer} eSIMs vencerán en los próximos 3 días")
+                ahora = datetime.now(timezone.utc)
+                for esim in await service.get_esims_proximas_a_vencer(dias=3, limit=5):  # Mostrar primeras 5
+                    dias_restantes = (esim.fecha_vencimiento - ahora).days
                     logger.warning(
                         f"  - {esim.iccid} ({esim.numero_telefono}): "
                         f"Vence en {dias_restantes} día(s) - {esim.fecha_vencimiento.strftime('%Y-%m-%d')}"
@@ -55,7 +56,7 @@ async def process_esim_expirations():
             return {
                 "success": True,
                 "esims_vencidas": count,
-                "proximas_a_vencer": len(proximas_vencer),
+                "proximas_a_vencer": proximas_vencer,
                 "elapsed_seconds": elapsed
             }
 
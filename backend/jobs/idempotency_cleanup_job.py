@@ -0,0 +1,23 @@
+"""
+Job automático para limpiar Idempotency-Keys vencidas
+
+Las claves viven IDEMPOTENCY_TTL_HOURS (24 por defecto); pasado ese tiempo
+un reintento con la misma clave se trata como una solicitud nueva.
+"""
+
+import logging
+
+from services.idempotency import purgar_vencidas
+
+logger = logging.getLogger(__name__)
+
+
+async def purge_expired_idempotency_keys():
+    """Elimina de la tabla idempotency_keys las claves vencidas"""
+    try:
+        count = await purgar_vencidas()
+        logger.info(f"Idempotency-Keys vencidas eliminadas: {count}")
+        return {"success": True, "eliminadas": count}
+    except Exception as e:
+        logger.error(f"Error limpiando Idempotency-Keys: {str(e)}", exc_info=True)
+        return {"success": False, "error": str(e)}
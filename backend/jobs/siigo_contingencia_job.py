@@ -0,0 +1,36 @@
+"""
+Job automático para enviar a Siigo las ventas guardadas en contingencia
+
+Se ejecuta cada pocos minutos; si Siigo sigue caído la sincronización se
+aborta sola tras varios fallos seguidos y se reintenta en la próxima ejecución.
+Los rechazos de Siigo no cuentan como caída: la venta sale de la cola (siigo_rechazada).
+"""
+
+import logging
+
+from services.siigo_contingencia import sincronizar_pendientes, contar_pendientes, estado_modo
+
+logger = logging.getLogger(__name__)
+
+
+async def sync_pending_siigo_invoices():
+    """Sincroniza la cola de contingencia con Siigo (si hay pendientes y el modo no está forzado)"""
+    try:
+        if (await estado_modo())["forzado"]:
+            logger.info("Modo contingencia forzado: se omite la sincronización automática")
+            return {"success": True, "omitido": True}
+
+        cola = await contar_pendientes()
+        if not cola["pendientes"]:
+            return {"success": True, "pendientes": 0}
+
+        resultado = await sincronizar_pendientes()
+        logger.info(
+            f"Contingencia Siigo: enviadas={resultado.get('enviadas')} conciliadas={resultado.get('conciliadas')} "
+            f"fallidas={resultado.get('fallidas')} rechazadas={resultado.get('rechazadas')} abortado={resultado.get('abortado')}"
+        )
+        return {"success": True, **resultado}
+
+    except Exception as e:
+        logger.error(f"Error en job de contingencia Siigo: {str(e)}", exc_info=True)
+        return {"success": False, "error": str(e)}
@@ -0,0 +1,23 @@
+"""
+Job automático para retomar recargas Winred por lote huérfanas
+
+Un job queda huérfano si el proceso que lo ejecutaba se cayó o se reinició
+(su heartbeat dejó de avanzar); se retoma desde la primera SIM pendiente.
+"""
+
+import logging
+
+from services.winred_topup import reanudar_huerfanos
+
+logger = logging.getLogger(__name__)
+
+
+async def resume_orphan_topup_jobs(client):
+    """Lanza en este proceso los topup jobs pendientes o sin heartbeat reciente"""
+    try:
+        lanzados = await reanudar_huerfanos(client)
+        return {"success": True, "lanzados": lanzados}
+
+    except Exception as e:
+        logger.error(f"Error retomando topup jobs: {str(e)}", exc_info=True)
+        return {"success": False, "error": str(e)}
@@ -0,0 +1,73 @@
+"""
+Entorno de Alembic (asyncpg).
+
+Se ejecuta una vez por despliegue (serve.py antes de lanzar los workers, o
+`alembic upgrade head` a mano), no en cada arranque de worker. Un advisory lock
+evita que dos réplicas que arrancan a la vez apliquen las migraciones en paralelo.
+"""
+
+import asyncio
+from logging.config import fileConfig
+
+from alembic import context
+from dotenv import load_dotenv
+from sqlalchemy import pool, text
+from sqlalchemy.ext.asyncio import async_engine_from_config
+
+load_dotenv()
+
+from database import DATABASE_URL, Base  # noqa: E402
+import models  # noqa: E402,F401  (registra las tablas en Base.metadata)
+
+# Clave del advisory lock de migraciones (distinta de la del líder del scheduler)
+MIGRATIONS_LOCK_KEY = 7402002
+
+config = context.config
+config.set_main_option("sqlalchemy.url", DATABASE_URL.replace("%", "%%"))
+
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name, disable_existing_loggers=False)
+
+target_metadata = Base.metadata
+
+
+def run_migrations_offline():
+    """Genera el SQL sin conectarse (alembic upgrade head --sql)."""
+    context.configure(
+        url=config.get_main_option("sqlalchemy.url"),
+        target_metadata=target_metadata,
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"},
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def do_run_migrations(connection):
+    # Lock de sesión: sobrevive a los commits de las migraciones con autocommit_block
+    connection.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATIONS_LOCK_KEY})
+    connection.commit()
+    try:
+        context.configure(connection=connection, target_metadata=target_metadata, compare_type=True)
+        with context.begin_transaction():
+            context.run_migrations()
+    finally:
+        connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATIONS_LOCK_KEY})
+        connection.commit()
+
+
+async def run_async_migrations():
+    connectable = async_engine_from_config(
+        config.get_section(config.config_ini_section, {}),
+        prefix="sqlalchemy.",
+        poolclass=pool.NullPool,
+    )
+    async with connectable.connect() as connection:
+        await connection.run_sync(do_run_migrations)
+    await connectable.dispose()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    asyncio.run(run_async_migrations())
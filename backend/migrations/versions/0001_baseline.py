@@ -0,0 +1,503 @@
+"""Esquema base (reemplaza create_all y los scripts migration_*.py / migrations/*.sql)
+
+Crea las tablas que falten con el DDL de los modelos a la fecha de esta revisión
+(congelado aquí: cambios posteriores en models.py van en revisiones nuevas) y pone al
+día las bases existentes aplicando, de forma idempotente, lo que hacían los scripts
+sueltos de migración. Sirve tanto para una BD vacía como para una creada antes con
+create_all.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+ENUMS = {
+    "simstatus": ("available", "recargado", "vendido", "defectuosa", "devuelta"),
+    "esimstatus": ("disponible", "vendida", "vencida", "inactiva"),
+}
+
+# Antes migrations/001_create_inventario_sim_turno.sql
+INVENTARIO_SIM_TURNO = ("inventario_sim_turno", """
+        CREATE TABLE inventario_sim_turno (
+            id UUID NOT NULL,
+            turno_id UUID NOT NULL,
+            plan VARCHAR(10) NOT NULL,
+            cantidad_inicial_reportada INTEGER NOT NULL DEFAULT 0,
+            cantidad_final_reportada INTEGER,
+            cantidad_inicial_sistema INTEGER NOT NULL DEFAULT 0,
+            cantidad_final_sistema INTEGER,
+            diferencia_inicial INTEGER GENERATED ALWAYS AS (cantidad_inicial_reportada - cantidad_inicial_sistema) STORED NOT NULL,
+            diferencia_final INTEGER,
+            fecha_registro TIMESTAMP WITH TIME ZONE DEFAULT now(),
+            fecha_cierre TIMESTAMP WITH TIME ZONE,
+            observaciones_apertura TEXT,
+            observaciones_cierre TEXT,
+            PRIMARY KEY (id),
+            FOREIGN KEY(turno_id) REFERENCES turnos (id),
+            CONSTRAINT inventario_sim_turno_unique_turno_plan UNIQUE (turno_id, plan)
+        )
+    """, [
+        "CREATE INDEX IF NOT EXISTS idx_inventario_sim_turno_fecha_registro ON inventario_sim_turno (fecha_registro)",
+        "CREATE INDEX IF NOT EXISTS idx_inventario_sim_turno_plan ON inventario_sim_turno (plan)",
+        "CREATE INDEX IF NOT EXISTS idx_inventario_sim_turno_diferencias ON inventario_sim_turno (diferencia_inicial, diferencia_final)",
+        "CREATE INDEX IF NOT EXISTS idx_inventario_sim_turno_turno_id ON inventario_sim_turno (turno_id)",
+    ])
+
+# (tabla, CREATE TABLE, índices) en orden de dependencias
+TABLAS = [
+    ("job_runs", """
+        CREATE TABLE job_runs (
+            id SERIAL NOT NULL,
+            job_id VARCHAR(100) NOT NULL,
+            worker_id VARCHAR(100) NOT NULL,
+            estado VARCHAR(20) NOT NULL,
+            resultado JSONB,
+            error TEXT,
+            iniciado_en TIMESTAMP WITH TIME ZONE DEFAULT now() NOT NULL,
+            finalizado_en TIMESTAMP WITH TIME ZONE,
+            duracion_ms INTEGER,
+            PRIMARY KEY (id)
+        )
+    """, [
+        "CREATE INDEX ix_job_runs_job_iniciado ON job_runs (job_id, iniciado_en)",
+    ]),
+    ("modules", """
+        CREATE TABLE modules (
+            id SERIAL NOT NULL,
+            name VARCHAR NOT NULL,
+            PRIMARY KEY (id),
+            UNIQUE (name)
+        )
+    """, [
+        "CREATE INDEX ix_modules_id ON modules (id)",
+    ]),
+    ("plan_homologacion", """
+        CREATE TABLE plan_homologacion (
+            winred_product_id VARCHAR NOT NULL,
+            operador VARCHAR(20) NOT NULL,
+            nombre_winred VARCHAR(120) NOT NULL,
+            siigo_code VARCHAR(20) NOT NULL,
+            activo BOOLEAN NOT NULL,
+            PRIMARY KEY (winred_product_id)
+        )
+    """, [
+        "CREATE INDEX ix_plan_homologacion_siigo_code ON plan_homologacion (siigo_code)",
+    ]),
+    ("roles", """
+        CREATE TABLE roles (
+            id SERIAL NOT NULL,
+            name VARCHAR NOT NULL,
+            PRIMARY KEY (id),
+            UNIQUE (name)
+        )
+    """, [
+        "CREATE INDEX ix_roles_id ON roles (id)",
+    ]),
+    ("sim_lotes", """
+        CREATE TABLE sim_lotes (
+            id VARCHAR NOT NULL,
+            operador VARCHAR NOT NULL,
+            plan_asignado VARCHAR,
+            estado VARCHAR,
+            fecha_registro TIMESTAMP WITH TIME ZONE DEFAULT now(),
+            PRIMARY KEY (id)
+        )
+    """, [
+    ]),
+    ("role_modules", """
+        CREATE TABLE role_modules (
+            id SERIAL NOT NULL,
+            role_id INTEGER,
+            module_id INTEGER,
+            PRIMARY KEY (id),
+            FOREIGN KEY(role_id) REFERENCES roles (id) ON DELETE CASCADE,
+            FOREIGN KEY(module_id) REFERENCES modules (id) ON DELETE CASCADE
+        )
+    """, [
+        "CREATE INDEX ix_role_modules_id ON role_modules (id)",
+    ]),
+    ("sim_detalle", """
+        CREATE TABLE sim_detalle (
+            id VARCHAR NOT NULL,
+            lote_id VARCHAR NOT NULL,
+            numero_linea VARCHAR NOT NULL,
+            iccid VARCHAR NOT NULL,
+            estado simstatus,
+            fecha_registro TIMESTAMP WITH TIME ZONE DEFAULT now(),
+            plan_asignado VARCHAR,
+            fecha_ultima_recarga TIMESTAMP WITH TIME ZONE,
+            winred_product_id VARCHAR,
+            vendida BOOLEAN NOT NULL,
+            fecha_venta TIMESTAMP WITH TIME ZONE,
+            venta_id VARCHAR,
+            PRIMARY KEY (id),
+            FOREIGN KEY(lote_id) REFERENCES sim_lotes (id) ON DELETE CASCADE,
+            UNIQUE (iccid)
+        )
+    """, [
+    ]),
+    ("topup_jobs", """
+        CREATE TABLE topup_jobs (
+            id UUID NOT NULL,
+            lote_id VARCHAR NOT NULL,
+            winred_product_id VARCHAR NOT NULL,
+            amount VARCHAR(20) NOT NULL,
+            sell_from VARCHAR(5) NOT NULL,
+            estado VARCHAR(20) NOT NULL,
+            worker_id VARCHAR(100),
+            heartbeat_at TIMESTAMP WITH TIME ZONE,
+            total INTEGER NOT NULL,
+            procesadas INTEGER NOT NULL,
+            exitosas INTEGER NOT NULL,
+            fallidas INTEGER NOT NULL,
+            por_verificar INTEGER NOT NULL,
+            ultimo_indice INTEGER NOT NULL,
+            ultimo_error TEXT,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+            updated_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+            finished_at TIMESTAMP WITH TIME ZONE,
+            PRIMARY KEY (id),
+            FOREIGN KEY(lote_id) REFERENCES sim_lotes (id) ON DELETE CASCADE
+        )
+    """, [
+        "CREATE INDEX ix_topup_jobs_lote_id ON topup_jobs (lote_id)",
+    ]),
+    ("users", """
+        CREATE TABLE users (
+            id SERIAL NOT NULL,
+            username VARCHAR NOT NULL,
+            hashed_password VARCHAR NOT NULL,
+            full_name VARCHAR,
+            email VARCHAR,
+            is_active BOOLEAN,
+            role_id INTEGER,
+            PRIMARY KEY (id),
+            UNIQUE (email),
+            FOREIGN KEY(role_id) REFERENCES roles (id)
+        )
+    """, [
+        "CREATE INDEX ix_users_id ON users (id)",
+        "CREATE UNIQUE INDEX ix_users_username ON users (username)",
+    ]),
+    ("idempotency_keys", """
+        CREATE TABLE idempotency_keys (
+            key VARCHAR(255) NOT NULL,
+            user_id INTEGER NOT NULL,
+            endpoint VARCHAR(100) NOT NULL,
+            request_hash VARCHAR(64) NOT NULL,
+            estado VARCHAR(20) NOT NULL,
+            status_code INTEGER,
+            response JSONB,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+            expires_at TIMESTAMP WITH TIME ZONE NOT NULL,
+            PRIMARY KEY (key, user_id, endpoint),
+            FOREIGN KEY(user_id) REFERENCES users (id)
+        )
+    """, [
+        "CREATE INDEX ix_idempotency_keys_expires_at ON idempotency_keys (expires_at)",
+    ]),
+    ("sales", """
+        CREATE TABLE sales (
+            id UUID NOT NULL,
+            numero_consecutivo VARCHAR(50) NOT NULL,
+            customer_id VARCHAR,
+            customer_identification VARCHAR,
+            payment_method VARCHAR,
+            siigo_invoice_id VARCHAR,
+            total NUMERIC,
+            created_at TIMESTAMP WITHOUT TIME ZONE DEFAULT now(),
+            estado VARCHAR(20) NOT NULL,
+            es_contingencia BOOLEAN NOT NULL,
+            siigo_pendiente BOOLEAN NOT NULL,
+            observaciones TEXT,
+            siigo_payload TEXT,
+            siigo_intentos INTEGER NOT NULL,
+            siigo_ultimo_error TEXT,
+            user_id INTEGER,
+            PRIMARY KEY (id),
+            FOREIGN KEY(user_id) REFERENCES users (id)
+        )
+    """, [
+        "CREATE UNIQUE INDEX ix_sales_numero_consecutivo ON sales (numero_consecutivo)",
+        "CREATE INDEX ix_sales_siigo_pendiente ON sales (created_at, id) WHERE siigo_pendiente = TRUE",
+    ]),
+    ("topup_job_items", """
+        CREATE TABLE topup_job_items (
+            id SERIAL NOT NULL,
+            job_id UUID NOT NULL,
+            posicion INTEGER NOT NULL,
+            sim_detalle_id VARCHAR,
+            msisdn VARCHAR NOT NULL,
+            estado VARCHAR(20) NOT NULL,
+            error TEXT,
+            procesado_en TIMESTAMP WITH TIME ZONE,
+            PRIMARY KEY (id),
+            FOREIGN KEY(job_id) REFERENCES topup_jobs (id) ON DELETE CASCADE
+        )
+    """, [
+        "CREATE INDEX ix_topup_job_items_pendientes ON topup_job_items (job_id, posicion) WHERE estado = 'pendiente'",
+        "CREATE UNIQUE INDEX ux_topup_job_items_job_posicion ON topup_job_items (job_id, posicion)",
+    ]),
+    ("turnos", """
+        CREATE TABLE turnos (
+            id UUID NOT NULL,
+            numero_consecutivo INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            fecha_apertura TIMESTAMP WITH TIME ZONE DEFAULT now(),
+            fecha_cierre TIMESTAMP WITH TIME ZONE,
+            estado VARCHAR(20) NOT NULL,
+            PRIMARY KEY (id),
+            FOREIGN KEY(user_id) REFERENCES users (id)
+        )
+    """, [
+        "CREATE INDEX ix_turnos_id ON turnos (id)",
+        "CREATE UNIQUE INDEX ix_turnos_numero_consecutivo ON turnos (numero_consecutivo)",
+    ]),
+    ("cierres_caja", """
+        CREATE TABLE cierres_caja (
+            id UUID NOT NULL,
+            turno_id UUID NOT NULL,
+            fecha_cierre TIMESTAMP WITH TIME ZONE DEFAULT now(),
+            total_ventas_electronicas NUMERIC(12, 2) NOT NULL,
+            total_ventas_efectivo NUMERIC(12, 2) NOT NULL,
+            total_ventas_datafono NUMERIC(12, 2) NOT NULL,
+            total_ventas_dollars NUMERIC(12, 2) NOT NULL,
+            efectivo_reportado NUMERIC(12, 2) NOT NULL,
+            datafono_reportado NUMERIC(12, 2) NOT NULL,
+            dolares_reportado NUMERIC(12, 2) NOT NULL,
+            diferencia_efectivo NUMERIC(12, 2) GENERATED ALWAYS AS (efectivo_reportado - total_ventas_efectivo) STORED NOT NULL,
+            diferencia_datafono NUMERIC(12, 2) GENERATED ALWAYS AS (datafono_reportado - total_ventas_electronicas) STORED NOT NULL,
+            diferencia_dolares NUMERIC(12, 2) GENERATED ALWAYS AS (dolares_reportado - total_ventas_dollars) STORED NOT NULL,
+            observaciones TEXT,
+            PRIMARY KEY (id),
+            FOREIGN KEY(turno_id) REFERENCES turnos (id)
+        )
+    """, [
+        "CREATE INDEX ix_cierres_caja_id ON cierres_caja (id)",
+    ]),
+    ("devoluciones_sim", """
+        CREATE TABLE devoluciones_sim (
+            id UUID NOT NULL,
+            tipo_devolucion VARCHAR(20) NOT NULL,
+            sale_id UUID NOT NULL,
+            sim_defectuosa_id VARCHAR NOT NULL,
+            sim_defectuosa_iccid VARCHAR NOT NULL,
+            sim_defectuosa_numero VARCHAR NOT NULL,
+            sim_reemplazo_id VARCHAR,
+            sim_reemplazo_iccid VARCHAR,
+            sim_reemplazo_numero VARCHAR,
+            motivo TEXT NOT NULL,
+            fecha_devolucion TIMESTAMP WITH TIME ZONE DEFAULT now(),
+            user_id INTEGER NOT NULL,
+            turno_id UUID,
+            cliente_nombre VARCHAR,
+            cliente_identificacion VARCHAR,
+            cliente_telefono VARCHAR,
+            monto_devuelto NUMERIC(12, 2),
+            metodo_devolucion VARCHAR,
+            PRIMARY KEY (id),
+            FOREIGN KEY(sale_id) REFERENCES sales (id),
+            FOREIGN KEY(sim_defectuosa_id) REFERENCES sim_detalle (id),
+            FOREIGN KEY(sim_reemplazo_id) REFERENCES sim_detalle (id),
+            FOREIGN KEY(user_id) REFERENCES users (id),
+            FOREIGN KEY(turno_id) REFERENCES turnos (id)
+        )
+    """, [
+    ]),
+    ("esims", """
+        CREATE TABLE esims (
+            id UUID NOT NULL,
+            iccid VARCHAR(20) NOT NULL,
+            numero_telefono VARCHAR(15) NOT NULL,
+            estado esimstatus NOT NULL,
+            qr_blob_key VARCHAR(100),
+            qr_code_data TEXT,
+            qr_code_url VARCHAR(500),
+            fecha_venta TIMESTAMP WITH TIME ZONE,
+            fecha_vencimiento TIMESTAMP WITH TIME ZONE,
+            plan_dias INTEGER,
+            plan_nombre VARCHAR(50),
+            sale_id UUID,
+            historial_regeneraciones INTEGER NOT NULL,
+            ultima_regeneracion TIMESTAMP WITH TIME ZONE,
+            operador VARCHAR(50),
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+            updated_at TIMESTAMP WITH TIME ZONE,
+            observaciones TEXT,
+            PRIMARY KEY (id),
+            FOREIGN KEY(sale_id) REFERENCES sales (id)
+        )
+    """, [
+        "CREATE INDEX ix_esims_estado ON esims (estado)",
+        "CREATE INDEX ix_esims_fecha_vencimiento ON esims (fecha_vencimiento)",
+        "CREATE UNIQUE INDEX ix_esims_iccid ON esims (iccid)",
+        "CREATE UNIQUE INDEX ix_esims_numero_telefono ON esims (numero_telefono)",
+        "CREATE INDEX ix_esims_vendidas_vencimiento ON esims (fecha_vencimiento) WHERE estado = 'vendida'",
+    ]),
+    INVENTARIO_SIM_TURNO,
+    ("movimientos_caja", """
+        CREATE TABLE movimientos_caja (
+            id UUID NOT NULL,
+            turno_id UUID,
+            tipo VARCHAR(20) NOT NULL,
+            monto NUMERIC(12, 2) NOT NULL,
+            descripcion TEXT,
+            fecha TIMESTAMP WITH TIME ZONE DEFAULT now(),
+            metodo_pago VARCHAR(20),
+            sale_id UUID,
+            PRIMARY KEY (id),
+            FOREIGN KEY(turno_id) REFERENCES turnos (id),
+            FOREIGN KEY(sale_id) REFERENCES sales (id)
+        )
+    """, [
+        "CREATE INDEX ix_movimientos_caja_id ON movimientos_caja (id)",
+    ]),
+    ("sale_items", """
+        CREATE TABLE sale_items (
+            id UUID NOT NULL,
+            sale_id UUID,
+            product_code VARCHAR,
+            description VARCHAR,
+            quantity INTEGER,
+            unit_price NUMERIC,
+            iva NUMERIC,
+            PRIMARY KEY (id),
+            FOREIGN KEY(sale_id) REFERENCES sales (id)
+        )
+    """, [
+    ]),
+]
+
+
+def _crear_enums(bind):
+    for nombre, valores in ENUMS.items():
+        existe = bind is not None and bind.execute(
+            sa.text("SELECT 1 FROM pg_type WHERE typname = :n"), {"n": nombre}
+        ).scalar()
+        if not existe:
+            etiquetas = ", ".join(f"'{v}'" for v in valores)
+            op.execute(f"CREATE TYPE {nombre} AS ENUM ({etiquetas})")
+        elif nombre == "simstatus":
+            # Antes migration_add_devuelta_status.py
+            op.execute("ALTER TYPE simstatus ADD VALUE IF NOT EXISTS 'devuelta'")
+
+
+def _numero_consecutivo(bind, tabla: str, orden: str):
+    """Antes migration_add_numero_consecutivo*.py: columna consecutiva numerada por fecha."""
+    existe = bind.execute(
+        sa.text("SELECT 1 FROM information_schema.columns WHERE table_name = :t AND column_name = 'numero_consecutivo'"),
+        {"t": tabla},
+    ).scalar()
+    if existe:
+        return
+    op.execute(f"ALTER TABLE {tabla} ADD COLUMN numero_consecutivo INTEGER")
+    op.execute(f"""
+        UPDATE {tabla} t SET numero_consecutivo = n.fila
+        FROM (SELECT id, ROW_NUMBER() OVER (ORDER BY {orden}) AS fila FROM {tabla}) n
+        WHERE t.id = n.id
+    """)
+    op.execute(f"ALTER TABLE {tabla} ALTER COLUMN numero_consecutivo SET NOT NULL")
+    op.execute(f"ALTER TABLE {tabla} ADD CONSTRAINT {tabla}_numero_consecutivo_key UNIQUE (numero_consecutivo)")
+
+
+def _poner_al_dia(bind):
+    """Cambios de los scripts sueltos de migración, para BDs creadas antes con create_all."""
+    _numero_consecutivo(bind, "turnos", "fecha_apertura ASC")
+    _numero_consecutivo(bind, "sales", "created_at ASC")
+
+    # migration_change_consecutivo_to_varchar.py
+    tipo = bind.execute(sa.text(
+        "SELECT data_type FROM information_schema.columns WHERE table_name = 'sales' AND column_name = 'numero_consecutivo'"
+    )).scalar()
+    if tipo and "char" not in tipo.lower():
+        op.execute("ALTER TABLE sales ALTER COLUMN numero_consecutivo TYPE VARCHAR(50)")
+
+    # migration_add_contingencia_fields.py / migration_add_siigo_cola_fields.py
+    op.execute("ALTER TABLE sales ADD COLUMN IF NOT EXISTS es_contingencia BOOLEAN NOT NULL DEFAULT FALSE")
+    op.execute("ALTER TABLE sales ADD COLUMN IF NOT EXISTS siigo_pendiente BOOLEAN NOT NULL DEFAULT FALSE")
+    op.execute("ALTER TABLE sales ADD COLUMN IF NOT EXISTS observaciones TEXT")
+    op.execute("ALTER TABLE sales ADD COLUMN IF NOT EXISTS siigo_payload TEXT")
+    op.execute("ALTER TABLE sales ADD COLUMN IF NOT EXISTS siigo_intentos INTEGER NOT NULL DEFAULT 0")
+    op.execute("ALTER TABLE sales ADD COLUMN IF NOT EXISTS siigo_ultimo_error TEXT")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_sales_siigo_pendiente ON sales (created_at, id) WHERE siigo_pendiente = TRUE")
+    op.execute("ALTER TABLE movimientos_caja ALTER COLUMN turno_id DROP NOT NULL")
+
+    # migration_add_topup_job_items.py
+    op.execute("ALTER TABLE topup_jobs ADD COLUMN IF NOT EXISTS worker_id VARCHAR(100)")
+    op.execute("ALTER TABLE topup_jobs ADD COLUMN IF NOT EXISTS heartbeat_at TIMESTAMP WITH TIME ZONE")
+    op.execute("ALTER TABLE topup_jobs ADD COLUMN IF NOT EXISTS por_verificar INTEGER NOT NULL DEFAULT 0")
+    op.execute("ALTER TABLE topup_jobs ALTER COLUMN estado SET DEFAULT 'pendiente'")
+    op.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_topup_job_items_job_posicion ON topup_job_items (job_id, posicion)"
+    )
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_topup_job_items_pendientes ON topup_job_items (job_id, posicion) "
+        "WHERE estado = 'pendiente'"
+    )
+
+    # migration_move_esim_qr_to_blobs.py (la copia de los QR al blob store sigue en backfill_esim_qr_blobs.py)
+    op.execute("ALTER TABLE esims ADD COLUMN IF NOT EXISTS qr_blob_key VARCHAR(100)")
+    # migration_add_esim_vencimiento_index.py
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_esims_vendidas_vencimiento ON esims (fecha_vencimiento) WHERE estado = 'vendida'"
+    )
+
+    # Marcador del create_all al arrancar, reemplazado por alembic_version
+    op.execute("DROP TABLE IF EXISTS schema_marker")
+
+
+def _datos():
+    # migrations/add_esims_module.sql y migration_add_contingencia_fields.py
+    op.execute("INSERT INTO modules (name) VALUES ('eSims') ON CONFLICT (name) DO NOTHING")
+    op.execute("INSERT INTO modules (name) VALUES ('Contingencia') ON CONFLICT (name) DO NOTHING")
+    op.execute("""
+        INSERT INTO role_modules (role_id, module_id)
+        SELECT r.id, m.id
+        FROM roles r, modules m
+        WHERE LOWER(r.name) IN ('admin', 'administrador')
+          AND m.name = 'Contingencia'
+          AND NOT EXISTS (
+            SELECT 1 FROM role_modules rm WHERE rm.role_id = r.id AND rm.module_id = m.id
+          )
+    """)
+
+
+def upgrade():
+    if op.get_context().as_sql:
+        # alembic upgrade head --sql: script para una BD vacía
+        bind, existentes = None, set()
+    else:
+        bind = op.get_bind()
+        existentes = set(sa.inspect(bind).get_table_names())
+
+    _crear_enums(bind)
+    for nombre, create_table, indices in TABLAS:
+        if nombre in existentes:
+            continue
+        op.execute(create_table)
+        for indice in indices:
+            op.execute(indice)
+    # Los índices de inventario_sim_turno solo existían en el .sql; create_all no los creaba
+    if INVENTARIO_SIM_TURNO[0] in existentes:
+        for indice in INVENTARIO_SIM_TURNO[2]:
+            op.execute(indice)
+
+    if existentes:
+        _poner_al_dia(bind)
+        # En una BD nueva los módulos y roles los crea init_data.py
+        _datos()
+
+
+def downgrade():
+    for nombre, _create_table, _indices in reversed(TABLAS):
+        op.execute(f"DROP TABLE IF EXISTS {nombre}")
+    for nombre in ENUMS:
+        op.execute(f"DROP TYPE IF EXISTS {nombre}")
@@ -0,0 +1,59 @@
+"""Índices para las consultas de ventas, caja, SIMs y devoluciones
+
+Se crean con CREATE INDEX CONCURRENTLY (sin bloquear escrituras en tablas grandes),
+por eso cada uno va fuera de la transacción de la migración.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-19
+"""
+from alembic import op
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+INDICES = [
+    # Dashboard y reportes filtran ventas por rango de fechas
+    ("ix_sales_created_at", "sales (created_at)"),
+    # Totales de caja por turno y tipo de movimiento (cierres)
+    ("ix_movimientos_caja_turno_tipo", "movimientos_caja (turno_id, tipo)"),
+    # Movimientos por fecha (ventas en contingencia sin turno, reportes)
+    ("ix_movimientos_caja_fecha", "movimientos_caja (fecha)"),
+    # Inventario de un lote por estado
+    ("ix_sim_detalle_lote_estado", "sim_detalle (lote_id, estado)"),
+    # SIMs disponibles de un plan (venta e inventario por turno)
+    ("ix_sim_detalle_plan_estado", "sim_detalle (plan_asignado, estado)"),
+    # FK sin índice: devoluciones de una SIM
+    ("ix_devoluciones_sim_sim_defectuosa", "devoluciones_sim (sim_defectuosa_id)"),
+]
+
+
+def _borrar_si_invalido(nombre: str):
+    # Un CREATE INDEX CONCURRENTLY interrumpido deja un índice inválido que IF NOT EXISTS no repara
+    op.execute(f"""
+        DO $$
+        BEGIN
+            IF EXISTS (
+                SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+                WHERE c.relname = '{nombre}' AND NOT i.indisvalid
+            ) THEN
+                EXECUTE 'DROP INDEX {nombre}';
+            END IF;
+        END $$
+    """)
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        for nombre, definicion in INDICES:
+            _borrar_si_invalido(nombre)
+            op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {nombre} ON {definicion}")
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for nombre, _definicion in reversed(INDICES):
+            op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {nombre}")
@@ -0,0 +1,96 @@
+"""Índices según las consultas de dashboard, turnos y sims
+
+Diseñados a partir de los filtros reales de routes/dashboard.py, routes/turnos.py y
+routes/sims.py. Casi todas las consultas de ventas filtran movimientos_caja por
+tipo = 'venta' y unen sales con estado = 'activa', así que esos índices son parciales
+(solo indexan las filas que esas consultas leen) y algunos incluyen (INCLUDE) las
+columnas que se suman para resolver la consulta sin ir a la tabla.
+El parcial por turno reemplaza a ix_movimientos_caja_turno_tipo de 0002 (todas las
+consultas por turno filtran tipo = 'venta'), que se elimina. ix_movimientos_caja_fecha se
+mantiene: la exportación incremental de analytics (services/analytics_export.py) recorre
+todos los movimientos por fecha, sin filtrar el tipo.
+check_query_plans.py verifica con EXPLAIN que los planes los usen.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-19
+"""
+from alembic import op
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+INDICES = [
+    # KPIs / serie diaria / últimas ventas del dashboard: rango de fecha sobre las ventas
+    ("ix_movimientos_caja_ventas_fecha",
+     "movimientos_caja (fecha) INCLUDE (monto, metodo_pago, sale_id) WHERE tipo = 'venta'"),
+    # Totales y cierre de un turno (y de varios con turno_id IN (...))
+    ("ix_movimientos_caja_ventas_turno",
+     "movimientos_caja (turno_id) INCLUDE (monto, metodo_pago, sale_id) WHERE tipo = 'venta'"),
+    # Movimientos de una venta (anulación, detalle)
+    ("ix_movimientos_caja_sale_id", "movimientos_caja (sale_id)"),
+    # Filtro por vendedor del dashboard sobre las ventas activas
+    ("ix_sales_activas_user", "sales (user_id, created_at) WHERE estado = 'activa'"),
+    # Conteos por estado (stats de sims) e inventario disponible
+    ("ix_sim_detalle_estado", "sim_detalle (estado)"),
+    # SIM de una venta
+    ("ix_sim_detalle_venta_id", "sim_detalle (venta_id)"),
+    # Búsqueda por número de línea (MSISDN)
+    ("ix_sim_detalle_numero_linea", "sim_detalle (numero_linea)"),
+    # Listado de SIMs vendidas del dashboard (ORDER BY fecha_venta DESC NULLS LAST)
+    ("ix_sim_detalle_vendidas_fecha", "sim_detalle (fecha_venta DESC NULLS LAST) WHERE vendida = TRUE"),
+    # Turno abierto del usuario (se consulta en cada venta y apertura/cierre)
+    ("ix_turnos_user_abierto", "turnos (user_id) WHERE estado = 'abierto'"),
+    # Historial de turnos del usuario
+    ("ix_turnos_user_apertura", "turnos (user_id, fecha_apertura DESC)"),
+    # Cierres por rango de fecha y por turno
+    ("ix_cierres_caja_fecha_cierre", "cierres_caja (fecha_cierre)"),
+    ("ix_cierres_caja_turno_id", "cierres_caja (turno_id)"),
+    # Devoluciones por rango de fecha
+    ("ix_devoluciones_sim_fecha", "devoluciones_sim (fecha_devolucion)"),
+]
+
+# Índices de 0002 cubiertos por los parciales de arriba: (nombre, definición para el downgrade)
+SUPERADOS = [
+    ("ix_movimientos_caja_turno_tipo", "movimientos_caja (turno_id, tipo)"),
+]
+
+
+def _borrar_si_invalido(nombre: str):
+    # Un CREATE INDEX CONCURRENTLY interrumpido deja un índice inválido que IF NOT EXISTS no repara
+    op.execute(f"""
+        DO $$
+        BEGIN
+            IF EXISTS (
+                SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+                WHERE c.relname = '{nombre}' AND NOT i.indisvalid
+            ) THEN
+                EXECUTE 'DROP INDEX {nombre}';
+            END IF;
+        END $$
+    """)
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        for nombre, definicion in INDICES:
+            _borrar_si_invalido(nombre)
+            op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {nombre} ON {definicion}")
+        # Se borran después de crear los que los reemplazan: las consultas nunca quedan sin índice
+        for nombre, _definicion in SUPERADOS:
+            op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {nombre}")
+        # Estadísticas frescas para que el planificador considere los índices nuevos
+        for tabla in ("movimientos_caja", "sales", "sim_detalle", "turnos", "cierres_caja", "devoluciones_sim"):
+            op.execute(f"ANALYZE {tabla}")
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for nombre, definicion in SUPERADOS:
+            _borrar_si_invalido(nombre)
+            op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {nombre} ON {definicion}")
+        for nombre, _definicion in reversed(INDICES):
+            op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {nombre}")
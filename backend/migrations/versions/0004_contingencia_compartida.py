@@ -0,0 +1,48 @@
+"""Contingencia Siigo compartida entre procesos, conciliación y ventas rechazadas
+
+- sales.siigo_incierto: el último envío a Siigo quedó sin respuesta; el worker busca la
+  factura por su referencia antes de reenviarla.
+- sales.siigo_rechazada: venta sacada de la cola (rechazo de Siigo o reintentos agotados).
+- contingencia_estado: modo forzado, último error y progreso de la sincronización, que
+  antes vivían en la memoria de cada proceso.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-19
+"""
+from alembic import op
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("ALTER TABLE sales ADD COLUMN IF NOT EXISTS siigo_incierto BOOLEAN NOT NULL DEFAULT FALSE")
+    op.execute("ALTER TABLE sales ADD COLUMN IF NOT EXISTS siigo_rechazada BOOLEAN NOT NULL DEFAULT FALSE")
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS contingencia_estado (
+            id INTEGER PRIMARY KEY,
+            forzado BOOLEAN NOT NULL DEFAULT FALSE,
+            ultimo_error TEXT,
+            ultimo_error_en TIMESTAMP WITH TIME ZONE,
+            progreso JSONB,
+            actualizado_en TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+        )
+    """)
+    op.execute("INSERT INTO contingencia_estado (id, forzado) VALUES (1, FALSE) ON CONFLICT (id) DO NOTHING")
+
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_sales_siigo_rechazada "
+            "ON sales (created_at, id) WHERE siigo_rechazada = TRUE"
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_sales_siigo_rechazada")
+    op.execute("DROP TABLE IF EXISTS contingencia_estado")
+    op.execute("ALTER TABLE sales DROP COLUMN IF EXISTS siigo_rechazada")
+    op.execute("ALTER TABLE sales DROP COLUMN IF EXISTS siigo_incierto")
@@ -1,6 +1,6 @@
-from sqlalchemy import Column, String, Integer, Numeric,  Boolean, ForeignKey, Table, DateTime, Enum, Text, func
-from sqlalchemy.dialects.postgresql import UUID
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, String, Integer, Numeric,  Boolean, ForeignKey, Table, DateTime, Enum, Text, func, Index, text
+from sqlalchemy.dialects.postgresql import UUID, JSONB
+from sqlalchemy.orm import relationship, deferred, query_expression
 from uuid import uuid4
 from database import Base
 from sqlalchemy import Column, Integer, ForeignKey, Computed
@@ -46,11 +46,34 @@ class Sale(Base):
     siigo_pendiente = Column(Boolean, default=False, nullable=False)
     observaciones = Column(Text, nullable=True)
 
+    # Cola de contingencia: payload de factura pendiente de enviar a Siigo y control de reintentos
+    siigo_payload = Column(Text, nullable=True)
+    siigo_intentos = Column(Integer, default=0, nullable=False)
+    siigo_ultimo_error = Column(Text, nullable=True)
+    # Un envío quedó sin respuesta (timeout): antes de reenviar se busca la factura en Siigo
+    siigo_incierto = Column(Boolean, default=False, nullable=False)
+    # Fuera de la cola por rechazo de Siigo o reintentos agotados: requiere revisión manual
+    siigo_rechazada = Column(Boolean, default=False, nullable=False)
+
     user_id = Column(Integer, ForeignKey("users.id"))
     user = relationship("User")
 
     items = relationship("SaleItem", back_populates="sale", cascade="all, delete-orphan")
 
+    # Trae created_at (server_default) en el mismo INSERT ... RETURNING, sin refresh posterior
+    __mapper_args__ = {"eager_defaults": True}
+
+    __table_args__ = (
+        # Solo indexa las ventas pendientes de enviar a Siigo (cola de contingencia)
+        Index("ix_sales_siigo_pendiente", "created_at", "id", postgresql_where=text("siigo_pendiente = TRUE")),
+        # migrations/versions/0004_contingencia_compartida.py: ventas sacadas de la cola
+        Index("ix_sales_siigo_rechazada", "created_at", "id", postgresql_where=text("siigo_rechazada = TRUE")),
+        # Índices creados por migrations/versions/0002_indices_consultas.py
+        Index("ix_sales_created_at", "created_at"),
+        # migrations/versions/0003_indices_dashboard_turnos.py: filtro por vendedor sobre ventas activas
+        Index("ix_sales_activas_user", "user_id", "created_at", postgresql_where=text("estado = 'activa'")),
+    )
+
 class SaleItem(Base):
     __tablename__ = 'sale_items'
 
@@ -136,6 +159,16 @@ class SimDetalle(Base):
 
     lote = relationship("SimLote", back_populates="sims")
 
+    __table_args__ = (
+        Index("ix_sim_detalle_lote_estado", "lote_id", "estado"),
+        Index("ix_sim_detalle_plan_estado", "plan_asignado", "estado"),
+        Index("ix_sim_detalle_estado", "estado"),
+        Index("ix_sim_detalle_venta_id", "venta_id"),
+        Index("ix_sim_detalle_numero_linea", "numero_linea"),
+        # Listado de SIMs vendidas (ORDER BY fecha_venta DESC NULLS LAST)
+        Index("ix_sim_detalle_vendidas_fecha", text("fecha_venta DESC NULLS LAST"), postgresql_where=text("vendida = TRUE")),
+    )
+
 class Turno(Base):
     __tablename__ = "turnos"
 
@@ -146,6 +179,12 @@ class Turno(Base):
     fecha_cierre = Column(DateTime(timezone=True))
     estado = Column(String(20), nullable=False, default="abierto")
 
+    __table_args__ = (
+        # Turno abierto del usuario: solo hay uno por usuario, el índice parcial es mínimo
+        Index("ix_turnos_user_abierto", "user_id", postgresql_where=text("estado = 'abierto'")),
+        Index("ix_turnos_user_apertura", "user_id", text("fecha_apertura DESC")),
+    )
+
 class CierreCaja(Base):
     __tablename__ = "cierres_caja"
 
@@ -171,6 +210,11 @@ class CierreCaja(Base):
 
     observaciones = Column(Text)
 
+    __table_args__ = (
+        Index("ix_cierres_caja_fecha_cierre", "fecha_cierre"),
+        Index("ix_cierres_caja_turno_id", "turno_id"),
+    )
+
 class MovimientoCaja(Base):
     __tablename__ = "movimientos_caja"
     
@@ -183,6 +227,21 @@ class MovimientoCaja(Base):
     metodo_pago = Column(String(20))
     sale_id = Column(UUID(as_uuid=True), ForeignKey("sales.id"))
 
+    # Sin la relación el flush puede insertar el movimiento antes que la venta (FK sale_id)
+    sale = relationship("Sale")
+
+    __table_args__ = (
+        # Exportación incremental de analytics: todos los movimientos por fecha, sin filtrar el tipo
+        Index("ix_movimientos_caja_fecha", "fecha"),
+        # Solo las ventas (tipo = 'venta'), con las columnas que suman el dashboard y los cierres;
+        # las consultas de ventas por fecha o turno filtran así (reemplazan a ix_movimientos_caja_turno_tipo)
+        Index("ix_movimientos_caja_ventas_fecha", "fecha", postgresql_include=["monto", "metodo_pago", "sale_id"],
+              postgresql_where=text("tipo = 'venta'")),
+        Index("ix_movimientos_caja_ventas_turno", "turno_id", postgresql_include=["monto", "metodo_pago", "sale_id"],
+              postgresql_where=text("tipo = 'venta'")),
+        Index("ix_movimientos_caja_sale_id", "sale_id"),
+    )
+
 
 class PlanHomologacion(Base):
     __tablename__ = "plan_homologacion"
@@ -236,6 +295,11 @@ class DevolucionSim(Base):
     sim_reemplazo = relationship("SimDetalle", foreign_keys=[sim_reemplazo_id])
     turno = relationship("Turno")
 
+    __table_args__ = (
+        Index("ix_devoluciones_sim_sim_defectuosa", "sim_defectuosa_id"),
+        Index("ix_devoluciones_sim_fecha", "fecha_devolucion"),
+    )
+
 
 class ESim(Base):
     """Modelo para gestión de eSIMs con regeneración de QR"""
@@ -251,7 +315,12 @@ class ESim(Base):
     estado = Column(Enum(ESimStatus), default=ESimStatus.disponible, nullable=False, index=True)
 
     # Información del QR Code
-    qr_code_data = Column(Text, nullable=True)  # Datos del QR o base64
+    # El contenido (texto LPA o imagen) vive en el blob store (services/blob_store.py);
+    # la fila solo guarda la clave. qr_code_data queda para filas legadas y no se carga en listados.
+    qr_blob_key = Column(String(100), nullable=True)
+    qr_code_data = deferred(Column(Text, nullable=True))  # Legado: datos del QR o base64
+    # qr_code_data IS NOT NULL calculado en SQL (sin leer el texto); lo llenan las consultas de ESimService
+    qr_legado = query_expression()
     qr_code_url = Column(String(500), nullable=True)  # URL si se almacena en cloud
 
     # Información de venta y vencimiento
@@ -278,6 +347,11 @@ class ESim(Base):
     # Observaciones
     observaciones = Column(Text, nullable=True)
 
+    __table_args__ = (
+        # Job de vencimientos: solo indexa las vendidas (las únicas que pueden vencer)
+        Index("ix_esims_vendidas_vencimiento", "fecha_vencimiento", postgresql_where=text("estado = 'vendida'")),
+    )
+
 
 class InventarioSimTurno(Base):
     """Registro de inventario de SIMs por turno y plan."""
@@ -318,4 +392,115 @@ class InventarioSimTurno(Base):
 
 
 # Agregar relación inversa en Turno
-Turno.inventarios_sim = relationship("InventarioSimTurno", back_populates="turno", cascade="all, delete-orphan")
\ No newline at end of file
+Turno.inventarios_sim = relationship("InventarioSimTurno", back_populates="turno", cascade="all, delete-orphan")
+
+class IdempotencyKey(Base):
+    """Claves Idempotency-Key de endpoints de venta: un reintento devuelve la respuesta original."""
+    __tablename__ = "idempotency_keys"
+
+    # La clave es única por usuario y endpoint
+    key = Column(String(255), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    endpoint = Column(String(100), primary_key=True)
+
+    # sha256 del cuerpo de la solicitud original (detecta reuso de la clave con otro cuerpo)
+    request_hash = Column(String(64), nullable=False)
+
+    # en_curso | completada
+    estado = Column(String(20), nullable=False, default="en_curso")
+    status_code = Column(Integer, nullable=True)
+    response = Column(JSONB, nullable=True)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
+
+
+class TopupJob(Base):
+    """Recarga de un lote en Winred, ejecutada por un worker en segundo plano (services/winred_topup.py)."""
+    __tablename__ = "topup_jobs"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid4)
+    lote_id = Column(String, ForeignKey("sim_lotes.id", ondelete="CASCADE"), nullable=False, index=True)
+
+    # Parámetros de la recarga
+    winred_product_id = Column(String, nullable=False)
+    amount = Column(String(20), nullable=False, default="0")
+    sell_from = Column(String(5), nullable=False, default="S")
+
+    # pendiente | en_curso | completado | interrumpido
+    estado = Column(String(20), nullable=False, default="pendiente")
+
+    # Worker que lo está procesando; si heartbeat_at deja de avanzar otro worker lo retoma
+    worker_id = Column(String(100), nullable=True)
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True)
+
+    total = Column(Integer, nullable=False, default=0)
+    procesadas = Column(Integer, nullable=False, default=0)
+    exitosas = Column(Integer, nullable=False, default=0)
+    fallidas = Column(Integer, nullable=False, default=0)
+    # SIMs con resultado incierto (timeout o caída a mitad de la recarga): revisar antes de reintentar
+    por_verificar = Column(Integer, nullable=False, default=0)
+    # Posición (1..total, SIMs ordenadas por id) del último resultado persistido
+    ultimo_indice = Column(Integer, nullable=False, default=0)
+    ultimo_error = Column(Text, nullable=True)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+
+class TopupJobItem(Base):
+    """Estado de la recarga de una SIM dentro de un TopupJob."""
+    __tablename__ = "topup_job_items"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    job_id = Column(UUID(as_uuid=True), ForeignKey("topup_jobs.id", ondelete="CASCADE"), nullable=False)
+    posicion = Column(Integer, nullable=False)  # 1..total, SIMs del lote ordenadas por id
+    sim_detalle_id = Column(String, nullable=True)
+    msisdn = Column(String, nullable=False)
+
+    # pendiente | en_curso | exitosa | fallida | verificar
+    estado = Column(String(20), nullable=False, default="pendiente")
+    error = Column(Text, nullable=True)
+    procesado_en = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        Index("ux_topup_job_items_job_posicion", "job_id", "posicion", unique=True),
+        # El worker toma los pendientes en orden de posición
+        Index("ix_topup_job_items_pendientes", "job_id", "posicion", postgresql_where=text("estado = 'pendiente'")),
+    )
+
+
+class JobRun(Base):
+    """Ejecución de un job programado (services/scheduler_leader.py): historial, duración y resultado."""
+    __tablename__ = "job_runs"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    job_id = Column(String(100), nullable=False)
+    worker_id = Column(String(100), nullable=False)
+
+    # en_curso | exitoso | fallido | interrumpido (el proceso murió durante la ejecución)
+    estado = Column(String(20), nullable=False, default="en_curso")
+    resultado = Column(JSONB, nullable=True)
+    error = Column(Text, nullable=True)
+
+    iniciado_en = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    finalizado_en = Column(DateTime(timezone=True), nullable=True)
+    duracion_ms = Column(Integer, nullable=True)
+
+    __table_args__ = (
+        Index("ix_job_runs_job_iniciado", "job_id", "iniciado_en"),
+    )
+
+
+class ContingenciaEstado(Base):
+    """Estado compartido del modo contingencia Siigo (una sola fila, id=1): services/siigo_contingencia.py."""
+    __tablename__ = "contingencia_estado"
+
+    id = Column(Integer, primary_key=True)
+    forzado = Column(Boolean, nullable=False, default=False)
+    ultimo_error = Column(Text, nullable=True)
+    ultimo_error_en = Column(DateTime(timezone=True), nullable=True)
+    # Progreso de la última sincronización (lo escribe el proceso que la ejecuta)
+    progreso = Column(JSONB, nullable=True)
+    actualizado_en = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
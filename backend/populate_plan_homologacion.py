@@ -7,7 +7,7 @@ Ejecutar: python backend/populate_plan_homologacion.py
 import asyncio
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy import select
+from sqlalchemy import select, text
 from models import PlanHomologacion
 import os
 from dotenv import load_dotenv
@@ -67,6 +67,8 @@ async def populate_plan_homologacion():
             session.add(plan)
             print(f"✅ Agregado: {winred_id} → {siigo_code} ({nombre})")
 
+        # Avisar al servidor (LISTEN plan_homologacion) que recargue el mapa en memoria
+        await session.execute(text("SELECT pg_notify('plan_homologacion', 'populate')"))
         await session.commit()
         print("\n" + "="*70)
         print("✅ TABLA POBLADA CORRECTAMENTE")
@@ -98,4 +100,5 @@ if __name__ == "__main__":
     asyncio.run(populate_plan_homologacion())
 
     print("\n✅ Proceso completado.")
-    print("   Ahora las recargas se guardarán correctamente en la base de datos.\n")
+    print("   Ahora las recargas se guardarán correctamente en la base de datos.")
+    print("   El servidor recarga la homologación automáticamente (NOTIFY plan_homologacion).\n")
@@ -0,0 +1,77 @@
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import BaseModel, Field
+from typing import Optional
+from uuid import UUID
+from models import User
+from utils.auth_utils import get_current_user
+from services import siigo_contingencia
+
+router = APIRouter()
+
+
+class ModoContingenciaBody(BaseModel):
+    activo: bool
+
+
+class SincronizarBody(BaseModel):
+    concurrencia: Optional[int] = Field(None, ge=1, le=16)
+    lote: Optional[int] = Field(None, ge=1, le=500)
+
+
+def _verificar_permiso(current_user: User):
+    if "Contingencia" not in [m.name for m in current_user.role.modules]:
+        raise HTTPException(status_code=403, detail="No tienes permiso para gestionar la contingencia")
+
+
+@router.get("/estado")
+async def estado_contingencia(current_user: User = Depends(get_current_user)):
+    """Modo contingencia, ventas pendientes de Siigo y progreso de la última sincronización"""
+    _verificar_permiso(current_user)
+    return {
+        "modo": await siigo_contingencia.estado_modo(),
+        "cola": await siigo_contingencia.contar_pendientes(),
+        "sincronizacion": await siigo_contingencia.progreso(),
+    }
+
+
+@router.post("/sincronizar")
+async def sincronizar_contingencia(
+    body: Optional[SincronizarBody] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Inicia en segundo plano el envío a Siigo de las facturas pendientes"""
+    _verificar_permiso(current_user)
+    body = body or SincronizarBody()
+    iniciada = await siigo_contingencia.iniciar_sincronizacion(body.concurrencia, body.lote)
+    return {
+        "iniciada": iniciada,
+        "message": "Sincronización iniciada" if iniciada else "Ya hay una sincronización en curso",
+        "sincronizacion": await siigo_contingencia.progreso(),
+    }
+
+
+@router.post("/modo")
+async def cambiar_modo_contingencia(
+    body: ModoContingenciaBody,
+    current_user: User = Depends(get_current_user)
+):
+    """Activa/desactiva manualmente el modo contingencia (las ventas electrónicas no esperan a Siigo)"""
+    _verificar_permiso(current_user)
+    await siigo_contingencia.set_modo_forzado(body.activo)
+    return {"modo": await siigo_contingencia.estado_modo()}
+
+
+@router.get("/rechazadas")
+async def ventas_rechazadas(current_user: User = Depends(get_current_user)):
+    """Ventas fuera de la cola (rechazo de Siigo o reintentos agotados) que requieren revisión manual"""
+    _verificar_permiso(current_user)
+    return {"ventas": await siigo_contingencia.listar_rechazadas()}
+
+
+@router.post("/ventas/{venta_id}/reencolar")
+async def reencolar_venta(venta_id: UUID, current_user: User = Depends(get_current_user)):
+    """Devuelve a la cola de Siigo una venta rechazada (p.ej. tras corregir el cliente en Siigo)"""
+    _verificar_permiso(current_user)
+    if not await siigo_contingencia.reencolar(venta_id):
+        raise HTTPException(status_code=404, detail="La venta no existe o no está rechazada")
+    return {"message": "Venta devuelta a la cola de Siigo", "venta_id": str(venta_id)}
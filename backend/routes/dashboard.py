@@ -1,24 +1,106 @@
 # dashboard.py
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text, select, and_, func
+import logging
+import os
 from datetime import datetime, timedelta, timezone
 from typing import Optional
 
-from database import get_async_session
+from database import get_async_session, engine
 from models import (
     SimDetalle, SimLote, MovimientoCaja, Sale, CierreCaja,
     DevolucionSim, Turno, User, InventarioSimTurno
 )
 from utils.auth_utils import get_current_user
+from utils import concurrent_queries, streaming_export
+from services import analytics_duckdb, analytics_export, dashboard_cache, scheduler_leader
+from jobs.analytics_export_job import export_analytics
 
 router = APIRouter(tags=["dashboard"])
+logger = logging.getLogger(__name__)
 
 def _tznow():
     
     return datetime.now(timezone.utc).astimezone()
 
+
+# Consultas de los endpoints como funciones de módulo: check_query_plans.py hace EXPLAIN
+# sobre este mismo SQL, así la verificación no se desfasa de lo que ejecutan las rutas.
+
+def _condiciones_stats(con_usuario: bool, con_rango: bool) -> tuple:
+    cond_user = "s.user_id = :user_id" if con_usuario else "true"
+    cond_rango = "m.fecha >= :desde and m.fecha < :hasta" if con_rango else "true"
+    return cond_user, cond_rango
+
+
+def sql_stats_ventas(con_usuario: bool, con_rango: bool):
+    """
+    /stats: una sola lectura de las ventas activas para KPIs, tickets, ventas de hoy por
+    método y serie diaria. Cada sección marca sus filas (en_filtro / en_serie / es_hoy) y los
+    agregados se separan con FILTER; GROUPING SETS da en la misma pasada el total (), el
+    desglose por método de hoy y la serie por día.
+    """
+    cond_user, cond_rango = _condiciones_stats(con_usuario, con_rango)
+    return text(f"""
+        with base as (
+            select
+                m.monto,
+                m.metodo_pago,
+                m.fecha,
+                date(m.fecha)                                      as dia,
+                ({cond_user} and {cond_rango})                     as en_filtro,
+                ({cond_user}
+                  and m.fecha >= cast(:serie_desde as date)
+                  and m.fecha <  cast(:serie_hasta as date))       as en_serie,
+                (m.fecha >= :today0)                               as es_hoy
+            from movimientos_caja m
+            join sales s on m.sale_id = s.id
+            where m.tipo='venta' and s.estado='activa'
+            {"and m.fecha >= :base_desde" if con_rango else ""}
+        )
+        select
+            grouping(metodo_pago, dia)                                                   as nivel,
+            metodo_pago,
+            dia,
+            coalesce(sum(monto) filter (where en_filtro), 0)                              as total_general,
+            coalesce(sum(monto) filter (where en_filtro and metodo_pago='cash'), 0)       as total_efectivo,
+            coalesce(sum(monto) filter (where en_filtro and metodo_pago='electronic'), 0) as total_electronicas,
+            coalesce(sum(monto) filter (where en_filtro and metodo_pago='card'), 0)       as total_datafono,
+            coalesce(sum(monto) filter (where en_filtro and fecha >= :today0), 0)         as total_hoy,
+            coalesce(sum(monto) filter (where en_filtro and fecha >= :week0), 0)          as total_semana,
+            coalesce(sum(monto) filter (where en_filtro and fecha >= :month0), 0)         as total_mes,
+            count(*) filter (where en_filtro)                                            as ventas_total,
+            count(*) filter (where en_filtro and fecha >= :today0)                       as ventas_hoy,
+            coalesce(avg(monto) filter (where en_filtro and fecha >= :today0), 0)         as ticket_promedio_hoy,
+            coalesce(avg(monto) filter (where en_filtro), 0)                              as ticket_promedio_mes,
+            coalesce(sum(monto) filter (where es_hoy), 0)                                 as total_hoy_metodo,
+            count(*) filter (where es_hoy)                                               as ventas_hoy_metodo,
+            coalesce(sum(monto) filter (where en_serie), 0)                               as total_dia,
+            count(*) filter (where en_serie)                                             as ventas_dia
+        from base
+        group by grouping sets ((), (metodo_pago), (dia))
+    """)
+
+
+def sql_stats_ultimas(con_usuario: bool, con_rango: bool):
+    """/stats: últimas ventas (mismo rango/usuario), recorrido hacia atrás del índice parcial de ventas."""
+    cond_user, cond_rango = _condiciones_stats(con_usuario, con_rango)
+    return text(f"""
+        select m.fecha, m.metodo_pago, m.monto, m.sale_id
+        from movimientos_caja m
+        join sales s on m.sale_id = s.id
+        where m.tipo='venta' and s.estado = 'activa'
+          and {cond_user}
+          and {cond_rango}
+        order by m.fecha desc
+        limit 10
+    """)
+
+
 @router.get("/stats")
+@dashboard_cache.cacheado("/stats", ("ventas", "sims"))
 async def get_dashboard_stats(
     days: Optional[int] = None,
     fecha_desde: Optional[str] = None,
@@ -57,154 +139,72 @@ async def get_dashboard_stats(
         rango_desde = (now - timedelta(days=days)).replace(tzinfo=None)
         rango_hasta = now.replace(tzinfo=None)
 
-    where_user  = " and s.user_id = :user_id " if user_id_int else ""
-    where_rango = " and m.fecha >= :desde and m.fecha < :hasta " if (rango_desde and rango_hasta) else ""
-
-    params_base = {"today0": today0, "week0": week0, "month0": month0}
-    if user_id_int:
-        params_base["user_id"] = user_id_int
-    if rango_desde and rango_hasta:
-        params_base["desde"] = rango_desde
-        params_base["hasta"] = rango_hasta
-
-    # 1) KPIs totales
-    sql_payments = text(f"""
-        select
-            coalesce(sum(m.monto),0)                                              as total_general,
-            coalesce(sum(case when m.metodo_pago='cash' then m.monto end),0)      as total_efectivo,
-            coalesce(sum(case when m.metodo_pago='electronic' then m.monto end),0) as total_electronicas,
-            coalesce(sum(case when m.metodo_pago='card' then m.monto end),0)      as total_datafono,
-            coalesce(sum(case when m.fecha >= :today0 then m.monto end),0)        as total_hoy,
-            coalesce(sum(case when m.fecha >= :week0  then m.monto end),0)        as total_semana,
-            coalesce(sum(case when m.fecha >= :month0 then m.monto end),0)        as total_mes,
-            count(*)                                                              as ventas_total,
-            coalesce(sum(case when m.fecha >= :today0 then 1 else 0 end),0)       as ventas_hoy
-        from movimientos_caja m
-        join sales s on m.sale_id = s.id
-        where m.tipo='venta' and s.estado='activa'
-        {where_user}
-        {where_rango}
-    """)
-    res_pay = (await db.execute(sql_payments, params_base)).mappings().one()
-
-    # 2) Ticket promedio
-    sql_ticket = text(f"""
-        select
-            coalesce(avg(case when m.fecha >= :today0 then m.monto end),0) as ticket_promedio_hoy,
-            coalesce(avg(m.monto),0)                                       as ticket_promedio_mes
-        from movimientos_caja m
-        join sales s on m.sale_id = s.id
-        where m.tipo='venta' and s.estado = 'activa'
-        {where_user}
-        {where_rango}
-    """)
-    res_ticket = (await db.execute(sql_ticket, params_base)).mappings().one()
-
-    # 3) Serie diaria continua (incluye días con 0)
+    # Serie diaria: el rango pedido o, sin rango, los últimos `days` (14 por defecto) días
     if rango_desde and rango_hasta:
         serie_desde, serie_hasta = rango_desde, rango_hasta
     else:
         ventana = days if days else 14
         serie_desde = (now - timedelta(days=ventana)).replace(tzinfo=None)
         serie_hasta = now.replace(tzinfo=None)
+    serie_desde_date = serie_desde.date()
+    serie_hasta_date = serie_hasta.date()
 
-    # Convertir a date objects si son datetime
-    serie_desde_date = serie_desde.date() if hasattr(serie_desde, 'date') else serie_desde
-    serie_hasta_date = serie_hasta.date() if hasattr(serie_hasta, 'date') else serie_hasta
-    serie_hasta_minus_one = serie_hasta_date - timedelta(days=1)
-
-    # Usar f-string para insertar las fechas directamente (ya que son objetos date seguros)
-    where_user_series = f" and s.user_id = {user_id_int} " if user_id_int else ""
-
-    sql_series = text(f"""
-        with days as (
-            select generate_series(
-                '{serie_desde_date}'::date,
-                '{serie_hasta_minus_one}'::date,
-                interval '1 day'
-            )::date as d
-        ),
-        agg as (
-            select
-                date(m.fecha) as d,
-                coalesce(sum(m.monto), 0) as total
-            from movimientos_caja m
-            join sales s on m.sale_id = s.id
-            where m.tipo='venta'
-              and s.estado='activa'
-              and m.fecha >= '{serie_desde_date}'::date
-              and m.fecha < '{serie_hasta_date}'::date
-              {where_user_series}
-            group by 1
-        )
-        select d as fecha, coalesce(a.total, 0) as total
-        from days
-        left join agg a using(d)
-        order by d
-    """)
-    series_rows = (await db.execute(sql_series)).mappings().all()
-    series_por_dia = [{"fecha": r["fecha"].isoformat(), "total": float(r["total"])} for r in series_rows]
+    con_rango = bool(rango_desde and rango_hasta)
 
-    # 4) SIMs (global)
+    params = {
+        "today0": today0, "week0": week0, "month0": month0,
+        "serie_desde": serie_desde_date, "serie_hasta": serie_hasta_date,
+    }
+    if user_id_int:
+        params["user_id"] = user_id_int
+    if con_rango:
+        params["desde"] = rango_desde
+        params["hasta"] = rango_hasta
+        # Con rango no hace falta leer ventas anteriores a lo que usa alguna sección
+        params["base_desde"] = min(rango_desde, datetime.combine(serie_desde_date, datetime.min.time()), today0)
+
+    # 1) Una sola lectura de las ventas activas para KPIs, tickets, ventas de hoy por método y serie diaria
+    sql_ventas = sql_stats_ventas(bool(user_id_int), con_rango)
+
+    # 2) SIMs y lotes (global) en una lectura de sim_detalle: toda SIM pertenece a un lote
+    #    (lote_id NOT NULL), así los totales por lote son los mismos que los de las SIMs
     sql_sims = text("""
         select
-            count(*)                                                   as total_sims,
-            coalesce(sum(case when estado='available'  then 1 end),0)  as disponibles,
-            coalesce(sum(case when estado='recargado'  then 1 end),0)  as recargadas,
-            coalesce(sum(case when estado='vendido'    then 1 end),0)  as vendidas
+            (select count(*) from sim_lotes)                   as lotes,
+            count(*)                                           as total_sims,
+            count(*) filter (where estado='available')         as disponibles,
+            count(*) filter (where estado='recargado')         as recargadas,
+            count(*) filter (where estado='vendido')           as vendidas
         from sim_detalle
     """)
-    res_sims = (await db.execute(sql_sims)).mappings().one()
-
-    # 5) Lotes (global)
-    sql_lotes = text("""
-        select
-            count(*) as lotes,
-            coalesce(sum(total_sims),0) as total_sims,
-            coalesce(sum(disponibles),0) as disponibles,
-            coalesce(sum(recargadas),0) as recargadas,
-            coalesce(sum(vendidas),0) as vendidas
-        from (
-            select
-                l.id,
-                count(d.id)                                                      as total_sims,
-                sum(case when d.estado='available' then 1 else 0 end)            as disponibles,
-                sum(case when d.estado='recargado' then 1 else 0 end)            as recargadas,
-                sum(case when d.estado='vendido'   then 1 else 0 end)            as vendidas
-            from sim_lotes l
-            left join sim_detalle d on d.lote_id = l.id
-            group by l.id
-        ) t
-    """)
-    res_lotes = (await db.execute(sql_lotes)).mappings().one()
 
-    # 6) Ventas por método HOY (relativo a hoy)
-    sql_hoy_metodo = text("""
-        select m.metodo_pago, coalesce(sum(m.monto),0) as total
-        from movimientos_caja m
-        join sales s on m.sale_id = s.id
-        where m.tipo='venta' and s.estado = 'activa'
-          and m.fecha >= :today0
-        group by m.metodo_pago
-    """)
-    res_hoy_met = (await db.execute(sql_hoy_metodo, {"today0": today0})).mappings().all()
-    ventas_hoy_por_metodo = {r["metodo_pago"]: float(r["total"]) for r in res_hoy_met}
+    # 3) Últimas ventas (mismo rango/usuario)
+    sql_last_sales = sql_stats_ultimas(bool(user_id_int), con_rango)
+
+    # Las tres consultas son independientes: cada una en su propia conexión del pool
+    resultados = await concurrent_queries.en_paralelo({
+        "ventas": concurrent_queries.filas(sql_ventas, params),
+        "sims": concurrent_queries.fila(sql_sims),
+        "ultimas": concurrent_queries.filas(sql_last_sales, params),
+    }, db=db)
+    rows_ventas, res_last = resultados["ventas"], resultados["ultimas"]
+
+    res_pay = next(r for r in rows_ventas if r["nivel"] == 3)
+    res_sims = resultados["sims"]
+    # Con ventas hoy pero sin ninguna en el día aún no hay fila: igual que antes, solo métodos con ventas
+    ventas_hoy_por_metodo = {
+        r["metodo_pago"]: float(r["total_hoy_metodo"])
+        for r in rows_ventas if r["nivel"] == 1 and r["ventas_hoy_metodo"]
+    }
 
-    # 7) Últimas ventas (filtradas por el mismo rango/usuario si aplica)
-    where_user_last  = " and s.user_id = :user_id " if user_id_int else ""
-    where_rango_last = " and m.fecha >= :desde and m.fecha < :hasta " if (rango_desde and rango_hasta) else ""
+    # Serie continua: días sin ventas en 0
+    por_dia = {r["dia"]: float(r["total_dia"]) for r in rows_ventas if r["nivel"] == 2 and r["ventas_dia"]}
+    series_por_dia = []
+    dia = serie_desde_date
+    while dia < serie_hasta_date:
+        series_por_dia.append({"fecha": dia.isoformat(), "total": por_dia.get(dia, 0.0)})
+        dia += timedelta(days=1)
 
-    sql_last_sales = text(f"""
-        select m.fecha, m.metodo_pago, m.monto, m.sale_id
-        from movimientos_caja m
-        join sales s on m.sale_id = s.id
-        where m.tipo='venta' and s.estado = 'activa'
-        {where_user_last}
-        {where_rango_last}
-        order by m.fecha desc
-        limit 10
-    """)
-    res_last = (await db.execute(sql_last_sales, params_base)).mappings().all()
     ultimas_ventas = [
         {"fecha": r["fecha"], "metodo_pago": r["metodo_pago"], "monto": float(r["monto"]), "sale_id": r["sale_id"]}
         for r in res_last
@@ -221,8 +221,8 @@ async def get_dashboard_stats(
             "total_mes": float(res_pay["total_mes"]),
             "ventas_total": int(res_pay["ventas_total"]),
             "ventas_hoy": int(res_pay["ventas_hoy"]),
-            "ticket_promedio_hoy": float(res_ticket["ticket_promedio_hoy"]),
-            "ticket_promedio_mes": float(res_ticket["ticket_promedio_mes"]),
+            "ticket_promedio_hoy": float(res_pay["ticket_promedio_hoy"]),
+            "ticket_promedio_mes": float(res_pay["ticket_promedio_mes"]),
         },
         "series": {
             "ventas_ultimos_14_dias": series_por_dia,
@@ -235,11 +235,11 @@ async def get_dashboard_stats(
             "vendidas": int(res_sims["vendidas"]),
         },
         "lotes": {
-            "lotes": int(res_lotes["lotes"]),
-            "total_sims": int(res_lotes["total_sims"]),
-            "disponibles": int(res_lotes["disponibles"]),
-            "recargadas": int(res_lotes["recargadas"]),
-            "vendidas": int(res_lotes["vendidas"]),
+            "lotes": int(res_sims["lotes"]),
+            "total_sims": int(res_sims["total_sims"]),
+            "disponibles": int(res_sims["disponibles"]),
+            "recargadas": int(res_sims["recargadas"]),
+            "vendidas": int(res_sims["vendidas"]),
         },
         "ultimas_ventas": ultimas_ventas,
     }
@@ -248,6 +248,7 @@ async def get_dashboard_stats(
 
 
 @router.get("/inventario")
+@dashboard_cache.cacheado("/inventario", ("sims",))
 async def get_inventario_metrics(
     db: AsyncSession = Depends(get_async_session),
     current_user: User = Depends(get_current_user)
@@ -321,7 +322,56 @@ async def get_inventario_metrics(
     }
 
 
+def sql_ventas_ingresos(con_usuario: bool) -> tuple:
+    """/ventas-ingresos: (ventas por día y método de pago, resumen por método)."""
+    # Construcción dinámica de la consulta
+    where_clauses = [
+        "m.tipo = 'venta'",
+        "s.estado = 'activa'",
+        "m.fecha >= :fecha_desde",
+        "m.fecha <= :fecha_hasta"
+    ]
+
+    if con_usuario:
+        where_clauses.append("s.user_id = :user_id")
+
+    where_clause = " AND ".join(where_clauses)
+
+    # Ventas por día con desglose por método de pago
+    sql_ventas_dia = f"""
+        SELECT
+            DATE(m.fecha) as fecha,
+            m.metodo_pago,
+            COUNT(*) as cantidad_ventas,
+            SUM(m.monto) as total_ingresos,
+            AVG(m.monto) as ticket_promedio
+        FROM movimientos_caja m
+        JOIN sales s ON m.sale_id = s.id
+        WHERE {where_clause}
+        GROUP BY DATE(m.fecha), m.metodo_pago
+        ORDER BY fecha DESC, m.metodo_pago
+    """
+
+    sql_resumen_metodos = f"""
+        SELECT
+            m.metodo_pago,
+            COUNT(*) as cantidad_ventas,
+            SUM(m.monto) as total_ingresos,
+            AVG(m.monto) as ticket_promedio,
+            MIN(m.monto) as venta_minima,
+            MAX(m.monto) as venta_maxima
+        FROM movimientos_caja m
+        JOIN sales s ON m.sale_id = s.id
+        WHERE {where_clause}
+        GROUP BY m.metodo_pago
+        ORDER BY total_ingresos DESC
+    """
+
+    return sql_ventas_dia, sql_resumen_metodos
+
+
 @router.get("/ventas-ingresos")
+@dashboard_cache.cacheado("/ventas-ingresos", ("ventas",))
 async def get_ventas_ingresos(
     days: int = 30,
     fecha_desde: Optional[str] = None,
@@ -359,33 +409,7 @@ async def get_ventas_ingresos(
         fecha_hasta_dt = datetime.now(timezone.utc)
         print(f"[DATE] Usando dias por defecto: {days}")
 
-    # Construcción dinámica de la consulta
-    where_clauses = [
-        "m.tipo = 'venta'",
-        "s.estado = 'activa'",
-        "m.fecha >= :fecha_desde",
-        "m.fecha <= :fecha_hasta"
-    ]
-
-    if user_id_int:
-        where_clauses.append("s.user_id = :user_id")
-
-    where_clause = " AND ".join(where_clauses)
-
-    # Ventas por día con desglose por método de pago
-    sql_ventas_dia = text(f"""
-        SELECT
-            DATE(m.fecha) as fecha,
-            m.metodo_pago,
-            COUNT(*) as cantidad_ventas,
-            SUM(m.monto) as total_ingresos,
-            AVG(m.monto) as ticket_promedio
-        FROM movimientos_caja m
-        JOIN sales s ON m.sale_id = s.id
-        WHERE {where_clause}
-        GROUP BY DATE(m.fecha), m.metodo_pago
-        ORDER BY fecha DESC, m.metodo_pago
-    """)
+    sql_ventas_dia, sql_resumen_metodos = sql_ventas_ingresos(bool(user_id_int))
 
     # Parámetros para la consulta
     query_params = {
@@ -395,7 +419,9 @@ async def get_ventas_ingresos(
     if user_id_int:
         query_params["user_id"] = user_id_int
 
-    result = await db.execute(sql_ventas_dia, query_params)
+    # Con ANALYTICS_ENGINE=duckdb se resuelve sobre la exportación Parquet (services/analytics_duckdb.py)
+    datasets = ("movimientos_caja", "sales")
+    result, fuente = await analytics_duckdb.ejecutar(db, sql_ventas_dia, query_params, datasets, fecha_hasta_dt)
     ventas_por_dia = {}
 
     for row in result:
@@ -418,22 +444,7 @@ async def get_ventas_ingresos(
         ventas_por_dia[fecha_str]["total_ingresos"] += float(row.total_ingresos)
 
     # Resumen por método de pago
-    sql_resumen_metodos = text(f"""
-        SELECT
-            m.metodo_pago,
-            COUNT(*) as cantidad_ventas,
-            SUM(m.monto) as total_ingresos,
-            AVG(m.monto) as ticket_promedio,
-            MIN(m.monto) as venta_minima,
-            MAX(m.monto) as venta_maxima
-        FROM movimientos_caja m
-        JOIN sales s ON m.sale_id = s.id
-        WHERE {where_clause}
-        GROUP BY m.metodo_pago
-        ORDER BY total_ingresos DESC
-    """)
-
-    result = await db.execute(sql_resumen_metodos, query_params)
+    result, _ = await analytics_duckdb.ejecutar(db, sql_resumen_metodos, query_params, datasets, fecha_hasta_dt)
     resumen_metodos = [
         {
             "metodo": row.metodo_pago or "unknown",
@@ -452,51 +463,17 @@ async def get_ventas_ingresos(
         "periodo_dias": (fecha_hasta_dt - fecha_desde_dt).days,
         "fecha_desde": fecha_desde_dt.isoformat(),
         "fecha_hasta": fecha_hasta_dt.isoformat(),
-        "user_id": user_id_int
+        "user_id": user_id_int,
+        "fuente": fuente
     }
 
 
-@router.get("/cierres-descuadres")
-async def get_cierres_descuadres(
-    days: int = 30,
-    fecha_desde: Optional[str] = None,
-    fecha_hasta: Optional[str] = None,
-    user_id: Optional[str] = None,
-    solo_con_diferencias: bool = False,
-    db: AsyncSession = Depends(get_async_session),
-    current_user: User = Depends(get_current_user)
-):
-    """Análisis de cierres de turno y detección de descuadres con filtros de fecha y usuario"""
-    print(f"[CIERRES] Backend /cierres-descuadres recibió: days={days}, fecha_desde={fecha_desde}, fecha_hasta={fecha_hasta}, user_id={user_id}, solo_con_diferencias={solo_con_diferencias}")
-
-    # Convertir user_id de string a int si es necesario
-    user_id_int = None
-    if user_id:
-        try:
-            user_id_int = int(user_id)
-            print(f"[USER] User ID convertido a int: {user_id_int}")
-        except (ValueError, TypeError) as e:
-            print(f"[ERROR] Error convirtiendo user_id a int: {e}")
-            raise HTTPException(status_code=400, detail=f"user_id debe ser un número entero válido")
-
-    # Manejo de filtros de fecha
-    if fecha_desde and fecha_hasta:
-        try:
-            # Asegurar que las fechas cubran todo el día
-            fecha_desde_dt = datetime.fromisoformat(fecha_desde).replace(hour=0, minute=0, second=0, microsecond=0)
-            fecha_hasta_dt = datetime.fromisoformat(fecha_hasta).replace(hour=23, minute=59, second=59, microsecond=999999)
-            print(f"[DATE] Fechas parseadas: {fecha_desde_dt} hasta {fecha_hasta_dt}")
-        except ValueError as e:
-            print(f"[ERROR] Error parseando fechas: {e}")
-            raise HTTPException(status_code=400, detail=f"Formato de fecha inválido. Use ISO format (YYYY-MM-DD). Error: {str(e)}")
-    else:
-        fecha_desde_dt = datetime.now(timezone.utc) - timedelta(days=days)
-        fecha_hasta_dt = datetime.now(timezone.utc)
-
+def sql_cierres_descuadres(con_usuario: bool, solo_con_diferencias: bool) -> str:
+    """/cierres-descuadres: cierres del rango con totales del sistema, reportados y diferencias."""
     # Construcción dinámica de filtros WHERE
     where_clauses = ["c.fecha_cierre >= :fecha_desde", "c.fecha_cierre <= :fecha_hasta"]
 
-    if user_id_int:
+    if con_usuario:
         where_clauses.append("t.user_id = :user_id")
 
     where_clause = " AND ".join(where_clauses)
@@ -536,6 +513,48 @@ async def get_cierres_descuadres(
         """
 
     base_query += " ORDER BY c.fecha_cierre DESC"
+    return base_query
+
+
+@router.get("/cierres-descuadres")
+@dashboard_cache.cacheado("/cierres-descuadres", ("turnos",))
+async def get_cierres_descuadres(
+    days: int = 30,
+    fecha_desde: Optional[str] = None,
+    fecha_hasta: Optional[str] = None,
+    user_id: Optional[str] = None,
+    solo_con_diferencias: bool = False,
+    db: AsyncSession = Depends(get_async_session),
+    current_user: User = Depends(get_current_user)
+):
+    """Análisis de cierres de turno y detección de descuadres con filtros de fecha y usuario"""
+    print(f"[CIERRES] Backend /cierres-descuadres recibió: days={days}, fecha_desde={fecha_desde}, fecha_hasta={fecha_hasta}, user_id={user_id}, solo_con_diferencias={solo_con_diferencias}")
+
+    # Convertir user_id de string a int si es necesario
+    user_id_int = None
+    if user_id:
+        try:
+            user_id_int = int(user_id)
+            print(f"[USER] User ID convertido a int: {user_id_int}")
+        except (ValueError, TypeError) as e:
+            print(f"[ERROR] Error convirtiendo user_id a int: {e}")
+            raise HTTPException(status_code=400, detail=f"user_id debe ser un número entero válido")
+
+    # Manejo de filtros de fecha
+    if fecha_desde and fecha_hasta:
+        try:
+            # Asegurar que las fechas cubran todo el día
+            fecha_desde_dt = datetime.fromisoformat(fecha_desde).replace(hour=0, minute=0, second=0, microsecond=0)
+            fecha_hasta_dt = datetime.fromisoformat(fecha_hasta).replace(hour=23, minute=59, second=59, microsecond=999999)
+            print(f"[DATE] Fechas parseadas: {fecha_desde_dt} hasta {fecha_hasta_dt}")
+        except ValueError as e:
+            print(f"[ERROR] Error parseando fechas: {e}")
+            raise HTTPException(status_code=400, detail=f"Formato de fecha inválido. Use ISO format (YYYY-MM-DD). Error: {str(e)}")
+    else:
+        fecha_desde_dt = datetime.now(timezone.utc) - timedelta(days=days)
+        fecha_hasta_dt = datetime.now(timezone.utc)
+
+    base_query = sql_cierres_descuadres(bool(user_id_int), solo_con_diferencias)
 
     # Parámetros para la consulta
     query_params = {
@@ -545,7 +564,9 @@ async def get_cierres_descuadres(
     if user_id_int:
         query_params["user_id"] = user_id_int
 
-    result = await db.execute(text(base_query), query_params)
+    result, fuente = await analytics_duckdb.ejecutar(
+        db, base_query, query_params, ("cierres_caja", "turnos", "users"), fecha_hasta_dt
+    )
     cierres = []
 
     total_diferencias = {
@@ -603,11 +624,64 @@ async def get_cierres_descuadres(
         "fecha_desde": fecha_desde_dt.isoformat(),
         "fecha_hasta": fecha_hasta_dt.isoformat(),
         "user_id": user_id_int,
-        "solo_con_diferencias": solo_con_diferencias
+        "solo_con_diferencias": solo_con_diferencias,
+        "fuente": fuente
     }
 
 
+def sql_devoluciones_por_dia(con_usuario: bool) -> tuple:
+    """/devoluciones: (devoluciones por tipo y día, resumen por tipo, motivos más comunes)."""
+    # Construcción dinámica de filtros WHERE
+    where_clauses = ["d.fecha_devolucion >= :fecha_desde", "d.fecha_devolucion <= :fecha_hasta"]
+
+    if con_usuario:
+        where_clauses.append("d.user_id = :user_id")
+
+    where_clause = " AND ".join(where_clauses)
+
+    # Devoluciones por tipo y día
+    sql_devoluciones = f"""
+        SELECT
+            DATE(d.fecha_devolucion) as fecha,
+            d.tipo_devolucion,
+            COUNT(*) as cantidad,
+            SUM(CASE WHEN d.monto_devuelto IS NOT NULL THEN d.monto_devuelto ELSE 0 END) as monto_total,
+            AVG(CASE WHEN d.monto_devuelto IS NOT NULL THEN d.monto_devuelto ELSE NULL END) as monto_promedio
+        FROM devoluciones_sim d
+        WHERE {where_clause}
+        GROUP BY DATE(d.fecha_devolucion), d.tipo_devolucion
+        ORDER BY fecha DESC, d.tipo_devolucion
+    """
+
+    # Resumen general
+    sql_resumen = f"""
+        SELECT
+            d.tipo_devolucion,
+            COUNT(*) as total_casos,
+            SUM(CASE WHEN d.monto_devuelto IS NOT NULL THEN d.monto_devuelto ELSE 0 END) as monto_total_devuelto
+        FROM devoluciones_sim d
+        WHERE {where_clause}
+        GROUP BY d.tipo_devolucion
+    """
+
+    # Motivos más comunes
+    sql_motivos = f"""
+        SELECT
+            d.motivo,
+            COUNT(*) as frecuencia,
+            d.tipo_devolucion
+        FROM devoluciones_sim d
+        WHERE {where_clause}
+          AND d.motivo IS NOT NULL
+        GROUP BY d.motivo, d.tipo_devolucion
+        ORDER BY frecuencia DESC
+        LIMIT 10
+    """
+    return sql_devoluciones, sql_resumen, sql_motivos
+
+
 @router.get("/devoluciones")
+@dashboard_cache.cacheado("/devoluciones", ("devoluciones",))
 async def get_devoluciones_analytics(
     days: int = 30,
     fecha_desde: Optional[str] = None,
@@ -643,14 +717,6 @@ async def get_devoluciones_analytics(
         fecha_desde_dt = datetime.now(timezone.utc) - timedelta(days=days)
         fecha_hasta_dt = datetime.now(timezone.utc)
 
-    # Construcción dinámica de filtros WHERE
-    where_clauses = ["d.fecha_devolucion >= :fecha_desde", "d.fecha_devolucion <= :fecha_hasta"]
-
-    if user_id_int:
-        where_clauses.append("d.user_id = :user_id")
-
-    where_clause = " AND ".join(where_clauses)
-
     # Parámetros para las consultas
     query_params = {
         "fecha_desde": fecha_desde_dt,
@@ -659,21 +725,25 @@ async def get_devoluciones_analytics(
     if user_id_int:
         query_params["user_id"] = user_id_int
 
-    # Devoluciones por tipo y día
-    sql_devoluciones = text(f"""
-        SELECT
-            DATE(d.fecha_devolucion) as fecha,
-            d.tipo_devolucion,
-            COUNT(*) as cantidad,
-            SUM(CASE WHEN d.monto_devuelto IS NOT NULL THEN d.monto_devuelto ELSE 0 END) as monto_total,
-            AVG(CASE WHEN d.monto_devuelto IS NOT NULL THEN d.monto_devuelto ELSE NULL END) as monto_promedio
-        FROM devoluciones_sim d
-        WHERE {where_clause}
-        GROUP BY DATE(d.fecha_devolucion), d.tipo_devolucion
-        ORDER BY fecha DESC, d.tipo_devolucion
-    """)
+    sql_devoluciones, sql_resumen, sql_motivos = sql_devoluciones_por_dia(bool(user_id_int))
 
-    result = await db.execute(sql_devoluciones, query_params)
+    # Las tres consultas son independientes: se ejecutan a la vez, cada una en su conexión
+    datasets = ("devoluciones_sim",)
+
+    def _reporte(sql):
+        async def _consulta(session):
+            filas, fuente = await analytics_duckdb.ejecutar(session, sql, query_params, datasets, fecha_hasta_dt)
+            return list(filas), fuente
+
+        return _consulta
+
+    resultados = await concurrent_queries.en_paralelo({
+        "por_dia": _reporte(sql_devoluciones),
+        "resumen": _reporte(sql_resumen),
+        "motivos": _reporte(sql_motivos),
+    }, db=db)
+
+    result, fuente = resultados["por_dia"]
     devoluciones_por_dia = {}
 
     for row in result:
@@ -694,17 +764,7 @@ async def get_devoluciones_analytics(
             devoluciones_por_dia[fecha_str]["monto_devuelto"] += float(row.monto_total or 0)
 
     # Resumen general
-    sql_resumen = text(f"""
-        SELECT
-            d.tipo_devolucion,
-            COUNT(*) as total_casos,
-            SUM(CASE WHEN d.monto_devuelto IS NOT NULL THEN d.monto_devuelto ELSE 0 END) as monto_total_devuelto
-        FROM devoluciones_sim d
-        WHERE {where_clause}
-        GROUP BY d.tipo_devolucion
-    """)
-
-    result = await db.execute(sql_resumen, query_params)
+    result, _ = resultados["resumen"]
     resumen = {
         "intercambios": 0,
         "devoluciones_dinero": 0,
@@ -720,20 +780,7 @@ async def get_devoluciones_analytics(
             resumen["monto_total_devuelto"] = float(row.monto_total_devuelto or 0)
 
     # Motivos más comunes
-    sql_motivos = text(f"""
-        SELECT
-            d.motivo,
-            COUNT(*) as frecuencia,
-            d.tipo_devolucion
-        FROM devoluciones_sim d
-        WHERE {where_clause}
-          AND d.motivo IS NOT NULL
-        GROUP BY d.motivo, d.tipo_devolucion
-        ORDER BY frecuencia DESC
-        LIMIT 10
-    """)
-
-    result = await db.execute(sql_motivos, query_params)
+    result, _ = resultados["motivos"]
     motivos_comunes = [
         {
             "motivo": row.motivo,
@@ -750,11 +797,13 @@ async def get_devoluciones_analytics(
         "periodo_dias": (fecha_hasta_dt - fecha_desde_dt).days,
         "fecha_desde": fecha_desde_dt.isoformat(),
         "fecha_hasta": fecha_hasta_dt.isoformat(),
-        "user_id": user_id
+        "user_id": user_id,
+        "fuente": fuente
     }
 
 
 @router.get("/inventarios-descuadres")
+@dashboard_cache.cacheado("/inventarios-descuadres", ("turnos",))
 async def get_inventarios_descuadres(
     days: int = 30,
     fecha_desde: Optional[str] = None,
@@ -827,14 +876,16 @@ async def get_inventarios_descuadres(
     if user_id:
         query_params["user_id"] = user_id
 
-    result = await db.execute(text(base_query), query_params)
+    result, fuente = await analytics_duckdb.ejecutar(
+        db, base_query, query_params, ("inventario_sim_turno", "turnos", "users"), fecha_hasta_dt
+    )
     inventarios = []
 
     total_descuadres_inicial = 0
     total_descuadres_final = 0
     descuadres_por_plan = {}
 
-    for row in result.all():
+    for row in result:
         tiene_descuadre_inicial = abs(row.diferencia_inicial or 0) > 0
         tiene_descuadre_final = abs(row.diferencia_final or 0) > 0 if row.diferencia_final is not None else False
 
@@ -910,29 +961,159 @@ async def get_inventarios_descuadres(
         "fecha_desde": fecha_desde_dt.isoformat(),
         "fecha_hasta": fecha_hasta_dt.isoformat(),
         "user_id": user_id,
-        "solo_con_descuadres": solo_con_descuadres
+        "solo_con_descuadres": solo_con_descuadres,
+        "fuente": fuente
     }
 
 
-@router.get("/trazabilidad")
-async def get_trazabilidad_sims(
-    iccid: Optional[str] = None,
-    numero_linea: Optional[str] = None,
-    lote_id: Optional[str] = None,
-    db: AsyncSession = Depends(get_async_session),
+# Exportación masiva: filas por bloque desde un cursor del servidor (stream_results)
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "5000"))
+
+# dataset -> (SQL, columna de fecha del rango, columna de usuario); mismos filtros que ventas-ingresos
+EXPORT_DATASETS = {
+    "sales": ("""
+        SELECT s.numero_consecutivo, s.created_at AS fecha, s.estado, s.payment_method AS metodo_pago,
+               s.total, s.customer_identification, s.siigo_invoice_id, s.es_contingencia,
+               u.username AS usuario
+        FROM sales s
+        LEFT JOIN users u ON u.id = s.user_id
+        WHERE s.estado = 'activa'
+          AND s.created_at >= :fecha_desde AND s.created_at <= :fecha_hasta
+          {where_user}
+        ORDER BY s.created_at
+    """, "s.user_id"),
+    "movimientos": ("""
+        SELECT m.fecha, m.tipo, m.metodo_pago, m.monto, m.descripcion,
+               s.numero_consecutivo AS venta, t.numero_consecutivo AS turno, u.username AS usuario
+        FROM movimientos_caja m
+        JOIN sales s ON m.sale_id = s.id
+        LEFT JOIN turnos t ON t.id = m.turno_id
+        LEFT JOIN users u ON u.id = s.user_id
+        WHERE m.tipo = 'venta' AND s.estado = 'activa'
+          AND m.fecha >= :fecha_desde AND m.fecha <= :fecha_hasta
+          {where_user}
+        ORDER BY m.fecha
+    """, "s.user_id"),
+    "cierres": ("""
+        SELECT c.fecha_cierre, t.numero_consecutivo AS turno, t.fecha_apertura, u.username AS usuario,
+               c.total_ventas_efectivo, c.total_ventas_datafono, c.total_ventas_electronicas,
+               c.total_ventas_dollars, c.efectivo_reportado, c.datafono_reportado, c.dolares_reportado,
+               c.diferencia_efectivo, c.diferencia_datafono, c.diferencia_dolares, c.observaciones
+        FROM cierres_caja c
+        JOIN turnos t ON c.turno_id = t.id
+        LEFT JOIN users u ON u.id = t.user_id
+        WHERE c.fecha_cierre >= :fecha_desde AND c.fecha_cierre <= :fecha_hasta
+          {where_user}
+        ORDER BY c.fecha_cierre
+    """, "t.user_id"),
+}
+
+
+@router.get("/export/{dataset}")
+async def exportar_dataset(
+    dataset: str,
+    formato: str = "csv",
+    days: int = 30,
+    fecha_desde: Optional[str] = None,
+    fecha_hasta: Optional[str] = None,
+    user_id: Optional[str] = None,
     current_user: User = Depends(get_current_user)
 ):
     """
-    Trazabilidad completa de SIMs mostrando su ciclo de vida:
-    - Registro inicial
-    - Recargas realizadas
-    - Devoluciones (si las hay)
-    - Venta final
+    Descarga masiva de ventas, movimientos o cierres en CSV o XLSX.
 
-    Puede filtrar por ICCID, número de línea o lote
+    Las filas se leen por bloques con un cursor del servidor y se escriben a medida que
+    llegan (memoria constante aunque sean millones de filas). Filtros iguales a ventas-ingresos.
     """
-    print(f"[TRAZABILIDAD] Búsqueda: iccid={iccid}, numero_linea={numero_linea}, lote_id={lote_id}")
+    if dataset not in EXPORT_DATASETS:
+        raise HTTPException(status_code=404, detail=f"Dataset desconocido. Opciones: {', '.join(EXPORT_DATASETS)}")
+    if formato not in ("csv", "xlsx"):
+        raise HTTPException(status_code=400, detail="formato debe ser csv o xlsx")
 
+    user_id_int = None
+    if user_id:
+        try:
+            user_id_int = int(user_id)
+        except (ValueError, TypeError):
+            raise HTTPException(status_code=400, detail="user_id debe ser un número entero válido")
+
+    if fecha_desde and fecha_hasta:
+        try:
+            fecha_desde_dt = datetime.fromisoformat(fecha_desde).replace(hour=0, minute=0, second=0, microsecond=0)
+            fecha_hasta_dt = datetime.fromisoformat(fecha_hasta).replace(hour=23, minute=59, second=59, microsecond=999999)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Formato de fecha inválido. Use ISO format (YYYY-MM-DD). Error: {str(e)}")
+    else:
+        fecha_desde_dt = datetime.now(timezone.utc) - timedelta(days=days)
+        fecha_hasta_dt = datetime.now(timezone.utc)
+
+    sql, columna_usuario = EXPORT_DATASETS[dataset]
+    params = {"fecha_desde": fecha_desde_dt, "fecha_hasta": fecha_hasta_dt}
+    if user_id_int:
+        params["user_id"] = user_id_int
+    sql = sql.format(where_user=f"AND {columna_usuario} = :user_id" if user_id_int else "")
+
+    # Encabezados (y validación de la consulta) antes de empezar a responder: un error aquí
+    # es un 500 y no una descarga truncada
+    async with engine.connect() as conn:
+        columnas = list((await conn.execute(text(f"SELECT * FROM ({sql}) q LIMIT 0"), params)).keys())
+
+    # Conexión propia del generador: la sesión de la dependencia se cierra antes de que
+    # termine el streaming de la respuesta
+    async def bloques():
+        async with engine.connect() as conn:
+            result = await conn.stream(text(sql), params)
+            async for bloque in result.partitions(EXPORT_CHUNK_ROWS):
+                yield bloque
+
+    nombre = f"{dataset}_{fecha_desde_dt:%Y%m%d}_{fecha_hasta_dt:%Y%m%d}.{formato}"
+    if formato == "csv":
+        contenido = streaming_export.filas_csv(columnas, bloques())
+        media_type = "text/csv; charset=utf-8"
+    else:
+        contenido = streaming_export.archivo_xlsx(columnas, bloques(), hoja=dataset)
+        media_type = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+    logger.info("Exportación %s (%s) %s - %s, user_id=%s", dataset, formato, fecha_desde_dt, fecha_hasta_dt, user_id_int)
+    return StreamingResponse(
+        contenido,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{nombre}"', "X-Accel-Buffering": "no"}
+    )
+
+
+@router.get("/analytics/estado")
+async def get_analytics_estado(current_user: User = Depends(get_current_user)):
+    """Motor de los reportes (postgres/duckdb) y última exportación a Parquet de cada dataset"""
+    return {
+        "motor": analytics_duckdb.ANALYTICS_ENGINE,
+        "max_lag_minutes": analytics_duckdb.ANALYTICS_MAX_LAG_MINUTES,
+        "datasets": analytics_export.leer_manifest(),
+        "cache": dashboard_cache.estado(),
+    }
+
+
+@router.post("/analytics/export")
+async def exportar_analytics(
+    completo: bool = False,
+    current_user: User = Depends(get_current_user)
+):
+    """Exportación a Parquet a demanda (incremental por defecto); no se solapa con la programada"""
+    if current_user.role.name != "Admin":
+        raise HTTPException(status_code=403, detail="Solo un administrador puede lanzar la exportación")
+
+    resultado = await scheduler_leader.ejecutar_ahora('analytics_export_job', export_analytics, completo=completo)
+    if resultado.get("omitido"):
+        raise HTTPException(status_code=409, detail="Ya hay una exportación en curso")
+    if not resultado.get("success"):
+        raise HTTPException(status_code=500, detail=f"Error en la exportación: {resultado.get('error')}")
+    return resultado
+
+
+def sql_trazabilidad_sims(
+    iccid: Optional[str] = None, numero_linea: Optional[str] = None, lote_id: Optional[str] = None
+) -> tuple:
+    """/trazabilidad: (consulta de SIMs, parámetros). Sin filtros, las últimas 50 SIMs vendidas."""
     # Construir la consulta base para obtener todas las SIMs
     where_clauses = []
     query_params = {}
@@ -977,6 +1158,29 @@ async def get_trazabilidad_sims(
         ORDER BY s.fecha_venta DESC NULLS LAST, s.fecha_registro DESC
         LIMIT 50
     """)
+    return sql_sims, query_params
+
+
+@router.get("/trazabilidad")
+async def get_trazabilidad_sims(
+    iccid: Optional[str] = None,
+    numero_linea: Optional[str] = None,
+    lote_id: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_session),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Trazabilidad completa de SIMs mostrando su ciclo de vida:
+    - Registro inicial
+    - Recargas realizadas
+    - Devoluciones (si las hay)
+    - Venta final
+
+    Puede filtrar por ICCID, número de línea o lote
+    """
+    print(f"[TRAZABILIDAD] Búsqueda: iccid={iccid}, numero_linea={numero_linea}, lote_id={lote_id}")
+
+    sql_sims, query_params = sql_trazabilidad_sims(iccid, numero_linea, lote_id)
 
     result = await db.execute(sql_sims, query_params)
     sims = result.mappings().all()
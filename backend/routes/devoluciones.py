@@ -12,6 +12,7 @@ from schemas.devolucion_schemas import (
 )
 from utils.auth_utils import get_current_user
 from utils.turno_utils import get_turno_activo
+from services import dashboard_cache
 from typing import List
 from uuid import UUID
 
@@ -304,6 +305,7 @@ async def _procesar_intercambio(devolucion_data, sale, sim_defectuosa, turno_act
     sim_reemplazo.fecha_venta = func.now()
     sim_reemplazo.venta_id = str(sale_id)
 
+    await dashboard_cache.invalidar(db, "devoluciones", "ventas", "sims")
     await db.commit()
     await db.refresh(devolucion)
 
@@ -340,6 +342,8 @@ async def _procesar_devolucion_dinero(devolucion_data, sale, sim_defectuosa, tur
     sim_defectuosa.fecha_venta = None
     sim_defectuosa.venta_id = None
 
+    # La venta anulada cambia también los reportes de ventas
+    await dashboard_cache.invalidar(db, "devoluciones", "ventas", "sims")
     await db.commit()
     await db.refresh(devolucion)
 
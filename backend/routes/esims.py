@@ -2,7 +2,11 @@
 Rutas API para gestión de eSIMs
 """
 
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Query
+import json
+import logging
+
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Query, Header
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Optional, List, Dict
 from uuid import UUID
@@ -10,12 +14,33 @@ from pydantic import BaseModel
 from datetime import datetime
 
 from database import get_async_session
-from models import ESim, ESimStatus
+from models import ESim, ESimStatus, User
 from services.esim_service import ESimService
-# Usar versión con OpenCV (compatible con Windows sin zbar)
-from services.qr_extractor_opencv import extract_qrs_from_uploaded_pdf
+from services import qr_pool, qr_crops
+from utils.auth_utils import get_current_user
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
+
+# Usar versión con OpenCV (compatible con Windows sin zbar)
+QR_MOTOR = "services.qr_extractor_opencv"
+
+
+def _verificar_permiso(current_user: User):
+    if "eSims" not in [m.name for m in current_user.role.modules]:
+        raise HTTPException(status_code=403, detail="No tienes permiso para gestionar eSIMs")
+
+
+def _qr_extractor_module():
+    """
+    Extractor de QRs, importado en el primer uso: PyMuPDF, OpenCV y NumPy no se cargan
+    al arrancar y, si no están instalados, solo fallan los endpoints de extracción.
+    """
+    try:
+        from services import qr_extractor_opencv
+    except ImportError as e:
+        raise HTTPException(status_code=503, detail=f"Extracción de QRs no disponible: {str(e)}")
+    return qr_extractor_opencv
 
 
 # ============================================================
@@ -69,14 +94,21 @@ class QRExtractedResponse(BaseModel):
 # Utilidades
 # ============================================================
 
-def esim_to_dict(esim: ESim) -> dict:
-    """Serializa una eSIM a diccionario"""
+def esim_to_dict(esim: ESim, qr_code_data: Optional[str] = None) -> dict:
+    """
+    Serializa una eSIM a diccionario.
+    El contenido del QR no se incluye salvo que se pase (include_qr=true); se obtiene con qr_url.
+    """
+    # Filas legadas sin blob: GET /esims/{id}/qr las sirve desde qr_code_data
+    has_qr = bool(esim.qr_blob_key) or bool(esim.qr_legado)
     return {
         "id": str(esim.id),
         "iccid": esim.iccid,
         "numero_telefono": esim.numero_telefono,
         "estado": esim.estado.value if hasattr(esim.estado, 'value') else esim.estado,
-        "qr_code_data": esim.qr_code_data,
+        "has_qr": has_qr,
+        "qr_url": f"/api/esims/{esim.id}/qr" if has_qr else None,
+        "qr_code_data": qr_code_data,
         "qr_code_url": esim.qr_code_url,
         "fecha_venta": esim.fecha_venta.isoformat() if esim.fecha_venta else None,
         "fecha_vencimiento": esim.fecha_vencimiento.isoformat() if esim.fecha_vencimiento else None,
@@ -110,7 +142,9 @@ async def get_esims(
     search: Optional[str] = None,
     skip: int = 0,
     limit: int = 100,
-    db: AsyncSession = Depends(get_async_session)
+    include_qr: bool = False,
+    db: AsyncSession = Depends(get_async_session),
+    current_user: User = Depends(get_current_user)
 ):
     """
     Obtiene todas las eSIMs con filtros opcionales
@@ -120,7 +154,9 @@ async def get_esims(
     - **search**: Buscar por ICCID o número de teléfono
     - **skip**: Paginación - registros a saltar
     - **limit**: Paginación - límite de registros
+    - **include_qr**: Incluir el contenido del QR (por defecto solo qr_url)
     """
+    _verificar_permiso(current_user)
     service = ESimService(db)
 
     # Convertir string de estado a enum si existe
@@ -139,17 +175,21 @@ async def get_esims(
         limit=limit
     )
 
+    qrs = await service.get_qr_code_data_bulk(esims) if include_qr else {}
+
     return {
-        "esims": [esim_to_dict(esim) for esim in esims],
+        "esims": [esim_to_dict(esim, qrs.get(esim.id)) for esim in esims],
         "count": len(esims)
     }
 
 
 @router.get("/esims/stats")
 async def get_estadisticas(
-    db: AsyncSession = Depends(get_async_session)
+    db: AsyncSession = Depends(get_async_session),
+    current_user: User = Depends(get_current_user)
 ):
     """Obtiene estadísticas del inventario de eSIMs"""
+    _verificar_permiso(current_user)
     service = ESimService(db)
     stats = await service.get_estadisticas()
     return stats
@@ -158,9 +198,11 @@ async def get_estadisticas(
 @router.get("/esims/proximas-vencer")
 async def get_proximas_vencer(
     dias: int = Query(3, description="Días hacia adelante"),
-    db: AsyncSession = Depends(get_async_session)
+    db: AsyncSession = Depends(get_async_session),
+    current_user: User = Depends(get_current_user)
 ):
     """Obtiene eSIMs que vencerán en los próximos N días"""
+    _verificar_permiso(current_user)
     service = ESimService(db)
     esims = await service.get_esims_proximas_a_vencer(dias)
 
@@ -170,12 +212,29 @@ async def get_proximas_vencer(
     }
 
 
+@router.get("/esims/qr-crops/{crop_id}")
+async def get_qr_crop(crop_id: str, current_user: User = Depends(get_current_user)):
+    """Recorte PNG de un QR extraído con /esims/extract-qrs/stream (disponible por QR_CROPS_TTL_SECONDS)"""
+    _verificar_permiso(current_user)
+    path = qr_crops.ruta(crop_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Recorte no encontrado o vencido")
+    return FileResponse(
+        path,
+        media_type="image/png",
+        headers={"Cache-Control": f"private, max-age={qr_crops.QR_CROPS_TTL_SECONDS}"}
+    )
+
+
 @router.get("/esims/{esim_id}")
 async def get_esim(
     esim_id: str,
-    db: AsyncSession = Depends(get_async_session)
+    include_qr: bool = False,
+    db: AsyncSession = Depends(get_async_session),
+    current_user: User = Depends(get_current_user)
 ):
-    """Obtiene una eSIM por ID"""
+    """Obtiene una eSIM por ID (include_qr=true agrega el contenido del QR)"""
+    _verificar_permiso(current_user)
     service = ESimService(db)
 
     try:
@@ -188,15 +247,54 @@ async def get_esim(
     if not esim:
         raise HTTPException(status_code=404, detail="eSIM no encontrada")
 
-    return esim_to_dict(esim)
+    qrs = await service.get_qr_code_data_bulk([esim]) if include_qr else {}
+    return esim_to_dict(esim, qrs.get(esim.id))
+
+
+@router.get("/esims/{esim_id}/qr")
+async def get_esim_qr(
+    esim_id: str,
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_async_session),
+    current_user: User = Depends(get_current_user)
+):
+    """Contenido del QR de una eSIM (imagen o texto LPA) desde el blob store"""
+    _verificar_permiso(current_user)
+    service = ESimService(db)
+
+    try:
+        esim_uuid = UUID(esim_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ID de eSIM inválido")
+
+    esim = await service.get_esim_by_id(esim_uuid)
+    if not esim:
+        raise HTTPException(status_code=404, detail="eSIM no encontrada")
+
+    # La clave es el hash del contenido: sirve de ETag sin leer el blob
+    etag = f'"{esim.qr_blob_key.rsplit("/", 1)[-1]}"' if esim.qr_blob_key else None
+    headers = {"Cache-Control": "private, no-cache"}
+    if etag:
+        headers["ETag"] = etag
+        if if_none_match == etag:
+            return Response(status_code=304, headers=headers)
+
+    qr = await service.get_qr(esim)
+    if qr is None:
+        raise HTTPException(status_code=404, detail="La eSIM no tiene QR")
+
+    data, content_type = qr
+    return Response(content=data, media_type=content_type, headers=headers)
 
 
 @router.post("/esims")
 async def create_esim(
     esim_data: ESimCreate,
-    db: AsyncSession = Depends(get_async_session)
+    db: AsyncSession = Depends(get_async_session),
+    current_user: User = Depends(get_current_user)
 ):
     """Crea una nueva eSIM"""
+    _verificar_permiso(current_user)
     service = ESimService(db)
 
     # Verificar que no exista ya
@@ -227,18 +325,23 @@ async def create_esim(
 @router.post("/esims/bulk")
 async def create_esims_bulk(
     data: ESimBulkCreate,
-    db: AsyncSession = Depends(get_async_session)
+    db: AsyncSession = Depends(get_async_session),
+    current_user: User = Depends(get_current_user)
 ):
     """Crea múltiples eSIMs en una operación"""
+    _verificar_permiso(current_user)
     service = ESimService(db)
 
     esims_data = [esim.dict() for esim in data.esims]
 
     try:
-        esims = await service.create_esims_bulk(esims_data)
+        esims, omitidas = await service.create_esims_bulk(esims_data)
         return {
-            "message": f"{len(esims)} eSIMs creadas exitosamente",
-            "esims": [esim_to_dict(esim) for esim in esims]
+            "message": f"{len(esims)} eSIMs creadas exitosamente"
+            + (f", {len(omitidas)} omitidas por duplicadas" if omitidas else ""),
+            "creadas": len(esims),
+            "esims": [esim_to_dict(esim) for esim in esims],
+            "omitidas": omitidas
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error creando eSIMs: {str(e)}")
@@ -247,9 +350,11 @@ async def create_esims_bulk(
 @router.post("/esims/venta")
 async def vender_esim(
     venta_data: ESimVenta,
-    db: AsyncSession = Depends(get_async_session)
+    db: AsyncSession = Depends(get_async_session),
+    current_user: User = Depends(get_current_user)
 ):
     """Marca una eSIM como vendida"""
+    _verificar_permiso(current_user)
     service = ESimService(db)
 
     try:
@@ -279,9 +384,11 @@ async def vender_esim(
 async def regenerar_qr(
     esim_id: str,
     regeneracion: ESimRegeneracion,
-    db: AsyncSession = Depends(get_async_session)
+    db: AsyncSession = Depends(get_async_session),
+    current_user: User = Depends(get_current_user)
 ):
     """Regenera el código QR de una eSIM"""
+    _verificar_permiso(current_user)
     service = ESimService(db)
 
     try:
@@ -307,9 +414,11 @@ async def regenerar_qr(
 @router.post("/esims/regenerar-bulk")
 async def regenerar_qrs_bulk(
     data: ESimRegeneracionBulk,
-    db: AsyncSession = Depends(get_async_session)
+    db: AsyncSession = Depends(get_async_session),
+    current_user: User = Depends(get_current_user)
 ):
     """Regenera múltiples QRs en una operación"""
+    _verificar_permiso(current_user)
     service = ESimService(db)
 
     regeneraciones = []
@@ -324,10 +433,13 @@ async def regenerar_qrs_bulk(
             raise HTTPException(status_code=400, detail=f"ID inválido: {reg.esim_id}")
 
     try:
-        esims = await service.regenerar_qrs_bulk(regeneraciones)
+        esims, no_encontradas = await service.regenerar_qrs_bulk(regeneraciones)
         return {
-            "message": f"{len(esims)} eSIMs regeneradas exitosamente",
-            "esims": [esim_to_dict(esim) for esim in esims]
+            "message": f"{len(esims)} eSIMs regeneradas exitosamente"
+            + (f", {len(no_encontradas)} no encontradas" if no_encontradas else ""),
+            "regeneradas": len(esims),
+            "esims": [esim_to_dict(esim) for esim in esims],
+            "no_encontradas": [str(esim_id) for esim_id in no_encontradas]
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error regenerando QRs: {str(e)}")
@@ -336,22 +448,26 @@ async def regenerar_qrs_bulk(
 @router.post("/esims/extract-qrs")
 async def extract_qrs_from_pdf(
     file: UploadFile = File(...),
+    current_user: User = Depends(get_current_user)
 ):
     """
     Extrae códigos QR de un archivo PDF subido
 
     Retorna lista de QRs encontrados con sus imágenes
     """
+    _verificar_permiso(current_user)
     # Validar que sea PDF
     if not file.filename.endswith('.pdf'):
         raise HTTPException(status_code=400, detail="Solo se aceptan archivos PDF")
 
+    qr_extractor = _qr_extractor_module()
+
     try:
         # Leer contenido del archivo
         contents = await file.read()
 
         # Extraer QRs
-        qr_codes = await extract_qrs_from_uploaded_pdf(contents)
+        qr_codes = await qr_extractor.extract_qrs_from_uploaded_pdf(contents)
 
         return {
             "message": f"{len(qr_codes)} códigos QR extraídos exitosamente",
@@ -364,13 +480,81 @@ async def extract_qrs_from_pdf(
         raise HTTPException(status_code=500, detail=f"Error procesando PDF: {str(e)}")
 
 
+@router.post("/esims/extract-qrs/stream")
+async def extract_qrs_from_pdf_stream(
+    file: UploadFile = File(...),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Extrae códigos QR de un PDF emitiendo NDJSON (un objeto JSON por línea) a medida
+    que se procesa cada página:
+
+    - {"type": "start", "filename": ...}
+    - {"type": "qr", "page", "position", "qr_data", "is_valid", "validation_message", "crop_id", "crop_url"}
+    - {"type": "page", "page", "pages", "pages_done", "qrs"}
+    - {"type": "complete", "count", "pages"} o {"type": "error", "message"}
+
+    Los recortes no van en base64: se piden a crop_url.
+    """
+    _verificar_permiso(current_user)
+    if not file.filename.endswith('.pdf'):
+        raise HTTPException(status_code=400, detail="Solo se aceptan archivos PDF")
+
+    extractor = _qr_extractor_module().QRExtractor(dpi=300)
+    contents = await file.read()
+
+    def _linea(data: dict) -> str:
+        return json.dumps(data, ensure_ascii=False) + "\n"
+
+    async def generar():
+        yield _linea({"type": "start", "filename": file.filename})
+
+        count = 0
+        paginas = 0
+        hechas = 0
+        try:
+            async for page, page_qrs, paginas in qr_pool.extraer_por_pagina(
+                contents, motor=QR_MOTOR, dpi=extractor.dpi, formato_imagen="png"
+            ):
+                hechas += 1
+                for qr in sorted(page_qrs, key=lambda q: q['position']):
+                    is_valid, error_msg = extractor.validate_qr_format(qr['qr_data'])
+                    crop_id = await qr_crops.guardar(qr['qr_image_png']) if qr.get('qr_image_png') else None
+                    count += 1
+                    yield _linea({
+                        "type": "qr",
+                        "page": qr['page'],
+                        "position": qr['position'],
+                        "qr_data": qr['qr_data'],
+                        "is_valid": is_valid,
+                        "validation_message": error_msg,
+                        "crop_id": crop_id,
+                        "crop_url": f"/api/esims/qr-crops/{crop_id}" if crop_id else None,
+                    })
+                yield _linea({"type": "page", "page": page, "pages": paginas, "pages_done": hechas, "qrs": len(page_qrs)})
+
+            yield _linea({"type": "complete", "count": count, "pages": paginas})
+
+        except Exception as e:
+            logger.error(f"Error procesando PDF por streaming: {str(e)}")
+            yield _linea({"type": "error", "message": f"Error procesando PDF: {str(e)}"})
+
+    return StreamingResponse(
+        generar(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @router.put("/esims/{esim_id}")
 async def update_esim(
     esim_id: str,
     update_data: ESimUpdate,
-    db: AsyncSession = Depends(get_async_session)
+    db: AsyncSession = Depends(get_async_session),
+    current_user: User = Depends(get_current_user)
 ):
     """Actualiza campos de una eSIM"""
+    _verificar_permiso(current_user)
     service = ESimService(db)
 
     try:
@@ -403,9 +587,11 @@ async def update_esim(
 @router.delete("/esims/{esim_id}")
 async def delete_esim(
     esim_id: str,
-    db: AsyncSession = Depends(get_async_session)
+    db: AsyncSession = Depends(get_async_session),
+    current_user: User = Depends(get_current_user)
 ):
     """Elimina (marca como inactiva) una eSIM"""
+    _verificar_permiso(current_user)
     service = ESimService(db)
 
     try:
@@ -426,13 +612,15 @@ async def delete_esim(
 
 @router.post("/esims/procesar-vencimientos")
 async def procesar_vencimientos(
-    db: AsyncSession = Depends(get_async_session)
+    db: AsyncSession = Depends(get_async_session),
+    current_user: User = Depends(get_current_user)
 ):
     """
     Procesa automáticamente eSIMs vencidas
 
     Este endpoint puede ser llamado manualmente o por un job programado
     """
+    _verificar_permiso(current_user)
     service = ESimService(db)
 
     try:
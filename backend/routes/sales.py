@@ -1,37 +1,60 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Header
+from fastapi.responses import JSONResponse
 from sqlalchemy import select  
 from sqlalchemy.ext.asyncio import AsyncSession
-from database import SessionLocal, get_async_session  
-from services.sales import save_sale_to_db, generar_factura_siigo
+from database import get_async_session
+from services.sales import save_sale_to_db, construir_payload_factura
+from services.siigo_contingencia import facturar_o_contingencia
 from schemas.sale_schemas import SaleCreateSchema, SaleRequest, CartItem, TaxItem
 from models import User, Sale, Turno  
 from utils.auth_utils import get_current_user
 from datetime import datetime, timezone
-from typing import List  
-from routes.sims import mark_sim_sold
+from typing import List, Optional
+from utils.turno_utils import get_turno_activo
+from services import idempotency
 
 router = APIRouter(prefix="/sales", tags=["Ventas"])
 
-# Dependency para obtener sesión de base de datos
-async def get_db():
-    async with SessionLocal() as session:
-        yield session
+async def _cerrar_idempotency_con_error(key, user_id, req_hash, siigo_invoice_id, detail):
+    """Si la venta falló antes de facturar, libera la clave; si ya se facturó en Siigo, la cierra con el error."""
+    if not key:
+        return
+    if siigo_invoice_id:
+        await idempotency.completar(key, user_id, "/sales/ventas", req_hash, 500, {
+            "detail": f"Factura Siigo {siigo_invoice_id} emitida pero la venta no se guardó: {detail}",
+            "siigo_invoice_id": siigo_invoice_id,
+        })
+    else:
+        await idempotency.liberar(key, user_id, "/sales/ventas")
 
 @router.post("/ventas")
 async def registrar_venta(
     sale_data: SaleCreateSchema,
-    db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    # La misma sesión que usó get_current_user: la venta no retiene una segunda conexión
+    db: AsyncSession = Depends(get_async_session),
+    current_user: User = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
 ):
-    try:
-        # Verificar que el usuario tenga un turno abierto
-        turno_abierto = await db.execute(
-            select(Turno).where(
-                Turno.user_id == current_user.id,
-                Turno.estado == "abierto"
+    # Reintento de una venta ya registrada: se devuelve la respuesta original
+    req_hash = None
+    if idempotency_key:
+        req_hash = idempotency.request_hash(sale_data.model_dump())
+        previa = await idempotency.reservar(idempotency_key, current_user.id, "/sales/ventas", req_hash)
+        if previa is not None:
+            return JSONResponse(
+                status_code=previa["status_code"],
+                content=previa["response"],
+                headers={"Idempotent-Replayed": "true"},
             )
-        )
-        if not turno_abierto.scalar_one_or_none():
+
+    siigo_invoice_id = None
+    siigo_incierto = False
+    resultado = None
+    try:
+        # Verificar que el usuario tenga un turno abierto (se resuelve una sola vez
+        # y se reutiliza para el movimiento de caja)
+        turno = await get_turno_activo(db, current_user.id)
+        if not turno:
             raise HTTPException(
                 status_code=403, 
                 detail="Debes tener un turno abierto para registrar ventas"
@@ -58,38 +81,47 @@ async def registrar_venta(
                 customer_identification=sale_data.customer_identification
             )
 
-            # Crear la factura en Siigo
-            siigo_invoice_id = await generar_factura_siigo(siigo_request)
+            # Crear la factura en Siigo; si está caído o lento la venta queda en contingencia
+            invoice_payload = construir_payload_factura(siigo_request)
+            response, _, siigo_incierto = await facturar_o_contingencia(invoice_payload)
+            if response is not None:
+                siigo_invoice_id = str(response.get("number") or response.get("id"))
 
-            # Guardar venta con usuario
-            venta = await save_sale_to_db(sale_data, db, siigo_invoice_id, current_user.id)
-        else:
-            venta = await save_sale_to_db(sale_data, db, None, current_user.id)
+        es_contingencia = sale_data.payment_method == "electronic" and siigo_invoice_id is None
 
+        # Venta + items + SIMs vendidas + movimiento de caja en una sola transacción
+        venta = await save_sale_to_db(
+            sale_data, db, siigo_invoice_id, current_user.id, turno=turno,
+            es_contingencia=es_contingencia,
+            siigo_payload=invoice_payload if es_contingencia else None,
+            siigo_incierto=siigo_incierto,
+        )
 
-        for it in sale_data.items:
-            sim_id  = getattr(it, "sim_id",  None) or getattr(it, "simId",  None) or None
-            msisdn  = getattr(it, "msisdn",  None) or getattr(it, "numero_linea", None) or None
-            iccid   = getattr(it, "iccid",   None)
-
-            if sim_id or msisdn or iccid:
-                # Pasa venta_id para que quede registrado en sim_detalle
-                await mark_sim_sold(
-                    db,
-                    sim_id=sim_id,
-                    msisdn=msisdn,
-                    iccid=iccid,
-                    venta_id=str(venta.id)
-                )
-
-        return {
+        resultado = {
             "message": "Venta registrada correctamente",
             "venta_id": str(venta.id),
-            "enviada_a_siigo": sale_data.payment_method == "electronic"
+            "enviada_a_siigo": sale_data.payment_method == "electronic" and not es_contingencia,
+            "contingencia": es_contingencia,
         }
 
+    except HTTPException:
+        await _cerrar_idempotency_con_error(idempotency_key, current_user.id, req_hash, siigo_invoice_id, "")
+        raise
     except Exception as e:
+        await _cerrar_idempotency_con_error(idempotency_key, current_user.id, req_hash, siigo_invoice_id, str(e))
         raise HTTPException(status_code=500, detail=str(e))
+    except BaseException:
+        # Cliente desconectado (CancelledError) o apagado del worker: la clave no queda en_curso
+        if idempotency_key:
+            if resultado is not None:
+                await idempotency.completar(idempotency_key, current_user.id, "/sales/ventas", req_hash, 200, resultado)
+            else:
+                await _cerrar_idempotency_con_error(idempotency_key, current_user.id, req_hash, siigo_invoice_id, "solicitud cancelada")
+        raise
+
+    if idempotency_key:
+        await idempotency.completar(idempotency_key, current_user.id, "/sales/ventas", req_hash, 200, resultado)
+    return resultado
     
 def _to_naive_utc(dt: datetime) -> datetime:
     if dt is None:
@@ -5,8 +5,9 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from sqlalchemy import func, case, update, or_, select, text
 from database import get_async_session
+from utils import concurrent_queries
+from services import dashboard_cache
 from models import SimLote, SimDetalle, SimStatus, SimDetalle, SimLote, MovimientoCaja
-import pandas as pd
 from uuid import uuid4
 import io
 from typing import Optional, List, Tuple
@@ -133,6 +134,7 @@ async def mark_sim_sold(
             vendida=True,
         )
     )
+    await dashboard_cache.invalidar(db, "sims")
     await db.commit()
     return 1
 
@@ -146,6 +148,8 @@ async def upload_lotes(
     db: AsyncSession = Depends(get_async_session)
 ):
     try:
+        import pandas as pd  # solo aquí: cargarlo al importar el módulo retrasa el arranque de cada worker
+
         contents = await file.read()
         df = pd.read_excel(io.BytesIO(contents))
 
@@ -196,6 +200,7 @@ async def upload_lotes(
                     )
                 )
 
+        await dashboard_cache.invalidar(db, "sims")
         await db.commit()
         return {"message": f"Archivo procesado correctamente, {len(df)} SIMs registradas."}
 
@@ -229,6 +234,7 @@ async def crear_lote(
             estado="available"
         )
         db.add(nuevo_lote)
+        await dashboard_cache.invalidar(db, "sims")
         await db.commit()
 
         return {
@@ -293,6 +299,7 @@ async def agregar_sim_individual(
             estado=ST_AVAILABLE
         )
         db.add(nueva_sim)
+        await dashboard_cache.invalidar(db, "sims")
         await db.commit()
         await db.refresh(nueva_sim)
 
@@ -372,6 +379,7 @@ async def crear_sim_completa(
             estado=ST_AVAILABLE
         )
         db.add(nueva_sim)
+        await dashboard_cache.invalidar(db, "sims")
         await db.commit()
         await db.refresh(nueva_sim)
 
@@ -427,6 +435,7 @@ async def actualizar_sim(
     if body.numero_linea and body.numero_linea != sim.numero_linea:
         sim.numero_linea = body.numero_linea
 
+    await dashboard_cache.invalidar(db, "sims")
     await db.commit()
     return {"message": "SIM actualizada correctamente", "sim_id": sim_id}
 
@@ -462,6 +471,7 @@ async def eliminar_sim(
 
         # Eliminar la SIM
         await db.delete(sim)
+        await dashboard_cache.invalidar(db, "sims")
         await db.commit()
 
         # Contar SIMs restantes en el lote
@@ -514,6 +524,7 @@ async def asignar_plan(
             if hasattr(s, "estado"):
                 s.estado = ST_RECHARGED
 
+        await dashboard_cache.invalidar(db, "sims")
         await db.commit()
         return {"message": f"Plan '{plan}' asignado al lote {lote_id}."}
 
@@ -638,14 +649,17 @@ async def search_sim(
 # Buscar por código (alias que acepta ICCID o MSISDN)
 # ============================================================
 
-@router.get("/find-by-code")
-async def find_by_code(code: str, db: AsyncSession = Depends(get_async_session)):
-    q = (
+def consulta_sim_por_codigo(code: str):
+    """SIM (con el plan de su lote) cuyo ICCID o número de línea es code."""
+    return (
         select(SimDetalle, SimLote.plan_asignado.label("lote_plan"))
         .join(SimLote, SimLote.id == SimDetalle.lote_id)
         .where((SimDetalle.iccid == code) | (SimDetalle.numero_linea == code))
     )
-    r = (await db.execute(q)).first()
+
+@router.get("/find-by-code")
+async def find_by_code(code: str, db: AsyncSession = Depends(get_async_session)):
+    r = (await db.execute(consulta_sim_por_codigo(code))).first()
     if not r:
         raise HTTPException(status_code=404, detail="SIM no encontrada")
     sim, lote_plan = r
@@ -681,73 +695,93 @@ async def dashboard_stats(db: AsyncSession = Depends(get_async_session)):
     week_start = today_utc - timedelta(days=today_utc.weekday())
     month_start = today_utc.replace(day=1)
 
-    # ===== VENTAS / CAJA =====
-    ventas_base = select(MovimientoCaja).where(MovimientoCaja.tipo == "venta")
-
-    # Totales
-    total_revenue = (await db.execute(
-        select(func.coalesce(func.sum(MovimientoCaja.monto), 0.0)).where(MovimientoCaja.tipo == "venta")
-    )).scalar() or 0.0
-
-    total_ventas = (await db.execute(
-        select(func.count()).where(MovimientoCaja.tipo == "venta")
-    )).scalar() or 0
-
-    # Por periodos
-    revenue_hoy = (await db.execute(
-        select(func.coalesce(func.sum(MovimientoCaja.monto), 0.0))
-        .where(MovimientoCaja.tipo == "venta", MovimientoCaja.fecha >= today_utc)
-    )).scalar() or 0.0
+    es_venta = MovimientoCaja.tipo == "venta"
+    monto = MovimientoCaja.monto
+    desde_hoy = MovimientoCaja.fecha >= today_utc
+    desde_semana = MovimientoCaja.fecha >= week_start
+    desde_mes = MovimientoCaja.fecha >= month_start
+    disponibles = SimDetalle.estado.in_([ST_AVAILABLE, ST_RECHARGED])  # incluye 'recargado'
 
-    ventas_hoy = (await db.execute(
-        select(func.count()).where(MovimientoCaja.tipo == "venta", MovimientoCaja.fecha >= today_utc)
-    )).scalar() or 0
-
-    revenue_semana = (await db.execute(
-        select(func.coalesce(func.sum(MovimientoCaja.monto), 0.0))
-        .where(MovimientoCaja.tipo == "venta", MovimientoCaja.fecha >= week_start)
-    )).scalar() or 0.0
+    # Operadores con poco stock disponible (umbral configurable)
+    THRESHOLD = 5
+    # Tomamos el plan de la SIM; si no lo tiene, usamos el plan del lote
+    plan_expr = func.coalesce(SimDetalle.plan_asignado, SimLote.plan_asignado)
 
-    revenue_mes = (await db.execute(
-        select(func.coalesce(func.sum(MovimientoCaja.monto), 0.0))
-        .where(MovimientoCaja.tipo == "venta", MovimientoCaja.fecha >= month_start)
-    )).scalar() or 0.0
+    async def _ultimos(session: AsyncSession):
+        return (await session.execute(
+            select(MovimientoCaja)
+            .where(es_venta)
+            .order_by(MovimientoCaja.fecha.desc())
+            .limit(10)
+        )).scalars().all()
+
+    # Secciones independientes: cada consulta en su propia conexión, a la vez
+    res = await concurrent_queries.en_paralelo({
+        # ===== VENTAS / CAJA: totales y por periodos en una sola lectura =====
+        "ventas": concurrent_queries.fila(
+            select(
+                func.coalesce(func.sum(monto), 0.0).label("revenue_total"),
+                func.count().label("ventas_total"),
+                func.coalesce(func.sum(monto).filter(desde_hoy), 0.0).label("revenue_hoy"),
+                func.count().filter(desde_hoy).label("ventas_hoy"),
+                func.coalesce(func.sum(monto).filter(desde_semana), 0.0).label("revenue_semana"),
+                func.coalesce(func.sum(monto).filter(desde_mes), 0.0).label("revenue_mes"),
+                func.count().filter(desde_mes).label("ventas_mes"),
+            ).where(es_venta)
+        ),
+        # Por método de pago
+        "por_metodo": concurrent_queries.filas(
+            select(MovimientoCaja.metodo_pago.label("metodo"), func.coalesce(func.sum(monto), 0.0).label("total"))
+            .where(es_venta)
+            .group_by(MovimientoCaja.metodo_pago)
+        ),
+        # Serie últimos 14 días
+        "serie": concurrent_queries.filas(
+            select(
+                func.date_trunc('day', MovimientoCaja.fecha).label('dia'),
+                func.coalesce(func.sum(monto), 0.0).label('total')
+            )
+            .where(es_venta, MovimientoCaja.fecha >= (today_utc - timedelta(days=13)))
+            .group_by(text("1"))       # 1 = 'dia'
+            .order_by(text("1"))
+        ),
+        # Últimos 10 movimientos
+        "ultimos": _ultimos,
+        # ===== SIMS / STOCK: conteos por estado en una sola lectura =====
+        # Defectuosas: devueltas por fallas (intercambio); devueltas: con devolución de dinero
+        "sims": concurrent_queries.fila(
+            select(
+                func.count().label("total"),
+                func.count().filter(disponibles).label("available"),
+                func.count().filter(SimDetalle.estado == ST_SOLD).label("sold"),
+                func.count().filter(SimDetalle.estado == ST_DEFECTUOSA).label("defectuosas"),
+                func.count().filter(SimDetalle.estado == ST_DEVUELTA).label("devueltas"),
+            ).select_from(SimDetalle)
+        ),
+        # Disponibles por plan
+        "por_plan": concurrent_queries.filas(
+            select(plan_expr.label("plan"), func.count(SimDetalle.id).label("disponibles"))
+            .join(SimLote, SimLote.id == SimDetalle.lote_id)
+            .where(disponibles)
+            .group_by(plan_expr)
+        ),
+    }, db=db)
 
-    ventas_mes = (await db.execute(
-        select(func.count()).where(MovimientoCaja.tipo == "venta", MovimientoCaja.fecha >= month_start)
-    )).scalar() or 0
+    ventas = res["ventas"]
+    total_revenue = ventas["revenue_total"] or 0.0
+    total_ventas = ventas["ventas_total"] or 0
+    revenue_hoy = ventas["revenue_hoy"] or 0.0
+    ventas_hoy = ventas["ventas_hoy"] or 0
+    revenue_semana = ventas["revenue_semana"] or 0.0
+    revenue_mes = ventas["revenue_mes"] or 0.0
+    ventas_mes = ventas["ventas_mes"] or 0
 
     ticket_prom_hoy = (float(revenue_hoy) / ventas_hoy) if ventas_hoy else 0.0
     ticket_prom_mes = (float(revenue_mes) / ventas_mes) if ventas_mes else 0.0
 
-    # Por método de pago
-    by_method_rows = (await db.execute(
-        select(MovimientoCaja.metodo_pago, func.coalesce(func.sum(MovimientoCaja.monto), 0.0))
-        .where(MovimientoCaja.tipo == "venta")
-        .group_by(MovimientoCaja.metodo_pago)
-    )).all()
-    by_method = {m or "desconocido": float(t or 0) for m, t in by_method_rows}
+    by_method = {r["metodo"] or "desconocido": float(r["total"] or 0) for r in res["por_metodo"]}
+    serie_14d = [{"date": r["dia"].date().isoformat(), "total": float(r["total"])} for r in res["serie"]]
 
-    # Serie últimos 14 días
-    serie_rows = (await db.execute(
-        select(
-            func.date_trunc('day', MovimientoCaja.fecha).label('dia'),
-            func.coalesce(func.sum(MovimientoCaja.monto), 0.0).label('total')
-        )
-        .where(MovimientoCaja.tipo == "venta",
-               MovimientoCaja.fecha >= (today_utc - timedelta(days=13)))
-        .group_by(text("1"))       # 1 = 'dia'
-        .order_by(text("1"))
-    )).all()
-    serie_14d = [{"date": d.date().isoformat(), "total": float(t)} for d, t in serie_rows]
-
-    # Últimos 10 movimientos
-    ultimos = (await db.execute(
-        select(MovimientoCaja)
-        .where(MovimientoCaja.tipo == "venta")
-        .order_by(MovimientoCaja.fecha.desc())
-        .limit(10)
-    )).scalars().all()
     ultimas_ventas = [
         {
             "fecha": (m.fecha.isoformat() if getattr(m, "fecha", None) else None),
@@ -755,44 +789,20 @@ async def dashboard_stats(db: AsyncSession = Depends(get_async_session)):
             "monto": float(getattr(m, "monto", 0) or 0),
             "sale_id": getattr(m, "sale_id", None),
             "descripcion": getattr(m, "descripcion", None)
-        } for m in ultimos
+        } for m in res["ultimos"]
     ]
 
-    # ===== SIMS / STOCK =====
-    total_sims = (await db.execute(select(func.count()).select_from(SimDetalle))).scalar() or 0
-    # Disponibles: incluye 'available' Y 'recargado'
-    sims_available = (await db.execute(
-        select(func.count()).select_from(SimDetalle).where(SimDetalle.estado.in_([ST_AVAILABLE, ST_RECHARGED]))
-    )).scalar() or 0
-    sims_sold = (await db.execute(
-        select(func.count()).select_from(SimDetalle).where(SimDetalle.estado == ST_SOLD)
-    )).scalar() or 0
-    # Defectuosas: SIMs devueltas por fallas (intercambio)
-    sims_defectuosas = (await db.execute(
-        select(func.count()).select_from(SimDetalle).where(SimDetalle.estado == ST_DEFECTUOSA)
-    )).scalar() or 0
-    # Devueltas: SIMs devueltas con devolución de dinero (no disponibles para venta)
-    sims_devueltas = (await db.execute(
-        select(func.count()).select_from(SimDetalle).where(SimDetalle.estado == ST_DEVUELTA)
-    )).scalar() or 0
-
-    # Operadores con poco stock disponible (umbral configurable)
-    THRESHOLD = 5
-        # Tomamos el plan de la SIM; si no lo tiene, usamos el plan del lote
-    plan_expr = func.coalesce(SimDetalle.plan_asignado, SimLote.plan_asignado)
-
-    # Disponibles por plan: incluye 'available' Y 'recargado'
-    por_plan_rows = (await db.execute(
-        select(plan_expr.label("plan"), func.count(SimDetalle.id))
-        .join(SimLote, SimLote.id == SimDetalle.lote_id)
-        .where(SimDetalle.estado.in_([ST_AVAILABLE, ST_RECHARGED]))
-        .group_by(plan_expr)
-    )).all()
+    sims = res["sims"]
+    total_sims = sims["total"] or 0
+    sims_available = sims["available"] or 0
+    sims_sold = sims["sold"] or 0
+    sims_defectuosas = sims["defectuosas"] or 0
+    sims_devueltas = sims["devueltas"] or 0
 
     low_stock_plans = [
-        {"plan": (p or "Sin plan"), "disponibles": int(c)}
-        for p, c in por_plan_rows
-        if int(c) <= THRESHOLD
+        {"plan": (r["plan"] or "Sin plan"), "disponibles": int(r["disponibles"])}
+        for r in res["por_plan"]
+        if int(r["disponibles"]) <= THRESHOLD
     ]
 
     return {
@@ -868,8 +878,6 @@ async def dashboard_analytics(
         left join agg a using(d)
         order by d
     """)
-    trend_rows = (await db.execute(sql_trend, params)).mappings().all()
-    ventas_por_dia = [{"date": str(r["d"]), "ventas": int(r["ventas"]), "total": float(r["total"])} for r in trend_rows]
 
     # 2) Pie: “tipo de producto”
     # Si no tienes categorías, lo práctico es 2 grupos:
@@ -886,8 +894,6 @@ async def dashboard_analytics(
         group by 1
         order by total desc
     """)
-    pie_rows = (await db.execute(sql_pie, params)).mappings().all()
-    ventas_por_producto = [{"name": r["categoria"], "value": float(r["total"])} for r in pie_rows]
 
     # 3) Ventas por usuario (asesor)
     # Tomamos el usuario desde turnos -> movimientos_caja.turno_id
@@ -902,8 +908,6 @@ async def dashboard_analytics(
         group by 1
         order by total desc
     """)
-    user_rows = (await db.execute(sql_user, params)).mappings().all()
-    ventas_por_usuario = [{"usuario": r["usuario"], "ventas": int(r["ventas"]), "total": float(r["total"])} for r in user_rows]
 
     # 4) Cierres de caja del rango (opcional: solo con diferencia != 0)
     sql_cierres = text(f"""
@@ -925,7 +929,19 @@ async def dashboard_analytics(
         order by c.fecha_cierre desc
         limit 200
     """)
-    cierres_rows = (await db.execute(sql_cierres, params)).mappings().all()
+
+    # Las cuatro secciones son independientes: cada una en su propia conexión, a la vez
+    res = await concurrent_queries.en_paralelo({
+        "trend": concurrent_queries.filas(sql_trend, params),
+        "pie": concurrent_queries.filas(sql_pie, params),
+        "user": concurrent_queries.filas(sql_user, params),
+        "cierres": concurrent_queries.filas(sql_cierres, params),
+    }, db=db)
+    trend_rows, pie_rows, user_rows, cierres_rows = res["trend"], res["pie"], res["user"], res["cierres"]
+
+    ventas_por_dia = [{"date": str(r["d"]), "ventas": int(r["ventas"]), "total": float(r["total"])} for r in trend_rows]
+    ventas_por_producto = [{"name": r["categoria"], "value": float(r["total"])} for r in pie_rows]
+    ventas_por_usuario = [{"usuario": r["usuario"], "ventas": int(r["ventas"]), "total": float(r["total"])} for r in user_rows]
     cierres = [{
         "cierre_id": str(r["cierre_id"]),
         "turno_id": str(r["turno_id"]),
@@ -10,6 +10,7 @@ from decimal import Decimal
 
 from database import get_async_session
 from utils.auth_utils import get_current_user
+from services import dashboard_cache
 from models import (
     Turno as TurnoModel,
     CierreCaja as CierreCajaModel,
@@ -30,6 +31,78 @@ from schemas.sale_schemas import (
 router = APIRouter(prefix="/api/turnos", tags=["Turnos"])
 logger = logging.getLogger("turnos")
 
+
+# Consultas reutilizadas por varios endpoints; check_query_plans.py verifica sus planes.
+
+def consulta_turno_abierto(user_id: int):
+    """Turno abierto del usuario (a lo sumo uno)."""
+    return select(TurnoModel).where(TurnoModel.user_id == user_id, TurnoModel.estado == "abierto")
+
+
+def consulta_ventas_turno(turno_id):
+    """Movimientos de venta del turno, excluyendo ventas anuladas."""
+    return (
+        select(MovimientoCaja)
+        .join(Sale, MovimientoCaja.sale_id == Sale.id)
+        .where(
+            MovimientoCaja.turno_id == turno_id,
+            MovimientoCaja.tipo == "venta",
+            Sale.estado == "activa",
+        )
+    )
+
+
+def consulta_historial_turnos(user_id: int):
+    """Turnos del usuario, del más reciente al más antiguo."""
+    return select(TurnoModel).where(TurnoModel.user_id == user_id).order_by(TurnoModel.fecha_apertura.desc())
+
+
+def consulta_totales_turnos(turno_ids: list):
+    """Totales de ventas activas por turno y método de pago."""
+    return select(
+        MovimientoCaja.turno_id.label("turno_id"),
+        func.count(MovimientoCaja.id).label("ventas"),
+        func.sum(case((MovimientoCaja.metodo_pago == "electronic", MovimientoCaja.monto), else_=0)).label("total_electronicas"),
+        func.sum(case((MovimientoCaja.metodo_pago == "cash", MovimientoCaja.monto), else_=0)).label("total_efectivo"),
+        func.sum(case((MovimientoCaja.metodo_pago == "card", MovimientoCaja.monto), else_=0)).label("total_datafono"),
+        func.sum(case((MovimientoCaja.metodo_pago == "dollars", MovimientoCaja.monto), else_=0)).label("total_dollars"),
+        func.sum(MovimientoCaja.monto).label("total_general"),
+    ).join(
+        Sale, MovimientoCaja.sale_id == Sale.id
+    ).where(
+        MovimientoCaja.tipo == "venta",
+        MovimientoCaja.turno_id.in_(turno_ids),
+        Sale.estado == "activa"  # Excluir ventas anuladas
+    ).group_by(MovimientoCaja.turno_id)
+
+
+def consulta_ultimo_cierre(turno_ids: list):
+    """Observaciones del último cierre de cada turno."""
+    # Subconsulta: última fecha_cierre de CierreCaja por turno
+    latest_cierre_sq = (
+        select(
+            CierreCajaModel.turno_id,
+            func.max(CierreCajaModel.fecha_cierre).label("max_fecha")
+        )
+        .where(CierreCajaModel.turno_id.in_(turno_ids))
+        .group_by(CierreCajaModel.turno_id)
+        .subquery()
+    )
+
+    # Join al registro real del último cierre para obtener observaciones
+    return (
+        select(
+            CierreCajaModel.turno_id,
+            CierreCajaModel.observaciones
+        )
+        .join(
+            latest_cierre_sq,
+            (latest_cierre_sq.c.turno_id == CierreCajaModel.turno_id) &
+            (latest_cierre_sq.c.max_fecha == CierreCajaModel.fecha_cierre)
+        )
+    )
+
+
 # Endpoint de prueba
 @router.get("/test")
 async def test_endpoint():
@@ -141,10 +214,7 @@ async def abrir_turno(
 
         # ¿ya hay turno abierto?
         result = await db.execute(
-            select(TurnoModel).where(
-                TurnoModel.user_id == current_user.id,
-                TurnoModel.estado == "abierto"
-            )
+            consulta_turno_abierto(current_user.id)
         )
         turno_abierto = result.scalar_one_or_none()
         if turno_abierto:
@@ -193,6 +263,7 @@ async def abrir_turno(
             print(f"   ✓ Inventario agregado a la sesión")
 
         print(f"\n💾 Guardando en base de datos...")
+        await dashboard_cache.invalidar(db, "turnos")
         await db.commit()
         print(f"✅ Se guardaron {len(inventarios_creados)} inventarios de apertura")
         print(f"{'='*80}\n")
@@ -238,10 +309,7 @@ async def cerrar_turno_con_inventario(
     try:
         # 1) turno abierto
         result = await db.execute(
-            select(TurnoModel).where(
-                TurnoModel.user_id == current_user.id,
-                TurnoModel.estado == "abierto"
-            )
+            consulta_turno_abierto(current_user.id)
         )
         turno = result.scalar_one_or_none()
         if not turno:
@@ -317,13 +385,7 @@ async def cerrar_turno_con_inventario(
         # 4) Continuar con el proceso normal de cierre de caja
         # (mismo código que el endpoint original)
         movs_res = await db.execute(
-            select(MovimientoCaja).join(
-                Sale, MovimientoCaja.sale_id == Sale.id
-            ).where(
-                MovimientoCaja.turno_id == turno.id,
-                MovimientoCaja.tipo == "venta",
-                Sale.estado == "activa"
-            )
+            consulta_ventas_turno(turno.id)
         )
         movs = list(movs_res.scalars().all())
 
@@ -372,6 +434,7 @@ async def cerrar_turno_con_inventario(
         turno.fecha_cierre = aware_now
 
         db.add(cierre)
+        await dashboard_cache.invalidar(db, "turnos")
         await db.commit()
 
         cierre_db = await db.get(CierreCajaModel, cierre.id)
@@ -393,10 +456,7 @@ async def cerrar_turno(
     try:
         # 1) turno abierto
         result = await db.execute(
-            select(TurnoModel).where(
-                TurnoModel.user_id == current_user.id,
-                TurnoModel.estado == "abierto"
-            )
+            consulta_turno_abierto(current_user.id)
         )
         turno = result.scalar_one_or_none()
         if not turno:
@@ -407,13 +467,7 @@ async def cerrar_turno(
 
         # 3) Totales del turno usando movimientos_caja (excluyendo ventas anuladas)
         movs_res = await db.execute(
-            select(MovimientoCaja).join(
-                Sale, MovimientoCaja.sale_id == Sale.id
-            ).where(
-                MovimientoCaja.turno_id == turno.id,
-                MovimientoCaja.tipo == "venta",
-                Sale.estado == "activa"  # Excluir ventas anuladas
-            )
+            consulta_ventas_turno(turno.id)
         )
         movs = list(movs_res.scalars().all())
 
@@ -472,6 +526,7 @@ async def cerrar_turno(
         turno.fecha_cierre = aware_now
 
         db.add(cierre)
+        await dashboard_cache.invalidar(db, "turnos")
         await db.commit()
 
         # 6) Releer para obtener 'diferencia' (columna generada) y devolver con tipos correctos
@@ -491,10 +546,7 @@ async def estado_turno(
     current_user: User = Depends(get_current_user)
 ):
     result = await db.execute(
-        select(TurnoModel).where(
-            TurnoModel.user_id == current_user.id,
-            TurnoModel.estado == "abierto"
-        )
+        consulta_turno_abierto(current_user.id)
     )
     turno = result.scalar_one_or_none()
     if not turno:
@@ -509,10 +561,7 @@ async def ventas_por_turno(
 ):
     # turno abierto del usuario
     res_turno = await db.execute(
-        select(TurnoModel).where(
-            TurnoModel.user_id == current_user.id,
-            TurnoModel.estado == "abierto"
-        )
+        consulta_turno_abierto(current_user.id)
     )
     turno = res_turno.scalar_one_or_none()
     if not turno:
@@ -520,13 +569,7 @@ async def ventas_por_turno(
 
     # movimientos de venta del turno (excluyendo ventas anuladas)
     movs = (await db.execute(
-        select(MovimientoCaja).join(
-            Sale, MovimientoCaja.sale_id == Sale.id
-        ).where(
-            MovimientoCaja.turno_id == turno.id,
-            MovimientoCaja.tipo == "venta",
-            Sale.estado == "activa"  # Excluir ventas anuladas
-        )
+        consulta_ventas_turno(turno.id)
     )).scalars().all()
 
     def mp(m): 
@@ -562,7 +605,7 @@ async def mis_turnos(
 ):
     # Turnos del usuario
     turnos_res = await db.execute(
-        select(TurnoModel).where(TurnoModel.user_id == current_user.id).order_by(TurnoModel.fecha_apertura.desc())
+        consulta_historial_turnos(current_user.id)
     )
     turnos = turnos_res.scalars().all()
 
@@ -574,51 +617,13 @@ async def mis_turnos(
     # -------------------------------
     # 1) Agregados por turno (ventas activas únicamente)
     # -------------------------------
-    agg = await db.execute(
-        select(
-            MovimientoCaja.turno_id.label("turno_id"),
-            func.count(MovimientoCaja.id).label("ventas"),
-            func.sum(case((MovimientoCaja.metodo_pago == "electronic", MovimientoCaja.monto), else_=0)).label("total_electronicas"),
-            func.sum(case((MovimientoCaja.metodo_pago == "cash", MovimientoCaja.monto), else_=0)).label("total_efectivo"),
-            func.sum(case((MovimientoCaja.metodo_pago == "card", MovimientoCaja.monto), else_=0)).label("total_datafono"),
-            func.sum(case((MovimientoCaja.metodo_pago == "dollars", MovimientoCaja.monto), else_=0)).label("total_dollars"),
-            func.sum(MovimientoCaja.monto).label("total_general"),
-        ).join(
-            Sale, MovimientoCaja.sale_id == Sale.id
-        ).where(
-            MovimientoCaja.tipo == "venta",
-            MovimientoCaja.turno_id.in_(turno_ids),
-            Sale.estado == "activa"  # Excluir ventas anuladas
-        ).group_by(MovimientoCaja.turno_id)
-    )
+    agg = await db.execute(consulta_totales_turnos(turno_ids))
     por_turno = {str(r.turno_id): r._asdict() for r in agg.all()}
 
     # -------------------------------------------------
     # 2) Último cierre por turno → observaciones cierre
     # -------------------------------------------------
-    # Subconsulta: última fecha_cierre de CierreCaja por turno
-    latest_cierre_sq = (
-        select(
-            CierreCajaModel.turno_id,
-            func.max(CierreCajaModel.fecha_cierre).label("max_fecha")
-        )
-        .where(CierreCajaModel.turno_id.in_(turno_ids))
-        .group_by(CierreCajaModel.turno_id)
-        .subquery()
-    )
-
-    # Join al registro real del último cierre para obtener observaciones
-    cierres_rows = await db.execute(
-        select(
-            CierreCajaModel.turno_id,
-            CierreCajaModel.observaciones
-        )
-        .join(
-            latest_cierre_sq,
-            (latest_cierre_sq.c.turno_id == CierreCajaModel.turno_id) &
-            (latest_cierre_sq.c.max_fecha == CierreCajaModel.fecha_cierre)
-        )
-    )
+    cierres_rows = await db.execute(consulta_ultimo_cierre(turno_ids))
     obs_por_turno = {str(r.turno_id): r.observaciones for r in cierres_rows.all()}
 
     # -------------------------
@@ -6,17 +6,21 @@ import hmac
 import base64
 import hashlib
 import asyncio
+import time
 from datetime import datetime, timezone
 from typing import Any, Dict, List, Optional
+from uuid import UUID, uuid4
 import random
 import aiohttp
-from fastapi import APIRouter, HTTPException, Query, Depends
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi import APIRouter, HTTPException, Query, Depends, Header
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 from pydantic import BaseModel
-from sqlalchemy import select, update, func, or_
+from sqlalchemy import select, update, func, or_, text
 from sqlalchemy.ext.asyncio import AsyncSession
-from database import get_async_session
-from models import PlanHomologacion, SimDetalle, SimLote, SimStatus
+from database import get_async_session, SessionLocal, DATABASE_URL
+from models import SimDetalle, SimStatus, TopupJob
+from services import dashboard_cache, homologacion, winred_topup
+from utils.circuit_breaker import get_breaker, CircuitOpenError
 
 router = APIRouter()
 
@@ -35,7 +39,24 @@ WINRED_ALLOWED_IDS = set(
     s.strip() for s in os.getenv("WINRED_ALLOWED_IDS", "1163,1188,1189,1067").split(",") if s.strip()
 )
 
+# Antes: timeout fijo de 30s. Ahora adaptativo (p95 de latencias) con circuit breaker
+winred_breaker = get_breaker("winred", max_timeout=30.0, min_timeout=3.0)
+
 # ====== HELPERS ======
+class WinredHTTPError(HTTPException):
+    """Respuesta HTTP no exitosa de Winred (se devuelve al cliente como 502)."""
+    def __init__(self, upstream_status: int, detail: str):
+        self.upstream_status = upstream_status
+        super().__init__(status_code=502, detail=detail)
+
+def _es_caida_de_winred(e: BaseException) -> bool:
+    # 4xx (firma, ruta, formato) son respuestas de un Winred vivo: no abren el circuito
+    if isinstance(e, WinredHTTPError):
+        return e.upstream_status >= 500
+    if isinstance(e, HTTPException):
+        return e.status_code >= 500
+    return True
+
 def _must_have_creds() -> None:
     missing = [n for n, v in [
         ("WINRED_USER_ID", WINRED_USER_ID),
@@ -106,14 +127,8 @@ async def _apply_topup_to_sim_detalle(
       - fecha_ultima_recarga = now()
     Retorna cuántas filas fueron actualizadas.
     """
-    # 1) buscar siigo_code por product_id de Winred
-    q = await db.execute(
-        select(PlanHomologacion.siigo_code)
-        .where(PlanHomologacion.winred_product_id == str(winred_product_id))
-        .limit(1)
-    )
-    row = q.first()
-    siigo_code = row[0] if row else None
+    # 1) buscar siigo_code por product_id de Winred (mapa en memoria, sin consulta)
+    siigo_code = await homologacion.get_siigo_code(winred_product_id)
     if not siigo_code:
         # si no hay homologación, no hacemos nada para no grabar código vacío
         return 0
@@ -143,14 +158,85 @@ async def _apply_topup_to_sim_detalle(
         )
         .execution_options(synchronize_session=False)
     )
+    if res.rowcount:
+        await dashboard_cache.invalidar(db, "sims")
     await db.commit()
     return res.rowcount or 0
 
 # ====== CLIENTE ======
+# ====== VARIANTES APRENDIDAS (post_best) ======
+_TEXTPLAIN_MODE = "php-text/plain-body"
+_JSON_MODES = {
+    "with-hash": (True, False),
+    "no-hash": (False, False),
+    "no-hash+sorted": (False, True),
+}
+_VARIANT_ORDER = (*_JSON_MODES.keys(), _TEXTPLAIN_MODE)
+
+WINRED_VARIANTS_FILE = os.getenv(
+    "WINRED_VARIANTS_FILE",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "winred_variants.json"),
+)
+
+def _firma_invalida(resp: dict) -> bool:
+    resp = resp or {}
+    msg = (resp.get("result") or {}).get("message", "") or resp.get("message", "")
+    return isinstance(msg, str) and "firma" in msg.lower()
+
+class _VariantCache:
+    """(ruta, modo) que funcionó por grupo de servicios; se guarda en JSON para sobrevivir reinicios."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._data: Optional[Dict[str, Dict[str, str]]] = None
+
+    def _load(self) -> Dict[str, Dict[str, str]]:
+        if self._data is None:
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self._data = json.load(f)
+            except FileNotFoundError:
+                self._data = {}
+            except Exception as e:
+                print(f"⚠️ No se pudo leer {self.path}: {e}")
+                self._data = {}
+        return self._data
+
+    def _save(self) -> None:
+        # Nombre temporal único: varios workers pueden guardar a la vez y os.replace es atómico
+        tmp = f"{self.path}.{uuid4().hex}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self._data, f, indent=2)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            print(f"⚠️ No se pudo guardar {self.path}: {e}")
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+    def get(self, group: str) -> Optional[tuple]:
+        v = self._load().get(group)
+        return (v["route"], v["mode"]) if v else None
+
+    def learn(self, group: str, variant: tuple) -> None:
+        if self.get(group) == variant:
+            return
+        self._load()[group] = {"route": variant[0], "mode": variant[1], "learned_at": datetime.now(timezone.utc).isoformat()}
+        print(f"📌 Winred {group}: variante aprendida route={variant[0]} mode={variant[1]}")
+        self._save()
+
+    def forget(self, group: str, variant: tuple) -> None:
+        if self.get(group) == variant:
+            self._load().pop(group, None)
+            self._save()
+
+_variant_cache = _VariantCache(WINRED_VARIANTS_FILE)
+
 class WinredClient:
     def __init__(self, base_url: str):
         self.base_url = base_url
-        self.timeout = aiohttp.ClientTimeout(total=30)
 
     def build_header_for_body(self) -> Dict[str, Any]:
         """
@@ -234,73 +320,122 @@ class WinredClient:
         url = f"{self.base_url}/{service.strip('/')}"
         headers = {"Accept": "text/plain", "Content-Type": "text/plain"}
 
-        async with aiohttp.ClientSession(auth=auth, timeout=self.timeout) as s:
-            async with s.post(url, headers=headers, data=body_str.encode("utf-8"), ssl=True) as r:
-                text = await r.text()
-                print(f"⬅️ Winred RESP {service} text/plain status={r.status} body={text[:500]}")
-                if r.status in (200, 201):
-                    try:
-                        resp = json.loads(text)
-                    except json.JSONDecodeError:
-                        raise HTTPException(status_code=502, detail=f"Respuesta no JSON de Winred: {text[:200]}")
-                    resp["__mode"] = "php-text/plain-body"
-                    resp["__route"] = service
-                    resp["__req_id"] = header["request_id"]
-                    return resp
-                raise HTTPException(status_code=502, detail=f"Winred HTTP {r.status}: {text}")
+        async def _post() -> dict:
+            async with aiohttp.ClientSession(auth=auth) as s:
+                async with s.post(url, headers=headers, data=body_str.encode("utf-8"), ssl=True) as r:
+                    text = await r.text()
+                    print(f"⬅️ Winred RESP {service} text/plain status={r.status} body={text[:500]}")
+                    if r.status in (200, 201):
+                        try:
+                            resp = json.loads(text)
+                        except json.JSONDecodeError:
+                            raise HTTPException(status_code=502, detail=f"Respuesta no JSON de Winred: {text[:200]}")
+                        resp["__mode"] = "php-text/plain-body"
+                        resp["__route"] = service
+                        resp["__req_id"] = header["request_id"]
+                        return resp
+                    raise WinredHTTPError(r.status, f"Winred HTTP {r.status}: {text}")
+
+        try:
+            return await winred_breaker.call(_post, is_failure=_es_caida_de_winred)
+        except CircuitOpenError as e:
+            raise HTTPException(status_code=503, detail=str(e))
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=504, detail=f"Winred no respondió a tiempo ({service})")
 
 
     # -------- paquetes (tu flujo original que ya funciona) ----------
     def _payload_json_mode(self, data: Dict[str, Any], include_hash: bool, sort: bool) -> Dict[str, Any]:
         header = self.build_header_for_body()
+        if not include_hash:
+            header.pop("hash_key", None)
+        if sort:
+            data = {k: data[k] for k in sorted(data)}
         # Signature usa la misma fórmula que hash_key según el proveedor
         signature_string = f"{header['request_date']}{header['request_id']}{WINRED_API_KEY}"
         signature = _b64_hmac_sha256(WINRED_SECRET_KEY, signature_string)
         return {"header": header, "data": data, "signature": signature}
 
+    async def _post_json_mode(self, session: aiohttp.ClientSession, svc: str, tag: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        include_hash, sort = _JSON_MODES[tag]
+        payload = self._payload_json_mode(data, include_hash, sort)
+        req_id = payload["header"]["request_id"]
+        url = f"{self.base_url}/{svc.strip('/')}"
+
+        async def _post() -> dict:
+            print(f"➡️ Winred POST {svc} mode={tag} req_id={req_id} data={data}")
+            async with session.post(
+                url,
+                data=json.dumps(payload, separators=(",", ":"), ensure_ascii=False),
+                ssl=True,
+                skip_auto_headers={"Content-Type", "Accept"},
+            ) as r:
+                text = await r.text()
+                print(f"⬅️ Winred RESP {svc} mode={tag} status={r.status} body={text[:500]}")
+                if r.status in (200, 201):
+                    try:
+                        resp = json.loads(text)
+                    except json.JSONDecodeError:
+                        raise HTTPException(status_code=502, detail=f"Respuesta no JSON de Winred: {text[:200]}")
+                    resp["__mode"] = tag
+                    resp["__route"] = svc
+                    resp["__req_id"] = req_id
+                    return resp
+                raise WinredHTTPError(r.status, f"Winred HTTP {r.status}: {text}")
+
+        try:
+            return await winred_breaker.call(_post, is_failure=_es_caida_de_winred)
+        except CircuitOpenError as e:
+            raise HTTPException(status_code=503, detail=str(e))
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=504, detail=f"Winred no respondió a tiempo ({svc})")
+
     async def post_best(self, service: Any, data: Dict[str, Any]) -> Dict[str, Any]:
         """
-        Estrategia flexible (la que ya te traía paquetes):
-        prueba with-hash / no-hash / no-hash+sorted y rutas minúscula/camelCase.
+        Estrategia flexible (la que ya te traía paquetes): rutas minúscula/camelCase ×
+        with-hash / no-hash / no-hash+sorted / text/plain (estilo PHP).
+
+        La combinación (ruta, modo) que funcionó se recuerda por grupo de servicios
+        (persistida en WINRED_VARIANTS_FILE) y se prueba primero: el caso normal es 1 request.
+        Solo se pasa a la siguiente variante ante error de firma o HTTP 404/415;
+        cualquier otro error se devuelve de inmediato.
         """
         services: List[str] = [service] if isinstance(service, str) else [s for s in (service or []) if isinstance(s, str)]
         if not services:
             raise HTTPException(status_code=500, detail="Servicio Winred no especificado")
 
+        _must_have_creds()
+        group = "|".join(services)
+        candidates = [(svc, tag) for svc in services for tag in _VARIANT_ORDER]
+        learned = _variant_cache.get(group)
+        if learned in candidates:
+            candidates.remove(learned)
+            candidates.insert(0, learned)
+
         auth = aiohttp.BasicAuth(WINRED_BASIC_USER, WINRED_BASIC_PASS)
         last_err = None
 
-        async with aiohttp.ClientSession(auth=auth, timeout=self.timeout) as session:
-            for svc in services:
-                for (include_hash, sort, tag) in ((True, False, "with-hash"), (False, False, "no-hash"), (False, True, "no-hash+sorted")):
-                    payload = self._payload_json_mode(data, include_hash, sort)
-                    req_id = payload["header"]["request_id"]
-                    url = f"{self.base_url}/{svc.strip('/')}"
-                    try:
-                        print(f"➡️ Winred POST {svc} mode={tag} req_id={req_id} data={data}")
-                        async with session.post(
-                            url,
-                            data=json.dumps(payload, separators=(",", ":"), ensure_ascii=False),
-                            ssl=True,
-                            skip_auto_headers={"Content-Type", "Accept"},
-                        ) as r:
-                            text = await r.text()
-                            print(f"⬅️ Winred RESP {svc} mode={tag} status={r.status} body={text[:500]}")
-                            if r.status in (404, 415):
-                                last_err = f"Winred HTTP {r.status} en {svc} (probar siguiente variante/ruta)"
-                                continue
-                            if r.status in (200, 201):
-                                try:
-                                    resp = json.loads(text)
-                                except json.JSONDecodeError:
-                                    raise HTTPException(status_code=502, detail=f"Respuesta no JSON de Winred: {text[:200]}")
-                                resp["__mode"] = tag
-                                resp["__route"] = svc
-                                resp["__req_id"] = req_id
-                                return resp
-                            last_err = f"Winred HTTP {r.status}: {text}"
-                    except Exception as e:
-                        last_err = f"{type(e).__name__}: {e}"
+        async with aiohttp.ClientSession(auth=auth) as session:
+            for svc, tag in candidates:
+                try:
+                    if tag == _TEXTPLAIN_MODE:
+                        resp = await self.post_textplain_body(svc, data)
+                    else:
+                        resp = await self._post_json_mode(session, svc, tag, data)
+                except WinredHTTPError as e:
+                    if e.upstream_status in (404, 415):
+                        last_err = f"Winred HTTP {e.upstream_status} en {svc} (probar siguiente variante/ruta)"
+                        _variant_cache.forget(group, (svc, tag))
+                        continue
+                    raise
+
+                if _firma_invalida(resp):
+                    last_err = f"Firma inválida en {svc} mode={tag}"
+                    _variant_cache.forget(group, (svc, tag))
+                    continue
+
+                _variant_cache.learn(group, (svc, tag))
+                return resp
 
         raise HTTPException(status_code=502, detail=last_err or "Fallo desconocido en Winred")
     
@@ -321,6 +456,10 @@ class BulkTopupByLoteRequest(BaseModel):
     amount: int = 0
     sell_from: str = "S"
 
+class ResolverVerificacionRequest(BaseModel):
+    resultado: str  # exitosa | pendiente
+    posiciones: Optional[List[int]] = None
+
 # ====== ENDPOINTS ======
 @router.get("/verify")
 async def verify_basic_ip():
@@ -330,44 +469,28 @@ async def verify_basic_ip():
         async with s.get(f"{WINRED_BASE_URL}/verify", ssl=True, skip_auto_headers={"Accept"}) as r:
             return {"status": r.status, "text": await r.text()}
 
-@router.get("/packages")
-async def get_packages(product_parent_id: int = Query(1, ge=0, description="0=todos, 1=Claro, 2=Movistar, 3=Tigo")):
-    """
-    Trae paquetes probando primero el flujo JSON (como antes) y,
-    si Winred devuelve 'firma...' hace fallback a text/plain (estilo PHP), 
-    probando tanto querypackages como queryPackages.
-    """
-    data = {"product_id": str(product_parent_id)}  # Winred exige string
+# ====== CACHE DE PAQUETES ======
+# El catálogo cambia poco: se cachea por product_parent_id ya filtrado y ordenado.
+# - edad < TTL: se sirve del cache
+# - TTL <= edad < TTL + STALE: se sirve el valor viejo y se refresca en segundo plano
+# - más viejo (o sin cache): se consulta a Winred (una sola consulta aunque lleguen varias solicitudes)
+# Si Winred falla y hay un valor en cache, se sirve aunque esté vencido.
+WINRED_PACKAGES_TTL_SECONDS = int(os.getenv("WINRED_PACKAGES_TTL_SECONDS", "600"))
+WINRED_PACKAGES_STALE_SECONDS = int(os.getenv("WINRED_PACKAGES_STALE_SECONDS", "3600"))
 
-    def firma_invalida(resp: dict) -> bool:
-        msg = (resp or {}).get("result", {}).get("message", "") or resp.get("message", "")
-        return isinstance(msg, str) and "firma" in msg.lower()
+_packages_cache: Dict[int, Dict[str, Any]] = {}     # pid -> {"resp", "etag", "fetched_at"}
+_packages_locks: Dict[int, asyncio.Lock] = {}
+_packages_refresh_tasks: Dict[int, asyncio.Task] = {}
 
-    # 1) Intento original (JSON)
+async def _fetch_packages(product_parent_id: int) -> Dict[str, Any]:
+    data = {"product_id": str(product_parent_id)}  # Winred exige string
+
+    # post_best prueba primero la variante que ya funcionó (JSON o text/plain, minúscula o camelCase)
     try:
         raw = await winred.post_best(["querypackages", "queryPackages"], data)
-        if not firma_invalida(raw):
-            # OK, siguió funcionando
-            resp = _filter_allowed_packages_in_resp(raw)
-        else:
-            raise HTTPException(status_code=502, detail="Firma inválida en modo JSON")
-    except Exception as e_json:
-        print("ℹ️ /packages fallback a text/plain por:", e_json)
-
-        # 2) Fallback text/plain (igual a topup)
-        #    Probamos ambas rutas porque a veces el backend cambia el casing.
-        last_err = None
-        for svc in ("querypackages", "queryPackages"):
-            try:
-                raw = await winred.post_textplain_body(svc, data)
-                resp = _filter_allowed_packages_in_resp(raw)
-                break
-            except Exception as e_txt:
-                last_err = e_txt
-                continue
-        else:
-            # si no rompió el bucle, fallaron ambas rutas
-            raise HTTPException(status_code=502, detail=f"No se pudieron obtener paquetes (text/plain): {last_err}")
+    except HTTPException as e:
+        raise HTTPException(status_code=e.status_code, detail=f"No se pudieron obtener paquetes: {e.detail}")
+    resp = _filter_allowed_packages_in_resp(raw)
 
     # Post-proceso y orden, igual que antes
     try:
@@ -380,7 +503,181 @@ async def get_packages(product_parent_id: int = Query(1, ge=0, description="0=to
     except Exception as e:
         print("⚠️ postproc paquetes:", e)
 
-    return JSONResponse(content=resp, headers={"Cache-Control": "no-store, no-cache, must-revalidate, max-age=0"})
+    return resp
+
+def _packages_etag(resp: Dict[str, Any]) -> str:
+    # Sin los campos por-request (__req_id cambia en cada llamada aunque el catálogo sea igual)
+    stable = {k: v for k, v in resp.items() if not k.startswith("__")}
+    body = json.dumps(stable, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return '"' + hashlib.sha256(body.encode("utf-8")).hexdigest()[:32] + '"'
+
+async def _refresh_packages(product_parent_id: int) -> Dict[str, Any]:
+    lock = _packages_locks.setdefault(product_parent_id, asyncio.Lock())
+    async with lock:
+        entry = _packages_cache.get(product_parent_id)
+        # Otra solicitud ya lo refrescó mientras esperábamos el lock
+        if entry and time.monotonic() - entry["fetched_at"] < WINRED_PACKAGES_TTL_SECONDS:
+            return entry
+        resp = await _fetch_packages(product_parent_id)
+        entry = {"resp": resp, "etag": _packages_etag(resp), "fetched_at": time.monotonic()}
+        _packages_cache[product_parent_id] = entry
+        return entry
+
+async def _refresh_packages_background(product_parent_id: int) -> None:
+    try:
+        await _refresh_packages(product_parent_id)
+    except Exception as e:
+        print(f"⚠️ Refresco en segundo plano de paquetes {product_parent_id} falló: {e}")
+    finally:
+        _packages_refresh_tasks.pop(product_parent_id, None)
+
+async def _get_packages_cached(product_parent_id: int) -> tuple:
+    """Retorna (entry, estado_cache) con estado_cache en HIT / STALE / MISS."""
+    entry = _packages_cache.get(product_parent_id)
+    age = time.monotonic() - entry["fetched_at"] if entry else None
+
+    if entry and age < WINRED_PACKAGES_TTL_SECONDS:
+        return entry, "HIT"
+
+    if entry and age < WINRED_PACKAGES_TTL_SECONDS + WINRED_PACKAGES_STALE_SECONDS:
+        if product_parent_id not in _packages_refresh_tasks:
+            _packages_refresh_tasks[product_parent_id] = asyncio.create_task(
+                _refresh_packages_background(product_parent_id)
+            )
+        return entry, "STALE"
+
+    try:
+        return await _refresh_packages(product_parent_id), "MISS"
+    except HTTPException:
+        if entry:
+            print(f"⚠️ Winred falló, se sirven paquetes {product_parent_id} del cache vencido")
+            return entry, "STALE"
+        raise
+
+def invalidate_packages_cache(product_parent_id: Optional[int] = None) -> int:
+    """Borra el cache de paquetes (de un operador o de todos). Retorna cuántas entradas se borraron."""
+    if product_parent_id is None:
+        n = len(_packages_cache)
+        _packages_cache.clear()
+        return n
+    return 1 if _packages_cache.pop(product_parent_id, None) is not None else 0
+
+# El cache de paquetes vive en cada proceso: DELETE /packages/cache lo difunde a todos con
+# NOTIFY winred_packages (payload: product_parent_id o '*'); cada proceso lo escucha.
+PACKAGES_CHANNEL = "winred_packages"
+_packages_listener_task: Optional[asyncio.Task] = None
+
+async def notificar_invalidacion_paquetes(db: AsyncSession, product_parent_id: Optional[int] = None) -> None:
+    """Envía NOTIFY dentro de la transacción de db: se entrega a todos los procesos al hacer commit."""
+    payload = "*" if product_parent_id is None else str(product_parent_id)
+    await db.execute(text("SELECT pg_notify(:canal, :payload)"), {"canal": PACKAGES_CHANNEL, "payload": payload})
+
+def _aplicar_invalidacion_paquetes(payload: str) -> None:
+    try:
+        n = invalidate_packages_cache(None if payload == "*" else int(payload))
+    except ValueError:
+        print(f"⚠️ NOTIFY {PACKAGES_CHANNEL} con payload inválido: {payload!r}")
+        return
+    if n:
+        print(f"♻️ Cache de paquetes invalidado ({n} operadores) por NOTIFY {PACKAGES_CHANNEL}")
+
+async def _escuchar_paquetes():
+    import asyncpg
+
+    while True:
+        conn = None
+        try:
+            conn = await asyncpg.connect(DATABASE_URL.replace("postgresql+asyncpg://", "postgresql://", 1))
+            cerrada = asyncio.Event()
+            conn.add_termination_listener(lambda _c: cerrada.set())
+            await conn.add_listener(
+                PACKAGES_CHANNEL, lambda _c, _pid, _canal, payload: _aplicar_invalidacion_paquetes(payload)
+            )
+            # Al (re)conectar se descarta el cache: pudo haber invalidaciones mientras no escuchábamos
+            invalidate_packages_cache()
+            print(f"Escuchando NOTIFY {PACKAGES_CHANNEL}")
+            await cerrada.wait()
+            print(f"⚠️ Conexión LISTEN {PACKAGES_CHANNEL} cerrada, reconectando")
+        except asyncio.CancelledError:
+            break
+        except Exception as e:
+            print(f"⚠️ LISTEN {PACKAGES_CHANNEL} falló: {e}")
+        finally:
+            if conn is not None and not conn.is_closed():
+                await conn.close()
+        await asyncio.sleep(5)
+
+async def iniciar_listener_paquetes():
+    global _packages_listener_task
+    if _packages_listener_task is None or _packages_listener_task.done():
+        _packages_listener_task = asyncio.create_task(_escuchar_paquetes())
+
+async def detener_listener_paquetes():
+    global _packages_listener_task
+    if _packages_listener_task is not None:
+        _packages_listener_task.cancel()
+        try:
+            await _packages_listener_task
+        except asyncio.CancelledError:
+            pass
+        _packages_listener_task = None
+
+def _invalidate_packages_if_product_rejected(msg: Optional[str]) -> None:
+    # Si Winred rechaza un product_id (paquete retirado o cambiado) el catálogo cacheado ya no es válido
+    m = (msg or "").lower()
+    if "producto" in m or "paquete" in m or "product" in m:
+        n = invalidate_packages_cache()
+        print(f"♻️ Cache de paquetes invalidado ({n} operadores) por rechazo de Winred: {msg}")
+
+@router.get("/packages")
+async def get_packages(
+    product_parent_id: int = Query(1, ge=0, description="0=todos, 1=Claro, 2=Movistar, 3=Tigo"),
+    if_none_match: Optional[str] = Header(None, alias="If-None-Match"),
+):
+    """
+    Trae paquetes con la variante de Winred aprendida (ver WinredClient.post_best);
+    si Winred devuelve 'firma...' o 404/415 prueba las demás: flujo JSON y
+    text/plain (estilo PHP), tanto querypackages como queryPackages.
+
+    Respuesta cacheada en el servidor por product_parent_id (TTL + refresco en segundo plano)
+    con ETag: si el cliente envía If-None-Match con el mismo ETag se responde 304.
+    """
+    entry, cache_status = await _get_packages_cached(product_parent_id)
+    headers = {
+        "ETag": entry["etag"],
+        # El navegador siempre revalida; con el ETag la respuesta es un 304 sin cuerpo
+        "Cache-Control": "private, no-cache",
+        "X-Cache": cache_status,
+    }
+
+    if if_none_match and entry["etag"] in [t.strip() for t in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    return JSONResponse(content=entry["resp"], headers=headers)
+
+@router.delete("/packages/cache")
+async def clear_packages_cache(
+    product_parent_id: Optional[int] = Query(None, ge=0),
+    db: AsyncSession = Depends(get_async_session),
+):
+    """Invalida el cache de paquetes (de un operador o de todos) en todos los procesos"""
+    invalidadas = invalidate_packages_cache(product_parent_id)
+    await notificar_invalidacion_paquetes(db, product_parent_id)
+    await db.commit()
+    return {"ok": True, "invalidated": invalidadas}
+
+@router.get("/homologacion")
+async def get_homologacion():
+    """Mapa winred_product_id -> código Siigo cargado en memoria"""
+    return {"planes": homologacion.snapshot()}
+
+@router.post("/homologacion/reload")
+async def reload_homologacion(db: AsyncSession = Depends(get_async_session)):
+    """Recarga el mapa de homologación en este proceso y avisa a los demás (NOTIFY)"""
+    count = await homologacion.cargar()
+    await homologacion.notificar_cambio(db)
+    await db.commit()
+    return {"ok": True, "planes": count}
 
 @router.get("/balance")
 async def get_balance(suscriber: Optional[str] = None):
@@ -403,6 +700,7 @@ async def topup(req: TopupRequest, db: AsyncSession = Depends(get_async_session)
     ok  = (resp.get("result", {}) or {}).get("success") is True or resp.get("success") is True
     msg = resp.get("result", {}).get("message") or resp.get("message")
     if not ok:
+        _invalidate_packages_if_product_rejected(msg)
         raise HTTPException(status_code=400, detail=f"Winred rechazó la transacción: {msg or 'sin detalle'}")
     
     # confirmación rápida (mismo text/plain, solo 'suscriber')
@@ -436,190 +734,116 @@ async def topup(req: TopupRequest, db: AsyncSession = Depends(get_async_session)
 
 @router.post("/topup_lote")
 async def topup_lote(body: BulkTopupByLoteRequest, db: AsyncSession = Depends(get_async_session)):
-    res = await db.execute(select(SimDetalle).where(SimDetalle.lote_id == body.lote_id))
-    sims: List[SimDetalle] = list(res.scalars().all())
-    if not sims:
+    """
+    Recarga todo el lote. Crea un job durable y espera a que el worker termine;
+    si el cliente se desconecta el job sigue en segundo plano (ver GET /jobs/{id}).
+    """
+    job = await winred_topup.encolar_job(
+        db, lote_id=body.lote_id, winred_product_id=_as_str(body.product_id),
+        amount=_as_str(body.amount), sell_from=_as_str(body.sell_from),
+    )
+    if job is None:
         raise HTTPException(status_code=404, detail="Lote sin SIMs")
 
-    exitosas_msisdns: List[str] = []
-    fallidas: List[Dict[str, Any]] = []
-
-    for sim in sims:
-        msisdn = _as_str(sim.numero_linea)  
-        data = {
-            "product_id": _as_str(body.product_id),
-            "amount": _as_str(body.amount),
-            "suscriber": msisdn,
-            "sell_from": _as_str(body.sell_from),
-        }
-        # LOG: Imprimir el payload antes de enviar
-        try:
-            # Construir el header y la firma igual que en post_textplain_body
-            header = winred.build_header_for_body()
-            ordered_data = {
-                "product_id": _as_str(body.product_id),
-                "amount": _as_str(body.amount),
-                "suscriber": msisdn,
-                "sell_from": _as_str(body.sell_from),
-            }
-            # Signature usa la NUEVA fórmula: request_date + request_id + api_key
-            signature_string = f"{header['request_date']}{header['request_id']}{WINRED_API_KEY}"
-            signature = _b64_hmac_sha256(WINRED_SECRET_KEY, signature_string)
-            print(f"\n➡️ [LOG] Enviando a Winred: msisdn={msisdn}")
-            print(f"   Payload: {{'header': {header}, 'data': {ordered_data}, 'signature': {signature}}}")
-            print(f"   Concatenado para firma: {signature_string}")
-            print(f"   Signature: {signature}\n")
-        except Exception as log_exc:
-            print(f"⚠️ Error generando log de firma para msisdn={msisdn}: {log_exc}")
-        try:
-            resp = await winred.post_textplain_body("topup", data)
-            ok = (resp.get("result", {}) or {}).get("success") is True or resp.get("success") is True
-            if ok:
-                exitosas_msisdns.append(msisdn)
-                try:
-                    # Persistir inmediatamente en sim_detalle
-                    await _apply_topup_to_sim_detalle(
-                        db,
-                        msisdn=msisdn,
-                        winred_product_id=_as_str(body.product_id),
-                    )
-                except Exception as e:
-                    # no interrumpas el lote ante un error de DB puntual; registra en 'fallidas' si quieres
-                    print("⚠️ Persistencia sim_detalle fallida:", e)
-            else:
-                fallidas.append({"msisdn": msisdn, "resp": resp})
-        except Exception as e:
-            fallidas.append({"msisdn": msisdn, "error": str(e)})
-
-    # Homologación a Siigo
-    q = await db.execute(
-        select(PlanHomologacion.siigo_code).where(PlanHomologacion.winred_product_id == str(body.product_id))
-    )
-    row = q.first()
-    siigo_code = row[0] if row else None
-
-    if exitosas_msisdns and siigo_code:
-        await db.execute(
-            update(SimDetalle)
-            .where(SimDetalle.lote_id == body.lote_id, SimDetalle.numero_linea.in_(exitosas_msisdns))
-            .values(
-                plan_asignado=siigo_code,
-                winred_product_id=str(body.product_id),
-                fecha_ultima_recarga=func.now(),
-            )
-        )
-    if siigo_code:
-        await db.execute(update(SimLote).where(SimLote.id == body.lote_id).values(plan_asignado=siigo_code))
-    await db.commit()
+    await asyncio.shield(winred_topup.lanzar(job.id, winred))
 
+    estado = await winred_topup.resumen(db, job.id)
+    fallidas = [
+        {"msisdn": p["msisdn"], "error": p["error"]} for p in estado["problemas"] if p["estado"] == "fallida"
+    ]
     return {
-        "success": len(fallidas) == 0,
-        "processed": len(sims),
-        "successful_count": len(exitosas_msisdns),
-        "failed_count": len(fallidas),
+        "success": estado["estado"] == "completado" and estado["fallidas"] == 0 and estado["por_verificar"] == 0,
+        "job_id": estado["job_id"],
+        "estado": estado["estado"],
+        "processed": estado["procesadas"],
+        "successful_count": estado["exitosas"],
+        "failed_count": estado["fallidas"],
+        "verify_count": estado["por_verificar"],
         "failed": fallidas,
     }
 
 @router.get("/topup_lote_stream")
 async def topup_lote_stream(
-    lote_id: str = Query(...),
-    product_id: str = Query(...),
+    lote_id: Optional[str] = Query(None),
+    product_id: Optional[str] = Query(None),
     amount: str = Query("0"),
-    sell_from: str = Query("S")
+    sell_from: str = Query("S"),
+    job_id: Optional[UUID] = Query(None),
+    db: AsyncSession = Depends(get_async_session),
 ):
     """
-    Endpoint con Server-Sent Events para recarga de lote con progreso en tiempo real
+    Server-Sent Events con el progreso de una recarga de lote.
+    Con lote_id + product_id crea el job; con job_id se vuelve a conectar a uno existente.
+    La recarga la ejecuta el worker: cerrar la conexión no la detiene.
     """
-    async def event_generator():
-        # Crear sesión propia para el generador
-        async for db in get_async_session():
-            try:
-                # Obtener SIMs del lote (lote_id es text en la BD)
-                res = await db.execute(select(SimDetalle).where(SimDetalle.lote_id == str(lote_id)))
-                sims: List[SimDetalle] = list(res.scalars().all())
+    if job_id is None:
+        if not lote_id or not product_id:
+            raise HTTPException(status_code=400, detail="Indique job_id o lote_id y product_id")
+        job = await winred_topup.encolar_job(
+            db, lote_id=lote_id, winred_product_id=_as_str(product_id),
+            amount=_as_str(amount), sell_from=_as_str(sell_from),
+        )
+        if job is None:
+            raise HTTPException(status_code=404, detail="Lote sin SIMs")
+        job_id = job.id
+        winred_topup.lanzar(job_id, winred)
+    elif await db.get(TopupJob, job_id) is None:
+        raise HTTPException(status_code=404, detail="Job no encontrado")
+
+    def _evento(data: Dict[str, Any]) -> str:
+        return f"data: {json.dumps(data)}\n\n"
+
+    def _complete(estado: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "type": "complete" if estado["estado"] == "completado" else "interrupted",
+            "job_id": estado["job_id"],
+            "successful": estado["exitosas"],
+            "failed": estado["fallidas"],
+            "verify": estado["por_verificar"],
+            "total": estado["total"],
+            "message": estado["ultimo_error"],
+        }
 
-                if not sims:
-                    yield f"data: {json.dumps({'type': 'error', 'message': 'Lote sin SIMs'})}\n\n"
+    async def event_generator():
+        # Suscribirse antes de leer el estado para no perder eventos intermedios
+        cola = winred_topup.suscribir(job_id)
+        try:
+            async with SessionLocal() as s:
+                estado = await winred_topup.resumen(s, job_id, max_items=0)
+            yield _evento({
+                "type": "start",
+                "job_id": estado["job_id"],
+                "lote_id": estado["lote_id"],
+                "total": estado["total"],
+                "processed": estado["procesadas"],
+            })
+            if estado["estado"] in winred_topup.ESTADOS_FINALES:
+                yield _evento(_complete(estado))
+                return
+
+            while True:
+                try:
+                    ev = await asyncio.wait_for(cola.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    # Sin eventos (o el job corre en otro proceso): progreso desde la BD
+                    async with SessionLocal() as s:
+                        estado = await winred_topup.resumen(s, job_id, max_items=0)
+                    if estado["estado"] in winred_topup.ESTADOS_FINALES:
+                        yield _evento(_complete(estado))
+                        return
+                    yield _evento({
+                        "type": "progress",
+                        "job_id": estado["job_id"],
+                        "processed": estado["procesadas"],
+                        "total": estado["total"],
+                    })
+                    continue
+
+                yield _evento(ev)
+                if ev["type"] in ("complete", "interrupted"):
                     return
-
-                # Evento de inicio
-                yield f"data: {json.dumps({'type': 'start', 'total': len(sims), 'lote_id': lote_id})}\n\n"
-                await asyncio.sleep(0.1)
-
-                exitosas_msisdns: List[str] = []
-                fallidas: List[Dict[str, Any]] = []
-
-                for index, sim in enumerate(sims, 1):
-                    msisdn = _as_str(sim.numero_linea)
-
-                    # Evento de procesamiento
-                    yield f"data: {json.dumps({'type': 'processing', 'msisdn': msisdn, 'index': index, 'total': len(sims)})}\n\n"
-                    await asyncio.sleep(0.1)
-
-                    data = {
-                        "product_id": _as_str(product_id),
-                        "amount": _as_str(amount),
-                        "suscriber": msisdn,
-                        "sell_from": _as_str(sell_from),
-                    }
-
-                    try:
-                        resp = await winred.post_textplain_body("topup", data)
-                        ok = (resp.get("result", {}) or {}).get("success") is True or resp.get("success") is True
-
-                        if ok:
-                            exitosas_msisdns.append(msisdn)
-                            # Persistir inmediatamente
-                            try:
-                                await _apply_topup_to_sim_detalle(
-                                    db,
-                                    msisdn=msisdn,
-                                    winred_product_id=_as_str(product_id),
-                                )
-                            except Exception as e:
-                                print("⚠️ Persistencia sim_detalle fallida:", e)
-
-                            # Evento de éxito
-                            yield f"data: {json.dumps({'type': 'success', 'msisdn': msisdn, 'index': index, 'total': len(sims)})}\n\n"
-                        else:
-                            msg = resp.get("result", {}).get("message") or resp.get("message")
-                            fallidas.append({"msisdn": msisdn, "resp": resp})
-                            # Evento de error
-                            yield f"data: {json.dumps({'type': 'error', 'msisdn': msisdn, 'error': msg, 'index': index, 'total': len(sims)})}\n\n"
-
-                    except Exception as e:
-                        fallidas.append({"msisdn": msisdn, "error": str(e)})
-                        # Evento de error
-                        yield f"data: {json.dumps({'type': 'error', 'msisdn': msisdn, 'error': str(e), 'index': index, 'total': len(sims)})}\n\n"
-
-                    await asyncio.sleep(0.1)
-
-                # Homologación a Siigo (igual que topup_lote)
-                q = await db.execute(
-                    select(PlanHomologacion.siigo_code).where(PlanHomologacion.winred_product_id == str(product_id))
-                )
-                row = q.first()
-                siigo_code = row[0] if row else None
-
-                if exitosas_msisdns and siigo_code:
-                    await db.execute(
-                        update(SimDetalle)
-                        .where(SimDetalle.lote_id == str(lote_id), SimDetalle.numero_linea.in_(exitosas_msisdns))
-                        .values(
-                            plan_asignado=siigo_code,
-                            winred_product_id=str(product_id),
-                            fecha_ultima_recarga=func.now(),
-                        )
-                    )
-                if siigo_code:
-                    await db.execute(update(SimLote).where(SimLote.id == str(lote_id)).values(plan_asignado=siigo_code))
-                await db.commit()
-
-                # Evento de finalización
-                yield f"data: {json.dumps({'type': 'complete', 'successful': len(exitosas_msisdns), 'failed': len(fallidas), 'total': len(sims)})}\n\n"
-
-            except Exception as e:
-                yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
+        finally:
+            winred_topup.desuscribir(job_id, cola)
 
     return StreamingResponse(
         event_generator(),
@@ -631,6 +855,36 @@ async def topup_lote_stream(
         }
     )
 
+@router.get("/jobs/{job_id}")
+async def get_topup_job(job_id: UUID, db: AsyncSession = Depends(get_async_session)):
+    estado = await winred_topup.resumen(db, job_id)
+    if estado is None:
+        raise HTTPException(status_code=404, detail="Job no encontrado")
+    return estado
+
+@router.post("/jobs/{job_id}/reanudar")
+async def reanudar_topup_job(job_id: UUID, db: AsyncSession = Depends(get_async_session)):
+    """Reanuda un job interrumpido (p.ej. por una caída de Winred) desde la primera SIM pendiente."""
+    if await db.get(TopupJob, job_id) is None:
+        raise HTTPException(status_code=404, detail="Job no encontrado")
+    if not await winred_topup.reanudar(db, job_id, winred):
+        raise HTTPException(status_code=409, detail="Solo se pueden reanudar jobs interrumpidos")
+    return {"ok": True, "job_id": str(job_id)}
+
+@router.post("/jobs/{job_id}/verificar")
+async def resolver_verificar_topup_job(
+    job_id: UUID, body: ResolverVerificacionRequest, db: AsyncSession = Depends(get_async_session)
+):
+    """
+    Resuelve las SIMs 'verificar' de un job tras confirmarlas en Winred:
+    'exitosa' las da por recargadas, 'pendiente' las vuelve a enviar.
+    Sin posiciones se resuelven todas las del job.
+    """
+    resueltas = await winred_topup.resolver_verificacion(
+        db, job_id, body.resultado, winred, posiciones=body.posiciones
+    )
+    return {"ok": True, "job_id": str(job_id), "resueltas": resueltas}
+
 # ====== DEBUG ======
 @router.get("/debug/sign")
 async def debug_sign(product_parent_id: int = 1):
@@ -0,0 +1,115 @@
+"""
+Punto de entrada de producción: varios workers de la API.
+
+    python serve.py
+
+Con gunicorn instalado (Linux) lanza gunicorn con workers de uvicorn: kill -HUP al
+proceso maestro recarga los workers de forma ordenada (los viejos terminan sus
+peticiones en curso, hasta WEB_GRACEFUL_TIMEOUT segundos). Sin gunicorn usa el
+supervisor de múltiples procesos de uvicorn.
+
+uvicorn usa uvloop y httptools si están instalados (uvicorn[standard]).
+
+Variables:
+  WEB_WORKERS            procesos (por defecto uno por CPU, hasta los que caben en DB_MAX_CONNECTIONS)
+  WEB_HOST / WEB_PORT    0.0.0.0 / 8000
+  WEB_TIMEOUT            segundos sin respuesta antes de reiniciar un worker (gunicorn)
+  WEB_GRACEFUL_TIMEOUT   segundos para terminar peticiones en curso al recargar o detener
+  WEB_KEEPALIVE          segundos de keep-alive HTTP
+  WEB_MAX_REQUESTS       reinicia cada worker tras N peticiones (0 = nunca; gunicorn)
+  DB_MAX_CONNECTIONS     presupuesto total de conexiones a PostgreSQL, repartido entre workers (database.py)
+  MIGRATE_ON_START       aplica las migraciones de Alembic antes de lanzar los workers (true por defecto)
+"""
+
+import os
+import shutil
+import sys
+
+WEB_HOST = os.getenv("WEB_HOST", "0.0.0.0")
+WEB_PORT = int(os.getenv("WEB_PORT", "8000"))
+WEB_TIMEOUT = int(os.getenv("WEB_TIMEOUT", "120"))
+WEB_GRACEFUL_TIMEOUT = int(os.getenv("WEB_GRACEFUL_TIMEOUT", "30"))
+WEB_KEEPALIVE = int(os.getenv("WEB_KEEPALIVE", "5"))
+WEB_MAX_REQUESTS = int(os.getenv("WEB_MAX_REQUESTS", "0"))
+MIGRATE_ON_START = os.getenv("MIGRATE_ON_START", "true").lower() in ("1", "true", "yes")
+
+
+def _workers() -> int:
+    """
+    WEB_WORKERS si está definido; si no, uno por CPU sin pasar de los que caben en el
+    presupuesto de conexiones (en un contenedor os.cpu_count() es el del host).
+    """
+    from database import conexiones_por_worker, workers_maximos
+
+    presupuesto = int(os.getenv("DB_MAX_CONNECTIONS", "80"))
+    maximo = workers_maximos(presupuesto)
+    if os.getenv("WEB_WORKERS"):
+        workers = max(1, int(os.getenv("WEB_WORKERS")))
+        if workers > maximo:
+            print(f"⚠️ WEB_WORKERS={workers} necesita ~{workers * conexiones_por_worker()} conexiones "
+                  f"y DB_MAX_CONNECTIONS={presupuesto} alcanza para {maximo} workers")
+        return workers
+    return min(os.cpu_count() or 1, maximo)
+
+
+def _gunicorn(gunicorn_bin: str, workers: int):
+    args = [
+        gunicorn_bin,
+        "server:app",
+        "--worker-class", "uvicorn.workers.UvicornWorker",
+        "--workers", str(workers),
+        "--bind", f"{WEB_HOST}:{WEB_PORT}",
+        "--timeout", str(WEB_TIMEOUT),
+        "--graceful-timeout", str(WEB_GRACEFUL_TIMEOUT),
+        "--keep-alive", str(WEB_KEEPALIVE),
+        "--access-logfile", "-",
+    ]
+    if WEB_MAX_REQUESTS > 0:
+        # El jitter evita que todos los workers se reinicien a la vez
+        args += ["--max-requests", str(WEB_MAX_REQUESTS), "--max-requests-jitter", str(max(1, WEB_MAX_REQUESTS // 10))]
+    # exec: gunicorn queda como PID del contenedor y recibe las señales (TERM, HUP) directamente
+    os.execv(gunicorn_bin, args)
+
+
+def _uvicorn(workers: int):
+    import uvicorn
+
+    uvicorn.run(
+        "server:app",
+        host=WEB_HOST,
+        port=WEB_PORT,
+        workers=workers,
+        loop="auto",
+        http="auto",
+        proxy_headers=True,
+        timeout_keep_alive=WEB_KEEPALIVE,
+        timeout_graceful_shutdown=WEB_GRACEFUL_TIMEOUT,
+    )
+
+
+def main():
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+    # Una vez por despliegue, antes de los workers (que solo verifican la revisión al arrancar)
+    if MIGRATE_ON_START:
+        from utils.migraciones import upgrade_head
+
+        print("Aplicando migraciones (alembic upgrade head)...")
+        upgrade_head()
+
+    # Cada worker lo lee en database.py para dimensionar su pool de conexiones
+    workers = _workers()
+    os.environ["WEB_WORKERS"] = str(workers)
+    print(f"Iniciando API con {workers} workers en {WEB_HOST}:{WEB_PORT}")
+
+    gunicorn_bin = shutil.which("gunicorn")
+    if gunicorn_bin and sys.platform != "win32":
+        _gunicorn(gunicorn_bin, workers)
+    else:
+        _uvicorn(workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,8 @@
+from utils import startup_timing  # primero: mide el tiempo de los imports de la aplicación
 import os
 import uuid
-import aiohttp
 import json
-from datetime import datetime, timedelta
+from datetime import datetime
 from typing import List, Optional, Dict, Any
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
@@ -11,12 +11,21 @@ from dotenv import load_dotenv
 from database import engine, get_async_session
 from models import Base, User
 from services.sales import save_sale_to_db
-from fastapi import Depends, Response
+from fastapi import Depends, Response, Header
+from fastapi.responses import JSONResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from utils.auth_utils import get_current_user
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
 from jobs.esim_expiration_job import process_esim_expirations
+from jobs.idempotency_cleanup_job import purge_expired_idempotency_keys
+from jobs.siigo_contingencia_job import sync_pending_siigo_invoices
+from jobs.winred_topup_job import resume_orphan_topup_jobs
+from jobs.analytics_export_job import export_analytics
+from apscheduler.triggers.interval import IntervalTrigger
+from services import idempotency, homologacion, winred_topup, qr_pool, scheduler_leader, dashboard_cache, siigo_contingencia
+from services.siigo_contingencia import facturar_o_contingencia
+from utils import circuit_breaker, migraciones
 
 
 
@@ -52,9 +61,13 @@ from routes.auth import router as auth_router
 from routes.users import router as users_router
 from routes import roles
 from routes.turnos import router as turnos_router
-from routes.winred import router as winred_router
+from routes.winred import (
+    router as winred_router, winred as winred_client,
+    iniciar_listener_paquetes, detener_listener_paquetes,
+)
 from routes.devoluciones import router as devoluciones_router
-# from routes.esims import router as esims_router  # Temporalmente deshabilitado - requiere OpenCV
+from routes.contingencia import router as contingencia_router
+from routes.esims import router as esims_router  # OpenCV/PyMuPDF se cargan solo al extraer QRs
 
 print(f"🔍 Turnos router importado: {turnos_router}")
 print(f"🔍 Turnos router prefix: {turnos_router.prefix}")
@@ -72,8 +85,11 @@ app.include_router(turnos_router)
 print("✅ Turnos router incluido en la aplicación")
 app.include_router(winred_router, prefix="/api/winred", tags=["Winred"])
 app.include_router(devoluciones_router, prefix="/api/devoluciones", tags=["Devoluciones"])
-# app.include_router(esims_router, prefix="/api", tags=["eSIMs"])  # Temporalmente deshabilitado - requiere OpenCV
-# print("✅ eSIMs router incluido en la aplicación")
+app.include_router(contingencia_router, prefix="/api/contingencia", tags=["Contingencia"])
+app.include_router(esims_router, prefix="/api", tags=["eSIMs"])
+print("✅ eSIMs router incluido en la aplicación")
+
+startup_timing.marca("imports")
 
 
 
@@ -82,33 +98,131 @@ app.include_router(devoluciones_router, prefix="/api/devoluciones", tags=["Devol
 
 @app.on_event("startup")
 async def startup_event():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
-    print("Tablas verificadas o creadas")
-
-    # Configurar scheduler para jobs automáticos
+    # Las migraciones se aplican al desplegar (serve.py / alembic upgrade head); aquí solo se verifica la revisión
+    with startup_timing.etapa("esquema"):
+        if await migraciones.verificar_version(engine):
+            print("Esquema de la BD al día")
+        else:
+            print("⚠️ Esquema de la BD desactualizado: ejecute 'alembic upgrade head'")
+
+    # Mapa de homologación Winred -> Siigo en memoria (se recarga con NOTIFY plan_homologacion)
+    with startup_timing.etapa("homologacion"):
+        await homologacion.cargar()
+        await homologacion.iniciar_listener()
+
+    # Invalidación de la caché del dashboard (NOTIFY dashboard_cache desde ventas, devoluciones y turnos)
+    await dashboard_cache.iniciar_listener()
+
+    # Modo contingencia Siigo forzado (NOTIFY siigo_contingencia desde /api/contingencia/modo)
+    await siigo_contingencia.iniciar_listener()
+
+    # Cache de paquetes Winred (NOTIFY winred_packages desde DELETE /api/winred/packages/cache)
+    await iniciar_listener_paquetes()
+
+    # Recargas por lote que quedaron a medias (reinicio o caída del proceso anterior)
+    with startup_timing.etapa("topups_huerfanos"):
+        await resume_orphan_topup_jobs(winred_client)
+
+    # Configurar scheduler para jobs automáticos. Cada worker tiene su scheduler, pero los
+    # jobs solo se ejecutan en el líder (advisory lock en PostgreSQL, ver services/scheduler_leader.py)
+    await scheduler_leader.iniciar()
     scheduler = AsyncIOScheduler()
 
     # Job de vencimiento de eSIMs - ejecutar cada hora
     scheduler.add_job(
-        process_esim_expirations,
+        scheduler_leader.exclusivo('esim_expiration_job', process_esim_expirations),
         trigger=CronTrigger(hour='*'),  # Cada hora
         id='esim_expiration_job',
         name='Procesamiento automático de vencimientos de eSIMs',
         replace_existing=True
     )
 
-    scheduler.start()
-    print("✅ Scheduler iniciado - Job de vencimiento de eSIMs configurado (cada hora)")
+    # Limpieza de Idempotency-Keys vencidas - cada hora
+    scheduler.add_job(
+        scheduler_leader.exclusivo('idempotency_cleanup_job', purge_expired_idempotency_keys),
+        trigger=CronTrigger(hour='*', minute=30),
+        id='idempotency_cleanup_job',
+        name='Limpieza de Idempotency-Keys vencidas',
+        replace_existing=True
+    )
 
-    # Debug: Listar todas las rutas registradas
-    print("\n" + "="*80)
-    print("📋 RUTAS REGISTRADAS EN FASTAPI:")
-    print("="*80)
-    for route in app.routes:
-        if hasattr(route, 'path') and hasattr(route, 'methods'):
-            print(f"  {list(route.methods)[0] if route.methods else 'N/A':6} {route.path}")
-    print("="*80 + "\n")
+    # Envío a Siigo de las ventas en contingencia - cada 5 minutos
+    scheduler.add_job(
+        scheduler_leader.exclusivo('siigo_contingencia_job', sync_pending_siigo_invoices),
+        trigger=IntervalTrigger(minutes=int(os.getenv("SIIGO_SYNC_INTERVAL_MINUTES", "5"))),
+        id='siigo_contingencia_job',
+        name='Sincronización de ventas en contingencia con Siigo',
+        replace_existing=True,
+        max_instances=1,
+        coalesce=True
+    )
+
+    # Topup jobs de Winred huérfanos (otro worker se cayó) - cada minuto
+    scheduler.add_job(
+        scheduler_leader.exclusivo('winred_topup_resume_job', resume_orphan_topup_jobs),
+        trigger=IntervalTrigger(minutes=1),
+        args=[winred_client],
+        id='winred_topup_resume_job',
+        name='Reanudación de recargas Winred por lote huérfanas',
+        replace_existing=True,
+        max_instances=1,
+        coalesce=True
+    )
+
+    # Exportación a Parquet para el modo analítico del dashboard: completa de noche,
+    # incremental durante el día (mismo job_id: nunca se solapan)
+    if os.getenv("ANALYTICS_EXPORT_ENABLED", "false").lower() in ("1", "true", "yes"):
+        scheduler.add_job(
+            scheduler_leader.exclusivo('analytics_export_job', export_analytics),
+            trigger=CronTrigger(hour=int(os.getenv("ANALYTICS_EXPORT_HOUR", "2")), minute=0),
+            kwargs={"completo": True},
+            id='analytics_export_full',
+            name='Exportación analítica completa a Parquet',
+            replace_existing=True,
+            max_instances=1,
+            coalesce=True
+        )
+        incremental_minutes = int(os.getenv("ANALYTICS_INCREMENTAL_MINUTES", "15"))
+        if incremental_minutes > 0:
+            scheduler.add_job(
+                scheduler_leader.exclusivo('analytics_export_job', export_analytics),
+                trigger=IntervalTrigger(minutes=incremental_minutes),
+                kwargs={"completo": False},
+                id='analytics_export_incremental',
+                name='Exportación analítica incremental a Parquet',
+                replace_existing=True,
+                max_instances=1,
+                coalesce=True
+            )
+
+    scheduler.start()
+    startup_timing.marca("scheduler")
+    print("✅ Scheduler iniciado - Jobs de vencimiento de eSIMs, limpieza de Idempotency-Keys, contingencia Siigo y recargas Winred configurados")
+
+    # Debug: Listar todas las rutas registradas (LOG_ROUTES=1)
+    if os.getenv("LOG_ROUTES", "false").lower() in ("1", "true", "yes"):
+        print("\n" + "="*80)
+        print("📋 RUTAS REGISTRADAS EN FASTAPI:")
+        print("="*80)
+        for route in app.routes:
+            if hasattr(route, 'path') and hasattr(route, 'methods'):
+                print(f"  {list(route.methods)[0] if route.methods else 'N/A':6} {route.path}")
+        print("="*80 + "\n")
+
+    print(startup_timing.reporte())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # Cerrar la conexión del líder libera el lock para que otro worker tome los jobs
+    await scheduler_leader.detener()
+    await homologacion.detener_listener()
+    await dashboard_cache.detener_listener()
+    await siigo_contingencia.detener_listener()
+    await detener_listener_paquetes()
+    # Libera los topup jobs en curso para que otro worker (o el próximo arranque) los retome
+    await winred_topup.detener_workers()
+    # Procesos de extracción de QRs (solo existen si se usó la carga de PDFs de eSIMs)
+    qr_pool.shutdown()
 
 # Modelos
 class TaxItem(BaseModel):
@@ -133,91 +247,40 @@ class SaleRequest(BaseModel):
     customer_id: str
     customer_identification: str
 
-# Cliente Siigo
-class SiigoClient:
-    def __init__(self):
-        self.user = os.getenv("SIIGO_USER")
-        self.partner_id = os.getenv("SIIGO_PARTNER_ID")
-        self.api_url = os.getenv("SIIGO_API_URL")
-        self.access_key = os.getenv("SIIGO_KEY")
-        self.token = None
-        self.token_expires = None
-
-    
-
-    async def get_token(self):
-        if self.token and self.token_expires and datetime.now() < self.token_expires:
-            return self.token
-
-        try:
-            print("🔐 Obteniendo token de Siigo con /auth")
-
-            headers = {
-                "Content-Type": "application/json",
-                "Partner-Id": self.partner_id
-            }
-
-            payload = {
-                "username": self.user,
-                "access_key": self.access_key
-            }
-
-            async with aiohttp.ClientSession() as session:
-                async with session.post(f"{self.api_url}/auth", json=payload, headers=headers) as resp:
-                    print(f"🔄 Status de respuesta: {resp.status}")
-                    body = await resp.text()  # primero leemos el texto sin asumir JSON
-                    print("🧾 Respuesta cuerpo crudo:", body)
-
-                    if resp.status in [200, 201]:
-                        try:
-                            data = json.loads(body)
-                            self.token = data["access_token"]
-                            self.token_expires = datetime.now() + timedelta(seconds=data.get("expires_in", 86400))
-                            print("Token obtenido:", self.token[:10], "...")
-                            return self.token
-                        except Exception as json_err:
-                            raise Exception(f"Error parseando JSON del token: {json_err} — Body: {body}")
-                    else:
-                        raise Exception(f"Error HTTP al obtener token: {resp.status} — {body}")
-
-        except Exception as e:
-            print(f"⛔ Error en get_token(): {e}")
-            raise
-
-    async def make_request(self, method: str, endpoint: str, **kwargs):
-        token = await self.get_token()
-        headers = {
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "application/json",
-        "Partner-Id": self.partner_id
-    }
-
-        async with aiohttp.ClientSession() as session:
-            async with session.request(method, f"{self.api_url}{endpoint}", headers=headers, **kwargs) as resp:
-                if resp.status in [200, 201]:
-                    return await resp.json()
-                else:
-                    error_text = await resp.text()
-                    print("Error en respuesta Siigo:")
-                    print(f"Status: {resp.status}")
-                    print(f"Body: {error_text}")
-
-                    raise Exception(f"Siigo API error {resp.status}: {error_text}")
-
-siigo_client = SiigoClient()
 
 # Endpoint de salud
 @app.get("/api/health")
 async def health_check():
-    return {"status": "healthy", "timestamp": datetime.now().isoformat()}
+    breakers = circuit_breaker.snapshot()
+    degraded = any(b["state"] != "closed" for b in breakers.values())
+    return {
+        "status": "degraded" if degraded else "healthy",
+        "timestamp": datetime.now().isoformat(),
+        "upstreams": breakers,
+    }
 
 # Crear factura en Siigo
 @app.post("/api/sales/create_invoice")
 async def create_siigo_invoice(
     sale_data: SaleRequest,
     db: AsyncSession = Depends(get_async_session),
-    current_user: User = Depends(get_current_user)  # 👈 tomamos el usuario autenticado
+    current_user: User = Depends(get_current_user),  # 👈 tomamos el usuario autenticado
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
 ):
+    # Reintento de una factura ya emitida: se devuelve la respuesta original sin re-facturar en Siigo
+    req_hash = None
+    if idempotency_key:
+        req_hash = idempotency.request_hash(sale_data.model_dump())
+        previa = await idempotency.reservar(idempotency_key, current_user.id, "/api/sales/create_invoice", req_hash)
+        if previa is not None:
+            return JSONResponse(
+                status_code=previa["status_code"],
+                content=previa["response"],
+                headers={"Idempotent-Replayed": "true"},
+            )
+
+    response = None
+    guardada = False
     try:
         today = datetime.now().strftime("%Y-%m-%d")
 
@@ -263,23 +326,60 @@ async def create_siigo_invoice(
 
         print("📦 Enviando payload a Siigo:", json.dumps(invoice_payload, indent=2))
 
-        # 1) Crear factura en Siigo (sin user_id en el payload)
-        response = await siigo_client.make_request("POST", "/v1/invoices", json=invoice_payload)
-        siigo_invoice_id = str(response.get("number") or response.get("id"))
-
-        # 2) Guardar en la BD con el user_id del usuario autenticado 👇
-        await save_sale_to_db(
-            sale_data,
-            db,
-            siigo_invoice_id=siigo_invoice_id,
-            user_id=current_user.id  
-        )
-
-        return response
+        # 1) Crear factura en Siigo (sin user_id en el payload); si Siigo está caído o lento
+        #    la venta queda en contingencia y el worker la factura después
+        response, motivo_contingencia, siigo_incierto = await facturar_o_contingencia(invoice_payload)
+
+        if response is None:
+            venta = await save_sale_to_db(
+                sale_data,
+                db,
+                user_id=current_user.id,
+                es_contingencia=True,
+                siigo_payload=invoice_payload,
+                siigo_incierto=siigo_incierto,
+            )
+            response = {
+                "message": "Venta registrada en contingencia: la factura se enviará a Siigo al restablecerse el servicio",
+                "venta_id": str(venta.id),
+                "contingencia": True,
+                "motivo": motivo_contingencia,
+            }
+        else:
+            siigo_invoice_id = str(response.get("number") or response.get("id"))
+
+            # 2) Guardar en la BD con el user_id del usuario autenticado 👇
+            await save_sale_to_db(
+                sale_data,
+                db,
+                siigo_invoice_id=siigo_invoice_id,
+                user_id=current_user.id  
+            )
+        guardada = True
 
     except Exception as e:
         print(f"Error creando la factura en Siigo: {str(e)}")
+        if idempotency_key:
+            if response is not None and not response.get("contingencia"):
+                # La factura ya existe en Siigo: el reintento no debe volver a emitirla
+                await idempotency.completar(idempotency_key, current_user.id, "/api/sales/create_invoice", req_hash, 500, {"detail": str(e), "siigo": response})
+            else:
+                await idempotency.liberar(idempotency_key, current_user.id, "/api/sales/create_invoice")
         raise HTTPException(status_code=500, detail=str(e))
+    except BaseException:
+        # Cliente desconectado (CancelledError) o apagado del worker: la clave no queda en_curso
+        if idempotency_key:
+            if guardada:
+                await idempotency.completar(idempotency_key, current_user.id, "/api/sales/create_invoice", req_hash, 200, response)
+            elif response is not None:
+                await idempotency.completar(idempotency_key, current_user.id, "/api/sales/create_invoice", req_hash, 500, {"detail": "Solicitud cancelada tras emitir la factura en Siigo", "siigo": response})
+            else:
+                await idempotency.liberar(idempotency_key, current_user.id, "/api/sales/create_invoice")
+        raise
+
+    if idempotency_key:
+        await idempotency.completar(idempotency_key, current_user.id, "/api/sales/create_invoice", req_hash, 200, response)
+    return response
 
 
 if __name__ == "__main__":
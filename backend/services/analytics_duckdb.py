@@ -0,0 +1,107 @@
+"""
+Modo analítico de los reportes del dashboard: consultas sobre los Parquet con DuckDB.
+
+Con ANALYTICS_ENGINE=duckdb, ventas-ingresos, cierres-descuadres, devoluciones e
+inventarios-descuadres ejecutan su misma SQL sobre los archivos que genera
+services/analytics_export.py en lugar de PostgreSQL. Cada dataset se expone como una
+vista con el nombre de la tabla original, así la consulta no cambia (los parámetros
+:nombre se traducen a $nombre).
+
+Se usa PostgreSQL (comportamiento anterior) si:
+  - ANALYTICS_ENGINE no es duckdb o duckdb no está instalado;
+  - la exportación no cubre el rango pedido: la última es anterior al fin del rango y
+    además tiene más de ANALYTICS_MAX_LAG_MINUTES minutos;
+  - la consulta en DuckDB falla (p.ej. un dataset aún sin exportar).
+
+ANALYTICS_TIMEZONE debe coincidir con la zona horaria de la sesión de PostgreSQL: de ella
+dependen DATE(fecha) y la comparación de fechas sin zona.
+"""
+
+import asyncio
+import logging
+import os
+import re
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from services import analytics_export
+
+logger = logging.getLogger(__name__)
+
+ANALYTICS_ENGINE = os.getenv("ANALYTICS_ENGINE", "postgres").lower()
+ANALYTICS_MAX_LAG_MINUTES = int(os.getenv("ANALYTICS_MAX_LAG_MINUTES", "60"))
+ANALYTICS_TIMEZONE = os.getenv("ANALYTICS_TIMEZONE", "UTC")
+ANALYTICS_DUCKDB_THREADS = int(os.getenv("ANALYTICS_DUCKDB_THREADS", "2"))
+ANALYTICS_DUCKDB_MEMORY = os.getenv("ANALYTICS_DUCKDB_MEMORY", "512MB")
+
+FUENTE_POSTGRES = "postgres"
+FUENTE_DUCKDB = "duckdb"
+
+# :nombre de SQLAlchemy, sin confundirlo con los casts ::tipo
+_PARAM = re.compile(r"(?<![:\w]):([A-Za-z_]\w*)")
+
+
+def _exportacion_cubre(datasets: Iterable[str], hasta: Optional[datetime]) -> bool:
+    manifest = analytics_export.leer_manifest()
+    ahora = datetime.now(timezone.utc)
+    if hasta is not None and hasta.tzinfo is None:
+        hasta = hasta.astimezone()
+    for nombre in datasets:
+        exportado = manifest.get(nombre, {}).get("exportado_en")
+        if not exportado:
+            return False
+        exportado_en = datetime.fromisoformat(exportado)
+        al_dia = ahora - exportado_en <= timedelta(minutes=ANALYTICS_MAX_LAG_MINUTES)
+        if not al_dia and (hasta is None or exportado_en < hasta):
+            return False
+    return True
+
+
+def _ruta(nombre: str) -> str:
+    carpeta = os.path.join(analytics_export.ANALYTICS_DIR, nombre)
+    if analytics_export.DATASETS[nombre]["fecha"]:
+        ruta = os.path.join(carpeta, "dia=*", analytics_export.ARCHIVO)
+    else:
+        ruta = os.path.join(carpeta, analytics_export.ARCHIVO)
+    return ruta.replace("'", "''")
+
+
+def _consultar(sql: str, params: Dict[str, Any], datasets: Iterable[str]) -> List[Any]:
+    import duckdb
+
+    con = duckdb.connect(config={"threads": ANALYTICS_DUCKDB_THREADS, "memory_limit": ANALYTICS_DUCKDB_MEMORY})
+    try:
+        con.execute(f"SET TimeZone = '{ANALYTICS_TIMEZONE}'")
+        for nombre in datasets:
+            con.execute(f"CREATE VIEW {nombre} AS SELECT * FROM read_parquet('{_ruta(nombre)}')")
+
+        usados = set(_PARAM.findall(sql))
+        cursor = con.execute(_PARAM.sub(r"$\1", sql), {k: v for k, v in params.items() if k in usados})
+        Fila = namedtuple("Fila", [col[0] for col in cursor.description], rename=True)
+        return [Fila(*fila) for fila in cursor.fetchall()]
+    finally:
+        con.close()
+
+
+async def ejecutar(
+    db: AsyncSession,
+    sql: str,
+    params: Dict[str, Any],
+    datasets: Tuple[str, ...],
+    hasta: Optional[datetime] = None,
+) -> Tuple[Iterable[Any], str]:
+    """
+    Ejecuta una consulta de reporte en DuckDB si el modo analítico aplica, si no en
+    PostgreSQL. Devuelve (filas, fuente); las filas tienen acceso por atributo en ambos casos.
+    """
+    if ANALYTICS_ENGINE == FUENTE_DUCKDB and _exportacion_cubre(datasets, hasta):
+        try:
+            return await asyncio.to_thread(_consultar, sql, params, datasets), FUENTE_DUCKDB
+        except Exception as e:
+            logger.warning(f"Consulta analítica en DuckDB falló, se usa PostgreSQL: {e}")
+
+    return await db.execute(text(sql), params), FUENTE_POSTGRES
@@ -0,0 +1,369 @@
+"""
+Exportación de las tablas de reportes a Parquet (almacén columnar para analítica).
+
+Los endpoints de reportes del dashboard (ventas-ingresos, cierres-descuadres,
+devoluciones, inventarios-descuadres) agregan rangos amplios sobre la BD transaccional.
+Este módulo copia esas tablas a archivos Parquet bajo ANALYTICS_DIR para que
+services/analytics_duckdb.py los consulte con DuckDB sin tocar PostgreSQL.
+
+Estructura:
+  ANALYTICS_DIR/<dataset>/dia=AAAA-MM-DD/part.parquet   tablas de hechos, una partición por día
+  ANALYTICS_DIR/<dataset>/part.parquet                  tablas pequeñas o sin fecha (snapshot completo)
+  ANALYTICS_DIR/_manifest.json                          hora de la última exportación por dataset
+
+Modos:
+  - completo (job nocturno): reconstruye cada dataset en un directorio temporal y lo
+    reemplaza al final; recoge también cambios viejos (p.ej. una venta anulada semanas después);
+  - incremental (a demanda o cada ANALYTICS_INCREMENTAL_MINUTES): reescribe solo las
+    particiones desde el último día exportado menos ANALYTICS_LOOKBACK_DAYS días.
+
+Las filas se leen con un cursor del servidor (stream_results) en bloques de
+ANALYTICS_CHUNK_ROWS y se escriben bloque a bloque: la memoria no depende del tamaño
+de la tabla. Cada archivo se escribe con otro nombre y se renombra al terminar, así un
+lector nunca ve un Parquet a medio escribir.
+
+pyarrow es opcional: se importa al exportar, no al arrancar la API.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import shutil
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from uuid import uuid4
+
+from sqlalchemy import text
+
+from database import engine
+
+logger = logging.getLogger(__name__)
+
+ANALYTICS_DIR = os.getenv(
+    "ANALYTICS_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "storage", "analytics")
+)
+ANALYTICS_CHUNK_ROWS = int(os.getenv("ANALYTICS_CHUNK_ROWS", "20000"))
+ANALYTICS_LOOKBACK_DAYS = int(os.getenv("ANALYTICS_LOOKBACK_DAYS", "2"))
+
+MANIFEST = "_manifest.json"
+ARCHIVO = "part.parquet"
+
+# Tipos de columna -> tipo de Arrow (esquema fijo: todas las particiones iguales aunque
+# una columna venga vacía en un día)
+_TIPOS = {
+    "texto": lambda pa: pa.string(),
+    "entero": lambda pa: pa.int64(),
+    "decimal": lambda pa: pa.float64(),
+    "booleano": lambda pa: pa.bool_(),
+    "fecha_hora": lambda pa: pa.timestamp("us"),
+    "fecha_hora_tz": lambda pa: pa.timestamp("us", tz="UTC"),
+}
+
+# dataset -> columna de fecha que define la partición (None = snapshot completo) y
+# columnas (nombre, expresión SQL, tipo). Los UUID se exportan como texto y los montos
+# como float8: los reportes los devuelven como float. users no incluye credenciales.
+DATASETS: Dict[str, Dict[str, Any]] = {
+    "sales": {
+        "fecha": "created_at",
+        "columnas": [
+            ("id", "id::text", "texto"),
+            ("numero_consecutivo", "numero_consecutivo", "texto"),
+            ("payment_method", "payment_method", "texto"),
+            ("total", "total::float8", "decimal"),
+            ("created_at", "created_at", "fecha_hora"),
+            ("estado", "estado", "texto"),
+            ("es_contingencia", "es_contingencia", "booleano"),
+            ("user_id", "user_id", "entero"),
+        ],
+    },
+    "movimientos_caja": {
+        "fecha": "fecha",
+        "columnas": [
+            ("id", "id::text", "texto"),
+            ("turno_id", "turno_id::text", "texto"),
+            ("tipo", "tipo", "texto"),
+            ("monto", "monto::float8", "decimal"),
+            ("fecha", "fecha", "fecha_hora_tz"),
+            ("metodo_pago", "metodo_pago", "texto"),
+            ("sale_id", "sale_id::text", "texto"),
+        ],
+    },
+    "cierres_caja": {
+        "fecha": "fecha_cierre",
+        "columnas": [
+            ("id", "id::text", "texto"),
+            ("turno_id", "turno_id::text", "texto"),
+            ("fecha_cierre", "fecha_cierre", "fecha_hora_tz"),
+            ("total_ventas_electronicas", "total_ventas_electronicas::float8", "decimal"),
+            ("total_ventas_efectivo", "total_ventas_efectivo::float8", "decimal"),
+            ("total_ventas_datafono", "total_ventas_datafono::float8", "decimal"),
+            ("total_ventas_dollars", "total_ventas_dollars::float8", "decimal"),
+            ("efectivo_reportado", "efectivo_reportado::float8", "decimal"),
+            ("datafono_reportado", "datafono_reportado::float8", "decimal"),
+            ("dolares_reportado", "dolares_reportado::float8", "decimal"),
+            ("observaciones", "observaciones", "texto"),
+        ],
+    },
+    "devoluciones_sim": {
+        "fecha": "fecha_devolucion",
+        "columnas": [
+            ("id", "id::text", "texto"),
+            ("tipo_devolucion", "tipo_devolucion", "texto"),
+            ("sale_id", "sale_id::text", "texto"),
+            ("sim_defectuosa_id", "sim_defectuosa_id", "texto"),
+            ("sim_reemplazo_id", "sim_reemplazo_id", "texto"),
+            ("motivo", "motivo", "texto"),
+            ("fecha_devolucion", "fecha_devolucion", "fecha_hora_tz"),
+            ("user_id", "user_id", "entero"),
+            ("turno_id", "turno_id::text", "texto"),
+            ("monto_devuelto", "monto_devuelto::float8", "decimal"),
+            ("metodo_devolucion", "metodo_devolucion", "texto"),
+        ],
+    },
+    "inventario_sim_turno": {
+        "fecha": "fecha_registro",
+        "columnas": [
+            ("id", "id::text", "texto"),
+            ("turno_id", "turno_id::text", "texto"),
+            ("plan", "plan", "texto"),
+            ("cantidad_inicial_reportada", "cantidad_inicial_reportada", "entero"),
+            ("cantidad_final_reportada", "cantidad_final_reportada", "entero"),
+            ("cantidad_inicial_sistema", "cantidad_inicial_sistema", "entero"),
+            ("cantidad_final_sistema", "cantidad_final_sistema", "entero"),
+            ("diferencia_inicial", "diferencia_inicial", "entero"),
+            ("diferencia_final", "diferencia_final", "entero"),
+            ("fecha_registro", "fecha_registro", "fecha_hora_tz"),
+            ("fecha_cierre", "fecha_cierre", "fecha_hora_tz"),
+            ("observaciones_apertura", "observaciones_apertura", "texto"),
+            ("observaciones_cierre", "observaciones_cierre", "texto"),
+        ],
+    },
+    "sim_detalle": {
+        "fecha": None,
+        "columnas": [
+            ("id", "id", "texto"),
+            ("lote_id", "lote_id", "texto"),
+            ("numero_linea", "numero_linea", "texto"),
+            ("iccid", "iccid", "texto"),
+            ("estado", "estado::text", "texto"),
+            ("fecha_registro", "fecha_registro", "fecha_hora_tz"),
+            ("plan_asignado", "plan_asignado", "texto"),
+            ("vendida", "vendida", "booleano"),
+            ("fecha_venta", "fecha_venta", "fecha_hora_tz"),
+            ("venta_id", "venta_id", "texto"),
+        ],
+    },
+    # Dimensiones que usan los joins de cierres e inventarios
+    "turnos": {
+        "fecha": None,
+        "columnas": [
+            ("id", "id::text", "texto"),
+            ("numero_consecutivo", "numero_consecutivo", "entero"),
+            ("user_id", "user_id", "entero"),
+            ("fecha_apertura", "fecha_apertura", "fecha_hora_tz"),
+            ("fecha_cierre", "fecha_cierre", "fecha_hora_tz"),
+            ("estado", "estado", "texto"),
+        ],
+    },
+    "users": {
+        "fecha": None,
+        "columnas": [
+            ("id", "id", "entero"),
+            ("username", "username", "texto"),
+            ("full_name", "full_name", "texto"),
+        ],
+    },
+}
+
+
+# ---------- manifiesto ----------
+
+def leer_manifest() -> Dict[str, Any]:
+    try:
+        with open(os.path.join(ANALYTICS_DIR, MANIFEST), encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _guardar_manifest(manifest: Dict[str, Any]):
+    os.makedirs(ANALYTICS_DIR, exist_ok=True)
+    destino = os.path.join(ANALYTICS_DIR, MANIFEST)
+    tmp = f"{destino}.{uuid4().hex}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, default=str)
+    os.replace(tmp, destino)
+
+
+# ---------- escritura ----------
+
+def _esquema(pa, columnas):
+    return pa.schema([(nombre, _TIPOS[tipo](pa)) for nombre, _expr, tipo in columnas])
+
+
+class _Escritor:
+    """Escribe un Parquet por partición; cambia de archivo cuando cambia el día."""
+
+    def __init__(self, pa, pq, esquema, base: str):
+        self.pa, self.pq, self.esquema, self.base = pa, pq, esquema, base
+        self.writer = None
+        self.tmp = None
+        self.destino = None
+        self.particion = object()
+        self.particiones = 0
+
+    def escribir(self, particion: Optional[str], filas: List[Dict[str, Any]]):
+        if particion != self.particion:
+            self.cerrar()
+            carpeta = self.base if particion is None else os.path.join(self.base, f"dia={particion}")
+            os.makedirs(carpeta, exist_ok=True)
+            self.destino = os.path.join(carpeta, ARCHIVO)
+            self.tmp = f"{self.destino}.{uuid4().hex}.tmp"
+            self.writer = self.pq.ParquetWriter(self.tmp, self.esquema, compression="zstd")
+            self.particion = particion
+            self.particiones += 1
+        self.writer.write_table(self.pa.Table.from_pylist(filas, schema=self.esquema))
+
+    def cerrar(self):
+        if self.writer is not None:
+            self.writer.close()
+            os.replace(self.tmp, self.destino)
+            self.writer = None
+
+
+def _vaciar(escritor: _Escritor, bloque: List[Dict[str, Any]]):
+    # El bloque viene ordenado por día: un write por tramo del mismo día (_dia no está en el esquema)
+    inicio = 0
+    for i in range(1, len(bloque) + 1):
+        if i == len(bloque) or bloque[i]["_dia"] != bloque[inicio]["_dia"]:
+            escritor.escribir(bloque[inicio]["_dia"], bloque[inicio:i])
+            inicio = i
+
+
+def sql_exportacion(nombre: str, desde: Optional[date] = None) -> Tuple[str, Dict[str, Any]]:
+    """SELECT de un dataset (incremental desde 'desde'); check_query_plans.py verifica su plan."""
+    definicion = DATASETS[nombre]
+    col_fecha = definicion["fecha"]
+
+    select = ", ".join(f"{expr} AS {alias}" for alias, expr, _tipo in definicion["columnas"])
+    params: Dict[str, Any] = {}
+    if col_fecha:
+        select += f", coalesce({col_fecha}::date, DATE '1970-01-01')::text AS _dia"
+        sql = f"SELECT {select} FROM {nombre}"
+        if desde:
+            sql += f" WHERE {col_fecha} >= CAST(:desde AS date)"
+            params["desde"] = desde
+        # Mismo orden que _dia (NULLs al final) y aprovecha el índice de la columna de fecha
+        sql += f" ORDER BY {col_fecha}"
+    else:
+        sql = f"SELECT {select} FROM {nombre}"
+    return sql, params
+
+
+async def _exportar_dataset(pa, pq, nombre: str, desde: Optional[date], destino: str) -> Dict[str, Any]:
+    definicion = DATASETS[nombre]
+    col_fecha = definicion["fecha"]
+    esquema = _esquema(pa, definicion["columnas"])
+    sql, params = sql_exportacion(nombre, desde)
+
+    escritor = _Escritor(pa, pq, esquema, destino)
+    filas = 0
+    max_dia = None
+    try:
+        async with engine.connect() as conn:
+            result = await conn.stream(text(sql), params)
+            async for bloque in result.mappings().partitions(ANALYTICS_CHUNK_ROWS):
+                bloque = [dict(fila) for fila in bloque]
+                filas += len(bloque)
+                if col_fecha:
+                    max_dia = bloque[-1]["_dia"]
+                    await asyncio.to_thread(_vaciar, escritor, bloque)
+                else:
+                    await asyncio.to_thread(escritor.escribir, None, bloque)
+        if not col_fecha and escritor.particiones == 0:
+            # Tabla vacía: igual se deja el archivo con el esquema para que las consultas no fallen
+            await asyncio.to_thread(escritor.escribir, None, [])
+    finally:
+        escritor.cerrar()
+
+    return {"filas": filas, "particiones": escritor.particiones, "max_dia": max_dia}
+
+
+def _reemplazar_directorio(tmp: str, destino: str):
+    viejo = f"{destino}.old-{uuid4().hex}"
+    if os.path.exists(destino):
+        os.replace(destino, viejo)
+    os.replace(tmp, destino)
+    shutil.rmtree(viejo, ignore_errors=True)
+
+
+def _fusionar_particiones(tmp: str, carpeta: str, desde: date):
+    # Archivo a archivo con os.replace: un lector ve la partición vieja o la nueva, nunca ninguna
+    nuevas = set()
+    for particion in os.listdir(tmp):
+        os.makedirs(os.path.join(carpeta, particion), exist_ok=True)
+        os.replace(os.path.join(tmp, particion, ARCHIVO), os.path.join(carpeta, particion, ARCHIVO))
+        nuevas.add(particion)
+    # Días de la ventana que ya no tienen filas (p.ej. movimientos borrados) no quedan con datos viejos
+    for particion in os.listdir(carpeta):
+        if particion.startswith("dia=") and particion[4:] >= desde.isoformat() and particion not in nuevas:
+            shutil.rmtree(os.path.join(carpeta, particion), ignore_errors=True)
+
+
+async def exportar(completo: bool = False, datasets: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Exporta los datasets a Parquet (completo o incremental) y actualiza el manifiesto."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    nombres = datasets or list(DATASETS)
+    desconocidos = set(nombres) - set(DATASETS)
+    if desconocidos:
+        raise ValueError(f"Datasets desconocidos: {', '.join(sorted(desconocidos))}")
+
+    manifest = leer_manifest()
+    resumen = {}
+    for nombre in nombres:
+        inicio = time.monotonic()
+        carpeta = os.path.join(ANALYTICS_DIR, nombre)
+        previo = manifest.get(nombre, {})
+        con_fecha = DATASETS[nombre]["fecha"] is not None
+
+        if con_fecha and not completo and previo.get("max_dia") and os.path.isdir(carpeta):
+            desde = date.fromisoformat(previo["max_dia"]) - timedelta(days=ANALYTICS_LOOKBACK_DAYS)
+            tmp = f"{carpeta}.tmp-{uuid4().hex}"
+            try:
+                stats = await _exportar_dataset(pa, pq, nombre, desde, tmp)
+                os.makedirs(tmp, exist_ok=True)
+                await asyncio.to_thread(_fusionar_particiones, tmp, carpeta, desde)
+            finally:
+                shutil.rmtree(tmp, ignore_errors=True)
+            stats["max_dia"] = max(filter(None, [stats["max_dia"], previo["max_dia"]]))
+            modo = "incremental"
+        else:
+            # Sin exportación previa, snapshot o modo completo: se reconstruye y se reemplaza
+            desde = None
+            tmp = f"{carpeta}.tmp-{uuid4().hex}"
+            try:
+                stats = await _exportar_dataset(pa, pq, nombre, None, tmp)
+                os.makedirs(tmp, exist_ok=True)
+                await asyncio.to_thread(_reemplazar_directorio, tmp, carpeta)
+            finally:
+                shutil.rmtree(tmp, ignore_errors=True)
+            modo = "completo"
+
+        stats.update({
+            "modo": modo,
+            "desde": desde.isoformat() if desde else None,
+            "exportado_en": datetime.now(timezone.utc).isoformat(),
+            "segundos": round(time.monotonic() - inicio, 2),
+        })
+        manifest[nombre] = stats
+        # Se guarda dataset a dataset: si uno falla, los anteriores ya quedan registrados
+        _guardar_manifest(manifest)
+        resumen[nombre] = stats
+        logger.info(f"Analytics: {nombre} exportado ({modo}): {stats['filas']} filas, "
+                    f"{stats['particiones']} particiones, {stats['segundos']}s")
+
+    return resumen
@@ -0,0 +1,180 @@
+"""
+Almacén de blobs direccionado por contenido (imágenes y datos de QR de eSIMs).
+
+La clave es el sha256 del contenido: el mismo QR subido dos veces se guarda una sola vez
+y la fila de la BD solo guarda la clave (p.ej. "qr/3f2a...e9.png").
+
+Backends (BLOB_STORE):
+  - local (por defecto): archivos bajo BLOB_STORE_DIR, repartidos en subcarpetas por prefijo.
+  - s3: bucket BLOB_S3_BUCKET; BLOB_S3_ENDPOINT_URL permite usar MinIO u otro compatible.
+Ambos exponen la misma interfaz (put / get / exists / delete), así el local sirve de
+reemplazo de S3 en desarrollo.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+from typing import Optional
+from uuid import uuid4
+
+logger = logging.getLogger(__name__)
+
+BLOB_STORE = os.getenv("BLOB_STORE", "local").lower()
+BLOB_STORE_DIR = os.getenv(
+    "BLOB_STORE_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "storage", "blobs")
+)
+BLOB_S3_BUCKET = os.getenv("BLOB_S3_BUCKET", "")
+BLOB_S3_PREFIX = os.getenv("BLOB_S3_PREFIX", "")
+BLOB_S3_ENDPOINT_URL = os.getenv("BLOB_S3_ENDPOINT_URL") or None
+
+_EXTENSIONES = {
+    "image/png": "png",
+    "image/jpeg": "jpg",
+    "image/gif": "gif",
+    "image/webp": "webp",
+    "image/svg+xml": "svg",
+    "text/plain": "txt",
+}
+_CONTENT_TYPES = {ext: ct for ct, ext in _EXTENSIONES.items()}
+
+
+def clave_para(data: bytes, content_type: str, prefijo: str = "qr") -> str:
+    """Clave por contenido: {prefijo}/{sha256}.{ext}"""
+    ext = _EXTENSIONES.get(content_type, "bin")
+    return f"{prefijo}/{hashlib.sha256(data).hexdigest()}.{ext}"
+
+
+def content_type_de(key: str) -> str:
+    return _CONTENT_TYPES.get(key.rsplit(".", 1)[-1], "application/octet-stream")
+
+
+class BlobStore:
+    """Interfaz común (métodos async; los backends son síncronos y corren en hilos)."""
+
+    def _put(self, key: str, data: bytes, content_type: str):
+        raise NotImplementedError
+
+    def _get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def _exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+    def _delete(self, key: str):
+        raise NotImplementedError
+
+    async def put(self, key: str, data: bytes, content_type: str = "application/octet-stream"):
+        await asyncio.to_thread(self._put, key, data, content_type)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await asyncio.to_thread(self._get, key)
+
+    async def exists(self, key: str) -> bool:
+        return await asyncio.to_thread(self._exists, key)
+
+    async def delete(self, key: str):
+        await asyncio.to_thread(self._delete, key)
+
+    async def put_contenido(self, data: bytes, content_type: str, prefijo: str = "qr") -> str:
+        """Guarda por contenido (no reescribe si ya existe) y retorna la clave."""
+        key = clave_para(data, content_type, prefijo)
+        if not await self.exists(key):
+            await self.put(key, data, content_type)
+        return key
+
+
+class LocalBlobStore(BlobStore):
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, key: str) -> str:
+        carpeta, _, nombre = key.rpartition("/")
+        if ".." in key.split("/") or not nombre:
+            raise ValueError(f"Clave de blob inválida: {key}")
+        # qr/3f2a...png -> {root}/qr/3f/3f2a...png (evita carpetas con millones de archivos)
+        return os.path.join(self.root, carpeta, nombre[:2], nombre)
+
+    def _put(self, key: str, data: bytes, content_type: str):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Nombre único: dos solicitudes del mismo proceso pueden guardar el mismo contenido a la vez
+        tmp = f"{path}.{uuid4().hex}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+
+    def _get(self, key: str) -> Optional[bytes]:
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _exists(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    def _delete(self, key: str):
+        try:
+            os.unlink(self._path(key))
+        except FileNotFoundError:
+            pass
+
+
+class S3BlobStore(BlobStore):
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: Optional[str] = None):
+        import boto3  # solo si se usa S3
+
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.client = boto3.client("s3", endpoint_url=endpoint_url)
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def _put(self, key: str, data: bytes, content_type: str):
+        self.client.put_object(Bucket=self.bucket, Key=self._key(key), Body=data, ContentType=content_type)
+
+    def _get(self, key: str) -> Optional[bytes]:
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self._key(key))["Body"].read()
+        except self.client.exceptions.NoSuchKey:
+            return None
+
+    def _exists(self, key: str) -> bool:
+        from botocore.exceptions import ClientError
+
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+            return True
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+    def _delete(self, key: str):
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+
+
+_store: Optional[BlobStore] = None
+
+
+def get_blob_store() -> BlobStore:
+    """Backend configurado por BLOB_STORE (se crea al primer uso)."""
+    global _store
+    if _store is None:
+        if BLOB_STORE == "s3":
+            if not BLOB_S3_BUCKET:
+                raise RuntimeError("BLOB_STORE=s3 requiere BLOB_S3_BUCKET")
+            _store = S3BlobStore(BLOB_S3_BUCKET, BLOB_S3_PREFIX, BLOB_S3_ENDPOINT_URL)
+        else:
+            _store = LocalBlobStore(BLOB_STORE_DIR)
+        logger.info(f"Blob store: {type(_store).__name__}")
+    return _store
@@ -0,0 +1,311 @@
+"""
+Caché de respuestas de los endpoints del dashboard.
+
+Varios usuarios abren las mismas vistas (mismo rango de fechas) y cada llamada recalculaba
+los agregados. Ahora la respuesta se guarda con clave (endpoint, parámetros normalizados,
+alcance del usuario) durante DASHBOARD_CACHE_TTL_SECONDS:
+  - single-flight: peticiones iguales que llegan mientras se calcula esperan ese mismo
+    cálculo en lugar de lanzar otro (por proceso);
+  - invalidación por generación: cada endpoint depende de dominios (ventas, devoluciones,
+    turnos, sims: inventario de SIMs, lotes y eSIMs) y la clave incluye la generación actual de cada uno. Las escrituras llaman a
+    invalidar(db, ...), que envía NOTIFY dashboard_cache dentro de su transacción (se
+    entrega solo si hace commit); cada proceso lo escucha y sube la generación, así las
+    entradas viejas dejan de usarse y salen por TTL/LRU.
+
+Backends (DASHBOARD_CACHE):
+  - memoria (por defecto): LRU en el proceso, DASHBOARD_CACHE_MAX_ENTRIES entradas;
+  - redis: compartida entre procesos/réplicas (DASHBOARD_CACHE_REDIS_URL); las generaciones
+    también viven en Redis y cada evento se aplica una sola vez aunque lo reciban todos;
+  - off: sin caché.
+El backend en memoria tiene la misma interfaz que el de Redis y lo reemplaza en desarrollo.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from functools import wraps
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+from uuid import uuid4
+
+from sqlalchemy import text
+
+from database import DATABASE_URL
+
+log = logging.getLogger("dashboard_cache")
+
+DASHBOARD_CACHE = os.getenv("DASHBOARD_CACHE", "memoria").lower()
+DASHBOARD_CACHE_TTL_SECONDS = int(os.getenv("DASHBOARD_CACHE_TTL_SECONDS", "60"))
+DASHBOARD_CACHE_MAX_ENTRIES = int(os.getenv("DASHBOARD_CACHE_MAX_ENTRIES", "512"))
+DASHBOARD_CACHE_REDIS_URL = os.getenv("DASHBOARD_CACHE_REDIS_URL", "redis://localhost:6379/0")
+
+CHANNEL = "dashboard_cache"
+DOMINIOS = ("ventas", "devoluciones", "turnos", "sims")
+
+_PREFIJO_REDIS = "dashcache"
+
+
+# ---------- backends ----------
+
+class MemoriaLRU:
+    """LRU con vencimiento por entrada, en el proceso."""
+
+    def __init__(self, max_entradas: int):
+        self.max_entradas = max_entradas
+        self._datos: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._generaciones: Dict[str, int] = {d: 0 for d in DOMINIOS}
+
+    async def get(self, clave: str) -> Optional[Any]:
+        entrada = self._datos.get(clave)
+        if entrada is None:
+            return None
+        vence, valor = entrada
+        if vence < time.monotonic():
+            del self._datos[clave]
+            return None
+        self._datos.move_to_end(clave)
+        return valor
+
+    async def set(self, clave: str, valor: Any, ttl: int):
+        self._datos[clave] = (time.monotonic() + ttl, valor)
+        self._datos.move_to_end(clave)
+        while len(self._datos) > self.max_entradas:
+            self._datos.popitem(last=False)
+
+    async def generaciones(self, dominios: Iterable[str]) -> List[int]:
+        return [self._generaciones.get(d, 0) for d in dominios]
+
+    async def subir_generacion(self, dominio: str, evento: str):
+        self._generaciones[dominio] = self._generaciones.get(dominio, 0) + 1
+
+    def tamano(self) -> int:
+        return len(self._datos)
+
+
+class RedisCache:
+    """Caché compartida en Redis; los valores se guardan como JSON."""
+
+    def __init__(self, url: str):
+        import redis.asyncio as redis
+
+        self._redis = redis.from_url(url)
+
+    async def get(self, clave: str) -> Optional[Any]:
+        crudo = await self._redis.get(f"{_PREFIJO_REDIS}:r:{clave}")
+        return json.loads(crudo) if crudo is not None else None
+
+    async def set(self, clave: str, valor: Any, ttl: int):
+        from fastapi.encoders import jsonable_encoder
+
+        await self._redis.set(f"{_PREFIJO_REDIS}:r:{clave}", json.dumps(jsonable_encoder(valor)), ex=ttl)
+
+    async def generaciones(self, dominios: Iterable[str]) -> List[int]:
+        valores = await self._redis.mget([f"{_PREFIJO_REDIS}:gen:{d}" for d in dominios])
+        return [int(v or 0) for v in valores]
+
+    async def subir_generacion(self, dominio: str, evento: str):
+        # Todos los procesos reciben el NOTIFY; solo el primero que marca el evento incrementa
+        if await self._redis.set(f"{_PREFIJO_REDIS}:evt:{evento}", 1, nx=True, ex=3600):
+            await self._redis.incr(f"{_PREFIJO_REDIS}:gen:{dominio}")
+
+    def tamano(self) -> Optional[int]:
+        return None
+
+
+def _crear_backend():
+    if DASHBOARD_CACHE == "off":
+        return None
+    if DASHBOARD_CACHE == "redis":
+        return RedisCache(DASHBOARD_CACHE_REDIS_URL)
+    return MemoriaLRU(DASHBOARD_CACHE_MAX_ENTRIES)
+
+
+_backend = _crear_backend()
+_en_vuelo: Dict[str, asyncio.Future] = {}
+_stats = {"aciertos": 0, "fallos": 0, "compartidos": 0, "invalidaciones": 0}
+
+
+class _CalculoCancelado(Exception):
+    """La petición que calculaba se canceló: quien esperaba calcula por su cuenta."""
+
+
+def estado() -> Dict[str, Any]:
+    return {
+        "backend": DASHBOARD_CACHE,
+        "ttl_seconds": DASHBOARD_CACHE_TTL_SECONDS,
+        "entradas": _backend.tamano() if _backend else 0,
+        **_stats,
+    }
+
+
+# ---------- lectura ----------
+
+def _normalizar(params: Dict[str, Any]) -> str:
+    # user_id="5" y user_id=5 son la misma vista; los None no cuentan
+    return json.dumps({k: str(v) for k, v in sorted(params.items()) if v is not None}, sort_keys=True)
+
+
+async def _calcular(clave: str, calcular: Callable[[], Awaitable[Any]]) -> Any:
+    en_curso = _en_vuelo.get(clave)
+    if en_curso is not None:
+        try:
+            resultado = await asyncio.shield(en_curso)
+            _stats["compartidos"] += 1
+            return resultado
+        except _CalculoCancelado:
+            return await calcular()
+
+    futuro = asyncio.get_running_loop().create_future()
+    # Sin nadie esperando, la excepción no debe quedar como "never retrieved"
+    futuro.add_done_callback(lambda f: f.cancelled() or f.exception())
+    _en_vuelo[clave] = futuro
+    try:
+        resultado = await calcular()
+        futuro.set_result(resultado)
+        return resultado
+    except Exception as e:
+        futuro.set_exception(e)
+        raise
+    except BaseException:
+        futuro.set_exception(_CalculoCancelado())
+        raise
+    finally:
+        _en_vuelo.pop(clave, None)
+
+
+async def obtener(
+    endpoint: str,
+    params: Dict[str, Any],
+    alcance: str,
+    dominios: Tuple[str, ...],
+    calcular: Callable[[], Awaitable[Any]],
+) -> Any:
+    """Respuesta en caché o calculada (una sola vez aunque lleguen varias peticiones iguales)."""
+    if _backend is None:
+        return await calcular()
+
+    try:
+        generaciones = await _backend.generaciones(dominios)
+        base = f"{endpoint}|{_normalizar(params)}|{alcance}|{generaciones}"
+        clave = hashlib.sha1(base.encode()).hexdigest()
+        valor = await _backend.get(clave)
+    except Exception as e:
+        log.warning("Caché del dashboard no disponible (%s), se calcula sin caché", e)
+        return await calcular()
+
+    if valor is not None:
+        _stats["aciertos"] += 1
+        return valor
+
+    _stats["fallos"] += 1
+
+    async def calcular_y_guardar():
+        resultado = await calcular()
+        try:
+            await _backend.set(clave, resultado, DASHBOARD_CACHE_TTL_SECONDS)
+        except Exception as e:
+            log.warning("No se pudo guardar en la caché del dashboard: %s", e)
+        return resultado
+
+    return await _calcular(clave, calcular_y_guardar)
+
+
+def cacheado(endpoint: str, dominios: Tuple[str, ...]):
+    """
+    Decorador para endpoints del dashboard. La clave usa los parámetros de la petición
+    (sin db ni current_user) y el rol del usuario como alcance.
+    """
+    def decorador(func):
+        @wraps(func)
+        async def _endpoint(*args, **kwargs):
+            usuario = kwargs.get("current_user")
+            rol = getattr(getattr(usuario, "role", None), "name", None) or "-"
+            params = {k: v for k, v in kwargs.items() if k not in ("db", "current_user")}
+            db = kwargs.get("db")
+            if db is not None:
+                # Quien espera un cálculo en curso no debe retener la conexión de su petición
+                # (la que usó get_current_user): el cálculo puede necesitar conexiones del pool
+                await db.commit()
+            return await obtener(endpoint, params, rol, dominios, lambda: func(*args, **kwargs))
+
+        return _endpoint
+
+    return decorador
+
+
+# ---------- invalidación ----------
+
+async def invalidar(db, *dominios: str) -> None:
+    """
+    Marca como viejas las respuestas que dependen de estos dominios. Se entrega al hacer
+    commit la transacción de db (si hace rollback, no se invalida nada).
+    """
+    for dominio in dominios:
+        await db.execute(
+            text("SELECT pg_notify(:canal, :payload)"),
+            {"canal": CHANNEL, "payload": f"{dominio}:{uuid4().hex}"},
+        )
+
+
+async def _aplicar(payload: str):
+    dominio, _, evento = payload.partition(":")
+    if _backend is None or dominio not in DOMINIOS:
+        return
+    try:
+        await _backend.subir_generacion(dominio, evento or uuid4().hex)
+        _stats["invalidaciones"] += 1
+    except Exception as e:
+        log.error("No se pudo invalidar la caché del dashboard (%s): %s", dominio, e)
+
+
+def _asyncpg_dsn() -> str:
+    return DATABASE_URL.replace("postgresql+asyncpg://", "postgresql://", 1)
+
+
+async def _escuchar():
+    import asyncpg
+
+    while True:
+        conn = None
+        try:
+            conn = await asyncpg.connect(_asyncpg_dsn())
+            cerrada = asyncio.Event()
+            conn.add_termination_listener(lambda _c: cerrada.set())
+            await conn.add_listener(CHANNEL, lambda _c, _pid, _canal, payload: asyncio.create_task(_aplicar(payload)))
+            # Al (re)conectar se invalida todo: pudo haber escrituras mientras no escuchábamos
+            for dominio in DOMINIOS:
+                await _aplicar(f"{dominio}:{uuid4().hex}")
+            log.info("Escuchando NOTIFY %s", CHANNEL)
+            await cerrada.wait()
+            log.warning("Conexión LISTEN %s cerrada, reconectando", CHANNEL)
+        except asyncio.CancelledError:
+            break
+        except Exception as e:
+            log.error("LISTEN %s falló: %s", CHANNEL, e)
+        finally:
+            if conn is not None and not conn.is_closed():
+                await conn.close()
+        await asyncio.sleep(5)
+
+
+_listener_task: Optional[asyncio.Task] = None
+
+
+async def iniciar_listener():
+    global _listener_task
+    if _backend is not None and (_listener_task is None or _listener_task.done()):
+        _listener_task = asyncio.create_task(_escuchar())
+
+
+async def detener_listener():
+    global _listener_task
+    if _listener_task is not None:
+        _listener_task.cancel()
+        try:
+            await _listener_task
+        except asyncio.CancelledError:
+            pass
+        _listener_task = None
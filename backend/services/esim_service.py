@@ -2,18 +2,77 @@
 Servicio de lógica de negocio para gestión de eSIMs
 """
 
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Tuple
 from datetime import datetime, timedelta
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func, and_, or_
-from sqlalchemy.orm import selectinload
+from sqlalchemy import select, update, func, and_, or_, case
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import selectinload, with_expression
+import asyncio
+import base64
+import binascii
 import logging
+import os
 
 from models import ESim, ESimStatus, Sale
-from uuid import UUID
+from services import dashboard_cache
+from services.blob_store import get_blob_store, content_type_de
+from uuid import UUID, uuid4
 
 logger = logging.getLogger(__name__)
 
+BLOB_BULK_CONCURRENCY = int(os.getenv("BLOB_BULK_CONCURRENCY", "16"))
+
+
+def _select_esims():
+    """select(ESim) que además indica si la fila legada tiene QR en qr_code_data (has_qr)."""
+    return select(ESim).options(with_expression(ESim.qr_legado, ESim.qr_code_data.isnot(None)))
+
+
+def qr_a_bytes(qr_code_data: str) -> Tuple[bytes, str]:
+    """
+    Convierte el QR recibido por la API al contenido a guardar:
+    data URL (data:image/png;base64,...) -> bytes de la imagen; texto (LPA:...) -> UTF-8
+    """
+    if qr_code_data.startswith("data:") and ";base64," in qr_code_data:
+        cabecera, datos = qr_code_data.split(",", 1)
+        try:
+            return base64.b64decode(datos, validate=True), cabecera[5:].split(";", 1)[0] or "application/octet-stream"
+        except (binascii.Error, ValueError):
+            pass
+    return qr_code_data.encode("utf-8"), "text/plain"
+
+
+def bytes_a_qr(data: bytes, content_type: str) -> str:
+    """Inverso de qr_a_bytes: texto tal cual, imágenes como data URL"""
+    if content_type == "text/plain":
+        return data.decode("utf-8")
+    return f"data:{content_type};base64,{base64.b64encode(data).decode('ascii')}"
+
+
+async def guardar_qr(qr_code_data: Optional[str]) -> Optional[str]:
+    """Guarda el QR en el blob store (deduplicado por hash) y retorna la clave"""
+    if not qr_code_data:
+        return None
+    data, content_type = qr_a_bytes(qr_code_data)
+    return await get_blob_store().put_contenido(data, content_type, prefijo="qr")
+
+
+async def guardar_qrs(qrs: List[Optional[str]]) -> List[Optional[str]]:
+    """
+    guardar_qr para un lote: cada contenido distinto se sube una sola vez y
+    hasta BLOB_BULK_CONCURRENCY en paralelo (no toca la BD).
+    """
+    distintos = {qr for qr in qrs if qr}
+    semaforo = asyncio.Semaphore(BLOB_BULK_CONCURRENCY)
+
+    async def _uno(qr: str) -> Tuple[str, Optional[str]]:
+        async with semaforo:
+            return qr, await guardar_qr(qr)
+
+    claves = dict(await asyncio.gather(*(_uno(qr) for qr in distintos)))
+    return [claves.get(qr) if qr else None for qr in qrs]
+
 
 class ESimService:
     """Servicio para gestión de eSIMs"""
@@ -42,7 +101,7 @@ class ESimService:
         Returns:
             Lista de eSIMs
         """
-        query = select(ESim)
+        query = _select_esims()
 
         # Aplicar filtros
         conditions = []
@@ -74,22 +133,53 @@ class ESimService:
 
     async def get_esim_by_id(self, esim_id: UUID) -> Optional[ESim]:
         """Obtiene una eSIM por ID"""
-        query = select(ESim).where(ESim.id == esim_id)
+        query = _select_esims().where(ESim.id == esim_id)
         result = await self.db.execute(query)
         return result.scalar_one_or_none()
 
     async def get_esim_by_iccid(self, iccid: str) -> Optional[ESim]:
         """Obtiene una eSIM por ICCID"""
-        query = select(ESim).where(ESim.iccid == iccid)
+        query = _select_esims().where(ESim.iccid == iccid)
         result = await self.db.execute(query)
         return result.scalar_one_or_none()
 
     async def get_esim_by_numero(self, numero: str) -> Optional[ESim]:
         """Obtiene una eSIM por número de teléfono"""
-        query = select(ESim).where(ESim.numero_telefono == numero)
+        query = _select_esims().where(ESim.numero_telefono == numero)
         result = await self.db.execute(query)
         return result.scalar_one_or_none()
 
+    async def get_qr(self, esim: ESim) -> Optional[Tuple[bytes, str]]:
+        """
+        Contenido del QR de una eSIM como (bytes, content_type).
+        Lee del blob store; para filas legadas lee la columna qr_code_data.
+        """
+        if esim.qr_blob_key:
+            data = await get_blob_store().get(esim.qr_blob_key)
+            if data is None:
+                logger.warning(f"Blob de QR no encontrado: {esim.qr_blob_key} (eSIM {esim.iccid})")
+                return None
+            return data, content_type_de(esim.qr_blob_key)
+
+        legado = (await self.db.execute(select(ESim.qr_code_data).where(ESim.id == esim.id))).scalar()
+        return qr_a_bytes(legado) if legado else None
+
+    async def get_qr_code_data_bulk(self, esims: List[ESim]) -> Dict[UUID, Optional[str]]:
+        """QR de varias eSIMs en formato API (texto o data URL); solo cuando se pide explícitamente"""
+        store = get_blob_store()
+        con_blob = [e for e in esims if e.qr_blob_key]
+        contenidos = await asyncio.gather(*(store.get(e.qr_blob_key) for e in con_blob))
+        resultado: Dict[UUID, Optional[str]] = {
+            e.id: bytes_a_qr(data, content_type_de(e.qr_blob_key)) if data is not None else None
+            for e, data in zip(con_blob, contenidos)
+        }
+
+        legados = [e.id for e in esims if not e.qr_blob_key]
+        if legados:
+            rows = await self.db.execute(select(ESim.id, ESim.qr_code_data).where(ESim.id.in_(legados)))
+            resultado.update({row.id: row.qr_code_data for row in rows})
+        return resultado
+
     async def create_esim(
         self,
         iccid: str,
@@ -114,50 +204,110 @@ class ESimService:
         esim = ESim(
             iccid=iccid,
             numero_telefono=numero_telefono,
-            qr_code_data=qr_code_data,
+            qr_blob_key=await guardar_qr(qr_code_data),
             operador=operador,
             estado=ESimStatus.disponible,
             observaciones=observaciones
         )
 
         self.db.add(esim)
+        await dashboard_cache.invalidar(self.db, "sims")
         await self.db.commit()
         await self.db.refresh(esim)
 
         logger.info(f"eSIM creada: {iccid}")
         return esim
 
-    async def create_esims_bulk(self, esims_data: List[Dict]) -> List[ESim]:
+    async def create_esims_bulk(self, esims_data: List[Dict]) -> Tuple[List[ESim], List[Dict]]:
         """
         Crea múltiples eSIMs en una operación
 
+        Los duplicados (ICCID o número ya registrados, o repetidos dentro del lote) se
+        detectan con una sola consulta previa y se omiten en vez de abortar el lote;
+        las filas válidas se insertan con un INSERT multi-fila ... RETURNING.
+
         Args:
             esims_data: Lista de diccionarios con datos de eSIMs
 
         Returns:
-            Lista de eSIMs creadas
+            (eSIMs creadas, omitidas como [{iccid, numero_telefono, motivo}])
         """
-        esims = []
-        for data in esims_data:
-            esim = ESim(
-                iccid=data['iccid'],
-                numero_telefono=data['numero_telefono'],
-                qr_code_data=data.get('qr_code_data'),
-                operador=data.get('operador'),
-                estado=ESimStatus.disponible,
-                observaciones=data.get('observaciones')
-            )
-            esims.append(esim)
-            self.db.add(esim)
+        if not esims_data:
+            return [], []
 
+        omitidas: List[Dict] = []
+
+        def _omitir(data: Dict, motivo: str):
+            omitidas.append({
+                'iccid': data['iccid'],
+                'numero_telefono': data['numero_telefono'],
+                'motivo': motivo
+            })
+
+        # Una consulta para todos los ICCID y números del lote
+        result = await self.db.execute(
+            select(ESim.iccid, ESim.numero_telefono).where(
+                or_(
+                    ESim.iccid.in_({d['iccid'] for d in esims_data}),
+                    ESim.numero_telefono.in_({d['numero_telefono'] for d in esims_data})
+                )
+            )
+        )
+        iccids_bd = set()
+        numeros_bd = set()
+        for iccid, numero in result.all():
+            iccids_bd.add(iccid)
+            numeros_bd.add(numero)
+
+        validas = []
+        iccids_lote = set()
+        numeros_lote = set()
+        for data in esims_data:
+            if data['iccid'] in iccids_bd:
+                _omitir(data, 'ICCID ya registrado')
+            elif data['numero_telefono'] in numeros_bd:
+                _omitir(data, 'Número ya registrado')
+            elif data['iccid'] in iccids_lote or data['numero_telefono'] in numeros_lote:
+                _omitir(data, 'Repetido en el lote')
+            else:
+                validas.append(data)
+                iccids_lote.add(data['iccid'])
+                numeros_lote.add(data['numero_telefono'])
+
+        if not validas:
+            return [], omitidas
+
+        claves = await guardar_qrs([d.get('qr_code_data') for d in validas])
+        filas = [
+            {
+                'id': uuid4(),
+                'iccid': data['iccid'],
+                'numero_telefono': data['numero_telefono'],
+                'qr_blob_key': clave,
+                'operador': data.get('operador'),
+                'estado': ESimStatus.disponible,
+                'observaciones': data.get('observaciones'),
+                'historial_regeneraciones': 0
+            }
+            for data, clave in zip(validas, claves)
+        ]
+
+        # ON CONFLICT DO NOTHING cubre lo insertado por otra petición entre la consulta y el INSERT
+        result = await self.db.scalars(
+            pg_insert(ESim).on_conflict_do_nothing().returning(ESim),
+            filas
+        )
+        esims = list(result.all())
+        await dashboard_cache.invalidar(self.db, "sims")
         await self.db.commit()
 
-        # Refresh all
-        for esim in esims:
-            await self.db.refresh(esim)
+        creadas = {esim.iccid for esim in esims}
+        for data in validas:
+            if data['iccid'] not in creadas:
+                _omitir(data, 'ICCID o número ya registrado')
 
-        logger.info(f"{len(esims)} eSIMs creadas en bulk")
-        return esims
+        logger.info(f"{len(esims)} eSIMs creadas en bulk ({len(omitidas)} omitidas)")
+        return esims, omitidas
 
     async def vender_esim(
         self,
@@ -194,6 +344,7 @@ class ESimService:
         esim.plan_nombre = plan_nombre
         esim.fecha_vencimiento = datetime.utcnow() + timedelta(days=plan_dias)
 
+        await dashboard_cache.invalidar(self.db, "sims")
         await self.db.commit()
         await self.db.refresh(esim)
 
@@ -221,7 +372,8 @@ class ESimService:
             raise ValueError(f"eSIM {esim_id} no encontrada")
 
         # Actualizar QR y estado
-        esim.qr_code_data = nuevo_qr_data
+        esim.qr_blob_key = await guardar_qr(nuevo_qr_data)
+        esim.qr_code_data = None
         esim.estado = ESimStatus.disponible
         esim.historial_regeneraciones += 1
         esim.ultima_regeneracion = datetime.utcnow()
@@ -239,45 +391,56 @@ class ESimService:
         logger.info(f"QR regenerado para eSIM: {esim.iccid} (regeneración #{esim.historial_regeneraciones})")
         return esim
 
-    async def regenerar_qrs_bulk(self, regeneraciones: List[Dict]) -> List[ESim]:
+    async def regenerar_qrs_bulk(self, regeneraciones: List[Dict]) -> Tuple[List[ESim], List[UUID]]:
         """
         Regenera múltiples QRs en una operación
 
+        Un solo UPDATE ... RETURNING (la clave de cada eSIM con CASE por id);
+        los ids inexistentes se reportan en vez de abortar el lote.
+
         Args:
             regeneraciones: Lista de dicts con {esim_id, qr_data}
 
         Returns:
-            Lista de eSIMs actualizadas
+            (eSIMs actualizadas, ids no encontrados)
         """
-        esims_actualizadas = []
-
-        for reg in regeneraciones:
-            esim_id = reg['esim_id']
-            nuevo_qr = reg['qr_data']
-
-            esim = await self.get_esim_by_id(esim_id)
-            if esim:
-                esim.qr_code_data = nuevo_qr
-                esim.estado = ESimStatus.disponible
-                esim.historial_regeneraciones += 1
-                esim.ultima_regeneracion = datetime.utcnow()
-
+        if not regeneraciones:
+            return [], []
+
+        # Si un id viene repetido gana el último QR
+        nuevos_qrs = {reg['esim_id']: reg['qr_data'] for reg in regeneraciones}
+        ids = list(nuevos_qrs)
+        claves = dict(zip(ids, await guardar_qrs([nuevos_qrs[i] for i in ids])))
+
+        result = await self.db.scalars(
+            update(ESim)
+            .where(ESim.id.in_(ids))
+            .values(
+                qr_blob_key=case(claves, value=ESim.id),
+                qr_code_data=None,
+                estado=ESimStatus.disponible,
+                historial_regeneraciones=ESim.historial_regeneraciones + 1,
+                ultima_regeneracion=func.now(),
                 # Limpiar información de venta
-                esim.sale_id = None
-                esim.fecha_venta = None
-                esim.fecha_vencimiento = None
-                esim.plan_dias = None
-                esim.plan_nombre = None
-
-                esims_actualizadas.append(esim)
-
+                sale_id=None,
+                fecha_venta=None,
+                fecha_vencimiento=None,
+                plan_dias=None,
+                plan_nombre=None
+            )
+            .returning(ESim)
+            .execution_options(synchronize_session=False, populate_existing=True)
+        )
+        esims_actualizadas = list(result.all())
         await self.db.commit()
 
-        for esim in esims_actualizadas:
-            await self.db.refresh(esim)
+        actualizados = {esim.id for esim in esims_actualizadas}
+        no_encontrados = [i for i in ids if i not in actualizados]
 
-        logger.info(f"{len(esims_actualizadas)} eSIMs regeneradas en bulk")
-        return esims_actualizadas
+        logger.info(
+            f"{len(esims_actualizadas)} eSIMs regeneradas en bulk ({len(no_encontrados)} no encontradas)"
+        )
+        return esims_actualizadas, no_encontrados
 
     async def marcar_vencida(self, esim_id: UUID) -> ESim:
         """
@@ -296,6 +459,7 @@ class ESimService:
 
         esim.estado = ESimStatus.vencida
 
+        await dashboard_cache.invalidar(self.db, "sims")
         await self.db.commit()
         await self.db.refresh(esim)
 
@@ -304,56 +468,58 @@ class ESimService:
 
     async def procesar_vencimientos_automaticos(self) -> int:
         """
-        Procesa todas las eSIMs vendidas que ya vencieron
-        y las marca como vencidas
+        Marca como vencidas todas las eSIMs vendidas cuya fecha de vencimiento ya pasó,
+        con un solo UPDATE (usa el índice parcial ix_esims_vendidas_vencimiento)
 
         Returns:
             Número de eSIMs procesadas
         """
-        now = datetime.utcnow()
-
-        # Buscar eSIMs vendidas con fecha de vencimiento <= ahora
-        query = select(ESim).where(
-            and_(
+        result = await self.db.execute(
+            update(ESim)
+            .where(
                 ESim.estado == ESimStatus.vendida,
-                ESim.fecha_vencimiento <= now
+                ESim.fecha_vencimiento <= func.now()
             )
+            .values(estado=ESimStatus.vencida, updated_at=func.now())
+            .returning(ESim.id)
+            .execution_options(synchronize_session=False)
         )
-
-        result = await self.db.execute(query)
-        esims_vencidas = result.scalars().all()
-
-        count = 0
-        for esim in esims_vencidas:
-            esim.estado = ESimStatus.vencida
-            count += 1
-            logger.info(f"eSIM auto-vencida: {esim.iccid}")
+        count = len(result.scalars().all())
 
         if count > 0:
+            await dashboard_cache.invalidar(self.db, "sims")
             await self.db.commit()
 
         logger.info(f"Procesamiento automático: {count} eSIMs marcadas como vencidas")
         return count
 
-    async def get_esims_proximas_a_vencer(self, dias: int = 3) -> List[ESim]:
+    def _filtro_proximas_a_vencer(self, dias: int):
+        return and_(
+            ESim.estado == ESimStatus.vendida,
+            ESim.fecha_vencimiento.between(func.now(), func.now() + timedelta(days=dias))
+        )
+
+    async def contar_esims_proximas_a_vencer(self, dias: int = 3) -> int:
+        """Cantidad de eSIMs que vencerán en los próximos N días (COUNT, sin cargar filas)"""
+        query = select(func.count(ESim.id)).where(self._filtro_proximas_a_vencer(dias))
+        return (await self.db.execute(query)).scalar() or 0
+
+    async def get_esims_proximas_a_vencer(self, dias: int = 3, limit: Optional[int] = None) -> List[ESim]:
         """
         Obtiene eSIMs que vencerán en los próximos N días
 
         Args:
             dias: Número de días hacia adelante
+            limit: Máximo de eSIMs a retornar (las más próximas primero)
 
         Returns:
             Lista de eSIMs próximas a vencer
         """
-        now = datetime.utcnow()
-        fecha_limite = now + timedelta(days=dias)
-
-        query = select(ESim).where(
-            and_(
-                ESim.estado == ESimStatus.vendida,
-                ESim.fecha_vencimiento.between(now, fecha_limite)
-            )
+        query = _select_esims().where(
+            self._filtro_proximas_a_vencer(dias)
         ).order_by(ESim.fecha_vencimiento.asc())
+        if limit:
+            query = query.limit(limit)
 
         result = await self.db.execute(query)
         return list(result.scalars().all())
@@ -379,7 +545,7 @@ class ESimService:
         total = (await self.db.execute(query_total)).scalar()
 
         # eSIMs próximas a vencer
-        proximas_vencer = await self.get_esims_proximas_a_vencer(3)
+        proximas_vencer = await self.contar_esims_proximas_a_vencer(3)
 
         return {
             'total': total,
@@ -387,7 +553,7 @@ class ESimService:
             'vendidas': vendidas,
             'vencidas': vencidas,
             'inactivas': inactivas,
-            'proximas_a_vencer': len(proximas_vencer)
+            'proximas_a_vencer': proximas_vencer
         }
 
     async def update_esim(
@@ -415,6 +581,7 @@ class ESimService:
             if hasattr(esim, campo):
                 setattr(esim, campo, valor)
 
+        await dashboard_cache.invalidar(self.db, "sims")
         await self.db.commit()
         await self.db.refresh(esim)
 
@@ -439,6 +606,7 @@ class ESimService:
         # En lugar de eliminar, marcar como inactiva
         esim.estado = ESimStatus.inactiva
 
+        await dashboard_cache.invalidar(self.db, "sims")
         await self.db.commit()
 
         logger.info(f"eSIM marcada como inactiva: {esim.iccid}")
@@ -0,0 +1,118 @@
+"""
+Mapa en memoria winred_product_id -> siigo_code (tabla plan_homologacion).
+
+La tabla tiene pocas filas y casi nunca cambia, así que se carga al arrancar y
+las recargas se disparan por cambio:
+  - NOTIFY plan_homologacion (lo envían populate_plan_homologacion.py y el endpoint
+    de recarga); cada proceso lo escucha con una conexión asyncpg dedicada.
+  - Un product_id desconocido fuerza una recarga (como mucho una cada RELOAD_ON_MISS_SECONDS),
+    por si se perdió una notificación.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, Optional
+
+from sqlalchemy import select, text
+
+from database import SessionLocal, DATABASE_URL
+from models import PlanHomologacion
+
+log = logging.getLogger("homologacion")
+
+CHANNEL = "plan_homologacion"
+RELOAD_ON_MISS_SECONDS = int(os.getenv("HOMOLOGACION_RELOAD_ON_MISS_SECONDS", "60"))
+
+_map: Dict[str, Dict[str, object]] = {}
+_loaded_at: Optional[float] = None
+_load_lock = asyncio.Lock()
+
+_listener_task: Optional[asyncio.Task] = None
+
+
+async def cargar() -> int:
+    """(Re)carga el mapa completo desde la BD. Retorna la cantidad de planes."""
+    global _map, _loaded_at
+    async with _load_lock:
+        async with SessionLocal() as db:
+            rows = (await db.execute(select(PlanHomologacion))).scalars().all()
+        _map = {
+            str(r.winred_product_id): {
+                "siigo_code": r.siigo_code,
+                "operador": r.operador,
+                "nombre_winred": r.nombre_winred,
+                "activo": r.activo,
+            }
+            for r in rows
+        }
+        _loaded_at = time.monotonic()
+    log.info("Homologación cargada: %s planes", len(_map))
+    return len(_map)
+
+
+async def get_siigo_code(winred_product_id) -> Optional[str]:
+    """Código Siigo del paquete de Winred (None si no está homologado)."""
+    key = str(winred_product_id)
+    if _loaded_at is None or (key not in _map and time.monotonic() - _loaded_at > RELOAD_ON_MISS_SECONDS):
+        await cargar()
+    plan = _map.get(key)
+    return plan["siigo_code"] if plan else None
+
+
+def snapshot() -> Dict[str, Dict[str, object]]:
+    return dict(_map)
+
+
+async def notificar_cambio(db) -> None:
+    """Avisa a todos los procesos que recarguen (se entrega al hacer commit)."""
+    await db.execute(text("SELECT pg_notify(:canal, 'reload')"), {"canal": CHANNEL})
+
+
+# ---------- LISTEN ----------
+
+def _asyncpg_dsn() -> str:
+    return DATABASE_URL.replace("postgresql+asyncpg://", "postgresql://", 1)
+
+
+async def _escuchar():
+    import asyncpg
+
+    while True:
+        conn = None
+        try:
+            conn = await asyncpg.connect(_asyncpg_dsn())
+            cerrada = asyncio.Event()
+            conn.add_termination_listener(lambda _c: cerrada.set())
+            await conn.add_listener(CHANNEL, lambda *_args: asyncio.create_task(cargar()))
+            # Al (re)conectar se recarga: pudo haber cambios mientras no escuchábamos
+            await cargar()
+            log.info("Escuchando NOTIFY %s", CHANNEL)
+            await cerrada.wait()
+            log.warning("Conexión LISTEN %s cerrada, reconectando", CHANNEL)
+        except asyncio.CancelledError:
+            break
+        except Exception as e:
+            log.error("LISTEN %s falló: %s", CHANNEL, e)
+        finally:
+            if conn is not None and not conn.is_closed():
+                await conn.close()
+        await asyncio.sleep(5)
+
+
+async def iniciar_listener():
+    global _listener_task
+    if _listener_task is None or _listener_task.done():
+        _listener_task = asyncio.create_task(_escuchar())
+
+
+async def detener_listener():
+    global _listener_task
+    if _listener_task is not None:
+        _listener_task.cancel()
+        try:
+            await _listener_task
+        except asyncio.CancelledError:
+            pass
+        _listener_task = None
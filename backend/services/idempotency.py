@@ -0,0 +1,203 @@
+"""
+Soporte del header Idempotency-Key para endpoints de venta.
+
+Flujo:
+  1) reservar(): inserta la clave (INSERT ... ON CONFLICT). Si ya existía:
+       - completada  -> devuelve la respuesta original (no se re-ejecuta la venta ni se re-factura en Siigo)
+       - en_curso    -> 409 (el intento original sigue procesándose); pasados
+                        IDEMPOTENCY_LEASE_SECONDS se considera abandonada (proceso caído)
+                        y el reintento la toma
+       - otro cuerpo -> 422 (la clave se reusó con una venta distinta)
+  2) completar(): guarda status + respuesta y la deja en un cache en memoria.
+  3) liberar(): si la venta falló (o se canceló), borra la clave para que el reintento
+     vuelva a ejecutarse.
+
+Las operaciones usan su propia sesión para no mezclarse con la transacción de la venta.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import select, delete, update, func, and_, or_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from database import SessionLocal
+from models import IdempotencyKey
+
+log = logging.getLogger("idempotency")
+
+IDEMPOTENCY_TTL_HOURS = int(os.getenv("IDEMPOTENCY_TTL_HOURS", "24"))
+# Una venta tarda como mucho el timeout de Siigo en caja más el guardado: una clave en_curso
+# más vieja que esto quedó de un intento que murió sin liberarla
+IDEMPOTENCY_LEASE_SECONDS = int(os.getenv("IDEMPOTENCY_LEASE_SECONDS", "120"))
+_CACHE_MAX = int(os.getenv("IDEMPOTENCY_CACHE_MAX", "2048"))
+
+# (user_id, endpoint, key) -> (expira_epoch, request_hash, status_code, response)
+_cache: "OrderedDict[tuple, tuple[float, str, int, Any]]" = OrderedDict()
+
+
+def request_hash(payload: Any) -> str:
+    """sha256 estable del cuerpo de la solicitud."""
+    raw = json.dumps(payload, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _cache_get(ck: tuple):
+    hit = _cache.get(ck)
+    if not hit:
+        return None
+    if hit[0] < time.time():
+        _cache.pop(ck, None)
+        return None
+    _cache.move_to_end(ck)
+    return hit
+
+
+def _cache_put(ck: tuple, req_hash: str, status_code: int, response: Any):
+    _cache[ck] = (time.time() + IDEMPOTENCY_TTL_HOURS * 3600, req_hash, status_code, response)
+    _cache.move_to_end(ck)
+    while len(_cache) > _CACHE_MAX:
+        _cache.popitem(last=False)
+
+
+def _check_hash(stored_hash: str, req_hash: str):
+    if stored_hash != req_hash:
+        raise HTTPException(
+            status_code=422,
+            detail="La Idempotency-Key ya se usó con una solicitud distinta",
+        )
+
+
+async def reservar(key: str, user_id: int, endpoint: str, req_hash: str) -> Optional[dict]:
+    """
+    Reserva la clave para esta solicitud.
+    Retorna None si el llamador debe ejecutar la operación, o
+    {"status_code", "response"} si ya se completó antes.
+    """
+    if not key or len(key) > 255:
+        raise HTTPException(status_code=400, detail="Idempotency-Key inválida (1 a 255 caracteres)")
+
+    ck = (user_id, endpoint, key)
+    hit = _cache_get(ck)
+    if hit:
+        _check_hash(hit[1], req_hash)
+        return {"status_code": hit[2], "response": hit[3]}
+
+    expires_at = datetime.now(timezone.utc) + timedelta(hours=IDEMPOTENCY_TTL_HOURS)
+
+    async with SessionLocal() as db:
+        # Inserta la clave; si existe pero ya venció (o quedó en_curso de un intento abandonado),
+        # se reutiliza (mismo statement)
+        stmt = pg_insert(IdempotencyKey).values(
+            key=key,
+            user_id=user_id,
+            endpoint=endpoint,
+            request_hash=req_hash,
+            estado="en_curso",
+            expires_at=expires_at,
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[IdempotencyKey.key, IdempotencyKey.user_id, IdempotencyKey.endpoint],
+            set_={
+                "request_hash": stmt.excluded.request_hash,
+                "estado": "en_curso",
+                "status_code": None,
+                "response": None,
+                "created_at": func.now(),
+                "expires_at": stmt.excluded.expires_at,
+            },
+            where=or_(
+                IdempotencyKey.expires_at < func.now(),
+                and_(
+                    IdempotencyKey.estado == "en_curso",
+                    IdempotencyKey.created_at < func.now() - timedelta(seconds=IDEMPOTENCY_LEASE_SECONDS),
+                ),
+            ),
+        ).returning(IdempotencyKey.key)
+
+        reservada = (await db.execute(stmt)).scalar_one_or_none()
+        await db.commit()
+        if reservada is not None:
+            return None
+
+        row = (await db.execute(
+            select(IdempotencyKey).where(
+                IdempotencyKey.key == key,
+                IdempotencyKey.user_id == user_id,
+                IdempotencyKey.endpoint == endpoint,
+            )
+        )).scalar_one_or_none()
+
+    if row is None:
+        # Se liberó entre el INSERT y el SELECT: que el cliente reintente
+        raise HTTPException(status_code=409, detail="Solicitud con esta Idempotency-Key en proceso, reintente")
+
+    _check_hash(row.request_hash, req_hash)
+
+    if row.estado != "completada":
+        raise HTTPException(
+            status_code=409,
+            detail="Solicitud con esta Idempotency-Key en proceso, reintente",
+            headers={"Retry-After": str(IDEMPOTENCY_LEASE_SECONDS)},
+        )
+
+    _cache_put(ck, row.request_hash, row.status_code, row.response)
+    return {"status_code": row.status_code, "response": row.response}
+
+
+async def completar(key: str, user_id: int, endpoint: str, req_hash: str, status_code: int, response: Any):
+    """Guarda la respuesta de la operación para devolverla en los reintentos."""
+    response = json.loads(json.dumps(response, default=str))
+    try:
+        async with SessionLocal() as db:
+            await db.execute(
+                update(IdempotencyKey)
+                .where(
+                    IdempotencyKey.key == key,
+                    IdempotencyKey.user_id == user_id,
+                    IdempotencyKey.endpoint == endpoint,
+                )
+                .values(estado="completada", status_code=status_code, response=response)
+            )
+            await db.commit()
+    except Exception as e:
+        # La venta ya quedó guardada: no se propaga el error, el reintento verá 409 hasta que venza la clave
+        log.error("No se pudo completar la Idempotency-Key %s (user=%s): %s", key, user_id, e)
+    _cache_put((user_id, endpoint, key), req_hash, status_code, response)
+
+
+async def liberar(key: str, user_id: int, endpoint: str):
+    """Borra la clave tras un fallo para que el reintento ejecute la operación de nuevo."""
+    _cache.pop((user_id, endpoint, key), None)
+    try:
+        async with SessionLocal() as db:
+            await db.execute(
+                delete(IdempotencyKey).where(
+                    IdempotencyKey.key == key,
+                    IdempotencyKey.user_id == user_id,
+                    IdempotencyKey.endpoint == endpoint,
+                    IdempotencyKey.estado == "en_curso",
+                )
+            )
+            await db.commit()
+    except Exception as e:
+        log.error("No se pudo liberar la Idempotency-Key %s (user=%s): %s", key, user_id, e)
+
+
+async def purgar_vencidas() -> int:
+    """Elimina las claves vencidas. Retorna la cantidad borrada."""
+    now = time.time()
+    for ck in [ck for ck, hit in _cache.items() if hit[0] < now]:
+        _cache.pop(ck, None)
+
+    async with SessionLocal() as db:
+        res = await db.execute(delete(IdempotencyKey).where(IdempotencyKey.expires_at < func.now()))
+        await db.commit()
+        return res.rowcount or 0
@@ -0,0 +1,83 @@
+"""
+Almacén temporal de recortes de QR extraídos de PDFs.
+
+La extracción por streaming no incrusta cada recorte como base64 en la respuesta:
+guarda el PNG aquí y devuelve un id que el frontend pide por separado
+(GET /api/esims/qr-crops/{id}). Los archivos viven en QR_CROPS_DIR y se borran
+pasados QR_CROPS_TTL_SECONDS; al estar en disco los comparte cualquier worker del host.
+"""
+
+import asyncio
+import logging
+import os
+import re
+import tempfile
+import time
+from typing import Optional
+from uuid import uuid4
+
+logger = logging.getLogger(__name__)
+
+QR_CROPS_DIR = os.getenv("QR_CROPS_DIR", os.path.join(tempfile.gettempdir(), "esim_qr_crops"))
+QR_CROPS_TTL_SECONDS = int(os.getenv("QR_CROPS_TTL_SECONDS", "3600"))
+_PURGA_CADA_SECONDS = 300
+
+_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+_ultima_purga = 0.0
+
+
+def _path(crop_id: str) -> str:
+    return os.path.join(QR_CROPS_DIR, f"{crop_id}.png")
+
+
+def _escribir(crop_id: str, png: bytes):
+    os.makedirs(QR_CROPS_DIR, exist_ok=True)
+    tmp = _path(crop_id) + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(png)
+    os.replace(tmp, _path(crop_id))
+
+
+def _purgar() -> int:
+    limite = time.time() - QR_CROPS_TTL_SECONDS
+    borrados = 0
+    try:
+        entradas = list(os.scandir(QR_CROPS_DIR))
+    except FileNotFoundError:
+        return 0
+    for entrada in entradas:
+        try:
+            if entrada.stat().st_mtime < limite:
+                os.unlink(entrada.path)
+                borrados += 1
+        except OSError:
+            pass
+    return borrados
+
+
+async def guardar(png: bytes) -> str:
+    """Guarda el recorte y retorna su id."""
+    global _ultima_purga
+
+    crop_id = uuid4().hex
+    await asyncio.to_thread(_escribir, crop_id, png)
+
+    if time.monotonic() - _ultima_purga >= _PURGA_CADA_SECONDS:
+        _ultima_purga = time.monotonic()
+        borrados = await asyncio.to_thread(_purgar)
+        if borrados:
+            logger.info(f"Recortes de QR vencidos eliminados: {borrados}")
+    return crop_id
+
+
+def ruta(crop_id: str) -> Optional[str]:
+    """Ruta del recorte si existe y no venció (None si el id no es válido o expiró)."""
+    if not _ID_RE.match(crop_id or ""):
+        return None
+    path = _path(crop_id)
+    try:
+        if os.path.getmtime(path) < time.time() - QR_CROPS_TTL_SECONDS:
+            return None
+    except OSError:
+        return None
+    return path
@@ -3,14 +3,13 @@ Servicio para extraer códigos QR de archivos PDF
 Diseñado para procesar PDFs con múltiples eSIMs
 """
 
-import io
-import base64
 from typing import List, Dict, Optional, Tuple
-from PIL import Image
 import fitz  # PyMuPDF
-from pyzbar.pyzbar import decode as decode_qr
+from pyzbar.pyzbar import decode as decode_qr, ZBarSymbol
 import logging
 
+from services import qr_render
+
 logger = logging.getLogger(__name__)
 
 
@@ -51,60 +50,65 @@ class QRExtractor:
 
             # Procesar cada página
             for page_num in range(pdf_document.page_count):
-                page = pdf_document[page_num]
-                logger.info(f"Procesando página {page_num + 1}")
+                qr_codes.extend(self.extract_qrs_from_page(pdf_document[page_num], page_num))
 
-                # Convertir página a imagen de alta resolución
-                zoom = self.dpi / 72  # 72 DPI es la base de PDF
-                matrix = fitz.Matrix(zoom, zoom)
-                pix = page.get_pixmap(matrix=matrix)
+            pdf_document.close()
+            logger.info(f"Total QRs extraídos: {len(qr_codes)}")
 
-                # Convertir a PIL Image
-                img_data = pix.tobytes("png")
-                image = Image.open(io.BytesIO(img_data))
+        except Exception as e:
+            logger.error(f"Error extrayendo QRs del PDF: {str(e)}")
+            raise
 
-                # Buscar QR codes en la imagen
-                decoded_objects = decode_qr(image)
+        return qr_codes
 
-                logger.info(f"QRs encontrados en página {page_num + 1}: {len(decoded_objects)}")
+    def extract_qrs_from_page(
+        self, page, page_num: int, con_imagen: bool = True, formato_imagen: str = "base64"
+    ) -> List[Dict[str, any]]:
+        """
+        Extrae los códigos QR de una página (unidad de trabajo del pool de procesos)
 
-                # Procesar cada QR encontrado
-                for idx, obj in enumerate(decoded_objects):
-                    qr_data = obj.data.decode('utf-8')
+        Una sola pasada en escala de grises a self.dpi: zbar no reporta los QRs que detectó
+        sin poder decodificar, así que una pasada a baja resolución perdería en silencio los
+        que no salen en una página con varias eSIMs.
 
-                    # Extraer la imagen del QR específico
-                    x, y, w, h = obj.rect.left, obj.rect.top, obj.rect.width, obj.rect.height
+        Args:
+            page: Página de PyMuPDF
+            page_num: Índice de la página (base 0)
+            con_imagen: Si False no se genera el recorte del QR
+            formato_imagen: "base64" (data URL en qr_image_base64) o "png" (bytes en qr_image_png)
 
-                    # Agregar margen para capturar el QR completo
-                    margin = 20
-                    x = max(0, x - margin)
-                    y = max(0, y - margin)
-                    w = w + 2 * margin
-                    h = h + 2 * margin
+        Returns:
+            Lista de QRs de la página, con el mismo formato que extract_qrs_from_pdf
+        """
+        qr_codes = []
+        logger.info(f"Procesando página {page_num + 1}")
 
-                    # Recortar imagen del QR
-                    qr_image = image.crop((x, y, x + w, y + h))
+        dpi = self.dpi
+        pix = qr_render.render_gris(page, dpi)
+        decoded_objects = decode_qr(qr_render.como_zbar(pix), symbols=[ZBarSymbol.QRCODE])
 
-                    # Convertir a base64
-                    buffered = io.BytesIO()
-                    qr_image.save(buffered, format="PNG")
-                    qr_image_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
+        logger.info(f"QRs encontrados en página {page_num + 1}: {len(decoded_objects)} ({dpi} DPI)")
 
-                    qr_codes.append({
-                        'qr_data': qr_data,
-                        'qr_image_base64': f"data:image/png;base64,{qr_image_base64}",
-                        'page': page_num + 1,
-                        'position': idx + 1
-                    })
+        # Procesar cada QR encontrado
+        for idx, obj in enumerate(decoded_objects):
+            qr_data = obj.data.decode('utf-8')
 
-                    logger.info(f"QR extraído: página {page_num + 1}, posición {idx + 1}")
+            qr = {
+                'qr_data': qr_data,
+                'qr_image_base64': None,
+                'page': page_num + 1,
+                'position': idx + 1
+            }
+            if con_imagen:
+                # Recorte del QR renderizado a resolución completa (solo esa región)
+                x, y, w, h = obj.rect.left, obj.rect.top, obj.rect.width, obj.rect.height
+                rect = qr_render.rect_pdf(page, [(x, y), (x + w, y + h)], dpi)
+                clave, imagen = qr_render.recorte(page, rect, self.dpi, formato_imagen)
+                qr[clave] = imagen
 
-            pdf_document.close()
-            logger.info(f"Total QRs extraídos: {len(qr_codes)}")
+            qr_codes.append(qr)
 
-        except Exception as e:
-            logger.error(f"Error extrayendo QRs del PDF: {str(e)}")
-            raise
+            logger.info(f"QR extraído: página {page_num + 1}, posición {idx + 1}")
 
         return qr_codes
 
@@ -124,20 +128,8 @@ class QRExtractor:
             pdf_document = fitz.open(stream=pdf_bytes, filetype="pdf")
 
             for page_num in range(pdf_document.page_count):
-                page = pdf_document[page_num]
-
-                zoom = self.dpi / 72
-                matrix = fitz.Matrix(zoom, zoom)
-                pix = page.get_pixmap(matrix=matrix)
-
-                img_data = pix.tobytes("png")
-                image = Image.open(io.BytesIO(img_data))
-
-                decoded_objects = decode_qr(image)
-
-                for obj in decoded_objects:
-                    qr_data = obj.data.decode('utf-8')
-                    qr_data_list.append(qr_data)
+                for qr in self.extract_qrs_from_page(pdf_document[page_num], page_num, con_imagen=False):
+                    qr_data_list.append(qr['qr_data'])
 
             pdf_document.close()
 
@@ -177,7 +169,9 @@ class QRExtractor:
 # Función helper para uso rápido
 async def extract_qrs_from_uploaded_pdf(file_content: bytes) -> List[Dict[str, any]]:
     """
-    Función de conveniencia para extraer QRs de un PDF subido
+    Función de conveniencia para extraer QRs de un PDF subido.
+    Las páginas se procesan en paralelo en el pool de procesos (services/qr_pool.py),
+    así el event loop no se bloquea mientras se renderiza el PDF.
 
     Args:
         file_content: Contenido del archivo PDF
@@ -185,8 +179,14 @@ async def extract_qrs_from_uploaded_pdf(file_content: bytes) -> List[Dict[str, a
     Returns:
         Lista de QRs extraídos con metadata
     """
+    from services import qr_pool
+
     extractor = QRExtractor(dpi=300)
-    qr_codes = extractor.extract_qrs_from_pdf(file_content)
+    qr_codes = []
+    async for _page, page_qrs, _paginas in qr_pool.extraer_por_pagina(file_content, motor=__name__, dpi=extractor.dpi):
+        qr_codes.extend(page_qrs)
+    qr_codes.sort(key=lambda qr: (qr['page'], qr['position']))
+    logger.info(f"Total QRs extraídos: {len(qr_codes)}")
 
     # Validar cada QR
     for qr in qr_codes:
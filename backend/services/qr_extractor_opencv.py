@@ -3,15 +3,14 @@ Servicio para extraer códigos QR de archivos PDF
 Versión compatible con Windows usando OpenCV (no requiere zbar)
 """
 
-import io
-import base64
 from typing import List, Dict, Optional, Tuple
-from PIL import Image
 import fitz  # PyMuPDF
 import cv2
 import numpy as np
 import logging
 
+from services import qr_render
+
 logger = logging.getLogger(__name__)
 
 
@@ -46,114 +45,116 @@ class QRExtractor:
 
             # Procesar cada página
             for page_num in range(pdf_document.page_count):
-                page = pdf_document[page_num]
-                logger.info(f"Procesando página {page_num + 1}")
+                qr_codes.extend(self.extract_qrs_from_page(pdf_document[page_num], page_num))
 
-                # Convertir página a imagen de alta resolución
-                zoom = self.dpi / 72  # 72 DPI es la base de PDF
-                matrix = fitz.Matrix(zoom, zoom)
-                pix = page.get_pixmap(matrix=matrix)
+            pdf_document.close()
+            logger.info(f"Total QRs extraídos: {len(qr_codes)}")
 
-                # Convertir a PIL Image
-                img_data = pix.tobytes("png")
-                pil_image = Image.open(io.BytesIO(img_data))
+        except Exception as e:
+            logger.error(f"Error extrayendo QRs del PDF: {str(e)}")
+            raise
 
-                # Convertir PIL a numpy array para OpenCV
-                img_array = np.array(pil_image)
+        return qr_codes
 
-                # OpenCV espera BGR, PIL da RGB
-                if len(img_array.shape) == 3 and img_array.shape[2] == 3:
-                    img_cv = cv2.cvtColor(img_array, cv2.COLOR_RGB2BGR)
-                else:
-                    img_cv = img_array
+    def _detectar(self, img: np.ndarray) -> List[Tuple[str, np.ndarray]]:
+        """
+        Detecta los QRs de una imagen en escala de grises.
+        Retorna (datos, puntos) por QR; datos vacío si se detectó pero no se pudo decodificar.
+        """
+        encontrados = []
 
-                # Detectar y decodificar QRs usando OpenCV
-                # Intentar con la imagen original
-                qr_data, bbox, straight_qrcode = self.qr_detector.detectAndDecode(img_cv)
+        try:
+            retval, points = self.qr_detector.detectMulti(img)
+        except cv2.error as multi_error:
+            logger.warning(f"Error detectando múltiples QRs: {multi_error}")
+            retval, points = False, None
+
+        if retval and points is not None:
+            try:
+                _, decoded_info, _ = self.qr_detector.decodeMulti(img, points)
+            except cv2.error:
+                decoded_info = None
+            decoded_info = list(decoded_info or [""] * len(points))
+            for data, pts in zip(decoded_info, points):
+                encontrados.append((data or "", pts))
+        else:
+            # detectMulti a veces no ve un QR aislado: intentar con el detector simple
+            data, bbox, _ = self.qr_detector.detectAndDecode(img)
+            if bbox is not None and len(bbox) > 0:
+                encontrados.append((data or "", bbox.reshape(-1, 2)))
+
+        return encontrados
+
+    def extract_qrs_from_page(
+        self, page, page_num: int, con_imagen: bool = True, formato_imagen: str = "base64"
+    ) -> List[Dict[str, any]]:
+        """
+        Extrae los códigos QR de una página (unidad de trabajo del pool de procesos)
 
-                found_qrs = []
+        Primera pasada en escala de grises a baja resolución; los QRs detectados pero no
+        decodificados se re-renderizan a self.dpi solo en su región. Si no se detecta
+        ninguno se repite la página completa a self.dpi.
 
-                if qr_data:
-                    found_qrs.append({
-                        'data': qr_data,
-                        'bbox': bbox,
-                        'position': 0
-                    })
+        Args:
+            page: Página de PyMuPDF
+            page_num: Índice de la página (base 0)
+            con_imagen: Si False no se genera el recorte del QR
+            formato_imagen: "base64" (data URL en qr_image_base64) o "png" (bytes en qr_image_png)
 
-                # También intentar detectar múltiples QRs
+        Returns:
+            Lista de QRs de la página, con el mismo formato que extract_qrs_from_pdf
+        """
+        qr_codes = []
+        logger.info(f"Procesando página {page_num + 1}")
+
+        dpi = qr_render.dpi_primera_pasada(self.dpi)
+        pix = qr_render.render_gris(page, dpi)
+        detectados = self._detectar(qr_render.como_array(pix))
+
+        if not detectados and dpi < self.dpi:
+            dpi = self.dpi
+            pix = qr_render.render_gris(page, dpi)
+            detectados = self._detectar(qr_render.como_array(pix))
+
+        found_qrs = []
+        for qr_data, points in detectados:
+            rect = qr_render.rect_pdf(page, points, dpi)
+
+            if not qr_data and dpi < self.dpi:
+                # Detectado pero no decodificado: solo esa región a resolución completa
+                clip = qr_render.render_gris(page, self.dpi, clip=rect)
+                qr_data, _, _ = self.qr_detector.detectAndDecode(qr_render.como_array(clip))
+
+            if not qr_data:
+                logger.warning(f"QR detectado sin decodificar en página {page_num + 1}")
+                continue
+
+            # Verificar que no sea duplicado
+            if qr_data not in [qr['data'] for qr in found_qrs]:
+                found_qrs.append({'data': qr_data, 'rect': rect})
+
+        logger.info(f"QRs encontrados en página {page_num + 1}: {len(found_qrs)}")
+
+        # Procesar cada QR encontrado
+        for idx, qr_info in enumerate(found_qrs):
+            qr = {
+                'qr_data': qr_info['data'],
+                'qr_image_base64': None,
+                'page': page_num + 1,
+                'position': idx + 1
+            }
+            if con_imagen:
                 try:
-                    # Crear detector de QR multi
-                    detector = cv2.QRCodeDetector()
-
-                    # Detectar todos los QRs en la imagen
-                    retval, decoded_info, points, straight_qrcode = detector.detectAndDecodeMulti(img_cv)
-
-                    if retval:
-                        for idx, (data, pts) in enumerate(zip(decoded_info, points)):
-                            if data:  # Solo si hay datos
-                                # Verificar que no sea duplicado
-                                if data not in [qr['data'] for qr in found_qrs]:
-                                    found_qrs.append({
-                                        'data': data,
-                                        'bbox': pts,
-                                        'position': idx
-                                    })
-                except Exception as multi_error:
-                    logger.warning(f"Error detectando múltiples QRs: {multi_error}")
-
-                logger.info(f"QRs encontrados en página {page_num + 1}: {len(found_qrs)}")
-
-                # Procesar cada QR encontrado
-                for idx, qr_info in enumerate(found_qrs):
-                    qr_data = qr_info['data']
-                    bbox = qr_info['bbox']
-
-                    # Extraer la región del QR de la imagen PIL original
-                    try:
-                        if bbox is not None and len(bbox) > 0:
-                            # Calcular bounding box
-                            x_coords = [int(p[0]) for p in bbox]
-                            y_coords = [int(p[1]) for p in bbox]
-
-                            x_min, x_max = max(0, min(x_coords) - 20), min(pil_image.width, max(x_coords) + 20)
-                            y_min, y_max = max(0, min(y_coords) - 20), min(pil_image.height, max(y_coords) + 20)
-
-                            # Recortar imagen del QR
-                            qr_image = pil_image.crop((x_min, y_min, x_max, y_max))
-                        else:
-                            # Si no hay bbox, usar toda la imagen
-                            qr_image = pil_image
-
-                        # Convertir a base64
-                        buffered = io.BytesIO()
-                        qr_image.save(buffered, format="PNG")
-                        qr_image_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
-
-                        qr_codes.append({
-                            'qr_data': qr_data,
-                            'qr_image_base64': f"data:image/png;base64,{qr_image_base64}",
-                            'page': page_num + 1,
-                            'position': idx + 1
-                        })
-
-                        logger.info(f"QR extraído: página {page_num + 1}, posición {idx + 1}")
-
-                    except Exception as crop_error:
-                        logger.warning(f"Error recortando QR: {crop_error}")
-                        # Agregar sin imagen si falla
-                        qr_codes.append({
-                            'qr_data': qr_data,
-                            'qr_image_base64': None,
-                            'page': page_num + 1,
-                            'position': idx + 1
-                        })
+                    # Recorte del QR renderizado a resolución completa (solo esa región)
+                    clave, imagen = qr_render.recorte(page, qr_info['rect'], self.dpi, formato_imagen)
+                    qr[clave] = imagen
+                except Exception as crop_error:
+                    # Agregar sin imagen si falla
+                    logger.warning(f"Error recortando QR: {crop_error}")
 
-            pdf_document.close()
-            logger.info(f"Total QRs extraídos: {len(qr_codes)}")
+            qr_codes.append(qr)
 
-        except Exception as e:
-            logger.error(f"Error extrayendo QRs del PDF: {str(e)}")
-            raise
+            logger.info(f"QR extraído: página {page_num + 1}, posición {idx + 1}")
 
         return qr_codes
 
@@ -173,36 +174,9 @@ class QRExtractor:
             pdf_document = fitz.open(stream=pdf_bytes, filetype="pdf")
 
             for page_num in range(pdf_document.page_count):
-                page = pdf_document[page_num]
-
-                zoom = self.dpi / 72
-                matrix = fitz.Matrix(zoom, zoom)
-                pix = page.get_pixmap(matrix=matrix)
-
-                img_data = pix.tobytes("png")
-                pil_image = Image.open(io.BytesIO(img_data))
-
-                # Convertir a OpenCV
-                img_array = np.array(pil_image)
-                if len(img_array.shape) == 3 and img_array.shape[2] == 3:
-                    img_cv = cv2.cvtColor(img_array, cv2.COLOR_RGB2BGR)
-                else:
-                    img_cv = img_array
-
-                # Detectar QR
-                qr_data, _, _ = self.qr_detector.detectAndDecode(img_cv)
-                if qr_data:
-                    qr_data_list.append(qr_data)
-
-                # Intentar detectar múltiples
-                try:
-                    retval, decoded_info, points, _ = self.qr_detector.detectAndDecodeMulti(img_cv)
-                    if retval:
-                        for data in decoded_info:
-                            if data and data not in qr_data_list:
-                                qr_data_list.append(data)
-                except:
-                    pass
+                for qr in self.extract_qrs_from_page(pdf_document[page_num], page_num, con_imagen=False):
+                    if qr['qr_data'] not in qr_data_list:
+                        qr_data_list.append(qr['qr_data'])
 
             pdf_document.close()
 
@@ -241,7 +215,9 @@ class QRExtractor:
 # Función helper para uso rápido
 async def extract_qrs_from_uploaded_pdf(file_content: bytes) -> List[Dict[str, any]]:
     """
-    Función de conveniencia para extraer QRs de un PDF subido
+    Función de conveniencia para extraer QRs de un PDF subido.
+    Las páginas se procesan en paralelo en el pool de procesos (services/qr_pool.py),
+    así el event loop no se bloquea mientras se renderiza el PDF.
 
     Args:
         file_content: Contenido del archivo PDF
@@ -249,8 +225,14 @@ async def extract_qrs_from_uploaded_pdf(file_content: bytes) -> List[Dict[str, a
     Returns:
         Lista de QRs extraídos con metadata
     """
+    from services import qr_pool
+
     extractor = QRExtractor(dpi=300)
-    qr_codes = extractor.extract_qrs_from_pdf(file_content)
+    qr_codes = []
+    async for _page, page_qrs, _paginas in qr_pool.extraer_por_pagina(file_content, motor=__name__, dpi=extractor.dpi):
+        qr_codes.extend(page_qrs)
+    qr_codes.sort(key=lambda qr: (qr['page'], qr['position']))
+    logger.info(f"Total QRs extraídos: {len(qr_codes)}")
 
     # Validar cada QR
     for qr in qr_codes:
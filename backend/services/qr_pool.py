@@ -0,0 +1,153 @@
+"""
+Pool de procesos para extraer QRs de PDFs de eSIMs.
+
+Renderizar y decodificar un PDF de proveedor de 100 páginas es CPU puro y antes corría
+dentro del event loop. Ahora cada página es una tarea en un ProcessPoolExecutor
+(creado al primer uso, QR_POOL_WORKERS procesos) y los resultados se entregan a medida
+que terminan las páginas. Cada worker web tiene su propio pool: por defecto las CPUs se
+reparten entre los WEB_WORKERS (lo exporta serve.py), no un proceso por CPU en cada uno.
+
+El PDF se escribe una vez a un archivo temporal; cada proceso lo abre por ruta y
+mantiene abierto el último documento, así no se serializa el PDF completo por página.
+Con QR_POOL_WORKERS=0 las páginas se procesan en hilos (útil donde no se pueden crear procesos).
+"""
+
+import asyncio
+import importlib
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_WEB_WORKERS = max(1, int(os.getenv("WEB_WORKERS") or 1))
+QR_POOL_WORKERS = int(os.getenv("QR_POOL_WORKERS") or max(1, (os.cpu_count() or 1) // _WEB_WORKERS))
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> Optional[ProcessPoolExecutor]:
+    """Pool compartido (None = hilos del loop si QR_POOL_WORKERS=0)."""
+    global _pool
+    if QR_POOL_WORKERS <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            # spawn: no hereda el event loop, hilos ni conexiones a la BD del proceso web
+            _pool = ProcessPoolExecutor(max_workers=QR_POOL_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+            logger.info(f"Pool de extracción de QRs iniciado con {QR_POOL_WORKERS} procesos")
+        return _pool
+
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def shutdown():
+    """Cierra el pool (al apagar la aplicación)."""
+    _reset_pool()
+
+
+# ---------- lado del proceso trabajador ----------
+
+_local = threading.local()
+
+
+def _abrir_documento(path: str):
+    import fitz  # PyMuPDF
+
+    doc = getattr(_local, "doc", None)
+    if doc is None or getattr(_local, "path", None) != path:
+        if doc is not None:
+            doc.close()
+        _local.doc = fitz.open(path)
+        _local.path = path
+    return _local.doc
+
+
+def _get_extractor(motor: str, dpi: int):
+    extractores = getattr(_local, "extractores", None)
+    if extractores is None:
+        extractores = _local.extractores = {}
+    key = (motor, dpi)
+    if key not in extractores:
+        extractores[key] = importlib.import_module(motor).QRExtractor(dpi=dpi)
+    return extractores[key]
+
+
+def _extraer_pagina(
+    path: str, page_num: int, motor: str, dpi: int, formato_imagen: str
+) -> Tuple[int, List[Dict[str, Any]]]:
+    """Tarea del pool: QRs de una página (page_num base 0)."""
+    doc = _abrir_documento(path)
+    extractor = _get_extractor(motor, dpi)
+    return page_num + 1, extractor.extract_qrs_from_page(doc[page_num], page_num, formato_imagen=formato_imagen)
+
+
+def _contar_paginas(path: str) -> int:
+    import fitz  # PyMuPDF
+
+    with fitz.open(path) as doc:
+        return doc.page_count
+
+
+def _escribir_temporal(pdf_bytes: bytes) -> str:
+    fd, path = tempfile.mkstemp(prefix="esims_", suffix=".pdf")
+    with os.fdopen(fd, "wb") as f:
+        f.write(pdf_bytes)
+    return path
+
+
+# ---------- lado del event loop ----------
+
+async def extraer_por_pagina(
+    pdf_bytes: bytes, *, motor: str, dpi: int = 300, formato_imagen: str = "base64"
+) -> AsyncIterator[Tuple[int, List[Dict[str, Any]], int]]:
+    """
+    Procesa las páginas en paralelo y entrega (página, qrs, total_páginas) en orden de finalización.
+
+    Args:
+        pdf_bytes: Contenido del PDF
+        motor: Módulo con la clase QRExtractor a usar (p.ej. "services.qr_extractor_opencv")
+        dpi: Resolución de renderizado
+        formato_imagen: "base64" (data URL en qr_image_base64) o "png" (bytes en qr_image_png)
+    """
+    loop = asyncio.get_running_loop()
+    path = await asyncio.to_thread(_escribir_temporal, pdf_bytes)
+    futures: List[asyncio.Future] = []
+    try:
+        paginas = await asyncio.to_thread(_contar_paginas, path)
+        logger.info(f"PDF abierto: {paginas} páginas")
+
+        pool = get_pool()
+        futures = [
+            loop.run_in_executor(pool, _extraer_pagina, path, page_num, motor, dpi, formato_imagen)
+            for page_num in range(paginas)
+        ]
+        for siguiente in asyncio.as_completed(futures):
+            try:
+                page, qrs = await siguiente
+            except BrokenProcessPool:
+                # Un proceso murió (p.ej. crash nativo decodificando): se recrea en la próxima llamada
+                logger.error("El pool de extracción de QRs se rompió; se reiniciará")
+                _reset_pool()
+                raise
+            yield page, qrs, paginas
+    finally:
+        # Si el consumidor se fue (cliente desconectado) no se procesan las páginas restantes
+        for f in futures:
+            f.cancel()
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
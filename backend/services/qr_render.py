@@ -0,0 +1,81 @@
+"""
+Renderizado de páginas PDF para los extractores de QR (pyzbar y OpenCV).
+
+Antes cada página se renderizaba a 300 DPI en color, se codificaba a PNG y se volvía a
+decodificar con PIL solo para pasarle píxeles al decodificador. Ahora:
+  - se renderiza en escala de grises (1 byte por píxel, sin alfa) y las muestras del
+    pixmap se entregan directamente (vista NumPy sobre el buffer de MuPDF, sin PNG);
+  - OpenCV: primero a QR_DPI_BAJO; solo las regiones donde se detectó un QR que no se
+    pudo decodificar se vuelven a renderizar (clip) a la resolución completa. pyzbar no
+    reporta esos QRs, así que su extractor hace una sola pasada a la resolución completa;
+  - el recorte que se devuelve al usuario se renderiza aparte, solo del área del QR.
+"""
+
+import base64
+import os
+from typing import Optional, Sequence, Tuple
+
+import fitz  # PyMuPDF
+import numpy as np
+
+# DPI de la primera pasada de OpenCV (0 = desactiva la estrategia adaptativa y usa siempre el DPI del extractor)
+QR_DPI_BAJO = int(os.getenv("QR_DPI_BAJO", "150"))
+# Margen alrededor del QR en el recorte y al re-renderizar, en puntos PDF (20 px a 300 DPI)
+QR_MARGEN_PT = float(os.getenv("QR_MARGEN_PT", "5"))
+
+
+def dpi_primera_pasada(dpi: int) -> int:
+    if QR_DPI_BAJO <= 0:
+        return dpi
+    return min(dpi, QR_DPI_BAJO)
+
+
+def render_gris(page, dpi: int, clip: Optional[fitz.Rect] = None) -> fitz.Pixmap:
+    zoom = dpi / 72  # 72 DPI es la base de PDF
+    return page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY, alpha=False, clip=clip)
+
+
+def como_array(pix: fitz.Pixmap) -> np.ndarray:
+    """Vista (alto x ancho, uint8) sobre las muestras del pixmap, sin copiar. El pixmap debe seguir vivo."""
+    buf = np.frombuffer(pix.samples_mv, dtype=np.uint8).reshape(pix.height, pix.stride)
+    return buf[:, : pix.width]
+
+
+def como_zbar(pix: fitz.Pixmap) -> Tuple[bytes, int, int]:
+    """Formato (píxeles, ancho, alto) de 8 bits que pyzbar acepta sin pasar por PIL."""
+    return pix.samples, pix.width, pix.height
+
+
+def rect_pdf(page, puntos_px: Sequence[Sequence[float]], dpi: int, origen: Optional[fitz.Rect] = None) -> fitz.Rect:
+    """
+    Convierte puntos en píxeles de un render a un rectángulo en coordenadas PDF,
+    con QR_MARGEN_PT de margen y recortado al área de la página.
+    Si el render fue de un clip, 'origen' es ese clip.
+    """
+    zoom = dpi / 72
+    xs = [float(p[0]) for p in puntos_px]
+    ys = [float(p[1]) for p in puntos_px]
+    ox, oy = (origen.x0, origen.y0) if origen is not None else (page.rect.x0, page.rect.y0)
+    rect = fitz.Rect(
+        ox + min(xs) / zoom - QR_MARGEN_PT,
+        oy + min(ys) / zoom - QR_MARGEN_PT,
+        ox + max(xs) / zoom + QR_MARGEN_PT,
+        oy + max(ys) / zoom + QR_MARGEN_PT,
+    )
+    return rect & page.rect
+
+
+def recorte_png(page, rect: fitz.Rect, dpi: int) -> bytes:
+    """PNG del área del QR renderizada a resolución completa."""
+    return render_gris(page, dpi, clip=rect).tobytes("png")
+
+
+def recorte(page, rect: fitz.Rect, dpi: int, formato_imagen: str = "base64") -> Tuple[str, object]:
+    """
+    Recorte del QR como (clave, valor) para el dict del resultado:
+    ("qr_image_png", bytes) o ("qr_image_base64", data URL).
+    """
+    png = recorte_png(page, rect, dpi)
+    if formato_imagen == "png":
+        return "qr_image_png", png
+    return "qr_image_base64", f"data:image/png;base64,{base64.b64encode(png).decode('utf-8')}"
@@ -1,3 +1,4 @@
+import json
 from datetime import datetime, timezone
 from uuid import uuid4
 from decimal import Decimal
@@ -7,7 +8,9 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.sql import func as sa_func
 from siigo_client import siigo_client
 from schemas.sale_schemas import SaleRequest, SaleCreateSchema
-from models import Sale, SaleItem, MovimientoCaja, Turno, SimDetalle
+from models import Sale, SaleItem, MovimientoCaja, Turno, SimDetalle, SimStatus
+from utils.turno_utils import get_turno_activo
+from services import dashboard_cache
 
 log = logging.getLogger("sales-service")
 
@@ -32,26 +35,18 @@ async def _turno_abierto_user_id(db: AsyncSession) -> int | None:
     return getattr(turno, "user_id", None) if turno else None
 
 
-async def _registrar_movimiento_caja(
-    db: AsyncSession,
+def _build_movimiento_caja(
     *,
-    user_id: int | None,
+    turno: Turno | None,
     sale_id,
     monto: Decimal,
     metodo_pago: str,
     descripcion: str = "Venta",
-):
-    if user_id is None:
+) -> MovimientoCaja | None:
+    if turno is None:
         return None
 
-    res_turno = await db.execute(
-        select(Turno).where(Turno.user_id == user_id, Turno.estado == "abierto")
-    )
-    turno = res_turno.scalar_one_or_none()
-    if not turno:
-        return None
-
-    mov = MovimientoCaja(
+    return MovimientoCaja(
         id=uuid4(),
         turno_id=turno.id,
         tipo="venta",
@@ -60,8 +55,32 @@ async def _registrar_movimiento_caja(
         metodo_pago=_pm_norm(metodo_pago),
         sale_id=sale_id,
     )
-    db.add(mov)
-    return mov
+
+
+def _sim_refs_from_item(item) -> tuple[str | None, str | None, str | None]:
+    """
+    Devuelve (sim_id, msisdn, iccid) de un item del carrito.
+    Prioriza campos explícitos; si no vienen, intenta inferirlos del product_code/description.
+    """
+    # 1) prioridad: campos explícitos
+    sim_id = getattr(item, "sim_id", None) or getattr(item, "simId", None)
+    msisdn = getattr(item, "msisdn", None) or getattr(item, "numero_linea", None)
+    iccid  = getattr(item, "iccid",  None)
+
+    # 2) heurística: si no vienen, intentar inferir del product_code/description
+    pc = (item.product_code or "").strip()
+    desc = (item.description or "").strip()
+
+    # si el product_code son ~10-13 dígitos, suele ser el número de línea
+    if not msisdn and pc.isdigit() and 10 <= len(pc) <= 13:
+        msisdn = pc
+    # intenta iccid en descripción
+    if not iccid and any(x in desc.lower() for x in ("iccid", "sim", "chip", "tarjeta")):
+        # extrae la primera secuencia larga de dígitos como iccid
+        digits = "".join(ch if ch.isdigit() else " " for ch in desc).split()
+        iccid = next((d for d in digits if len(d) >= 18), None)
+
+    return sim_id, msisdn, iccid
 
 
 async def save_sale_to_db(
@@ -69,10 +88,22 @@ async def save_sale_to_db(
     db: AsyncSession,
     siigo_invoice_id: str | None = None,
     user_id: int | None = None,
+    turno: Turno | None = None,
+    es_contingencia: bool = False,
+    siigo_payload: dict | None = None,
+    siigo_incierto: bool = False,
 ):
     """
-    Crea la venta + items y registra el movimiento de caja.
+    Crea la venta + items, marca las SIMs vendidas y registra el movimiento de caja
+    en una sola transacción (un único commit).
+
+    Si el llamador ya resolvió el turno abierto lo pasa en 'turno' y no se vuelve a consultar.
     Se asegura de que 'user_id' quede seteado.
+
+    Con es_contingencia=True la venta queda en la cola de Siigo (siigo_pendiente) con el
+    payload de la factura, para que el worker de contingencia la envíe después.
+    siigo_incierto=True indica que el envío quedó sin respuesta: el worker busca la factura
+    en Siigo antes de reenviarla.
     """
     # 0) Normalizar método de pago y total
     payment_method = _pm_norm(sale_data.payment_method)
@@ -82,6 +113,8 @@ async def save_sale_to_db(
         total += Decimal(str(item.unit_price)) * Decimal(str(item.quantity))
 
     # 1) Si no llega user_id, intenta inferirlo (robusto)
+    if user_id is None and turno is not None:
+        user_id = turno.user_id
     if user_id is None:
         inferred = await _turno_abierto_user_id(db)
         if inferred is not None:
@@ -90,7 +123,11 @@ async def save_sale_to_db(
         else:
             log.error("save_sale_to_db: user_id es None y no hay turno abierto para inferirlo")
 
-    # 2) Crear venta
+    # 2) Turno abierto del usuario (una sola consulta, y solo si no nos lo pasaron)
+    if turno is None and user_id is not None:
+        turno = await get_turno_activo(db, user_id)
+
+    # 3) Crear venta (id generado aquí: no hace falta flush para conocerlo)
     venta = Sale(
         id=uuid4(),
         customer_id=sale_data.customer_id,
@@ -99,18 +136,23 @@ async def save_sale_to_db(
         siigo_invoice_id=siigo_invoice_id,
         total=total,
         user_id=user_id,  # <- clave
-        # created_at = server_default en el modelo
+        es_contingencia=es_contingencia,
+        siigo_pendiente=es_contingencia,
+        siigo_payload=json.dumps(siigo_payload, default=str) if siigo_payload is not None else None,
+        siigo_incierto=es_contingencia and siigo_incierto,
+        # created_at = server_default en el modelo (se trae con RETURNING)
     )
     db.add(venta)
 
-    # 3) Items
+    # 4) Items + referencias de SIM a marcar
+    sim_refs = []
     for item in sale_data.items:
         try:
             iva_val = item.taxes[0].percentage if item.taxes and item.taxes[0].percentage else 0
         except Exception:
             iva_val = 0
 
-        detalle = SaleItem(
+        db.add(SaleItem(
             id=uuid4(),
             sale=venta,
             product_code=item.product_code,
@@ -118,57 +160,32 @@ async def save_sale_to_db(
             quantity=int(item.quantity),
             unit_price=Decimal(str(item.unit_price)),
             iva=Decimal(str(iva_val)),
-        )
-        db.add(detalle)
-
-        
-        # 1) prioridad: campos explícitos
-        msisdn = getattr(item, "msisdn", None)
-        iccid  = getattr(item, "iccid",  None)
-
-        # 2) heurística: si no vienen, intentar inferir del product_code/description
-        pc = (item.product_code or "").strip()
-        desc = (item.description or "").strip()
-
-        # si el product_code son ~10-13 dígitos, podría ser msisdn o iccid
-        if not msisdn and pc.isdigit() and 10 <= len(pc) <= 13:
-            if len(pc) in (10, 11, 12, 13):
-                msisdn = pc  # suele ser número de línea
-        # intenta iccid en descripción
-        if not iccid and any(x in desc.lower() for x in ("iccid", "sim", "chip", "tarjeta")):
-            # extrae la primera secuencia larga de dígitos como iccid
-            digits = "".join(ch if ch.isdigit() else " " for ch in desc).split()
-            iccand = next((d for d in digits if len(d) >= 18), None)
-            if iccand:
-                iccid = iccand
-
-        try:
-            updated = await _mark_sim_sold(db, venta_id=venta.id, msisdn=msisdn, iccid=iccid)
-            if updated:
-                log.info("SIM marcada vendida (venta=%s, msisdn=%s, iccid=%s)", venta.id, msisdn, iccid)
-        except Exception as e:
-            log.warning("No se pudo marcar SIM vendida (venta=%s): %s", venta.id, e)
-
-    # 4) Flushear para tener el id de la venta
-    await db.flush()
+        ))
+        sim_refs.append(_sim_refs_from_item(item))
 
     # 5) Movimiento de caja (si hay turno)
-    await _registrar_movimiento_caja(
-        db,
-        user_id=user_id,
+    mov = _build_movimiento_caja(
+        turno=turno,
         sale_id=venta.id,
         monto=total,
         metodo_pago=payment_method,
         descripcion=f"Venta #{str(venta.id)[:8]}",
     )
+    if mov is not None:
+        db.add(mov)
+
+    # 6) Todas las SIMs del carrito en un solo UPDATE (el autoflush inserta venta/items/movimiento antes)
+    updated = await _mark_sims_sold(db, venta_id=venta.id, refs=sim_refs)
+    if updated:
+        log.info("SIMs marcadas vendidas (venta=%s, filas=%s)", venta.id, updated)
 
-    # 6) Un commit al final
+    # 7) Un commit al final (la invalidación de la caché del dashboard se entrega con él)
+    await dashboard_cache.invalidar(db, *(("ventas", "sims") if updated else ("ventas",)))
     await db.commit()
-    await db.refresh(venta)
     return venta
 
 
-async def generar_factura_siigo(sale_data: SaleRequest) -> str:
+def construir_payload_factura(sale_data: SaleRequest) -> dict:
     today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
     total_amount = sum(item.unit_price * item.quantity for item in sale_data.items)
 
@@ -204,6 +221,11 @@ async def generar_factura_siigo(sale_data: SaleRequest) -> str:
             "taxes": [{"id": tax.id} for tax in (item.taxes or [])],
         })
 
+    return invoice_payload
+
+
+async def generar_factura_siigo(sale_data: SaleRequest) -> str:
+    invoice_payload = construir_payload_factura(sale_data)
     response = await siigo_client.make_request("POST", "/v1/invoices", json=invoice_payload)
     return str(response.get("number") or response.get("id"))
 
@@ -214,39 +236,55 @@ def _digits_only(v: str | None) -> str | None:
     d = "".join(ch for ch in str(v) if ch.isdigit())
     return d or None
 
-async def _mark_sim_sold(
+async def _mark_sims_sold(
     db: AsyncSession,
     *,
     venta_id,
-    msisdn: str | None = None,
-    iccid: str | None = None,
+    refs: list[tuple[str | None, str | None, str | None]],
 ) -> int:
     """
-    Marca como vendida una SIM en sim_detalle.
-    Busca por msisdn (numero_linea) o por iccid.
-    Retorna la cantidad de filas actualizadas (0 o 1).
+    Marca como vendidas en sim_detalle todas las SIMs de una venta con un único UPDATE.
+    Cada ref es (sim_id, msisdn, iccid); se busca por id, numero_linea (con o sin
+    prefijo país) o iccid.
+    Retorna la cantidad de filas actualizadas.
     """
-    msisdn = _digits_only(msisdn)
-    iccid = (iccid or "").strip() if iccid else None
-
-    if not msisdn and not iccid:
+    sim_ids: set[str] = set()
+    lineas: set[str] = set()
+    iccids: set[str] = set()
+
+    for sim_id, msisdn, iccid in refs:
+        if sim_id:
+            sim_ids.add(str(sim_id))
+        msisdn = _digits_only(msisdn)
+        if msisdn:
+            # admite que en DB guardes con o sin prefijo país (últimos 10 dígitos)
+            lineas.add(msisdn)
+            lineas.add(msisdn[-10:] if len(msisdn) > 10 else msisdn)
+        iccid = (iccid or "").strip() if iccid else None
+        if iccid:
+            iccids.add(iccid)
+
+    conds = []
+    if sim_ids:
+        conds.append(SimDetalle.id.in_(sorted(sim_ids)))
+    if lineas:
+        conds.append(SimDetalle.numero_linea.in_(sorted(lineas)))
+    if iccids:
+        conds.append(SimDetalle.iccid.in_(sorted(iccids)))
+    if not conds:
         return 0
 
-    q = update(SimDetalle).values(
-        vendida=True,
-        fecha_venta=sa_func.now(),
-        venta_id=str(venta_id),
-        estado="sold",
-    ).execution_options(synchronize_session=False)
-
-    if msisdn and iccid:
-        q = q.where(or_(SimDetalle.numero_linea == msisdn, SimDetalle.iccid == iccid))
-    elif msisdn:
-        # admite que en DB guardes con o sin prefijo país (últimos 10 dígitos)
-        last10 = msisdn[-10:] if len(msisdn) > 10 else msisdn
-        q = q.where(or_(SimDetalle.numero_linea == msisdn, SimDetalle.numero_linea == last10))
-    else:
-        q = q.where(SimDetalle.iccid == iccid)
+    q = (
+        update(SimDetalle)
+        .where(or_(*conds))
+        .values(
+            vendida=True,
+            fecha_venta=sa_func.now(),
+            venta_id=str(venta_id),
+            estado=SimStatus.vendido,
+        )
+        .execution_options(synchronize_session=False)
+    )
 
     res = await db.execute(q)
-    return res.rowcount or 0
\ No newline at end of file
+    return res.rowcount or 0
@@ -0,0 +1,226 @@
+"""
+Elección de líder para los jobs programados (APScheduler) entre varios procesos.
+
+Con varios workers de uvicorn/gunicorn cada proceso arranca su AsyncIOScheduler, así
+que sin coordinación cada job se ejecutaría una vez por worker. Ahora:
+  - cada proceso intenta tomar el advisory lock de PostgreSQL SCHEDULER_LOCK_KEY con una
+    conexión asyncpg dedicada; el que lo obtiene es el líder y los demás reintentan cada
+    SCHEDULER_LEADER_RETRY_SECONDS. Si el líder se cae su conexión se cierra, PostgreSQL
+    libera el lock y otro proceso lo toma;
+  - los jobs se registran envueltos con exclusivo(): en un proceso que no es líder la
+    ejecución se omite; en el líder se toma además un advisory lock por job durante la
+    ejecución (evita que se solapen durante un cambio de líder);
+  - cada ejecución queda en job_runs con estado, duración y resultado.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+from datetime import datetime, timedelta, timezone
+from functools import wraps
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from sqlalchemy import delete, insert, text, update
+
+from database import SessionLocal, DATABASE_URL
+from models import JobRun
+
+log = logging.getLogger("scheduler_leader")
+
+SCHEDULER_LOCK_KEY = int(os.getenv("SCHEDULER_LOCK_KEY", "7402001"))
+SCHEDULER_LEADER_RETRY_SECONDS = float(os.getenv("SCHEDULER_LEADER_RETRY_SECONDS", "15"))
+JOB_RUNS_RETENTION_DAYS = int(os.getenv("JOB_RUNS_RETENTION_DAYS", "30"))
+
+# Espacio (clave1) de los advisory locks por job: pg_try_advisory_xact_lock(int, int)
+# no se cruza con el lock de líder de un solo argumento bigint
+_JOB_LOCK_CLASE = 7402
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+_lider = False
+_leader_task: Optional[asyncio.Task] = None
+
+
+def es_lider() -> bool:
+    return _lider
+
+
+def estado() -> Dict[str, Any]:
+    return {"worker_id": WORKER_ID, "lider": _lider}
+
+
+# ---------- elección de líder ----------
+
+def _asyncpg_dsn() -> str:
+    return DATABASE_URL.replace("postgresql+asyncpg://", "postgresql://", 1)
+
+
+async def _esperar(evento: asyncio.Event, segundos: float) -> bool:
+    """Espera el evento como mucho 'segundos'; retorna si ocurrió."""
+    try:
+        await asyncio.wait_for(evento.wait(), segundos)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+
+async def _mantener_liderazgo():
+    import asyncpg
+
+    global _lider
+    while True:
+        conn = None
+        try:
+            conn = await asyncpg.connect(_asyncpg_dsn())
+            cerrada = asyncio.Event()
+            conn.add_termination_listener(lambda _c: cerrada.set())
+
+            while not await conn.fetchval("SELECT pg_try_advisory_lock($1)", SCHEDULER_LOCK_KEY):
+                if await _esperar(cerrada, SCHEDULER_LEADER_RETRY_SECONDS):
+                    raise ConnectionError("conexión cerrada esperando el lock de líder")
+
+            _lider = True
+            log.info("Líder del scheduler: %s", WORKER_ID)
+
+            # Mientras la conexión viva el lock es nuestro; un ping periódico detecta conexiones muertas
+            while not await _esperar(cerrada, SCHEDULER_LEADER_RETRY_SECONDS):
+                await asyncio.wait_for(conn.fetchval("SELECT 1"), SCHEDULER_LEADER_RETRY_SECONDS)
+            log.warning("Conexión del líder del scheduler cerrada")
+        except asyncio.CancelledError:
+            break
+        except Exception as e:
+            log.error("Elección de líder del scheduler falló: %s", e)
+        finally:
+            if _lider:
+                log.warning("%s deja de ser líder del scheduler", WORKER_ID)
+            _lider = False
+            # Cerrar la conexión libera el lock
+            if conn is not None and not conn.is_closed():
+                await conn.close()
+        await asyncio.sleep(5)
+
+
+async def iniciar():
+    global _leader_task
+    if _leader_task is None or _leader_task.done():
+        _leader_task = asyncio.create_task(_mantener_liderazgo())
+
+
+async def detener():
+    global _leader_task
+    if _leader_task is not None:
+        _leader_task.cancel()
+        try:
+            await _leader_task
+        except asyncio.CancelledError:
+            pass
+        _leader_task = None
+
+
+# ---------- ejecución de jobs ----------
+
+def _serializable(resultado: Any) -> Any:
+    return json.loads(json.dumps(resultado, default=str))
+
+
+async def _registrar_inicio(job_id: str) -> int:
+    async with SessionLocal() as db:
+        # Con el lock del job tomado, otra ejecución "en_curso" es de un proceso que murió
+        await db.execute(
+            update(JobRun)
+            .where(JobRun.job_id == job_id, JobRun.estado == "en_curso")
+            .values(estado="interrumpido", finalizado_en=datetime.now(timezone.utc))
+        )
+        run_id = (
+            await db.execute(
+                insert(JobRun).values(job_id=job_id, worker_id=WORKER_ID, estado="en_curso").returning(JobRun.id)
+            )
+        ).scalar_one()
+        await db.commit()
+        return run_id
+
+
+async def _registrar_fin(run_id: int, job_id: str, estado_run: str, duracion_ms: int, resultado: Any, error: Optional[str]):
+    async with SessionLocal() as db:
+        await db.execute(
+            update(JobRun)
+            .where(JobRun.id == run_id)
+            .values(
+                estado=estado_run,
+                resultado=_serializable(resultado),
+                error=error,
+                finalizado_en=datetime.now(timezone.utc),
+                duracion_ms=duracion_ms,
+            )
+        )
+        await db.execute(
+            delete(JobRun).where(
+                JobRun.job_id == job_id,
+                JobRun.iniciado_en < datetime.now(timezone.utc) - timedelta(days=JOB_RUNS_RETENTION_DAYS),
+            )
+        )
+        await db.commit()
+
+
+async def ejecutar(job_id: str, func: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+    """
+    Ejecuta el job si este proceso es el líder y nadie más lo está ejecutando,
+    registrando la ejecución en job_runs.
+    """
+    if not _lider:
+        log.debug("Job %s omitido: %s no es líder", job_id, WORKER_ID)
+        return {"success": True, "omitido": True, "motivo": "no_lider"}
+    return await ejecutar_ahora(job_id, func, *args, **kwargs)
+
+
+async def ejecutar_ahora(job_id: str, func: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+    """
+    Ejecución manual (p.ej. desde un endpoint) en cualquier proceso: no exige ser líder,
+    pero toma el mismo lock del job, así no se solapa con la ejecución programada.
+    """
+    # El lock del job vive lo que dura esta transacción (se libera al salir, incluso si el proceso muere)
+    async with SessionLocal() as lock_db:
+        async with lock_db.begin():
+            tomado = (
+                await lock_db.execute(
+                    text("SELECT pg_try_advisory_xact_lock(:clase, hashtext(:job_id))"),
+                    {"clase": _JOB_LOCK_CLASE, "job_id": job_id},
+                )
+            ).scalar()
+            if not tomado:
+                log.info("Job %s omitido: ya se está ejecutando en otro proceso", job_id)
+                return {"success": True, "omitido": True, "motivo": "en_ejecucion"}
+
+            run_id = await _registrar_inicio(job_id)
+            inicio = time.monotonic()
+            resultado: Any = None
+            error: Optional[str] = None
+            try:
+                resultado = await func(*args, **kwargs)
+            except Exception as e:
+                log.error("Error en job %s: %s", job_id, e, exc_info=True)
+                error = str(e)
+            duracion_ms = int((time.monotonic() - inicio) * 1000)
+
+            # Los jobs del sistema retornan {"success": bool, ...}
+            exitoso = error is None and not (isinstance(resultado, dict) and resultado.get("success") is False)
+            if error is None and not exitoso:
+                error = str(resultado.get("error", "")) or None
+            await _registrar_fin(run_id, job_id, "exitoso" if exitoso else "fallido", duracion_ms, resultado, error)
+            log.info("Job %s %s en %s ms", job_id, "completado" if exitoso else "fallido", duracion_ms)
+            if resultado is None and error is not None:
+                return {"success": False, "error": error}
+            return resultado
+
+
+def exclusivo(job_id: str, func: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+    """Envuelve un job para registrarlo en el scheduler: solo corre en el líder."""
+
+    @wraps(func)
+    async def _job(*args, **kwargs):
+        return await ejecutar(job_id, func, *args, **kwargs)
+
+    return _job
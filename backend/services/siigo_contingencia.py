@@ -0,0 +1,573 @@
+"""
+Modo contingencia de facturación Siigo.
+
+- facturar_o_contingencia(): envía la factura con timeout; si Siigo está caído o lento
+  (o el modo contingencia está activo) no bloquea la venta: el llamador la guarda
+  localmente con es_contingencia / siigo_pendiente y el payload de la factura.
+- sincronizar_pendientes(): worker de puesta al día que envía las facturas pendientes
+  en lotes con concurrencia acotada (Semaphore + gather). Una sola ejecución a la vez
+  entre todos los procesos (advisory lock) y el progreso queda en contingencia_estado.
+
+Mientras el circuit breaker de Siigo está abierto las ventas van directo a la cola,
+así un caído no cuesta el timeout completo en cada venta.
+
+Resultado desconocido: un timeout (o una conexión cortada a mitad) no dice si Siigo
+creó la factura. Cada payload lleva en observations una referencia estable
+[ref:<hex>] y la venta queda con siigo_incierto; antes de reenviarla el worker busca
+en Siigo una factura con esa referencia y, si existe, la da por facturada.
+
+Rechazos (4xx de negocio) y ventas que agotan SIIGO_SYNC_MAX_INTENTOS salen de la cola
+a siigo_rechazada con el error: necesitan revisión manual (ver /api/contingencia/rechazadas).
+
+El modo forzado vive en contingencia_estado y se propaga a todos los procesos con
+NOTIFY siigo_contingencia (cada proceso lo escucha con una conexión asyncpg dedicada).
+"""
+
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime, timezone
+from typing import Optional
+from uuid import uuid4
+
+import aiohttp
+from sqlalchemy import select, func, text, tuple_, update
+
+from database import SessionLocal, DATABASE_URL
+from models import Sale, ContingenciaEstado
+from siigo_client import siigo_client, siigo_breaker, SiigoAPIError
+from utils.circuit_breaker import CircuitOpenError
+
+log = logging.getLogger("siigo-contingencia")
+
+SIIGO_TIMEOUT_SECONDS = float(os.getenv("SIIGO_TIMEOUT_SECONDS", "8"))
+SIIGO_SYNC_CONCURRENCIA = int(os.getenv("SIIGO_SYNC_CONCURRENCIA", "4"))
+SIIGO_SYNC_LOTE = int(os.getenv("SIIGO_SYNC_LOTE", "50"))
+SIIGO_SYNC_MAX_INTENTOS = int(os.getenv("SIIGO_SYNC_MAX_INTENTOS", "10"))
+
+CHANNEL = "siigo_contingencia"
+
+# Advisory lock de la sincronización (mismo espacio de dos claves que los jobs del scheduler)
+_SYNC_LOCK_CLASE = 7402
+_SYNC_LOCK_NOMBRE = "siigo_contingencia_sync"
+
+_REF_PREFIJO = "[ref:"
+
+# Copia local del modo forzado (se actualiza con NOTIFY); lo demás se lee de la BD
+_modo = {"forzado": False}
+
+_progreso = {
+    "en_ejecucion": False,
+    "total": 0,
+    "procesadas": 0,
+    "enviadas": 0,
+    "conciliadas": 0,
+    "fallidas": 0,
+    "rechazadas": 0,
+    "omitidas": 0,
+    "abortado": False,
+    "iniciado": None,
+    "finalizado": None,
+    "ultimo_error": None,
+}
+
+_sync_task: Optional[asyncio.Task] = None
+_listener_task: Optional[asyncio.Task] = None
+_fallidas_consecutivas = 0
+
+
+def _ahora() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+# ---------- modo contingencia ----------
+
+def en_contingencia() -> bool:
+    return _modo["forzado"] or siigo_breaker.is_open()
+
+
+async def _leer_estado(db) -> ContingenciaEstado:
+    estado = await db.get(ContingenciaEstado, 1)
+    if estado is None:
+        estado = ContingenciaEstado(id=1, forzado=False)
+        db.add(estado)
+        await db.flush()
+    return estado
+
+
+async def cargar_modo():
+    async with SessionLocal() as db:
+        estado = await db.get(ContingenciaEstado, 1)
+    _modo["forzado"] = bool(estado and estado.forzado)
+
+
+async def set_modo_forzado(activo: bool):
+    async with SessionLocal() as db:
+        estado = await _leer_estado(db)
+        estado.forzado = bool(activo)
+        estado.actualizado_en = _ahora()
+        # Los demás procesos actualizan su copia al hacer commit
+        await db.execute(text("SELECT pg_notify(:canal, 'modo')"), {"canal": CHANNEL})
+        await db.commit()
+    _modo["forzado"] = bool(activo)
+    log.warning("Modo contingencia Siigo %s manualmente", "ACTIVADO" if activo else "desactivado")
+
+
+async def _registrar_fallo(error: str):
+    try:
+        async with SessionLocal() as db:
+            await db.execute(
+                update(ContingenciaEstado)
+                .where(ContingenciaEstado.id == 1)
+                .values(ultimo_error=error[:2000], ultimo_error_en=_ahora())
+            )
+            await db.commit()
+    except Exception as e:
+        log.error("No se pudo registrar el error de Siigo: %s", e)
+
+
+async def estado_modo() -> dict:
+    async with SessionLocal() as db:
+        estado = await db.get(ContingenciaEstado, 1)
+    forzado = bool(estado and estado.forzado)
+    return {
+        "activo": forzado or siigo_breaker.is_open(),
+        "forzado": forzado,
+        "circuito_siigo": siigo_breaker.state,
+        "ultimo_error": estado.ultimo_error if estado else None,
+        "ultimo_error_en": estado.ultimo_error_en.isoformat() if estado and estado.ultimo_error_en else None,
+    }
+
+
+# ---------- referencia estable y conciliación ----------
+
+def referencia(invoice_payload: dict) -> Optional[str]:
+    obs = invoice_payload.get("observations") or ""
+    inicio = obs.rfind(_REF_PREFIJO)
+    if inicio < 0:
+        return None
+    fin = obs.find("]", inicio)
+    return obs[inicio + len(_REF_PREFIJO):fin] if fin > inicio else None
+
+
+def asignar_referencia(invoice_payload: dict) -> str:
+    """Agrega (una sola vez) la referencia [ref:<hex>] a observations; modifica el payload."""
+    ref = referencia(invoice_payload)
+    if ref is None:
+        ref = uuid4().hex
+        obs = (invoice_payload.get("observations") or "").strip()
+        invoice_payload["observations"] = f"{obs} {_REF_PREFIJO}{ref}]".strip()
+    return ref
+
+
+def _resultado_desconocido(e: BaseException) -> bool:
+    """True si Siigo pudo haber creado la factura aunque la llamada falló."""
+    if isinstance(e, CircuitOpenError):
+        return False  # no se envió
+    if isinstance(e, SiigoAPIError):
+        return e.status >= 500
+    if isinstance(e, aiohttp.ClientConnectorError):
+        return False  # no llegó a conectar
+    return True  # timeout, conexión cortada a mitad, ...
+
+
+async def buscar_factura(invoice_payload: dict) -> Optional[dict]:
+    """
+    Busca en Siigo la factura del payload por su referencia (mismo cliente y fecha).
+    Retorna la factura o None si no existe; los errores de la consulta se propagan.
+    """
+    ref = referencia(invoice_payload)
+    if ref is None:
+        raise ValueError("El payload no tiene referencia: no se puede conciliar con Siigo")
+
+    marca = f"{_REF_PREFIJO}{ref}]"
+    params = {
+        "customer_identification": (invoice_payload.get("customer") or {}).get("identification"),
+        "date_start": invoice_payload.get("date"),
+        "date_end": invoice_payload.get("date"),
+        "page_size": 100,
+        "page": 1,
+    }
+    params = {k: v for k, v in params.items() if v is not None}
+    while True:
+        data = await siigo_client.make_request("GET", "/v1/invoices", params=params)
+        resultados = data.get("results") or []
+        for factura in resultados:
+            if marca in (factura.get("observations") or ""):
+                return factura
+        total = (data.get("pagination") or {}).get("total_results", 0)
+        if not resultados or params["page"] * params["page_size"] >= total:
+            return None
+        params["page"] += 1
+
+
+# ---------- envío ----------
+
+async def enviar_factura(invoice_payload: dict, timeout_cap: Optional[float] = None) -> dict:
+    return await siigo_client.make_request("POST", "/v1/invoices", json=invoice_payload, timeout_cap=timeout_cap)
+
+
+async def facturar_o_contingencia(invoice_payload: dict) -> tuple[Optional[dict], Optional[str], bool]:
+    """
+    Intenta crear la factura en Siigo. Agrega al payload (in place) la referencia estable,
+    así el payload que se guarda en la venta es el que se envió.
+    Retorna (respuesta, None, False) si se facturó, o (None, motivo, incierto) si la venta
+    debe quedar en contingencia; incierto=True cuando Siigo pudo haberla creado (timeout).
+    Los rechazos 4xx de Siigo se propagan como antes (la venta no se registra).
+    """
+    asignar_referencia(invoice_payload)
+    if en_contingencia():
+        return None, "Modo contingencia activo", False
+
+    try:
+        # En caja no se espera más de SIIGO_TIMEOUT_SECONDS aunque el breaker permita más
+        return await enviar_factura(invoice_payload, timeout_cap=SIIGO_TIMEOUT_SECONDS), None, False
+    except asyncio.TimeoutError as e:
+        error = f"Siigo no respondió en {SIIGO_TIMEOUT_SECONDS:g}s"
+        incierto = _resultado_desconocido(e)
+    except Exception as e:
+        if isinstance(e, SiigoAPIError) and e.es_rechazo:
+            raise
+        error = str(e)
+        incierto = _resultado_desconocido(e)
+
+    await _registrar_fallo(error)
+    log.warning("Siigo no disponible, venta en contingencia%s: %s", " (resultado desconocido)" if incierto else "", error)
+    return None, error, incierto
+
+
+# ---------- worker de puesta al día ----------
+
+def _lock_params() -> dict:
+    return {"clase": _SYNC_LOCK_CLASE, "nombre": _SYNC_LOCK_NOMBRE}
+
+
+async def _sync_en_curso() -> bool:
+    """True si algún proceso tiene tomado el lock de la sincronización."""
+    async with SessionLocal() as db:
+        libre = (await db.execute(
+            text("SELECT pg_try_advisory_xact_lock(:clase, hashtext(:nombre))"), _lock_params()
+        )).scalar()
+        await db.rollback()
+    return not libre
+
+
+async def _guardar_progreso():
+    try:
+        async with SessionLocal() as db:
+            estado = await _leer_estado(db)
+            estado.progreso = dict(_progreso)
+            estado.actualizado_en = _ahora()
+            await db.commit()
+    except Exception as e:
+        log.error("No se pudo guardar el progreso de la sincronización: %s", e)
+
+
+async def progreso() -> dict:
+    """Progreso de la última sincronización (de cualquier proceso)."""
+    async with SessionLocal() as db:
+        estado = await db.get(ContingenciaEstado, 1)
+    datos = dict((estado.progreso if estado else None) or _progreso)
+    if datos.get("en_ejecucion") and not await _sync_en_curso():
+        # El proceso que la ejecutaba murió sin terminarla
+        datos["en_ejecucion"] = False
+        datos["interrumpido"] = True
+    return datos
+
+
+async def contar_pendientes() -> dict:
+    async with SessionLocal() as db:
+        row = (await db.execute(
+            select(
+                func.count(Sale.id),
+                func.min(Sale.created_at),
+                func.count(Sale.id).filter(Sale.siigo_ultimo_error.isnot(None)),
+                func.count(Sale.id).filter(Sale.siigo_incierto == True),
+            ).where(Sale.siigo_pendiente == True)
+        )).one()
+        rechazadas = (await db.execute(
+            select(func.count(Sale.id)).where(Sale.siigo_rechazada == True)
+        )).scalar()
+    return {
+        "pendientes": row[0],
+        "mas_antigua": row[1],
+        "con_error": row[2],
+        "por_conciliar": row[3],
+        "rechazadas": rechazadas,
+    }
+
+
+def _sacar_de_cola(venta: Sale, error: str):
+    venta.siigo_pendiente = False
+    venta.siigo_rechazada = True
+    venta.siigo_ultimo_error = error[:2000]
+
+
+def _marcar_facturada(venta: Sale, factura: dict):
+    venta.siigo_invoice_id = str(factura.get("number") or factura.get("id"))
+    venta.siigo_pendiente = False
+    venta.siigo_incierto = False
+    venta.siigo_ultimo_error = None
+
+
+async def _sincronizar_venta(sale_id, sem: asyncio.Semaphore, concurrencia: int):
+    global _fallidas_consecutivas
+
+    async with sem:
+        if _progreso["abortado"]:
+            return
+
+        async with SessionLocal() as db:
+            # El bloqueo de fila evita que se envíe la misma factura en paralelo
+            venta = (await db.execute(
+                select(Sale)
+                .where(Sale.id == sale_id, Sale.siigo_pendiente == True)
+                .with_for_update(skip_locked=True)
+            )).scalar_one_or_none()
+
+            if venta is None:
+                _progreso["omitidas"] += 1
+                _progreso["procesadas"] += 1
+                return
+
+            if not venta.siigo_payload:
+                _sacar_de_cola(venta, "Venta sin payload de factura guardado")
+                await db.commit()
+                _progreso["rechazadas"] += 1
+                _progreso["procesadas"] += 1
+                return
+
+            payload = json.loads(venta.siigo_payload)
+            venta.siigo_intentos = (venta.siigo_intentos or 0) + 1
+            enviada = False
+            try:
+                # Un envío anterior pudo haber creado la factura: se busca antes de reenviar
+                if venta.siigo_incierto:
+                    factura = await buscar_factura(payload)
+                    if factura is not None:
+                        _marcar_facturada(venta, factura)
+                        await db.commit()
+                        _fallidas_consecutivas = 0
+                        _progreso["conciliadas"] += 1
+                        _progreso["procesadas"] += 1
+                        return
+
+                # Antes de enviar: referencia e incierto=True confirmados en la BD, así si el
+                # proceso muere con la factura en vuelo la próxima ejecución la concilia
+                asignar_referencia(payload)
+                venta.siigo_payload = json.dumps(payload, default=str)
+                venta.siigo_incierto = True
+                await db.commit()
+
+                enviada = True
+                response = await enviar_factura(payload)
+            except Exception as e:
+                accion = "envío" if enviada else "conciliación"
+                if enviada and not _resultado_desconocido(e):
+                    # Siigo no creó la factura: el próximo intento puede enviarla sin buscar
+                    venta.siigo_incierto = False
+
+                if isinstance(e, CircuitOpenError):
+                    # Siigo se considera caído: no se intentó, se corta la ejecución
+                    venta.siigo_intentos -= 1
+                    _progreso["abortado"] = True
+                    _progreso["ultimo_error"] = str(e)
+                    _progreso["omitidas"] += 1
+                elif enviada and isinstance(e, SiigoAPIError) and e.es_rechazo:
+                    # Siigo rechazó el envío (4xx del POST): no creó la factura y reintentar no sirve.
+                    # Un 4xx de la búsqueda o una respuesta ilegible (ValueError) no dicen si la
+                    # factura existe: la venta sigue en cola y por conciliar
+                    _sacar_de_cola(venta, f"Rechazada en el {accion}: {e}")
+                    _progreso["rechazadas"] += 1
+                    _fallidas_consecutivas = 0
+                else:
+                    error = "Siigo no respondió (timeout)" if isinstance(e, asyncio.TimeoutError) else str(e)
+                    venta.siigo_ultimo_error = f"Falló el {accion}: {error}"[:2000]
+                    _progreso["fallidas"] += 1
+                    _progreso["ultimo_error"] = error
+                    _fallidas_consecutivas += 1
+                    # Siigo sigue caído: no tiene sentido seguir intentando el resto del lote
+                    if _fallidas_consecutivas >= concurrencia * 2:
+                        _progreso["abortado"] = True
+                        await _registrar_fallo(error)
+
+                    if venta.siigo_intentos >= SIIGO_SYNC_MAX_INTENTOS:
+                        verificar = f" (verificar en Siigo la referencia {referencia(payload)})" if venta.siigo_incierto else ""
+                        _sacar_de_cola(venta, f"Sin respuesta de Siigo tras {venta.siigo_intentos} intentos{verificar}: {error}")
+                        _progreso["rechazadas"] += 1
+
+                await db.commit()
+                _progreso["procesadas"] += 1
+                return
+
+            _marcar_facturada(venta, response)
+            await db.commit()
+
+        _fallidas_consecutivas = 0
+        _progreso["enviadas"] += 1
+        _progreso["procesadas"] += 1
+
+
+async def sincronizar_pendientes(concurrencia: Optional[int] = None, lote: Optional[int] = None) -> dict:
+    """
+    Envía a Siigo todas las ventas con siigo_pendiente, de la más antigua a la más nueva,
+    en lotes de 'lote' con 'concurrencia' envíos simultáneos. Una sola ejecución a la vez
+    entre todos los procesos: el advisory lock dura lo que la transacción de lock_db.
+    """
+    global _fallidas_consecutivas
+
+    concurrencia = max(1, concurrencia or SIIGO_SYNC_CONCURRENCIA)
+    lote = max(1, lote or SIIGO_SYNC_LOTE)
+
+    async with SessionLocal() as lock_db:
+        async with lock_db.begin():
+            tomado = (await lock_db.execute(
+                text("SELECT pg_try_advisory_xact_lock(:clase, hashtext(:nombre))"), _lock_params()
+            )).scalar()
+            if not tomado:
+                return await progreso()
+
+            _fallidas_consecutivas = 0
+            _progreso.update({
+                "en_ejecucion": True,
+                "total": (await contar_pendientes())["pendientes"],
+                "procesadas": 0,
+                "enviadas": 0,
+                "conciliadas": 0,
+                "fallidas": 0,
+                "rechazadas": 0,
+                "omitidas": 0,
+                "abortado": False,
+                "iniciado": _ahora().isoformat(),
+                "finalizado": None,
+                "ultimo_error": None,
+            })
+            await _guardar_progreso()
+            log.info("Sincronización Siigo iniciada: %s ventas pendientes", _progreso["total"])
+
+            sem = asyncio.Semaphore(concurrencia)
+            cursor = None
+            try:
+                while not _progreso["abortado"]:
+                    # Keyset sobre (created_at, id): las fallidas no se vuelven a tomar en esta ejecución
+                    q = select(Sale.id, Sale.created_at).where(Sale.siigo_pendiente == True)
+                    if cursor is not None:
+                        q = q.where(tuple_(Sale.created_at, Sale.id) > cursor)
+                    q = q.order_by(Sale.created_at, Sale.id).limit(lote)
+
+                    async with SessionLocal() as db:
+                        rows = (await db.execute(q)).all()
+                    if not rows:
+                        break
+                    cursor = (rows[-1].created_at, rows[-1].id)
+
+                    await asyncio.gather(*(_sincronizar_venta(r.id, sem, concurrencia) for r in rows))
+                    await _guardar_progreso()
+            except Exception as e:
+                log.error("Error en sincronización Siigo: %s", e, exc_info=True)
+                _progreso["ultimo_error"] = str(e)
+            finally:
+                _progreso["en_ejecucion"] = False
+                _progreso["finalizado"] = _ahora().isoformat()
+                await _guardar_progreso()
+
+            log.info(
+                "Sincronización Siigo finalizada: enviadas=%s conciliadas=%s fallidas=%s rechazadas=%s omitidas=%s abortado=%s",
+                _progreso["enviadas"], _progreso["conciliadas"], _progreso["fallidas"],
+                _progreso["rechazadas"], _progreso["omitidas"], _progreso["abortado"],
+            )
+            return dict(_progreso)
+
+
+async def iniciar_sincronizacion(concurrencia: Optional[int] = None, lote: Optional[int] = None) -> bool:
+    """Lanza la sincronización en segundo plano. Retorna False si ya hay una en curso (en cualquier proceso)."""
+    global _sync_task
+    if (_sync_task is not None and not _sync_task.done()) or await _sync_en_curso():
+        return False
+    _sync_task = asyncio.create_task(sincronizar_pendientes(concurrencia, lote))
+    return True
+
+
+async def reencolar(sale_id) -> bool:
+    """Devuelve a la cola una venta rechazada (p.ej. tras corregir el cliente en Siigo)."""
+    async with SessionLocal() as db:
+        res = await db.execute(
+            update(Sale)
+            .where(Sale.id == sale_id, Sale.siigo_rechazada == True)
+            .values(siigo_rechazada=False, siigo_pendiente=True, siigo_intentos=0)
+        )
+        await db.commit()
+    return res.rowcount > 0
+
+
+async def listar_rechazadas(limite: int = 100) -> list:
+    async with SessionLocal() as db:
+        ventas = (await db.execute(
+            select(Sale)
+            .where(Sale.siigo_rechazada == True)
+            .order_by(Sale.created_at.desc())
+            .limit(limite)
+        )).scalars().all()
+    return [
+        {
+            "venta_id": str(v.id),
+            "numero_consecutivo": v.numero_consecutivo,
+            "created_at": v.created_at,
+            "total": float(v.total or 0),
+            "customer_identification": v.customer_identification,
+            "siigo_intentos": v.siigo_intentos,
+            "por_conciliar": v.siigo_incierto,
+            "referencia": referencia(json.loads(v.siigo_payload)) if v.siigo_payload else None,
+            "error": v.siigo_ultimo_error,
+        }
+        for v in ventas
+    ]
+
+
+# ---------- LISTEN ----------
+
+def _asyncpg_dsn() -> str:
+    return DATABASE_URL.replace("postgresql+asyncpg://", "postgresql://", 1)
+
+
+async def _escuchar():
+    import asyncpg
+
+    while True:
+        conn = None
+        try:
+            conn = await asyncpg.connect(_asyncpg_dsn())
+            cerrada = asyncio.Event()
+            conn.add_termination_listener(lambda _c: cerrada.set())
+            await conn.add_listener(CHANNEL, lambda *_args: asyncio.create_task(cargar_modo()))
+            # Al (re)conectar se recarga: pudo haber cambios mientras no escuchábamos
+            await cargar_modo()
+            log.info("Escuchando NOTIFY %s", CHANNEL)
+            await cerrada.wait()
+            log.warning("Conexión LISTEN %s cerrada, reconectando", CHANNEL)
+        except asyncio.CancelledError:
+            break
+        except Exception as e:
+            log.error("LISTEN %s falló: %s", CHANNEL, e)
+        finally:
+            if conn is not None and not conn.is_closed():
+                await conn.close()
+        await asyncio.sleep(5)
+
+
+async def iniciar_listener():
+    global _listener_task
+    if _listener_task is None or _listener_task.done():
+        _listener_task = asyncio.create_task(_escuchar())
+
+
+async def detener_listener():
+    global _listener_task
+    if _listener_task is not None:
+        _listener_task.cancel()
+        try:
+            await _listener_task
+        except asyncio.CancelledError:
+            pass
+        _listener_task = None
@@ -0,0 +1,644 @@
+"""
+Recargas Winred por lote como jobs durables.
+
+- encolar_job(): crea el TopupJob y un TopupJobItem por SIM del lote (un solo INSERT ... SELECT).
+- ejecutar_job(): worker en segundo plano. Reclama el job de forma atómica (worker_id +
+  heartbeat_at), lee los ítems pendientes en tandas de TOPUP_FLUSH_EVERY y persiste los
+  resultados con TopupResultBuffer: un UPDATE de ítems, un UPDATE a sim_detalle y un commit
+  por flush (cada TOPUP_FLUSH_EVERY resultados o TOPUP_FLUSH_SECONDS segundos), no por SIM.
+  Cada ítem se marca en_curso (UPDATE de una fila y commit) justo antes de llamar a Winred,
+  así que en un momento dado solo hay uno en_curso por job; el resto de la tanda sigue
+  pendiente.
+- Si el proceso se cae el heartbeat deja de avanzar y reanudar_huerfanos() (al arrancar y
+  desde el scheduler) vuelve a reclamar el job y sigue desde el primer ítem pendiente.
+  El ítem que quedó en_curso pasa a 'verificar': pudo recargarse en Winred antes de la
+  caída y reenviarlo podría cobrar dos veces.
+- resolver_verificacion(): tras confirmar en Winred, un ítem 'verificar' se da por exitoso
+  o vuelve a pendiente para reenviarse.
+- suscribir(): cola de eventos de progreso en memoria; el SSE solo escucha, no ejecuta.
+
+El cliente Winred (routes/winred.py) se recibe como parámetro.
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Set
+from uuid import UUID
+
+from fastapi import HTTPException
+from sqlalchemy import select, update, insert, func, literal, or_, and_
+from sqlalchemy.dialects.postgresql import UUID as PG_UUID
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import SessionLocal
+from models import SimDetalle, SimLote, SimStatus, TopupJob, TopupJobItem
+from services import dashboard_cache, homologacion
+
+log = logging.getLogger("winred-topup")
+
+TOPUP_FLUSH_EVERY = int(os.getenv("TOPUP_FLUSH_EVERY", "50"))
+TOPUP_FLUSH_SECONDS = float(os.getenv("TOPUP_FLUSH_SECONDS", "5"))
+TOPUP_HEARTBEAT_SECONDS = float(os.getenv("TOPUP_HEARTBEAT_SECONDS", "15"))
+# Sin heartbeat durante este tiempo el job se considera huérfano y se puede retomar
+TOPUP_STALE_SECONDS = float(os.getenv("TOPUP_STALE_SECONDS", "90"))
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+ESTADOS_FINALES = ("completado", "interrumpido")
+
+_tareas: Dict[UUID, asyncio.Task] = {}
+_suscriptores: Dict[UUID, Set[asyncio.Queue]] = {}
+
+
+class WinredNoDisponible(Exception):
+    """Winred rechazó la llamada sin procesarla (circuito abierto): el job se pausa."""
+
+
+# ---------- eventos de progreso ----------
+
+def suscribir(job_id: UUID) -> asyncio.Queue:
+    cola: asyncio.Queue = asyncio.Queue(maxsize=1000)
+    _suscriptores.setdefault(job_id, set()).add(cola)
+    return cola
+
+
+def desuscribir(job_id: UUID, cola: asyncio.Queue):
+    subs = _suscriptores.get(job_id)
+    if subs is not None:
+        subs.discard(cola)
+        if not subs:
+            _suscriptores.pop(job_id, None)
+
+
+def _publicar(job_id: UUID, evento: Dict[str, Any]):
+    for cola in list(_suscriptores.get(job_id, ())):
+        try:
+            cola.put_nowait(evento)
+        except asyncio.QueueFull:
+            # suscriptor lento: pierde eventos intermedios, el 'complete' trae los totales
+            pass
+
+
+# ---------- creación y consulta ----------
+
+async def encolar_job(
+    db: AsyncSession, *, lote_id: str, winred_product_id: str, amount: str, sell_from: str
+) -> Optional[TopupJob]:
+    """Crea el job con un ítem por SIM del lote. Retorna None si el lote no tiene SIMs."""
+    job = TopupJob(
+        lote_id=str(lote_id),
+        winred_product_id=str(winred_product_id),
+        amount=str(amount),
+        sell_from=str(sell_from),
+        estado="pendiente",
+    )
+    db.add(job)
+    await db.flush()
+
+    res = await db.execute(
+        insert(TopupJobItem).from_select(
+            ["job_id", "posicion", "sim_detalle_id", "msisdn"],
+            select(
+                literal(job.id, PG_UUID(as_uuid=True)),
+                func.row_number().over(order_by=SimDetalle.id),
+                SimDetalle.id,
+                SimDetalle.numero_linea,
+            ).where(SimDetalle.lote_id == str(lote_id)),
+        )
+    )
+    if not res.rowcount:
+        await db.rollback()
+        return None
+
+    job.total = res.rowcount
+    await db.commit()
+    return job
+
+
+async def resumen(db: AsyncSession, job_id: UUID, max_items: int = 500) -> Optional[Dict[str, Any]]:
+    """Estado del job, conteo de ítems por estado y detalle de los fallidos / por verificar."""
+    job = await db.get(TopupJob, job_id, populate_existing=True)
+    if job is None:
+        return None
+
+    conteo = dict((await db.execute(
+        select(TopupJobItem.estado, func.count())
+        .where(TopupJobItem.job_id == job_id)
+        .group_by(TopupJobItem.estado)
+    )).all())
+
+    problemas = (await db.execute(
+        select(TopupJobItem.posicion, TopupJobItem.msisdn, TopupJobItem.estado, TopupJobItem.error)
+        .where(TopupJobItem.job_id == job_id, TopupJobItem.estado.in_(("fallida", "verificar")))
+        .order_by(TopupJobItem.posicion)
+        .limit(max_items)
+    )).all()
+
+    return {
+        "job_id": str(job.id),
+        "lote_id": job.lote_id,
+        "winred_product_id": job.winred_product_id,
+        "amount": job.amount,
+        "sell_from": job.sell_from,
+        "estado": job.estado,
+        "worker_id": job.worker_id,
+        "heartbeat_at": job.heartbeat_at.isoformat() if job.heartbeat_at else None,
+        "total": job.total,
+        "procesadas": job.procesadas,
+        "exitosas": job.exitosas,
+        "fallidas": job.fallidas,
+        "por_verificar": job.por_verificar,
+        "ultimo_indice": job.ultimo_indice,
+        "ultimo_error": job.ultimo_error,
+        "items": {e: conteo.get(e, 0) for e in ("pendiente", "en_curso", "exitosa", "fallida", "verificar")},
+        "problemas": [
+            {"posicion": p.posicion, "msisdn": p.msisdn, "estado": p.estado, "error": p.error}
+            for p in problemas
+        ],
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+# ---------- persistencia por lotes ----------
+
+class TopupResultBuffer:
+    """Acumula resultados de ítems y los vuelca en una sola transacción."""
+
+    def __init__(
+        self,
+        db: AsyncSession,
+        job: TopupJob,
+        *,
+        siigo_code: Optional[str],
+        max_items: int = TOPUP_FLUSH_EVERY,
+        max_seconds: float = TOPUP_FLUSH_SECONDS,
+    ):
+        self.db = db
+        self.job = job
+        self.siigo_code = siigo_code
+        self.max_items = max(1, max_items)
+        self.max_seconds = max_seconds
+
+        self._items: List[Dict[str, Any]] = []
+        self._sims_exitosas: List[str] = []
+        self._ultimo_indice = job.ultimo_indice or 0
+        self._ultimo_error: Optional[str] = None
+        self._last_flush = time.monotonic()
+        self.commits = 0
+
+    @property
+    def pendientes(self) -> int:
+        return len(self._items)
+
+    def _agregar(self, item, estado: str, error: Optional[str] = None):
+        self._items.append({
+            "id": item.id,
+            "estado": estado,
+            "error": str(error)[:2000] if error else None,
+            "procesado_en": datetime.now(timezone.utc),
+        })
+        self._ultimo_indice = max(self._ultimo_indice, item.posicion)
+        if error:
+            self._ultimo_error = str(error)[:2000]
+
+    def add_success(self, item):
+        self._agregar(item, "exitosa")
+        if item.sim_detalle_id:
+            self._sims_exitosas.append(item.sim_detalle_id)
+
+    def add_failure(self, item, error: Optional[str] = None):
+        self._agregar(item, "fallida", error)
+
+    def add_verificar(self, item, error: Optional[str] = None):
+        self._agregar(item, "verificar", error)
+
+    async def maybe_flush(self) -> bool:
+        """Vuelca si se alcanzó el tamaño o el tiempo máximo. Retorna True si hizo flush."""
+        if self.pendientes >= self.max_items or (
+            self.pendientes and time.monotonic() - self._last_flush >= self.max_seconds
+        ):
+            await self.flush()
+            return True
+        return False
+
+    async def flush(self, final: bool = False):
+        """UPDATE de ítems + UPDATE de SIMs + UPDATE del job, en un commit."""
+        items, sims = self._items, self._sims_exitosas
+
+        if items:
+            # UPDATE por clave primaria en un solo executemany
+            await self.db.execute(update(TopupJobItem), items)
+
+        if sims and self.siigo_code:
+            await self.db.execute(
+                update(SimDetalle)
+                .where(SimDetalle.id.in_(sims))
+                .values(
+                    plan_asignado=self.siigo_code,
+                    winred_product_id=self.job.winred_product_id,
+                    fecha_ultima_recarga=func.now(),
+                    estado=SimStatus.recargado,
+                )
+                .execution_options(synchronize_session=False)
+            )
+
+        n_ok = sum(1 for i in items if i["estado"] == "exitosa")
+        n_fail = sum(1 for i in items if i["estado"] == "fallida")
+        n_verif = len(items) - n_ok - n_fail
+        valores = dict(
+            procesadas=TopupJob.procesadas + len(items),
+            exitosas=TopupJob.exitosas + n_ok,
+            fallidas=TopupJob.fallidas + n_fail,
+            por_verificar=TopupJob.por_verificar + n_verif,
+            ultimo_indice=self._ultimo_indice,
+            heartbeat_at=func.now(),
+        )
+        if self._ultimo_error:
+            valores["ultimo_error"] = self._ultimo_error
+
+        if final:
+            if self.siigo_code:
+                await self.db.execute(
+                    update(SimLote).where(SimLote.id == self.job.lote_id).values(plan_asignado=self.siigo_code)
+                )
+            valores.update(estado="completado", worker_id=None, finished_at=datetime.now(timezone.utc))
+
+        if items or final:
+            await self.db.execute(
+                update(TopupJob)
+                .where(TopupJob.id == self.job.id)
+                .values(**valores)
+                .execution_options(synchronize_session=False)
+            )
+            if self.siigo_code and (sims or final):
+                await dashboard_cache.invalidar(self.db, "sims")
+            await self.db.commit()
+            self.commits += 1
+            log.info(
+                "Topup job %s: flush de %s exitosas / %s fallidas / %s por verificar (índice %s%s)",
+                self.job.id, n_ok, n_fail, n_verif, self._ultimo_indice, ", final" if final else "",
+            )
+
+        self._items = []
+        self._sims_exitosas = []
+        self._ultimo_error = None
+        self._last_flush = time.monotonic()
+
+
+# ---------- worker ----------
+
+def _resultado(resp: Dict[str, Any]) -> tuple:
+    ok = (resp.get("result", {}) or {}).get("success") is True or resp.get("success") is True
+    msg = (resp.get("result", {}) or {}).get("message") or resp.get("message")
+    return ok, msg
+
+
+async def _reclamar(db: AsyncSession, job_id: UUID) -> Optional[TopupJob]:
+    """Toma el job si está pendiente o huérfano. Solo un worker puede ganar el UPDATE."""
+    limite = datetime.now(timezone.utc) - timedelta(seconds=TOPUP_STALE_SECONDS)
+    res = await db.execute(
+        update(TopupJob)
+        .where(
+            TopupJob.id == job_id,
+            or_(
+                TopupJob.estado == "pendiente",
+                and_(
+                    TopupJob.estado == "en_curso",
+                    or_(TopupJob.worker_id.is_(None), TopupJob.heartbeat_at.is_(None), TopupJob.heartbeat_at < limite),
+                ),
+            ),
+        )
+        .values(estado="en_curso", worker_id=WORKER_ID, heartbeat_at=func.now())
+        .returning(TopupJob.id)
+    )
+    if res.scalar_one_or_none() is None:
+        await db.rollback()
+        return None
+
+    # Reanudación: lo que quedó en_curso pudo llegar a Winred, no se reenvía
+    verif = await db.execute(
+        update(TopupJobItem)
+        .where(TopupJobItem.job_id == job_id, TopupJobItem.estado == "en_curso")
+        .values(
+            estado="verificar",
+            error="Interrumpida durante la recarga; confirmar en Winred antes de reintentar",
+            procesado_en=func.now(),
+        )
+    )
+    if verif.rowcount:
+        await db.execute(
+            update(TopupJob)
+            .where(TopupJob.id == job_id)
+            .values(
+                procesadas=TopupJob.procesadas + verif.rowcount,
+                por_verificar=TopupJob.por_verificar + verif.rowcount,
+            )
+        )
+        log.warning("Topup job %s reanudado: %s SIMs quedan por verificar", job_id, verif.rowcount)
+    await db.commit()
+
+    return await db.get(TopupJob, job_id, populate_existing=True)
+
+
+async def _latido(job_id: UUID, perdido: asyncio.Event):
+    """Renueva heartbeat_at; si otro worker se quedó con el job, avisa para detenerse."""
+    while True:
+        await asyncio.sleep(TOPUP_HEARTBEAT_SECONDS)
+        try:
+            async with SessionLocal() as db:
+                res = await db.execute(
+                    update(TopupJob)
+                    .where(TopupJob.id == job_id, TopupJob.worker_id == WORKER_ID)
+                    .values(heartbeat_at=func.now())
+                )
+                await db.commit()
+            if not res.rowcount:
+                log.warning("Topup job %s ya no pertenece a este worker", job_id)
+                perdido.set()
+                return
+        except Exception as e:
+            log.error("Heartbeat del topup job %s falló: %s", job_id, e)
+
+
+async def _devolver_items(db: AsyncSession, ids: List[int], estado: str, error: Optional[str] = None):
+    if ids:
+        await db.execute(
+            update(TopupJobItem).where(TopupJobItem.id.in_(ids)).values(estado=estado, error=error)
+        )
+
+
+async def _procesar(db: AsyncSession, job: TopupJob, client, perdido: asyncio.Event):
+    siigo_code = await homologacion.get_siigo_code(job.winred_product_id)
+    buffer = TopupResultBuffer(db, job, siigo_code=siigo_code)
+
+    en_vuelo = no_enviado = None
+    try:
+        while not perdido.is_set():
+            tanda = list((await db.execute(
+                select(TopupJobItem.id, TopupJobItem.posicion, TopupJobItem.msisdn, TopupJobItem.sim_detalle_id)
+                .where(TopupJobItem.job_id == job.id, TopupJobItem.estado == "pendiente")
+                .order_by(TopupJobItem.posicion)
+                .limit(buffer.max_items)
+            )).all())
+            if not tanda:
+                break
+
+            while tanda and not perdido.is_set():
+                item = tanda.pop(0)
+
+                # Se marca antes de llamar a Winred: si el proceso muere, se sabe cuál pudo enviarse.
+                # Solo si el job sigue siendo de este worker y nadie más tomó el ítem.
+                marca = await db.execute(
+                    update(TopupJobItem)
+                    .where(
+                        TopupJobItem.id == item.id,
+                        TopupJobItem.estado == "pendiente",
+                        select(TopupJob.id).where(TopupJob.id == job.id, TopupJob.worker_id == WORKER_ID).exists(),
+                    )
+                    .values(estado="en_curso")
+                )
+                await db.commit()
+                if not marca.rowcount:
+                    log.warning("Topup job %s: el ítem %s ya no es de este worker", job.id, item.posicion)
+                    perdido.set()
+                    break
+                en_vuelo = item
+
+                _publicar(job.id, {"type": "processing", "msisdn": item.msisdn, "index": item.posicion, "total": job.total})
+
+                data = {
+                    "product_id": job.winred_product_id,
+                    "amount": job.amount,
+                    "suscriber": item.msisdn,
+                    "sell_from": job.sell_from,
+                }
+                try:
+                    resp = await client.post_textplain_body("topup", data)
+                    ok, msg = _resultado(resp)
+                except HTTPException as e:
+                    if e.status_code == 503:
+                        # circuito abierto: la recarga no salió, el ítem vuelve a pendiente
+                        no_enviado, en_vuelo = item, None
+                        raise WinredNoDisponible(str(e.detail))
+                    if e.status_code == 504:
+                        # timeout: Winred pudo procesarla
+                        buffer.add_verificar(item, e.detail)
+                        _publicar(job.id, {"type": "verify", "msisdn": item.msisdn, "error": e.detail, "index": item.posicion, "total": job.total})
+                        en_vuelo = None
+                        await buffer.maybe_flush()
+                        continue
+                    ok, msg = False, str(e.detail)
+                except Exception as e:
+                    ok, msg = False, str(e)
+
+                en_vuelo = None
+                if ok:
+                    buffer.add_success(item)
+                    _publicar(job.id, {"type": "success", "msisdn": item.msisdn, "index": item.posicion, "total": job.total})
+                else:
+                    buffer.add_failure(item, msg or "Winred rechazó la transacción")
+                    _publicar(job.id, {"type": "error", "msisdn": item.msisdn, "error": msg, "index": item.posicion, "total": job.total})
+
+                await buffer.maybe_flush()
+
+        if perdido.is_set():
+            # El nuevo dueño ya pasó a 'verificar' el ítem en vuelo; solo se guardan los resultados conocidos
+            await buffer.flush()
+            return
+
+        await buffer.flush(final=True)
+        await db.refresh(job)
+        _publicar(job.id, {
+            "type": "complete",
+            "job_id": str(job.id),
+            "successful": job.exitosas,
+            "failed": job.fallidas,
+            "verify": job.por_verificar,
+            "total": job.total,
+        })
+
+    except (asyncio.CancelledError, WinredNoDisponible, Exception) as e:
+        cancelado = isinstance(e, asyncio.CancelledError)
+        try:
+            await db.rollback()
+            await buffer.flush()
+            if no_enviado is not None:
+                await _devolver_items(db, [no_enviado.id], "pendiente")
+            if en_vuelo is not None:
+                await _devolver_items(
+                    db, [en_vuelo.id], "verificar", "Interrumpida durante la recarga; confirmar en Winred antes de reintentar"
+                )
+            if cancelado:
+                # apagado del proceso: el job queda libre para que otro worker lo retome ya
+                valores = dict(worker_id=None, heartbeat_at=None)
+            else:
+                valores = dict(estado="interrumpido", worker_id=None, ultimo_error=str(e)[:2000])
+            if en_vuelo is not None:
+                valores.update(
+                    procesadas=TopupJob.procesadas + 1,
+                    por_verificar=TopupJob.por_verificar + 1,
+                )
+            await db.execute(update(TopupJob).where(TopupJob.id == job.id).values(**valores))
+            await db.commit()
+        except Exception as e2:
+            log.error("No se pudo liberar el topup job %s: %s", job.id, e2)
+
+        if cancelado:
+            raise
+        log.error("Topup job %s interrumpido: %s", job.id, e)
+        _publicar(job.id, {"type": "interrupted", "job_id": str(job.id), "message": str(e)})
+
+
+async def ejecutar_job(job_id: UUID, client) -> bool:
+    """Procesa el job si lo puede reclamar. Retorna False si lo tiene otro worker o ya terminó."""
+    async with SessionLocal() as db:
+        job = await _reclamar(db, job_id)
+        if job is None:
+            return False
+
+        log.info("Topup job %s reclamado por %s (%s/%s procesadas)", job_id, WORKER_ID, job.procesadas, job.total)
+        perdido = asyncio.Event()
+        latido = asyncio.create_task(_latido(job.id, perdido))
+        try:
+            await _procesar(db, job, client, perdido)
+        finally:
+            latido.cancel()
+        return True
+
+
+def lanzar(job_id: UUID, client) -> asyncio.Task:
+    """Ejecuta el job en segundo plano en este proceso (una tarea por job)."""
+    tarea = _tareas.get(job_id)
+    if tarea is None or tarea.done():
+        tarea = asyncio.create_task(ejecutar_job(job_id, client))
+        _tareas[job_id] = tarea
+        tarea.add_done_callback(lambda t: _tareas.pop(job_id, None) if _tareas.get(job_id) is t else None)
+    return tarea
+
+
+async def reanudar(db: AsyncSession, job_id: UUID, client) -> bool:
+    """Vuelve a encolar un job interrumpido (p.ej. tras una caída de Winred)."""
+    res = await db.execute(
+        update(TopupJob)
+        .where(TopupJob.id == job_id, TopupJob.estado == "interrumpido")
+        .values(estado="pendiente", worker_id=None, heartbeat_at=None, finished_at=None)
+    )
+    await db.commit()
+    if not res.rowcount:
+        return False
+    lanzar(job_id, client)
+    return True
+
+
+async def resolver_verificacion(
+    db: AsyncSession, job_id: UUID, resultado: str, client, posiciones: Optional[List[int]] = None
+) -> int:
+    """
+    Resuelve ítems 'verificar' ya confirmados en Winred (todos, o solo las posiciones dadas).
+    resultado='exitosa': la recarga sí se hizo; se aplica a la SIM como cualquier éxito.
+    resultado='pendiente': no se hizo; el ítem se vuelve a enviar (el job se relanza si ya
+    había terminado; si está interrumpido se retoma con reanudar()).
+    Retorna cuántos ítems se resolvieron.
+    """
+    if resultado not in ("exitosa", "pendiente"):
+        raise HTTPException(status_code=400, detail="resultado debe ser 'exitosa' o 'pendiente'")
+
+    job = await db.get(TopupJob, job_id, populate_existing=True, with_for_update=True)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job no encontrado")
+    if resultado == "pendiente" and job.estado == "en_curso":
+        # El worker podría estar cerrando el job y dejaría los ítems sin procesar
+        await db.rollback()
+        raise HTTPException(status_code=409, detail="El job está en curso; espere a que termine para reenviar ítems")
+
+    filtro = [TopupJobItem.job_id == job_id, TopupJobItem.estado == "verificar"]
+    if posiciones:
+        filtro.append(TopupJobItem.posicion.in_(posiciones))
+
+    if resultado == "exitosa":
+        sims = (await db.execute(
+            update(TopupJobItem)
+            .where(*filtro)
+            .values(estado="exitosa", error=None, procesado_en=func.now())
+            .returning(TopupJobItem.sim_detalle_id)
+        )).scalars().all()
+        n = len(sims)
+        siigo_code = await homologacion.get_siigo_code(job.winred_product_id)
+        sims = [s for s in sims if s]
+        if sims and siigo_code:
+            await db.execute(
+                update(SimDetalle)
+                .where(SimDetalle.id.in_(sims))
+                .values(
+                    plan_asignado=siigo_code,
+                    winred_product_id=job.winred_product_id,
+                    fecha_ultima_recarga=func.now(),
+                    estado=SimStatus.recargado,
+                )
+                .execution_options(synchronize_session=False)
+            )
+            await dashboard_cache.invalidar(db, "sims")
+        valores = dict(exitosas=TopupJob.exitosas + n, por_verificar=TopupJob.por_verificar - n)
+        relanzar = False
+    else:
+        n = len((await db.execute(
+            update(TopupJobItem)
+            .where(*filtro)
+            .values(estado="pendiente", error=None, procesado_en=None)
+            .returning(TopupJobItem.id)
+        )).all())
+        valores = dict(procesadas=TopupJob.procesadas - n, por_verificar=TopupJob.por_verificar - n)
+        relanzar = n > 0 and job.estado == "completado"
+        if relanzar:
+            valores.update(estado="pendiente", worker_id=None, heartbeat_at=None, finished_at=None)
+
+    if n:
+        await db.execute(
+            update(TopupJob)
+            .where(TopupJob.id == job_id)
+            .values(**valores)
+            .execution_options(synchronize_session=False)
+        )
+    await db.commit()
+
+    if relanzar:
+        lanzar(job_id, client)
+    log.info("Topup job %s: %s ítems por verificar resueltos como %s", job_id, n, resultado)
+    return n
+
+
+async def reanudar_huerfanos(client) -> int:
+    """Lanza los jobs pendientes o sin heartbeat reciente. Retorna cuántos se lanzaron."""
+    limite = datetime.now(timezone.utc) - timedelta(seconds=TOPUP_STALE_SECONDS)
+    async with SessionLocal() as db:
+        ids = (await db.execute(
+            select(TopupJob.id).where(
+                or_(
+                    TopupJob.estado == "pendiente",
+                    and_(
+                        TopupJob.estado == "en_curso",
+                        or_(TopupJob.worker_id.is_(None), TopupJob.heartbeat_at.is_(None), TopupJob.heartbeat_at < limite),
+                    ),
+                )
+            )
+        )).scalars().all()
+
+    for job_id in ids:
+        lanzar(job_id, client)
+    if ids:
+        log.info("Reanudando %s topup jobs", len(ids))
+    return len(ids)
+
+
+async def detener_workers():
+    """Al apagar: cancela los workers de este proceso; cada uno libera su job para que se retome."""
+    tareas = list(_tareas.values())
+    for t in tareas:
+        t.cancel()
+    if tareas:
+        await asyncio.gather(*tareas, return_exceptions=True)
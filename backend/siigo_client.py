@@ -4,9 +4,30 @@ import json
 from datetime import datetime, timedelta
 from typing import List, Optional, Dict, Any
 from dotenv import load_dotenv
+from utils.circuit_breaker import get_breaker
 
 load_dotenv()
 
+# Siigo no tenía timeout: el breaker aplica uno adaptativo (p95 de latencias, máx. 20s)
+siigo_breaker = get_breaker("siigo", max_timeout=20.0, min_timeout=3.0)
+
+
+class SiigoAPIError(Exception):
+    def __init__(self, status: int, body: str):
+        self.status = status
+        self.body = body
+        super().__init__(f"Siigo API error {status}: {body}")
+
+    @property
+    def es_rechazo(self) -> bool:
+        """4xx de negocio (payload inválido, duplicado...): Siigo está arriba, reintentar no sirve."""
+        return 400 <= self.status < 500 and self.status not in (401, 408, 429)
+
+
+def _es_caida_de_siigo(e: BaseException) -> bool:
+    return not (isinstance(e, SiigoAPIError) and e.es_rechazo)
+
+
 class SiigoClient:
     def __init__(self):
         self.user = os.getenv("SIIGO_USER")
@@ -43,7 +64,19 @@ class SiigoClient:
         except Exception as e:
             raise
 
-    async def make_request(self, method: str, endpoint: str, **kwargs):
+    async def make_request(self, method: str, endpoint: str, timeout_cap: Optional[float] = None, **kwargs):
+        """
+        Llamada a Siigo protegida por el circuit breaker: timeout adaptativo y
+        CircuitOpenError inmediato mientras Siigo se considera caído.
+        timeout_cap acota el timeout (p.ej. en caja, donde no se puede esperar 20s).
+        """
+        return await siigo_breaker.call(
+            lambda: self._make_request(method, endpoint, **kwargs),
+            is_failure=_es_caida_de_siigo,
+            timeout_cap=timeout_cap,
+        )
+
+    async def _make_request(self, method: str, endpoint: str, **kwargs):
         token = await self.get_token()
         headers = {
             "Authorization": f"Bearer {token}",
@@ -57,6 +90,6 @@ class SiigoClient:
                     return await resp.json()
                 else:
                     error_text = await resp.text()
-                    raise Exception(f"Siigo API error {resp.status}: {error_text}")
+                    raise SiigoAPIError(resp.status, error_text)
 
 siigo_client = SiigoClient()
\ No newline at end of file
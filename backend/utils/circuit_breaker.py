@@ -0,0 +1,221 @@
+"""
+Circuit breaker por servicio externo (Siigo, Winred) con timeout adaptativo.
+
+- closed:    las llamadas pasan; N fallos seguidos abren el circuito.
+- open:      las llamadas fallan al instante con CircuitOpenError durante recovery_seconds.
+- half_open: pasado ese tiempo se deja pasar una llamada de prueba; si responde bien
+             el circuito se cierra, si falla vuelve a abrirse.
+
+El timeout de cada llamada sale del percentil (p95 por defecto) de las latencias
+recientes multiplicado por un margen, acotado entre min_timeout y max_timeout.
+Mientras no hay muestras suficientes se usa max_timeout. Las llamadas que vencen entran
+a la ventana con el valor del timeout: si el servicio se vuelve más lento el timeout
+crece en lugar de cortar siempre antes de la respuesta. La llamada de prueba en
+half_open usa max_timeout, así una ventana vieja no impide que el circuito se cierre.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+log = logging.getLogger("circuit-breaker")
+
+T = TypeVar("T")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """El circuito está abierto: el servicio externo se considera caído."""
+
+    def __init__(self, name: str, retry_in: float):
+        self.name = name
+        self.retry_in = retry_in
+        super().__init__(f"Servicio {name} no disponible (circuito abierto, reintento en {retry_in:.0f}s)")
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 5,
+        recovery_seconds: float = 30.0,
+        min_timeout: float = 2.0,
+        max_timeout: float = 30.0,
+        percentile: float = 0.95,
+        multiplier: float = 2.0,
+        window: int = 100,
+        min_samples: int = 10,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_seconds = recovery_seconds
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.percentile = percentile
+        self.multiplier = multiplier
+        self.min_samples = min_samples
+
+        self._latencies: deque = deque(maxlen=window)
+        self._state = CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+
+        # Contadores para el health check
+        self._calls = 0
+        self._failures = 0
+        self._rejected = 0
+        self._timeouts = 0
+        self._last_error: Optional[str] = None
+        self._last_state_change = time.time()
+
+    # ---------- estado ----------
+
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.recovery_seconds:
+            return HALF_OPEN
+        return self._state
+
+    def is_open(self) -> bool:
+        """True si el circuito rechazaría una llamada ahora mismo."""
+        st = self.state
+        return st == OPEN or (st == HALF_OPEN and self._probe_in_flight)
+
+    def _set_state(self, new_state: str):
+        if new_state != self._state:
+            log.warning("Circuito %s: %s -> %s", self.name, self._state, new_state)
+            self._state = new_state
+            self._last_state_change = time.time()
+
+    def _latency_percentile(self) -> Optional[float]:
+        if len(self._latencies) < self.min_samples:
+            return None
+        data = sorted(self._latencies)
+        idx = min(len(data) - 1, int(round(self.percentile * (len(data) - 1))))
+        return data[idx]
+
+    def current_timeout(self) -> float:
+        p = self._latency_percentile()
+        if p is None:
+            return self.max_timeout
+        return max(self.min_timeout, min(self.max_timeout, p * self.multiplier))
+
+    # ---------- registro ----------
+
+    def _on_success(self, latency: float):
+        self._latencies.append(latency)
+        self._consecutive_failures = 0
+        self._set_state(CLOSED)
+
+    def _on_failure(self, error: str):
+        self._failures += 1
+        self._consecutive_failures += 1
+        self._last_error = error
+        if self._state == HALF_OPEN or self._consecutive_failures >= self.failure_threshold:
+            self._opened_at = time.monotonic()
+            self._set_state(OPEN)
+
+    # ---------- llamada ----------
+
+    async def call(
+        self,
+        factory: Callable[[], Awaitable[T]],
+        is_failure: Optional[Callable[[BaseException], bool]] = None,
+        timeout_cap: Optional[float] = None,
+    ) -> T:
+        """
+        Ejecuta factory() con el timeout adaptativo (o timeout_cap si es menor).
+        is_failure(exc) decide si una excepción cuenta como caída del servicio
+        (por defecto todas); p.ej. un 4xx del proveedor no debe abrir el circuito.
+        """
+        st = self.state
+        if st == OPEN or (st == HALF_OPEN and self._probe_in_flight):
+            self._rejected += 1
+            retry_in = max(0.0, self.recovery_seconds - (time.monotonic() - self._opened_at))
+            raise CircuitOpenError(self.name, retry_in)
+
+        probing = st == HALF_OPEN
+        if probing:
+            self._state = HALF_OPEN
+            self._probe_in_flight = True
+
+        self._calls += 1
+        timeout = self.max_timeout if probing else self.current_timeout()
+        if timeout_cap is not None:
+            timeout = min(timeout, timeout_cap)
+        start = time.monotonic()
+        try:
+            result = await asyncio.wait_for(factory(), timeout=timeout)
+        except asyncio.TimeoutError:
+            self._timeouts += 1
+            # Tardó al menos esto: sin registrarlo la ventana solo ve las respuestas rápidas
+            self._latencies.append(timeout)
+            self._on_failure(f"Timeout tras {timeout:.1f}s")
+            raise
+        except asyncio.CancelledError:
+            raise
+        except BaseException as e:
+            if is_failure is None or is_failure(e):
+                self._on_failure(f"{type(e).__name__}: {e}"[:300])
+            elif probing:
+                # El servicio respondió (aunque con error de negocio): está vivo
+                self._on_success(time.monotonic() - start)
+            raise
+        finally:
+            if probing:
+                self._probe_in_flight = False
+
+        self._on_success(time.monotonic() - start)
+        return result
+
+    def snapshot(self) -> dict:
+        p = self._latency_percentile()
+        return {
+            "state": self.state,
+            "timeout_s": round(self.current_timeout(), 2),
+            f"p{int(self.percentile * 100)}_latency_s": round(p, 3) if p is not None else None,
+            "samples": len(self._latencies),
+            "consecutive_failures": self._consecutive_failures,
+            "calls": self._calls,
+            "failures": self._failures,
+            "timeouts": self._timeouts,
+            "rejected": self._rejected,
+            "last_error": self._last_error,
+            "last_state_change": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self._last_state_change)),
+        }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def get_breaker(name: str, **config) -> CircuitBreaker:
+    """
+    Devuelve el breaker registrado con ese nombre (lo crea la primera vez).
+    Los valores por defecto se pueden sobreescribir con variables de entorno
+    {NAME}_CB_FAILURES, {NAME}_CB_RECOVERY_SECONDS, {NAME}_TIMEOUT_MIN y {NAME}_TIMEOUT_MAX.
+    """
+    if name not in _breakers:
+        prefix = name.upper()
+        env_map = {
+            "failure_threshold": (f"{prefix}_CB_FAILURES", int),
+            "recovery_seconds": (f"{prefix}_CB_RECOVERY_SECONDS", float),
+            "min_timeout": (f"{prefix}_TIMEOUT_MIN", float),
+            "max_timeout": (f"{prefix}_TIMEOUT_MAX", float),
+        }
+        for key, (env, cast) in env_map.items():
+            if os.getenv(env):
+                config[key] = cast(os.getenv(env))
+        _breakers[name] = CircuitBreaker(name, **config)
+    return _breakers[name]
+
+
+def snapshot() -> Dict[str, dict]:
+    """Estado de todos los breakers (para /api/health)."""
+    return {name: b.snapshot() for name, b in _breakers.items()}
@@ -0,0 +1,86 @@
+"""
+Consultas de lectura independientes en paralelo, cada una en su propia conexión del pool.
+
+Los endpoints del dashboard arman su respuesta con varias consultas que no dependen entre
+sí; sobre una sola sesión se ejecutan una tras otra y la latencia es la suma de todas.
+en_paralelo() las lanza a la vez, cada una con una sesión de SessionLocal, y devuelve los
+resultados con el mismo nombre con que se pidieron: la latencia pasa a ser la de la más lenta.
+
+  - DB_REQUEST_CONCURRENCY limita cuántas conexiones usa a la vez una misma petición (4 por
+    defecto), para que un endpoint no acapare el pool; con 1 se ejecutan en secuencia sobre
+    una sola sesión (comportamiento anterior).
+  - Si una consulta falla se cancelan las demás y se propaga ese error.
+  - La sesión de la petición (la de get_async_session, que ya usó get_current_user) se
+    pasa en db: antes de pedir conexiones al pool se hace commit para devolver la suya.
+    Si no, cada petición retiene una conexión mientras espera otras y, con el pool y el
+    overflow llenos de peticiones así, todas esperan a pool_timeout sin avanzar.
+  - Cada consulta ve su propio snapshot: sirve para secciones que no necesitan ser
+    consistentes entre sí (KPIs, series, conteos), no para escrituras.
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import DB_REQUEST_CONCURRENCY, SessionLocal
+
+Consulta = Callable[[AsyncSession], Awaitable[Any]]
+
+
+def filas(sql, params: Optional[Dict[str, Any]] = None) -> Consulta:
+    """Consulta que devuelve todas las filas como mappings."""
+    async def _consulta(session: AsyncSession):
+        return (await session.execute(sql, params or {})).mappings().all()
+
+    return _consulta
+
+
+def fila(sql, params: Optional[Dict[str, Any]] = None) -> Consulta:
+    """Consulta de una sola fila (agregados), como mapping."""
+    async def _consulta(session: AsyncSession):
+        return (await session.execute(sql, params or {})).mappings().one()
+
+    return _consulta
+
+
+async def en_paralelo(
+    consultas: Dict[str, Consulta],
+    limite: Optional[int] = None,
+    db: Optional[AsyncSession] = None,
+) -> Dict[str, Any]:
+    """
+    Ejecuta las consultas (nombre -> función que recibe una sesión) y devuelve
+    {nombre: resultado}. Los resultados deben materializarse dentro de la función
+    (mappings().all(), scalar(), ...): la sesión se cierra al terminar.
+    db es la sesión de la petición: se libera su conexión antes de usar otras.
+    """
+    limite = min(limite or DB_REQUEST_CONCURRENCY, len(consultas))
+
+    if db is not None:
+        # Cierra la transacción de la petición (solo lecturas) y devuelve su conexión al pool;
+        # con expire_on_commit=False los objetos ya cargados (current_user) siguen usables
+        await db.commit()
+
+    if limite <= 1:
+        if db is not None:
+            return {nombre: await consulta(db) for nombre, consulta in consultas.items()}
+        async with SessionLocal() as session:
+            return {nombre: await consulta(session) for nombre, consulta in consultas.items()}
+
+    semaforo = asyncio.Semaphore(limite)
+
+    async def _ejecutar(consulta: Consulta):
+        async with semaforo:
+            async with SessionLocal() as session:
+                return await consulta(session)
+
+    tareas = {nombre: asyncio.create_task(_ejecutar(consulta)) for nombre, consulta in consultas.items()}
+    try:
+        await asyncio.gather(*tareas.values())
+    except BaseException:
+        for tarea in tareas.values():
+            tarea.cancel()
+        await asyncio.gather(*tareas.values(), return_exceptions=True)
+        raise
+    return {nombre: tarea.result() for nombre, tarea in tareas.items()}
@@ -0,0 +1,53 @@
+"""
+Migraciones del esquema con Alembic (alembic.ini + migrations/).
+
+Se aplican una vez por despliegue: serve.py llama a upgrade_head() antes de lanzar
+los workers (MIGRATE_ON_START=false lo desactiva) o a mano con `alembic upgrade head`.
+Los workers ya no crean tablas al arrancar: solo verifican que la BD esté en la
+última revisión y avisan si no lo está.
+"""
+
+import logging
+import os
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+logger = logging.getLogger(__name__)
+
+ALEMBIC_INI = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "alembic.ini")
+
+
+def _config():
+    from alembic.config import Config
+
+    return Config(ALEMBIC_INI)
+
+
+def upgrade_head():
+    """Aplica las migraciones pendientes (síncrono: no llamar desde un event loop en marcha)."""
+    from alembic import command
+
+    command.upgrade(_config(), "head")
+
+
+def head_esperado() -> str:
+    from alembic.script import ScriptDirectory
+
+    return ScriptDirectory.from_config(_config()).get_current_head()
+
+
+async def verificar_version(engine: AsyncEngine) -> bool:
+    """True si la BD está en la última revisión; si no, lo registra como advertencia."""
+    esperado = head_esperado()
+    async with engine.connect() as conn:
+        existe = (await conn.execute(text("SELECT to_regclass('alembic_version')"))).scalar()
+        actual = (await conn.execute(text("SELECT version_num FROM alembic_version"))).scalar() if existe else None
+
+    if actual != esperado:
+        logger.warning(
+            f"Esquema de la BD en la revisión {actual or '(ninguna)'}, se esperaba {esperado}: "
+            f"ejecute 'alembic upgrade head'"
+        )
+        return False
+    return True
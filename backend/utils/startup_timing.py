@@ -0,0 +1,43 @@
+"""
+Reporte de tiempos de arranque de cada worker.
+
+server.py importa este módulo antes que cualquier otro, marca el fin de los imports
+y mide cada etapa del evento startup; al terminar se imprime una línea como:
+
+    ⏱️ Arranque (pid 123): imports=412ms esquema=35ms homologacion=18ms ... total=502ms
+"""
+
+import os
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, Tuple
+
+_inicio = time.perf_counter()
+_ultima_marca = _inicio
+_etapas: List[Tuple[str, float]] = []
+
+
+def marca(nombre: str):
+    """Registra el tiempo transcurrido desde la marca anterior (o desde el import de este módulo)."""
+    global _ultima_marca
+    ahora = time.perf_counter()
+    _etapas.append((nombre, ahora - _ultima_marca))
+    _ultima_marca = ahora
+
+
+@contextmanager
+def etapa(nombre: str) -> Iterator[None]:
+    """Mide un bloque del arranque."""
+    global _ultima_marca
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        _ultima_marca = time.perf_counter()
+        _etapas.append((nombre, _ultima_marca - t0))
+
+
+def reporte() -> str:
+    partes = " ".join(f"{nombre}={segundos * 1000:.0f}ms" for nombre, segundos in _etapas)
+    total = (time.perf_counter() - _inicio) * 1000
+    return f"⏱️ Arranque (pid {os.getpid()}): {partes} total={total:.0f}ms"
@@ -0,0 +1,115 @@
+"""
+Escritura por streaming de exportaciones tabulares (CSV y XLSX).
+
+Reciben los encabezados y un iterador asíncrono de bloques de filas (p.ej. las
+particiones de un resultado con stream_results) y producen el archivo de a pedazos,
+sin tener todas las filas en memoria:
+  - CSV: cada bloque se serializa y se envía de inmediato (UTF-8 con BOM para Excel);
+  - XLSX: openpyxl en modo write_only escribe a un archivo temporal, que se envía al
+    final y se borra. Cada XLSX_MAX_FILAS filas se abre una hoja nueva (límite de Excel).
+
+Los textos que empiezan con =, +, -, @, tabulador o retorno de carro son columnas de texto
+libre (identificación del cliente, descripciones, observaciones) que Excel evaluaría como
+fórmula: en CSV salen con un apóstrofo delante; en XLSX van como celda de texto explícita
+(con quotePrefix), sin alterar el valor.
+
+openpyxl se importa solo al exportar XLSX.
+"""
+
+import asyncio
+import csv
+import io
+import os
+import tempfile
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, AsyncIterator, List, Sequence
+from uuid import UUID
+
+XLSX_MAX_FILAS = 1_000_000
+CHUNK_BYTES = 256 * 1024
+PREFIJOS_FORMULA = ("=", "+", "-", "@", "\t", "\r")
+
+
+def _valor_csv(v: Any) -> Any:
+    if isinstance(v, str):
+        # En CSV no hay tipo de celda: el apóstrofo evita que Excel lo evalúe como fórmula
+        return f"'{v}" if v.startswith(PREFIJOS_FORMULA) else v
+    if isinstance(v, datetime):
+        return v.isoformat()
+    if isinstance(v, UUID):
+        return str(v)
+    return v
+
+
+def _valor_xlsx(v: Any, ws) -> Any:
+    if isinstance(v, str) and v.startswith(PREFIJOS_FORMULA):
+        # openpyxl escribiría "=..." como fórmula: celda de texto explícita, el valor no cambia
+        from openpyxl.cell import WriteOnlyCell
+
+        celda = WriteOnlyCell(ws, value=v)
+        celda.data_type = "s"
+        celda.quotePrefix = True
+        return celda
+    if isinstance(v, datetime) and v.tzinfo is not None:
+        # Excel no admite zona horaria: hora local del servidor
+        return v.astimezone().replace(tzinfo=None)
+    if isinstance(v, Decimal):
+        return float(v)
+    if isinstance(v, UUID):
+        return str(v)
+    return v
+
+
+async def filas_csv(columnas: Sequence[str], bloques: AsyncIterator[List[Sequence[Any]]]) -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write("\ufeff")
+    writer.writerow(columnas)
+    async for bloque in bloques:
+        writer.writerows([_valor_csv(v) for v in fila] for fila in bloque)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    resto = buffer.getvalue()
+    if resto:
+        yield resto.encode("utf-8")
+
+
+async def archivo_xlsx(
+    columnas: Sequence[str], bloques: AsyncIterator[List[Sequence[Any]]], hoja: str
+) -> AsyncIterator[bytes]:
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    estado = {"ws": None, "filas": XLSX_MAX_FILAS, "hojas": 0}
+
+    def _agregar(bloque):
+        for fila in bloque:
+            if estado["filas"] >= XLSX_MAX_FILAS:
+                estado["hojas"] += 1
+                estado["ws"] = wb.create_sheet(hoja if estado["hojas"] == 1 else f"{hoja} ({estado['hojas']})")
+                estado["ws"].append(list(columnas))
+                estado["filas"] = 0
+            estado["ws"].append([_valor_xlsx(v, estado["ws"]) for v in fila])
+            estado["filas"] += 1
+
+    fd, ruta = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
+    try:
+        async for bloque in bloques:
+            await asyncio.to_thread(_agregar, bloque)
+        if estado["ws"] is None:
+            # Sin filas: igual un archivo válido con los encabezados
+            estado["ws"] = wb.create_sheet(hoja)
+            estado["ws"].append(list(columnas))
+        await asyncio.to_thread(wb.save, ruta)
+
+        with open(ruta, "rb") as f:
+            while True:
+                chunk = await asyncio.to_thread(f.read, CHUNK_BYTES)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        os.remove(ruta)
@@ -9,6 +9,7 @@ import {
   TableHeader,
   TableRow,
 } from '../ui/table';
+import esimsService from '../../services/esimsService';
 
 const ESimTable = ({ esims, onRefresh }) => {
   const [selectedEsim, setSelectedEsim] = useState(null);
@@ -52,9 +53,16 @@ const ESimTable = ({ esims, onRefresh }) => {
     return <span className={color}>{dias} días</span>;
   };
 
-  const handleVerQR = (esim) => {
-    if (esim.qr_code_data) {
-      setSelectedEsim(esim);
+  const handleVerQR = async (esim) => {
+    // El listado no trae el contenido del QR: se pide al abrir el modal
+    try {
+      const detalle = await esimsService.getEsimById(esim.id, { includeQr: true });
+      if (detalle.qr_code_data) {
+        setSelectedEsim(detalle);
+      }
+    } catch (error) {
+      console.error('Error cargando QR:', error);
+      alert('Error cargando el código QR');
     }
   };
 
@@ -123,7 +131,7 @@ const ESimTable = ({ esims, onRefresh }) => {
                   </TableCell>
                   <TableCell>
                     <div className="flex gap-2">
-                      {esim.qr_code_data && (
+                      {esim.has_qr && (
                         <Button
                           size="sm"
                           variant="outline"
@@ -102,7 +102,7 @@ const QRRegenerationUpload = ({ onRegeneracionCompleta, esimsVencidas }) => {
 
       const result = await esimsService.regenerarQrsBulk(regeneraciones);
 
-      alert(`¡Éxito! ${result.esims.length} eSIMs regeneradas correctamente`);
+      alert(`¡Éxito! ${result.message}`);
       setStep('completed');
 
       // Limpiar estado después de 2 segundos
@@ -7,7 +7,7 @@ import { Label } from '../ui/label';
 import { Badge } from '../ui/badge';
 import { Dialog, DialogContent, DialogHeader, DialogTitle, DialogTrigger } from '../ui/dialog';
 import { Separator } from '../ui/separator';
-import { salesService } from '../../services/salesService';
+import { salesService, newIdempotencyKey } from '../../services/salesService';
 import { productsService } from '../../services/productsService';
 import { simsService } from '../../services/simsService';
 import { useApp } from '../../context/AppContext';
@@ -42,6 +42,13 @@ const SalesPointOfSale = () => {
   const [globalScanBuffer, setGlobalScanBuffer] = useState('');
   const scanTimeoutRef = useRef(null);
 
+  // Idempotency-Key del cobro en curso: se reutiliza si el cajero reintenta
+  // y se descarta cuando cambia el carrito o el método de pago
+  const checkoutKeyRef = useRef(null);
+  useEffect(() => {
+    checkoutKeyRef.current = null;
+  }, [cart, paymentMethod]);
+
   // Mantener cartRef actualizado
   useEffect(() => {
     cartRef.current = cart;
@@ -509,14 +516,22 @@ const SalesPointOfSale = () => {
         customer_identification: "222222222222"
       };
 
-      const result = await salesService.createSale(saleData);
+      if (!checkoutKeyRef.current) {
+        checkoutKeyRef.current = newIdempotencyKey();
+      }
+      const result = await salesService.createSale(saleData, checkoutKeyRef.current);
 
       // Calculate display total based on currency
       const displayTotal = totals.totalUSD > 0 ?
         formatPrice(totals.totalUSD, 'USD') :
         formatPrice(totals.totalCOP, 'COP');
 
-      if (paymentMethod === "electronic") {
+      if (result?.contingencia) {
+        showNotification(
+          `Venta registrada en contingencia (Siigo no disponible). La factura se enviará automáticamente. Total: ${displayTotal}`,
+          'warning'
+        );
+      } else if (paymentMethod === "electronic") {
         showNotification(
           `Factura electrónica creada exitosamente. Total: ${displayTotal}`,
           'success'
@@ -37,8 +37,10 @@ export const esimsService = {
   /**
    * Obtiene una eSIM por ID
    */
-  getEsimById: async (esimId) => {
-    const response = await api.get(`/api/esims/${esimId}`);
+  getEsimById: async (esimId, { includeQr = false } = {}) => {
+    const response = await api.get(`/api/esims/${esimId}`, {
+      params: includeQr ? { include_qr: true } : {}
+    });
     return response.data;
   },
 
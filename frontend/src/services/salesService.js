@@ -1,15 +1,26 @@
 import api from './api';
 
+// Una clave por intento de cobro: si se reintenta el mismo carrito el backend
+// devuelve la venta ya registrada en vez de crear otra
+export const newIdempotencyKey = () => {
+  if (window.crypto?.randomUUID) {
+    return window.crypto.randomUUID();
+  }
+  const bytes = window.crypto.getRandomValues(new Uint8Array(16));
+  return Array.from(bytes, (b) => b.toString(16).padStart(2, '0')).join('');
+};
+
 export const salesService = {
-  createSale: async (saleData) => {
+  createSale: async (saleData, idempotencyKey) => {
+    const config = idempotencyKey ? { headers: { 'Idempotency-Key': idempotencyKey } } : undefined;
     // Check payment method to determine endpoint
     if (saleData.payment_method === "electronic") {
-      const response = await api.post('/api/sales/create_invoice', saleData);
+      const response = await api.post('/api/sales/create_invoice', saleData, config);
       return response.data;
     } else {
       // Both cash and dollars go through the same endpoint
       // Backend will handle the different payment methods
-      const response = await api.post('/api/sales/ventas', saleData);
+      const response = await api.post('/api/sales/ventas', saleData, config);
       return response.data;
     }
   },